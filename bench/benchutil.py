@@ -0,0 +1,144 @@
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python module is in the public domain.
+
+"""Helpers shared by the benchmark scripts in this directory.
+
+The boodle and cboodle modules must be importable; run the scripts
+with PYTHONPATH pointing at a build directory, e.g.
+
+    python setup.py build
+    PYTHONPATH=build/lib.linux-x86_64-2.7 python bench/noteq.py
+"""
+
+import os
+import os.path
+import time
+import math
+import struct
+import wave
+import aifc
+import sunau
+import logging
+
+import boodle
+from boodle import generator
+
+def write_sample(dirname, name='blip.wav', frames=2205, channels=1):
+    """write_sample(dirname, name='blip.wav', frames=2205, channels=1) -> str
+
+    Write a 16-bit WAV file of a sine tone, and return its pathname.
+    """
+    pathname = os.path.join(dirname, name)
+    fl = wave.open(pathname, 'wb')
+    fl.setnchannels(channels)
+    fl.setsampwidth(2)
+    fl.setframerate(22050)
+    fl.writeframes(tone_data(frames, channels, '<h'))
+    fl.close()
+    return pathname
+
+def write_loop_sample(dirname, name='loop.aiff', frames=22050, channels=1,
+    rate=22050):
+    """write_loop_sample(dirname, name='loop.aiff', frames=22050,
+        channels=1, rate=22050) -> str
+
+    Write a 16-bit AIFF file of a sine tone, with loop markers around
+    the middle half, and return its pathname.
+    """
+    pathname = os.path.join(dirname, name)
+    fl = aifc.open(pathname, 'wb')
+    fl.setnchannels(channels)
+    fl.setsampwidth(2)
+    fl.setframerate(rate)
+    fl.writeframes(tone_data(frames, channels, '>h'))
+    fl.setmark(1, frames // 4, 'start')
+    fl.setmark(2, 3 * frames // 4, 'end')
+    fl.close()
+    return pathname
+
+def write_plain_sample(dirname, name, frames, channels=1, rate=22050):
+    """write_plain_sample(dirname, name, frames, channels=1, rate=22050)
+        -> str
+
+    Write a 16-bit sound file of a sine tone, with no loop, and return
+    its pathname. The file format (AIFF, WAV, or AU) is chosen by the
+    name's suffix.
+    """
+    pathname = os.path.join(dirname, name)
+    suffix = os.path.splitext(name)[1].lower()
+    if (suffix == '.wav'):
+        (mod, fmt) = (wave, '<h')
+    elif (suffix == '.au'):
+        (mod, fmt) = (sunau, '>h')
+    else:
+        (mod, fmt) = (aifc, '>h')
+    fl = mod.open(pathname, 'wb')
+    fl.setnchannels(channels)
+    fl.setsampwidth(2)
+    fl.setframerate(rate)
+    fl.writeframes(tone_data(frames, channels, fmt))
+    fl.close()
+    return pathname
+
+def tone_data(frames, channels, fmt):
+    ls = []
+    for ix in xrange(frames):
+        val = int(8000 * math.sin(ix * 0.1))
+        ls.append(struct.pack(fmt, val) * channels)
+    return ''.join(ls)
+
+def buffer_geometry(cboodle):
+    """buffer_geometry(cboodle) -> (framesperbuf, framespersec)
+
+    Find out the file driver's buffer size and sample rate. (They are
+    not known until init time, so this opens and closes the driver.)
+    """
+    cboodle.init(os.devnull, 0, 0, [('time', '0')])
+    try:
+        framesperbuf = cboodle.framesperbuf()
+        framespersec = cboodle.framespersec()
+    finally:
+        cboodle.final()
+    return (framesperbuf, framespersec)
+
+def run_generator(cboodle, gen, seconds, extraopts=()):
+    """run_generator(cboodle, gen, seconds, extraopts=()) -> float
+
+    Generate the given number of seconds of sound into /dev/null, and
+    return the wall-clock time it took. The generator is closed
+    afterwards.
+    """
+    opts = [('time', repr(seconds))] + list(extraopts)
+    cboodle.init(os.devnull, 0, 0, opts)
+    starttime = time.time()
+    try:
+        try:
+            cboodle.loop(generator.run_agents, gen)
+        finally:
+            cboodle.final()
+    except boodle.StopGeneration:
+        pass
+    elapsed = time.time() - starttime
+    gen.close()
+    return elapsed
+
+def parse_defines(ls):
+    """parse_defines(ls) -> list of (str, str)
+
+    Turn a list of 'key=val' strings (from -D options) into a list of
+    extra driver options.
+    """
+    res = []
+    for val in ls:
+        if ('=' in val):
+            (key, val) = val.split('=', 1)
+        else:
+            (key, val) = (val, None)
+        res.append( (key, val) )
+    return res
+
+def init_logging():
+    logging.basicConfig(level=logging.ERROR)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Benchmark for event dispatch.
+
+This sets up L listening agents, spread across C channels nested D
+deep, each listening for its own event name ("sensor.sN") on its own
+channel. A handful more listen for every "sensor" event on the root
+channel. Then it sends E events, each to a random leaf channel, and
+reports events dispatched per second. This is repeated for several
+listener counts.
+
+(See benchutil.py for how to run this.)
+"""
+
+import time
+import random
+import optparse
+
+import boodle
+from boodle import agent, generator
+import benchutil
+
+usage = 'usage: %prog [ options ]'
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-l', '--listeners',
+    action='store', type='string', dest='listeners',
+    default='10,100,1000,10000',
+    help='listener counts to try (default: 10,100,1000,10000)')
+popt.add_option('-c', '--channels',
+    action='store', type='int', dest='channels', default=20,
+    help='number of leaf channels (default: 20)')
+popt.add_option('-d', '--depth',
+    action='store', type='int', dest='depth', default=4,
+    help='depth of the leaf channels (default: 4)')
+popt.add_option('-e', '--events',
+    action='store', type='int', dest='events', default=20000,
+    help='number of events to send (default: 20000)')
+popt.add_option('--seed',
+    action='store', type='int', dest='seed', default=1,
+    help='random seed (default: 1)')
+
+class Listener(agent.Agent):
+    """Listen for one event, and count the events heard.
+    """
+    heard = 0
+    def init(self, event, chan):
+        self.event = event
+        self.chan = chan
+    def run(self):
+        self.listen(self.event, chan=self.chan, hold=True)
+    def receive(self, event, *args):
+        Listener.heard += 1
+
+class Sender(agent.Agent):
+    """Set up the listeners, then (in a second run) send the events.
+    """
+    def init(self, opts, count):
+        self.opts = opts
+        self.count = count
+        self.leaves = None
+        self.elapsed = None
+    def run(self):
+        opts = self.opts
+        rnd = random.Random(opts.seed)
+        if (self.leaves is None):
+            self.leaves = []
+            for ix in xrange(opts.channels):
+                chan = self.channel
+                for jx in xrange(opts.depth):
+                    chan = self.new_channel(1.0, chan)
+                self.leaves.append(chan)
+            for ix in xrange(self.count):
+                chan = self.leaves[ix % len(self.leaves)]
+                ag = Listener('sensor.s%d' % (ix,), chan)
+                self.sched_agent(ag, 0, chan)
+            for ix in xrange(5):
+                ag = Listener('sensor', self.channel)
+                self.sched_agent(ag, 0)
+            self.resched(0.1)
+            return
+        gen = self.generator
+        Listener.heard = 0
+        starttime = time.time()
+        for ix in xrange(opts.events):
+            num = rnd.randrange(self.count)
+            chan = self.leaves[num % len(self.leaves)]
+            gen.sendevent(('sensor.s%d' % (num,), ix), chan)
+        self.elapsed = time.time() - starttime
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+
+    cboodle = boodle.set_driver('file')
+    (framesperbuf, framespersec) = benchutil.buffer_geometry(cboodle)
+    mixspan = float(4 * framesperbuf) / framespersec
+
+    print '%d events, %d leaf channels at depth %d' % (opts.events,
+        opts.channels, opts.depth)
+    print '%10s %12s %10s' % ('listeners', 'events/sec', 'heard')
+    for count in [ int(val) for val in opts.listeners.split(',') ]:
+        gen = generator.Generator(0.5)
+        ag = Sender(opts, count)
+        gen.addagent(ag, gen.rootchannel, 0, ag.run)
+        benchutil.run_generator(cboodle, gen, mixspan)
+        print '%10d %12.0f %10d' % (count, opts.events / ag.elapsed,
+            Listener.heard)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Micro-benchmark for the cboodle note queue.
+
+This schedules N notes at random start times (in a single agent run,
+so they arrive in random order), and then mixes M buffers of sound
+into /dev/null with the "file" driver. It reports the time spent
+queueing notes and the time spent mixing.
+
+(See benchutil.py for how to run this.)
+"""
+
+import time
+import random
+import tempfile
+import shutil
+import optparse
+
+import boodle
+from boodle import agent, generator
+import benchutil
+
+usage = 'usage: %prog [ options ]'
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-n', '--notes',
+    action='store', type='int', dest='notes', default=20000,
+    help='number of notes to schedule (default: 20000)')
+popt.add_option('-m', '--buffers',
+    action='store', type='int', dest='buffers', default=400,
+    help='number of buffers to mix (default: 400)')
+popt.add_option('-s', '--span',
+    action='store', type='float', dest='span', default=600.0,
+    help='notes start at random times up to this many seconds (default: 600)')
+popt.add_option('--early',
+    action='store', type='float', dest='early', default=0.0,
+    help='fraction of notes which start within the mixed interval (default: 0)')
+popt.add_option('--seed',
+    action='store', type='int', dest='seed', default=1,
+    help='random seed (default: 1)')
+
+class NoteFlood(agent.Agent):
+    """Schedule every note in one run, and record how long it took.
+    """
+    def init(self, filename, count, span, early, mixspan, seed):
+        self.filename = filename
+        self.count = count
+        self.span = span
+        self.early = early
+        self.mixspan = mixspan
+        self.seed = seed
+        self.elapsed = None
+    def run(self):
+        rnd = random.Random(self.seed)
+        starttime = time.time()
+        for ix in xrange(self.count):
+            if (rnd.random() < self.early):
+                delay = rnd.uniform(0, self.mixspan)
+            else:
+                delay = rnd.uniform(0, self.span)
+            self.sched_note(self.filename, 1.0, 0.1, delay)
+        self.elapsed = time.time() - starttime
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+
+    cboodle = boodle.set_driver('file')
+
+    tempdir = tempfile.mkdtemp(prefix='boodle-bench-')
+    try:
+        filename = benchutil.write_sample(tempdir)
+
+        (framesperbuf, framespersec) = benchutil.buffer_geometry(cboodle)
+        mixspan = float(opts.buffers * framesperbuf) / framespersec
+
+        gen = generator.Generator(0.5)
+        ag = NoteFlood(filename, opts.notes, opts.span, opts.early,
+            mixspan, opts.seed)
+        gen.addagent(ag, gen.rootchannel, 0, ag.run)
+
+        total = benchutil.run_generator(cboodle, gen, mixspan)
+    finally:
+        shutil.rmtree(tempdir, True)
+
+    print '%d notes, %d buffers (%.1f seconds of sound)' % (opts.notes,
+        opts.buffers, mixspan)
+    print 'queueing: %.3f sec (%.2f usec/note)' % (ag.elapsed,
+        1000000.0 * ag.elapsed / max(opts.notes, 1))
+    print 'mixing:   %.3f sec (%.2f msec/buffer)' % (total - ag.elapsed,
+        1000.0 * (total - ag.elapsed) / max(opts.buffers, 1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Benchmark for scheduling notes from Python.
+
+An agent schedules N notes, in batches of B (as a chord or a cloud of
+notes would be), each with a random pitch, volume, pan, and delay. It
+does this once by calling sched_note_pan() for every note, and once by
+calling sched_notes() for every batch; and reports the notes scheduled
+per second each way (the best of several runs, since a single run is
+short enough to be noisy). This is repeated for several batch sizes.
+
+Batches only pay off when they are large. Typical ratios are about
+1.0-1.4x for batches of 100 to 500; a batch of 10 is within about 10%
+either way, and a batch of 1 runs at 0.8-0.95x of sched_note_pan(),
+since it takes the per-note path plus the cost of the batch call.
+(These were measured on a busy machine, and vary from run to run; use
+a large -r value to compare two versions of the code.)
+
+(See benchutil.py for how to run this.)
+"""
+
+import time
+import random
+import tempfile
+import shutil
+import optparse
+
+import boodle
+from boodle import agent, generator
+import benchutil
+
+usage = 'usage: %prog [ options ]'
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-n', '--notes',
+    action='store', type='int', dest='notes', default=20000,
+    help='number of notes to schedule (default: 20000)')
+popt.add_option('-b', '--batches',
+    action='store', type='string', dest='batches', default='1,10,100,500',
+    help='batch sizes to try (default: 1,10,100,500)')
+popt.add_option('-r', '--repeat',
+    action='store', type='int', dest='repeat', default=5,
+    help='take the best of this many runs (default: 5)')
+popt.add_option('--seed',
+    action='store', type='int', dest='seed', default=1,
+    help='random seed (default: 1)')
+
+class Scheduler(agent.Agent):
+    """Schedule every note in one run, and record how long it took.
+    """
+    def init(self, filename, count, batch, bulk, seed):
+        self.filename = filename
+        self.count = count
+        self.batch = batch
+        self.bulk = bulk
+        self.seed = seed
+        self.elapsed = None
+    def run(self):
+        rnd = random.Random(self.seed)
+        batches = []
+        for ix in xrange(0, self.count, self.batch):
+            ls = []
+            for jx in xrange(min(self.batch, self.count-ix)):
+                ls.append((self.filename, rnd.uniform(0.5, 2.0),
+                    rnd.uniform(0.0, 0.1), rnd.uniform(1.0, 10.0),
+                    rnd.uniform(-1.0, 1.0)))
+            batches.append(ls)
+        starttime = time.time()
+        if (self.bulk):
+            for ls in batches:
+                self.sched_notes(ls)
+        else:
+            for ls in batches:
+                for (samp, pitch, volume, delay, pan) in ls:
+                    self.sched_note_pan(samp, pan, pitch, volume, delay)
+        self.elapsed = time.time() - starttime
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+
+    cboodle = boodle.set_driver('file')
+
+    tempdir = tempfile.mkdtemp(prefix='boodle-bench-')
+    try:
+        filename = benchutil.write_sample(tempdir)
+
+        (framesperbuf, framespersec) = benchutil.buffer_geometry(cboodle)
+        mixspan = float(framesperbuf) / framespersec
+
+        print '%d notes' % (opts.notes,)
+        print '%8s %14s %14s %8s' % ('batch', 'sched_note_pan', 'sched_notes',
+            'ratio')
+        for batch in [ int(val) for val in opts.batches.split(',') ]:
+            rates = []
+            for bulk in (False, True):
+                best = None
+                for ix in xrange(opts.repeat):
+                    gen = generator.Generator(0.5)
+                    ag = Scheduler(filename, opts.notes, batch, bulk,
+                        opts.seed)
+                    gen.addagent(ag, gen.rootchannel, 0, ag.run)
+                    benchutil.run_generator(cboodle, gen, mixspan)
+                    if (best is None or ag.elapsed < best):
+                        best = ag.elapsed
+                rates.append(opts.notes / best)
+            print '%8d %14.0f %14.0f %7.2fx' % (batch, rates[0], rates[1],
+                rates[1] / rates[0])
+    finally:
+        shutil.rmtree(tempdir, True)
+
+if __name__ == '__main__':
+    main()
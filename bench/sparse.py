@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Benchmark for a sparse ambient soundscape.
+
+This sets up V agents, each of which plays one long looped note, waits
+for it to end and a while longer, and then does it again. It generates
+S seconds of sound into /dev/null with the "file" driver, and reports
+how often run_agents() was called, and how the time divided between
+running agents (in Python) and mixing.
+
+(See benchutil.py for how to run this.)
+"""
+
+import os
+import time
+import random
+import tempfile
+import shutil
+import optparse
+
+import boodle
+from boodle import agent, generator
+import benchutil
+
+usage = 'usage: %prog [ options ]'
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-v', '--voices',
+    action='store', type='int', dest='voices', default=4,
+    help='number of agents playing notes (default: 4)')
+popt.add_option('-s', '--seconds',
+    action='store', type='float', dest='seconds', default=600.0,
+    help='seconds of sound to generate (default: 600)')
+popt.add_option('-d', '--duration',
+    action='store', type='float', dest='duration', default=20.0,
+    help='duration of each note, in seconds (default: 20)')
+popt.add_option('--seed',
+    action='store', type='int', dest='seed', default=1,
+    help='random seed (default: 1)')
+
+class Drone(agent.Agent):
+    """Play a long note, and come back after it's over.
+    """
+    def init(self, filename, duration, seed):
+        self.filename = filename
+        self.duration = duration
+        self.rnd = random.Random(seed)
+    def run(self):
+        dur = self.sched_note_duration_pan(self.filename, self.duration,
+            self.rnd.uniform(-1, 1), 1.0, 0.1)
+        self.resched(dur + self.rnd.uniform(5, 30))
+
+class Starter(agent.Agent):
+    """Start the drones, at staggered times.
+    """
+    def init(self, filename, opts):
+        self.filename = filename
+        self.opts = opts
+    def run(self):
+        for ix in xrange(self.opts.voices):
+            ag = Drone(self.filename, self.opts.duration, self.opts.seed+ix)
+            self.sched_agent(ag, ix * 3.0)
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+
+    cboodle = boodle.set_driver('file')
+
+    calls = [0]
+    def run_agents(starttime, gen, finished):
+        calls[0] += 1
+        return generator.run_agents(starttime, gen, finished)
+
+    tempdir = tempfile.mkdtemp(prefix='boodle-bench-')
+    try:
+        filename = benchutil.write_loop_sample(tempdir)
+
+        gen = generator.Generator(0.5)
+        ag = Starter(filename, opts)
+        gen.addagent(ag, gen.rootchannel, 0, ag.run)
+
+        cboodle.init(os.devnull, 0, 0, [('time', repr(opts.seconds))])
+        try:
+            try:
+                cboodle.loop(run_agents, gen)
+            finally:
+                cboodle.final()
+        except boodle.StopGeneration:
+            pass
+        gen.close()
+    finally:
+        shutil.rmtree(tempdir, True)
+
+    (numbuffers, walltime, agenttime, mixtime, writetime) = cboodle.loop_stats()
+    print '%d voices, %.0f seconds of sound, %d buffers' % (opts.voices,
+        opts.seconds, numbuffers)
+    print 'run_agents calls: %d (%.1f%% of buffers)' % (calls[0],
+        100.0 * calls[0] / max(numbuffers, 1))
+    print 'total: %.3f sec' % (walltime,)
+    print 'agents: %.3f sec (%.1f%%)' % (agenttime,
+        100.0 * agenttime / walltime)
+    print 'mixing: %.3f sec (%.1f%%)' % (mixtime,
+        100.0 * mixtime / walltime)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Benchmark for stopping channels in a large soundscape.
+
+This builds a tree of G group channels, each with L leaf channels
+under it (5050 channels by default). It schedules A agents (20000 by
+default) and N notes, all for the far future, spread across the
+leaves. Then it stops S randomly-chosen leaves, timing how long each
+Channel.realstop() takes, and then stops a few whole groups.
+
+(See benchutil.py for how to run this.)
+"""
+
+import time
+import random
+import tempfile
+import shutil
+import optparse
+
+import boodle
+from boodle import agent, generator
+import benchutil
+
+usage = 'usage: %prog [ options ]'
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-g', '--groups',
+    action='store', type='int', dest='groups', default=50,
+    help='number of group channels (default: 50)')
+popt.add_option('-l', '--leaves',
+    action='store', type='int', dest='leaves', default=100,
+    help='number of leaf channels in each group (default: 100)')
+popt.add_option('-a', '--agents',
+    action='store', type='int', dest='agents', default=20000,
+    help='number of agents to schedule (default: 20000)')
+popt.add_option('-n', '--notes',
+    action='store', type='int', dest='notes', default=10000,
+    help='number of notes to schedule (default: 10000)')
+popt.add_option('-s', '--stops',
+    action='store', type='int', dest='stops', default=500,
+    help='number of leaf channels to stop (default: 500)')
+popt.add_option('--seed',
+    action='store', type='int', dest='seed', default=1,
+    help='random seed (default: 1)')
+
+class Idle(agent.Agent):
+    """An agent which is scheduled, but never gets to run.
+    """
+    def run(self):
+        pass
+
+class Builder(agent.Agent):
+    """Build the channel tree and fill it; then schedule the Stopper.
+    """
+    def init(self, filename, opts):
+        self.filename = filename
+        self.opts = opts
+        self.results = None
+    def run(self):
+        opts = self.opts
+        rnd = random.Random(opts.seed)
+        groups = []
+        leaves = []
+        for ix in xrange(opts.groups):
+            group = self.new_channel()
+            groups.append(group)
+            for jx in xrange(opts.leaves):
+                leaves.append(self.new_channel(1.0, group))
+        for ix in xrange(opts.agents):
+            self.sched_agent(Idle(), rnd.uniform(100, 200), rnd.choice(leaves))
+        for ix in xrange(opts.notes):
+            self.sched_note(self.filename, 1.0, 0.1, rnd.uniform(100, 200),
+                rnd.choice(leaves))
+        stopper = Stopper(self, groups, leaves)
+        self.sched_agent(stopper, 0.1, self.channel)
+
+class Stopper(agent.Agent):
+    """Stop channels, and record how long it took.
+    """
+    def init(self, builder, groups, leaves):
+        self.builder = builder
+        self.groups = groups
+        self.leaves = leaves
+    def run(self):
+        opts = self.builder.opts
+        rnd = random.Random(opts.seed+1)
+        numchannels = len(self.generator.channels)
+        numagents = len(self.generator.queueindex)
+        # (Any leaf which got neither agents nor notes is already gone.)
+        leaves = [ chan for chan in self.leaves if chan.active ]
+        doomed = rnd.sample(leaves, opts.stops)
+        starttime = time.time()
+        for chan in doomed:
+            chan.realstop()
+        leaftime = time.time() - starttime
+        doomed = self.groups[ : 5]
+        starttime = time.time()
+        for chan in doomed:
+            chan.realstop()
+        grouptime = time.time() - starttime
+        self.builder.results = (numchannels, numagents, leaftime,
+            len(doomed), grouptime)
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+
+    cboodle = boodle.set_driver('file')
+
+    tempdir = tempfile.mkdtemp(prefix='boodle-bench-')
+    try:
+        filename = benchutil.write_sample(tempdir)
+
+        (framesperbuf, framespersec) = benchutil.buffer_geometry(cboodle)
+        mixspan = float(4 * framesperbuf) / framespersec
+
+        gen = generator.Generator(0.5)
+        ag = Builder(filename, opts)
+        gen.addagent(ag, gen.rootchannel, 0, ag.run)
+
+        benchutil.run_generator(cboodle, gen, mixspan)
+    finally:
+        shutil.rmtree(tempdir, True)
+
+    (numchannels, numagents, leaftime, numgroups, grouptime) = ag.results
+    print '%d channels, %d agents, %d notes' % (numchannels, numagents,
+        opts.notes)
+    print 'stopping %d leaves: %.3f sec (%.1f usec/channel)' % (opts.stops,
+        leaftime, 1000000.0 * leaftime / max(opts.stops, 1))
+    print 'stopping %d groups: %.3f sec (%.1f msec/group)' % (numgroups,
+        grouptime, 1000.0 * grouptime / max(numgroups, 1))
+
+if __name__ == '__main__':
+    main()
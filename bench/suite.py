@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Benchmark suite for the mixer, the scheduler, and the sample loader.
+
+This drives the "file" driver headlessly (writing to /dev/null) and
+measures:
+
+    mix -- frames mixed per second, by voice count, for mono and
+        stereo samples, at natural and shifted pitch, with and without
+        a fading channel
+    depth -- frames mixed per second, with the voices nested 1 to 10
+        channels deep (the outermost channel fading)
+    addagent -- Generator.addagent() calls per second, with 10000
+        agents queued
+    runagents -- agent runs per second, inside run_agents(), with 10000
+        agents rescheduling themselves
+    load -- sample.get() load time for AIFF, WAV, and AU files of
+        several sizes
+
+Every result is a rate, so bigger is always better. The results are
+written as JSON (to stdout, or to the -o file), along with the commit
+and the options used. Give --compare OLDFILE to print each result
+next to the same result from an earlier run, so that regressions
+between commits stand out.
+
+(See benchutil.py for how to run this.)
+"""
+
+import sys
+import os
+import time
+import random
+import tempfile
+import shutil
+import optparse
+import subprocess
+import platform
+import json
+
+import boodle
+from boodle import agent, generator, sample
+import benchutil
+
+usage = 'usage: %prog [ options ] [ group ... ]'
+
+groups = ['mix', 'depth', 'addagent', 'runagents', 'load']
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-o', '--output',
+    action='store', type='string', dest='output', metavar='FILE',
+    help='write the JSON results to this file (default: stdout)')
+popt.add_option('--compare',
+    action='store', type='string', dest='compare', metavar='FILE',
+    help='compare against the JSON results of an earlier run')
+popt.add_option('--label',
+    action='store', type='string', dest='label',
+    help='a label to store with the results')
+popt.add_option('-m', '--buffers',
+    action='store', type='int', dest='buffers', default=100,
+    help='number of buffers to mix in each mixing test (default: 100)')
+popt.add_option('-v', '--voices',
+    action='store', type='string', dest='voices', default='10,100,400',
+    help='voice counts for the mixing tests (default: 10,100,400)')
+popt.add_option('-a', '--agents',
+    action='store', type='int', dest='agents', default=10000,
+    help='number of agents for the scheduler tests (default: 10000)')
+popt.add_option('-r', '--repeat',
+    action='store', type='int', dest='repeat', default=3,
+    help='take the best of this many sample loads (default: 3)')
+popt.add_option('-D', '--define',
+    action='append', dest='extraopts', metavar='VAR=VAL', default=[],
+    help='define additional driver parameters')
+
+class Voices(agent.Agent):
+    """Start a crowd of long looping notes, in a channel nested depth
+    levels deep. If fade is set, the outermost channel keeps fading.
+    """
+    def init(self, filename, count, pitch, duration, fade, depth=1):
+        self.filename = filename
+        self.count = count
+        self.pitch = pitch
+        self.duration = duration
+        self.fade = fade
+        self.depth = depth
+    def run(self):
+        rnd = random.Random(1)
+        outer = self.new_channel()
+        chan = outer
+        for ix in xrange(self.depth-1):
+            chan = self.new_channel(0.95, chan)
+        for ix in xrange(self.count):
+            self.sched_note_duration_pan(self.filename, self.duration,
+                rnd.uniform(-1, 1), self.pitch, 0.01, rnd.uniform(0, 0.05),
+                chan)
+        if (self.fade):
+            self.sched_agent(Fader(), 0, outer)
+
+class Fader(agent.Agent):
+    """Keep the channel fading up and down.
+    """
+    def init(self):
+        self.up = False
+    def run(self):
+        self.up = not self.up
+        if (self.up):
+            self.channel.set_volume(1.0, 2.0)
+        else:
+            self.channel.set_volume(0.25, 2.0)
+        self.resched(2.0)
+
+class Ticker(agent.Agent):
+    """Do nothing but reschedule, and count the runs.
+    """
+    runs = 0
+    def init(self, seed):
+        self.rnd = random.Random(seed)
+    def run(self):
+        Ticker.runs += 1
+        self.resched(self.rnd.uniform(0.05, 0.5))
+
+class Suite:
+    """Suite: Runs the benchmark groups, and collects the results.
+    """
+
+    def __init__(self, cboodle, opts, extraopts, tempdir):
+        self.cboodle = cboodle
+        self.opts = opts
+        self.extraopts = extraopts
+        self.tempdir = tempdir
+        self.results = []
+        (self.framesperbuf, self.framespersec) = benchutil.buffer_geometry(
+            cboodle)
+        self.seconds = (float(opts.buffers * self.framesperbuf)
+            / self.framespersec)
+
+    def add(self, name, value, unit, **params):
+        """add(name, value, unit, **params) -> None
+
+        Record (and print) one result.
+        """
+        res = { 'name':name, 'value':value, 'unit':unit }
+        res.update(params)
+        self.results.append(res)
+        print >> sys.stderr, '%-44s %14.1f %s' % (name, value, unit)
+
+    def mix_rate(self, filename, voices, pitch, fade, depth=1):
+        """mix_rate(filename, voices, pitch, fade, depth=1) -> float
+
+        Mix the voices, and return the number of frames mixed per
+        second of wall-clock time.
+        """
+        gen = generator.Generator(0.5)
+        ag = Voices(filename, voices, pitch, self.seconds+1.0, fade, depth)
+        gen.addagent(ag, gen.rootchannel, 0, ag.run)
+        elapsed = benchutil.run_generator(self.cboodle, gen, self.seconds,
+            self.extraopts)
+        return self.seconds * self.framespersec / elapsed
+
+    def voice_sample(self, channels):
+        # The sample is recorded at the output rate, so that pitch 1.0
+        # means stepping exactly one sample frame per output frame.
+        return benchutil.write_loop_sample(self.tempdir,
+            'voice%d.aiff' % (channels,), 44100, channels,
+            self.framespersec)
+
+    def run_mix(self):
+        voicelist = [ int(val) for val in self.opts.voices.split(',') ]
+        for channels in (1, 2):
+            filename = self.voice_sample(channels)
+            kind = ('mono', 'stereo')[channels-1]
+            for pitch in (1.0, 1.37):
+                for fade in (False, True):
+                    for voices in voicelist:
+                        rate = self.mix_rate(filename, voices, pitch, fade)
+                        name = 'mix/%s/pitch=%s/%s/voices=%d' % (kind,
+                            pitch, ('const', 'fade')[fade], voices)
+                        self.add(name, rate, 'frames/sec',
+                            group='mix', channels=channels, pitch=pitch,
+                            fade=fade, voices=voices)
+
+    def run_depth(self):
+        filename = self.voice_sample(1)
+        for depth in xrange(1, 11):
+            rate = self.mix_rate(filename, 100, 1.0, True, depth)
+            self.add('depth/depth=%d' % (depth,), rate, 'frames/sec',
+                group='depth', depth=depth, voices=100)
+
+    def run_addagent(self):
+        count = self.opts.agents
+        rnd = random.Random(1)
+        gen = generator.Generator(0.5)
+        span = 60 * self.framespersec
+        ls = [ Ticker(ix) for ix in xrange(count) ]
+        starttime = time.time()
+        for ag in ls:
+            gen.addagent(ag, gen.rootchannel, rnd.randrange(span), ag.run)
+        elapsed = time.time() - starttime
+        gen.close()
+        self.add('addagent/agents=%d' % (count,), count / elapsed,
+            'calls/sec', group='addagent', agents=count)
+
+    def run_runagents(self):
+        count = self.opts.agents
+        rnd = random.Random(1)
+        gen = generator.Generator(0.5)
+        span = int(0.5 * self.framespersec)
+        for ix in xrange(count):
+            ag = Ticker(ix)
+            gen.addagent(ag, gen.rootchannel, rnd.randrange(span), ag.run)
+        Ticker.runs = 0
+        benchutil.run_generator(self.cboodle, gen, self.seconds,
+            self.extraopts)
+        agenttime = self.cboodle.loop_stats()[2]
+        self.add('runagents/agents=%d' % (count,), Ticker.runs / agenttime,
+            'runs/sec', group='runagents', agents=count, runs=Ticker.runs)
+
+    def run_load(self):
+        for seconds in (1, 10, 60):
+            for suffix in ('.aiff', '.wav', '.au'):
+                frames = 44100 * seconds
+                filename = benchutil.write_plain_sample(self.tempdir,
+                    'load%d%s' % (seconds, suffix), frames, 2, 44100)
+                best = None
+                for ix in xrange(self.opts.repeat):
+                    starttime = time.time()
+                    samp = sample.get(filename)
+                    elapsed = time.time() - starttime
+                    del sample.cache[filename]
+                    self.cboodle.delete_sample(samp.csamp)
+                    if (best is None or elapsed < best):
+                        best = elapsed
+                self.add('load/%s/seconds=%d' % (suffix[1:], seconds),
+                    frames / best, 'frames/sec', group='load',
+                    format=suffix[1:], frames=frames, msec=1000.0*best)
+
+def commit_id():
+    """commit_id() -> str or None
+
+    Return the git commit of the source tree, if it can be found.
+    """
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=dirname,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = proc.communicate()
+    except OSError:
+        return None
+    if (proc.returncode != 0):
+        return None
+    return out.strip()
+
+def compare(results, filename):
+    """compare(results, filename) -> None
+
+    Print each result beside the same result from an earlier run.
+    """
+    fl = open(filename)
+    try:
+        old = json.load(fl)
+    finally:
+        fl.close()
+    oldmap = dict([ (res['name'], res) for res in old['results'] ])
+    print >> sys.stderr, 'compared with %s (commit %s)' % (filename,
+        old.get('commit'))
+    for res in results:
+        oldres = oldmap.get(res['name'])
+        if (oldres is None or not oldres['value']):
+            continue
+        ratio = res['value'] / oldres['value']
+        flag = ''
+        if (ratio < 0.9):
+            flag = '  <-- slower'
+        print >> sys.stderr, '%-44s %14.1f %14.1f %6.2fx%s' % (res['name'],
+            oldres['value'], res['value'], ratio, flag)
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+    extraopts = benchutil.parse_defines(opts.extraopts)
+
+    for val in args:
+        if (not (val in groups)):
+            popt.error('unknown benchmark group: ' + val)
+    if (not args):
+        args = groups
+
+    cboodle = boodle.set_driver('file')
+
+    tempdir = tempfile.mkdtemp(prefix='boodle-bench-')
+    try:
+        suite = Suite(cboodle, opts, extraopts, tempdir)
+        for val in args:
+            getattr(suite, 'run_'+val)()
+    finally:
+        shutil.rmtree(tempdir, True)
+
+    report = {
+        'label': opts.label,
+        'commit': commit_id(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'framesperbuf': suite.framesperbuf,
+        'framespersec': suite.framespersec,
+        'options': {
+            'buffers': opts.buffers,
+            'voices': opts.voices,
+            'agents': opts.agents,
+            'repeat': opts.repeat,
+            'define': opts.extraopts,
+        },
+        'results': suite.results,
+    }
+
+    if (opts.compare):
+        compare(suite.results, opts.compare)
+
+    if (opts.output):
+        fl = open(opts.output, 'w')
+        try:
+            json.dump(report, fl, indent=2, sort_keys=True,
+                separators=(',', ': '))
+            fl.write('\n')
+        finally:
+            fl.close()
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True,
+            separators=(',', ': '))
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Boodler: a programmable soundscape tool
+# Designed by Andrew Plotkin <erkyrath@eblong.com>
+# For more information, see <http://boodler.org/>
+#
+# This Python script is in the public domain.
+
+"""Benchmark for the cboodle mixing loop.
+
+This starts V looping voices, and mixes M buffers of sound into
+/dev/null with the "file" driver. It measures the mixing rate for mono
+and stereo samples, at natural and shifted pitch. The voices either
+play at constant volume (compared with the constant-volume fast path
+on and off, the "fastmix" driver option) or in a channel which is
+continually fading (compared with per-block and per-frame fade
+evaluation, the "fadeblock" driver option). The figure of merit is
+voices per CPU core: how many such voices one core could mix in real
+time.
+
+(See benchutil.py for how to run this.)
+"""
+
+import random
+import tempfile
+import shutil
+import optparse
+
+import boodle
+from boodle import agent, generator
+import benchutil
+
+usage = 'usage: %prog [ options ]'
+
+popt = optparse.OptionParser(usage=usage)
+popt.add_option('-v', '--voices',
+    action='store', type='int', dest='voices', default=200,
+    help='number of simultaneous voices (default: 200)')
+popt.add_option('-m', '--buffers',
+    action='store', type='int', dest='buffers', default=200,
+    help='number of buffers to mix (default: 200)')
+popt.add_option('-D', '--define',
+    action='append', dest='extraopts', metavar='VAR=VAL', default=[],
+    help='define additional driver parameters')
+
+class Voices(agent.Agent):
+    """Start a crowd of long looping notes, in a channel which may be
+    fading.
+    """
+    def init(self, filename, count, pitch, duration, fade):
+        self.filename = filename
+        self.count = count
+        self.pitch = pitch
+        self.duration = duration
+        self.fade = fade
+    def run(self):
+        rnd = random.Random(1)
+        chan = self.new_channel()
+        for ix in xrange(self.count):
+            self.sched_note_duration_pan(self.filename, self.duration,
+                rnd.uniform(-1, 1), self.pitch, 0.01, rnd.uniform(0, 0.05),
+                chan)
+        if (self.fade):
+            self.sched_agent(Fader(), 0, chan)
+
+class Fader(agent.Agent):
+    """Keep the channel fading up and down.
+    """
+    def init(self):
+        self.up = False
+    def run(self):
+        self.up = not self.up
+        if (self.up):
+            self.channel.set_volume(1.0, 2.0)
+        else:
+            self.channel.set_volume(0.25, 2.0)
+        self.resched(2.0)
+
+def measure(cboodle, filename, voices, pitch, fade, seconds, extraopts):
+    """measure(cboodle, filename, voices, pitch, fade, seconds, extraopts)
+        -> float
+
+    Mix the voices for the given number of seconds, and return the
+    wall-clock time it took.
+    """
+    gen = generator.Generator(0.5)
+    ag = Voices(filename, voices, pitch, seconds+1.0, fade)
+    gen.addagent(ag, gen.rootchannel, 0, ag.run)
+    return benchutil.run_generator(cboodle, gen, seconds, extraopts)
+
+def main():
+    (opts, args) = popt.parse_args()
+    benchutil.init_logging()
+    extraopts = benchutil.parse_defines(opts.extraopts)
+
+    cboodle = boodle.set_driver('file')
+
+    (framesperbuf, framespersec) = benchutil.buffer_geometry(cboodle)
+    seconds = float(opts.buffers * framesperbuf) / framespersec
+
+    print '%d voices, %d buffers (%.1f seconds of sound)' % (opts.voices,
+        opts.buffers, seconds)
+    print '%-8s %-6s %-8s %-12s %10s %12s' % ('sample', 'pitch', 'volume',
+        'option', 'msec/buf', 'voices/core')
+
+    # For each kind of volume, the options to compare.
+    cases = [
+        (False, [('fastmix', '1'), ('fastmix', '0')]),
+        (True, [('fadeblock', '32'), ('fadeblock', '1')]),
+    ]
+
+    tempdir = tempfile.mkdtemp(prefix='boodle-bench-')
+    try:
+        for channels in (1, 2):
+            # The sample is recorded at the output rate, so that pitch
+            # 1.0 means stepping exactly one sample frame per output
+            # frame.
+            filename = benchutil.write_loop_sample(tempdir,
+                'voice%d.aiff' % (channels,), 44100, channels,
+                framespersec)
+            for pitch in (1.0, 1.37):
+                for (fade, options) in cases:
+                    for opt in options:
+                        elapsed = measure(cboodle, filename, opts.voices,
+                            pitch, fade, seconds, extraopts + [opt])
+                        perbuf = 1000.0 * elapsed / opts.buffers
+                        capacity = opts.voices * seconds / elapsed
+                        print '%-8s %-6s %-8s %-12s %10.3f %12.0f' % (
+                            ('mono', 'stereo')[channels-1], pitch,
+                            ('const', 'fade')[fade], '%s=%s' % opt,
+                            perbuf, capacity)
+    finally:
+        shutil.rmtree(tempdir, True)
+
+if __name__ == '__main__':
+    main()
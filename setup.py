@@ -103,7 +103,8 @@ class BooExtension(Extension):
         self.boodler_key = key
         modname = 'boodle.cboodle_'+key
         
-        ls = ['audev-'+key, 'cboodle-'+key, 'noteq', 'sample']
+        ls = ['audev-'+key, 'cboodle-'+key, 'noteq', 'sample', 'channel',
+            'mixthread', 'stream', 'compress']
         ls = [ ('src/cboodle/' + val + '.c') for val in ls ]
 
         avail = opts.pop('available', None)
@@ -32,6 +32,9 @@ class Agent:
     sched_note_pan() -- schedule a note to be played at a stereo position
     sched_note_duration_pan() -- schedule a note, extended and stereo
     sched_note_params() -- schedule a note, allowing all parameters
+    sched_notes() -- schedule a whole batch of notes at once
+    preload_samples() -- begin loading sounds in the background
+    is_sample_ready() -- see whether a sound has finished loading
     sched_agent() -- schedule another agent to run
     resched() -- schedule self to run again
     new_channel() -- create a channel
@@ -75,6 +78,14 @@ class Agent:
 
     # Maps Agent subclasses to ArgLists; see get_argument_list().
     cached_argument_lists = {}
+
+    # The values of the entries missing from the end of a sched_notes()
+    # tuple. (The sample can't be missing.)
+    note_defaults = (None, 1.0, 1.0, 0.0, None, 0.0, 0.0, 0.0, None)
+
+    # The shapes of a note's attack and release fades, as understood by
+    # the cboodle module. (None means linear.)
+    note_curves = { None: 0, 'linear': 0, 'sine': 1, 'smooth': 2 }
     
     def __init__(self, *args, **kwargs):
         self.inited = True
@@ -97,9 +108,10 @@ class Agent:
         except TypeError, ex:
             raise boodle.BoodlerError(str(ex))
 
-    def sched_note(self, samp, pitch=1.0, volume=1.0, delay=0, chan=None):
-        """sched_note(sample, pitch=1, volume=1, delay=0, chan=self.channel)
-            -> duration
+    def sched_note(self, samp, pitch=1.0, volume=1.0, delay=0, chan=None,
+        attack=0, release=0, curve=None):
+        """sched_note(sample, pitch=1, volume=1, delay=0, chan=self.channel,
+            attack=0, release=0, curve=None) -> duration
 
         Schedule a note to play. The sound is loaded from samp (which can
         be a filename, File, or Sample object). The pitch is given as a
@@ -109,15 +121,20 @@ class Agent:
         if None or not supplied, defaults to the same channel the agent is
         running in.
 
+        The attack and release are times (in seconds) to fade the note in
+        and out; the curve is the shape of the fades. (See
+        sched_note_params().)
+
         This returns the expected duration of the sound, in seconds.
         """
 
-        return self.sched_note_pan(samp, None, pitch, volume, delay, chan)
+        return self.sched_note_pan(samp, None, pitch, volume, delay, chan,
+            attack, release, curve)
 
     def sched_note_pan(self, samp, pan=None, pitch=1.0, volume=1.0, delay=0,
-        chan=None):
+        chan=None, attack=0, release=0, curve=None):
         """sched_note_pan(sample, pan=0, pitch=1, volume=1, delay=0,
-            chan=self.channel) -> duration
+            chan=self.channel, attack=0, release=0, curve=None) -> duration
 
         Schedule a note to play, panning the stereo origin of the sound.
         The pan value defaults to 0, meaning no shift in origin;
@@ -131,9 +148,18 @@ class Agent:
         to delay before the note is played. The channel, if None or not
         supplied, defaults to the same channel the agent is running in.
 
+        The attack and release are times (in seconds) to fade the note in
+        and out; the curve is the shape of the fades. (See
+        sched_note_params().)
+
         This returns the expected duration of the sound, in seconds.
         """
 
+        if (attack or release):
+            spec = (samp, pitch, volume, delay, pan, 0,
+                attack, release, curve)
+            return self.sched_notes([spec], chan)[0]
+
         if (self.generator is None or self.channel is None):
             raise generator.ScheduleError('scheduler has never been scheduled')
         if (chan is None):
@@ -149,9 +175,9 @@ class Agent:
         return float(dur) / float(cboodle.framespersec())
 
     def sched_note_duration(self, samp, duration, pitch=1.0, volume=1.0,
-        delay=0, chan=None):
+        delay=0, chan=None, attack=0, release=0, curve=None):
         """sched_note_duration(sample, duration, pitch=1, volume=1, delay=0,
-            chan=self.channel) -> duration
+            chan=self.channel, attack=0, release=0, curve=None) -> duration
         
         Schedule a note to play, extending the original sound sample to a
         longer period of time. The duration is given in seconds. 
@@ -163,16 +189,23 @@ class Agent:
         to delay before the note is played. The channel, if None or not
         supplied, defaults to the same channel the agent is running in.
 
+        The attack and release are times (in seconds) to fade the note in
+        and out; the curve is the shape of the fades. (See
+        sched_note_params().)
+
         This returns the expected duration of the sound, in seconds. Due to
         the way sounds are looped, this may be slightly longer than the
         given duration.
         """
 
-        return self.sched_note_duration_pan(samp, duration, None, pitch, volume, delay, chan)
+        return self.sched_note_duration_pan(samp, duration, None, pitch, volume, delay, chan,
+            attack, release, curve)
 
-    def sched_note_duration_pan(self, samp, duration, pan=None, pitch=1.0, volume=1.0, delay=0, chan=None):
+    def sched_note_duration_pan(self, samp, duration, pan=None, pitch=1.0, volume=1.0, delay=0, chan=None,
+        attack=0, release=0, curve=None):
         """sched_note_duration_pan(sample, duration, pan=0, pitch=1, volume=1,
-            delay=0, chan=self.channel) -> duration
+            delay=0, chan=self.channel, attack=0, release=0, curve=None)
+            -> duration
 
         Schedule a note to play, panning the stereo origin of the sound.
         The pan value defaults to 0, meaning no shift in origin;
@@ -190,8 +223,17 @@ class Agent:
         The duration is given in seconds. This returns the expected duration 
         of the sound, in seconds. Due to the way sounds are looped, this may 
         be slightly longer than the given duration.
+
+        The attack and release are times (in seconds) to fade the note in
+        and out; the curve is the shape of the fades. (See
+        sched_note_params().)
         """
 
+        if (attack or release):
+            spec = (samp, pitch, volume, delay, pan, duration,
+                attack, release, curve)
+            return self.sched_notes([spec], chan)[0]
+
         if (self.generator is None or self.channel is None):
             raise generator.ScheduleError('scheduler has never been scheduled')
         if (chan is None):
@@ -223,6 +265,16 @@ class Agent:
             pan = None    (no stereo shift)
             duration = 0  (exactly once through the sound)
             chan = None   (play in agent's own channel)
+            attack = 0    (no fade-in)
+            release = 0   (no fade-out)
+            curve = None  (linear fades)
+
+        The attack and release are times (in seconds) over which the
+        note fades in from silence at its start, and out to silence at
+        its end. The curve is the shape of those fades: 'linear',
+        'sine' (a quarter sine wave, which is good for crossfades), or
+        'smooth' (an S-curve). A soft-edged note costs no more than a
+        plain one; there is no need to give it a channel of its own.
         """
 
         duration = args.get('duration', 0.0)
@@ -231,7 +283,121 @@ class Agent:
         volume = args.get('volume', 1.0)
         delay = args.get('delay', 0.0)
         chan = args.get('chan', None)
-        return self.sched_note_duration_pan(samp, duration, pan, pitch, volume, delay, chan)
+        attack = args.get('attack', 0.0)
+        release = args.get('release', 0.0)
+        curve = args.get('curve', None)
+        return self.sched_note_duration_pan(samp, duration, pan, pitch, volume, delay, chan,
+            attack, release, curve)
+
+    def sched_notes(self, notes, chan=None):
+        """sched_notes(notes, chan=self.channel) -> list of durations
+
+        Schedule a batch of notes to play, all in the same channel. This
+        does the same job as calling sched_note_params() for each note,
+        but with less work per note, which matters when an agent plays a
+        cloud of hundreds of notes at once. (For a batch of a few notes
+        there is little to gain. The bench/schednotes.py script measures
+        the difference.)
+
+        Each entry of the notes list is a tuple:
+
+            (sample, pitch=1, volume=1, delay=0, pan=None, duration=0,
+                attack=0, release=0, curve=None)
+
+        The tuple may stop after any of its entries; the rest take their
+        default values. They have the same meanings as the arguments of
+        sched_note_params(). A duration of 0 means exactly once through
+        the sound. The channel, if None or not supplied, defaults to the
+        same channel the agent is running in.
+
+        If any note is invalid, an exception is raised and none of the
+        notes are scheduled. Otherwise this returns a list of the expected
+        durations of the sounds, in seconds.
+        """
+
+        if (self.generator is None or self.channel is None):
+            raise generator.ScheduleError('scheduler has never been scheduled')
+        if (chan is None):
+            chan = self.channel
+        if (not chan.active):
+            raise generator.ChannelError('cannot schedule note to inactive channel')
+        gen = self.generator
+
+        samps = {}
+        ls = []
+        for spec in notes:
+            if (type(spec) != tuple or not (1 <= len(spec) <= 9)):
+                raise TypeError('each note must be a tuple of 1 to 9 values')
+            if (len(spec) < 9):
+                spec = spec + self.note_defaults[len(spec) : ]
+            (samp, pitch, volume, delay, pan, duration,
+                attack, release, curve) = spec
+            
+            sampval = samps.get(samp)
+            if (sampval is None):
+                sampval = sample.get(samp)
+                samps[samp] = sampval
+            if (isinstance(sampval, sample.MixinSample)):
+                (sampval, pitch, volume) = sampval.resolve(pitch, volume)
+
+            starttime = gen.select_time(delay)
+            if (duration):
+                duration = gen.select_duration(duration)
+            else:
+                duration = 0
+            if (pan is None or pan == 0):
+                pan = stereo.Identity_4
+            elif (type(pan) is float):
+                pan = (1.0, pan, 1.0, 0.0)
+            else:
+                pan = stereo.extend_tuple(stereo.cast(pan))
+
+            if (attack or release):
+                if (attack):
+                    attack = gen.select_duration(attack)
+                else:
+                    attack = 0
+                if (release):
+                    release = gen.select_duration(release)
+                else:
+                    release = 0
+                curveval = self.note_curves.get(curve)
+                if (curveval is None):
+                    raise generator.ScheduleError('unknown fade curve')
+                ls.append((sampval, pitch, volume, pan, starttime, duration,
+                    attack, release, curveval))
+            else:
+                ls.append((sampval, pitch, volume, pan, starttime, duration))
+
+        durs = sample.queue_notes(ls, chan)
+        fps = float(cboodle.framespersec())
+        return [ float(dur) / fps for dur in durs ]
+
+    def preload_samples(self, samps):
+        """preload_samples(samps) -> None
+
+        Begin loading a list of sounds in the background, so that they
+        are ready to play when the agent wants them. This returns at once.
+        Playing a sound which is still loading waits for it to finish,
+        so this is never required -- but loading a large sound file at
+        the moment it is played can interrupt the sound output.
+
+        Raises SampleError if a sound file cannot be found.
+        """
+
+        usetime = 0
+        if (not (self.generator is None
+            or self.generator.agentruntime is None)):
+            usetime = self.generator.agentruntime
+        sample.prefetch(samps, usetime)
+
+    def is_sample_ready(self, samp):
+        """is_sample_ready(samp) -> bool
+
+        Return whether a sound can be played without waiting for it to
+        load. (See preload_samples().)
+        """
+        return sample.is_ready(samp)
 
     def listen(self, event=None, handle=None, hold=None, chan=None):
         """listen(event=self.selected_event, handle=self.receive, hold=None, 
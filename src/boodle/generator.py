@@ -15,9 +15,10 @@ run_agents() -- the big function that does everything
 """
 
 import sys
+import time
 import logging
 import traceback
-import bisect
+import heapq
 import StringIO
 
 class Generator:
@@ -32,12 +33,27 @@ class Generator:
     significant. It may be worth changing to Python sets, or it may
     not.)
 
-    queue -- list of [runtime, agent, handler] lists. Sorted by
-        runtime (and, insignificantly, by the other list values).
-        These are not tuples because we have to update the runtime in
-        place occasionally.
+    queue -- heap of [runtime, seq, agent, handler] lists. The seq
+        value is a counter, so that agents scheduled for the same
+        runtime run in the order they were scheduled. An unscheduled
+        agent's entry stays in the heap, with agent and handler set to
+        None, until it reaches the top. (That's why these are lists,
+        not tuples.)
+    farqueue -- TimerWheel of queue entries for agents scheduled too far
+        ahead to be worth keeping in the queue heap. They move into
+        the heap as their time approaches
+    queueindex -- dict mapping each scheduled agent to its queue entry,
+        whether it is in queue or farqueue
+    farnotes -- TimerWheel of [starttime, seq, channel, note] lists, for
+        notes scheduled too far ahead to be worth handing to the cboodle
+        module yet. (The note is a tuple as for sample.queue_notes.) An
+        entry whose channel is stopped has its channel set to None
+    farnotecount -- number of live entries in farnotes
     rootchannel -- the root channel object
     channels -- set of channels in existence
+    maybeempty -- set of channels which may have run out of notes,
+        agents, holds, and children. (A channel goes in here when it is
+        created, and whenever one of those counts drops to zero.)
 
     allhandlers -- set of all active handler objects
     listeners -- list of sources of external events
@@ -52,11 +68,22 @@ class Generator:
     select_time() -- determine the schedule time represented by a value
     select_duration() -- determine the duration represented by a value
     set_stats_interval() -- set the interval at which stats are dumped
+    set_progress_interval() -- set the interval at which rendering
+        progress is reported
+    report_progress() -- count generated sound, and report rendering
+        progress
     addagent() -- put an agent on the schedule queue
     remagent() -- remove an agent from the schedule queue
+    nextagent() -- take the next due agent from the schedule queue
+    defer_note() -- hold a far-future note in the farnotes wheel
+    remfarnotes() -- discard the deferred notes of a list of channels
+    cascade() -- move agents and notes whose time is approaching out of
+        the far-future wheels
+    remnotes() -- account for a batch of notes which have ended
     addhandler() -- add a Handler object to the system
     remhandlers() -- remove a list of Handler objects from the system
     sendevent() -- process an event on the given channel
+    next_wakeup() -- work out when run_agents() next has work to do
     dump_stats() -- write statistical information to the given file
     """
 
@@ -68,7 +95,13 @@ class Generator:
         self.logger.info('generator setting up')
 
         self.queue = []
+        self.farqueue = TimerWheel(WHEELSPANS)
+        self.queueindex = {}
+        self.queueseq = 0
+        self.farnotes = TimerWheel(WHEELSPANS)
+        self.farnotecount = 0
         self.channels = {}
+        self.maybeempty = {}
         self.stoplist = []
         self.postqueue = []
         self.allhandlers = {}
@@ -76,6 +109,9 @@ class Generator:
         self.lastunload = 0
         self.stats_interval = None
         self.statslogger = None
+        self.progress_interval = None
+        self.progresslogger = None
+        self.progress_lasttime = None
         if stdinlisten:
             lis = listen.StdinListener(self.postqueue.append)
             self.listeners.append(lis)
@@ -122,20 +158,15 @@ class Generator:
         if (typ in [float, int, long]):
             if (delay < 0):
                 raise ScheduleError('negative delay time')
-            if (delay > 3605): 
-                # about one hour
-                ### need to think about this
-                raise ScheduleError('delay too long')
             # int() is willing to return a long if necessary
-            fdelay = int(delay * fps)
+            try:
+                fdelay = int(delay * fps)
+            except (OverflowError, ValueError):
+                raise ScheduleError('delay time is not finite')
         elif (isinstance(delay, FrameCount)):
             fdelay = delay.frames
             if (fdelay < 0):
                 raise ScheduleError('negative delay time')
-            if (fdelay > 3605L * fps): 
-                # about one hour
-                ### need to think about this
-                raise ScheduleError('delay too long')
         else:
             raise ScheduleError('unknown type for delay')
 
@@ -161,20 +192,15 @@ class Generator:
         if (typ in [float, int, long]):
             if (duration < 0):
                 raise ScheduleError('negative duration time')
-            if (duration > 3605): 
-                # about one hour
-                ### need to think about this
-                raise ScheduleError('duration too long')
             # int() is willing to return a long if necessary
-            fduration = int(duration * fps)
+            try:
+                fduration = int(duration * fps)
+            except (OverflowError, ValueError):
+                raise ScheduleError('duration time is not finite')
         elif (isinstance(duration, FrameCount)):
             fduration = duration.frames
             if (fduration < 0):
                 raise ScheduleError('negative duration time')
-            if (fduration > 3605L * fps): 
-                # about one hour
-                ### need to think about this
-                raise ScheduleError('duration too long')
         else:
             raise ScheduleError('unknown type for duration')
 
@@ -192,6 +218,52 @@ class Generator:
         self.stats_interval = val
         self.last_stats_dump = 0
 
+    def set_progress_interval(self, val, duration=None):
+        """set_progress_interval(val, duration=None) -> None
+
+        Set the interval (in seconds of real time) at which rendering
+        progress is reported to the logger. If the duration of the
+        render is known, pass it (in seconds) too. Pass None to turn
+        progress reports off.
+        """
+        
+        self.progresslogger = logging.getLogger('render')
+        self.progress_interval = val
+        self.progress_duration = duration
+        self.progress_frames = 0
+        self.progress_lasttime = None
+        self.progress_start = None
+        self.last_progress_report = None
+
+    def report_progress(self, starttime):
+        """report_progress(starttime) -> None
+
+        Count the sound generated since the last call (up to starttime),
+        and report how the render is going, if the progress interval has
+        passed since the last report. This is called by run_agents().
+        """
+        
+        now = time.time()
+        if (not (self.progress_lasttime is None)):
+            self.progress_frames += (starttime - self.progress_lasttime)
+        self.progress_lasttime = starttime
+        if (self.progress_start is None):
+            self.progress_start = now
+            self.last_progress_report = now
+        elif (now >= self.last_progress_report + self.progress_interval):
+            self.last_progress_report = now
+            secs = float(self.progress_frames) / cboodle.framespersec()
+            factor = secs / (now - self.progress_start)
+            if (self.progress_duration):
+                percent = 100.0 * secs / self.progress_duration
+                self.progresslogger.warning(
+                    'rendered %.1f of %.1f seconds (%d%%), %.1fx realtime',
+                    secs, self.progress_duration, percent, factor)
+            else:
+                self.progresslogger.warning(
+                    'rendered %.1f seconds, %.1fx realtime',
+                    secs, factor)
+
     def addagent(self, ag, chan, runtime, handle):
         """addagent(ag, chan, runtime, handle) -> None
 
@@ -209,9 +281,14 @@ class Generator:
         ag.generator = self
         ag.channel = chan
         chan.agentcount += 1
+        chan.agents[ag] = ag
         ag.queued = True
 
-        bisect.insort(self.queue, [runtime, ag, handle])
+        entry = [runtime, self.queueseq, ag, handle]
+        self.queueseq += 1
+        self.queueindex[ag] = entry
+        if (not self.farqueue.insert(entry)):
+            heapq.heappush(self.queue, entry)
 
         ag.logger.info('scheduled on %s', chan)
 
@@ -230,9 +307,145 @@ class Generator:
         
         ag.queued = False
         ag.channel.agentcount -= 1
-        posls = [ ix for ix in range(len(self.queue))
-            if (self.queue[ix][1] is ag) ]
-        self.queue.pop(posls[0])
+        ag.channel.agents.pop(ag)
+        if (ag.channel.agentcount == 0):
+            self.maybeempty[ag.channel] = ag.channel
+        entry = self.queueindex.pop(ag)
+        entry[2] = None
+        entry[3] = None
+
+        # Dead entries are normally discarded when they reach the top
+        # of the heap (or leave the wheel). If they come to outnumber
+        # the live ones, sweep them out all at once.
+        if (len(self.queue) + self.farqueue.count
+            > 2 * len(self.queueindex) + 64):
+            self.queue = [ ent for ent in self.queue
+                if (not (ent[2] is None)) ]
+            heapq.heapify(self.queue)
+            self.farqueue.sweep()
+
+    def nextagent(self, endtime):
+        """nextagent(endtime) -> (runtime, agent, handler) or None
+
+        Remove the first agent from the schedule queue, and return it,
+        if it is scheduled before endtime. If not, return None.
+
+        (The agent's queued flag and its channel's agentcount and agents
+        are not updated; that is up to the caller.)
+        """
+
+        queue = self.queue
+        while (queue):
+            entry = queue[0]
+            if (entry[2] is None):
+                heapq.heappop(queue)
+                continue
+            if (entry[0] >= endtime):
+                return None
+            heapq.heappop(queue)
+            (runtime, seq, ag, handle) = entry
+            del self.queueindex[ag]
+            return (runtime, ag, handle)
+        return None
+
+    def defer_note(self, note, chan):
+        """defer_note(note, chan) -> None
+
+        Hold a note in the farnotes wheel. The note is a tuple as for
+        sample.queue_notes, and must start at or beyond the wheel's
+        horizon. It counts in the channel's notecount, and it will be
+        handed to the cboodle module by cascade(), when its time comes
+        near.
+
+        A held note does not count as a use of its sample, so the sample
+        may be unloaded in the meantime.
+        """
+
+        entry = [note[4], self.queueseq, chan, note]
+        self.queueseq += 1
+        self.farnotes.insert(entry)
+        self.farnotecount += 1
+        chan.farnotes[entry[1]] = entry
+        chan.notecount += 1
+
+    def remfarnotes(self, chans):
+        """remfarnotes(chans) -> None
+
+        Discard all the notes deferred in a list of channels. (The
+        channels' notecounts are reduced accordingly.)
+        """
+
+        for chan in chans:
+            if (not chan.farnotes):
+                continue
+            for entry in chan.farnotes.itervalues():
+                entry[2] = None
+                entry[3] = None
+            chan.notecount -= len(chan.farnotes)
+            self.farnotecount -= len(chan.farnotes)
+            chan.farnotes.clear()
+            if (chan.notecount == 0):
+                self.maybeempty[chan] = chan
+
+        if (self.farnotes.count > 2 * self.farnotecount + 64):
+            self.farnotes.sweep()
+
+    def cascade(self, endtime):
+        """cascade(endtime) -> None
+
+        Move agents and notes whose time is approaching out of the
+        far-future wheels. Agents go into the queue heap; notes are
+        handed to the cboodle module. This is called by run_agents(),
+        with the end of the buffer about to be generated.
+        """
+
+        for entry in self.farqueue.advance(endtime):
+            heapq.heappush(self.queue, entry)
+
+        released = self.farnotes.advance(endtime)
+        if (not released):
+            return
+        # Group the notes by channel and sample, so that one missing
+        # sample doesn't take other notes down with it.
+        groups = {}
+        for entry in released:
+            (starttime, seq, chan, note) = entry
+            del chan.farnotes[seq]
+            chan.notecount -= 1
+            key = (chan, note[0])
+            ls = groups.get(key)
+            if (ls is None):
+                ls = []
+                groups[key] = ls
+            ls.append(note)
+        self.farnotecount -= len(released)
+
+        for ((chan, samp), ls) in groups.iteritems():
+            try:
+                sample.queue_notes(ls, chan)
+            except Exception, ex:
+                self.logger.error('deferred notes of %s: %s: %s',
+                    samp, ex.__class__.__name__, ex)
+            if (chan.notecount == 0):
+                self.maybeempty[chan] = chan
+
+    def remnotes(self, finished):
+        """remnotes(finished) -> None
+
+        Account for a batch of notes which have ended (or been stopped).
+        The batch is a list of (Sample, Channel) pairs, as handed back
+        by the cboodle module. Each sample's refcount and each channel's
+        notecount drop by one per note.
+        """
+
+        maybeempty = self.maybeempty
+        for (samp, chan) in finished:
+            samp.refcount -= 1
+            chan.notecount -= 1
+            if (chan.notecount <= 0):
+                if (chan.notecount < 0):
+                    raise BoodleInternalError('channel notecount negative')
+                maybeempty[chan] = chan
 
     def addhandler(self, han):
         """addhandler(han) -> None
@@ -250,6 +463,11 @@ class Generator:
 
         chan = han.listenchannel
         chan.listenhandlers[han] = han
+        subhans = chan.listenindex.get(han.event)
+        if (subhans is None):
+            subhans = {}
+            chan.listenindex[han.event] = subhans
+        subhans[han] = han
         if (han.holdlisten):
             chan.listenholds += 1
 
@@ -282,10 +500,16 @@ class Generator:
                 
             chan = han.listenchannel
             chan.listenhandlers.pop(han)
+            subhans = chan.listenindex[han.event]
+            subhans.pop(han)
+            if (not subhans):
+                chan.listenindex.pop(han.event)
             if (han.holdlisten):
                 chan.listenholds -= 1
                 if (chan.listenholds < 0):
                     raise BoodleInternalError('channel listenholds negative')
+                if (chan.listenholds == 0):
+                    self.maybeempty[chan] = chan
                     
             chan = han.runchannel
             chan.runhandlers.pop(han)
@@ -293,6 +517,8 @@ class Generator:
                 chan.runholds -= 1
                 if (chan.runholds < 0):
                     raise BoodleInternalError('channel runholds negative')
+                if (chan.runholds == 0):
+                    self.maybeempty[chan] = chan
 
             han.finalize()
 
@@ -306,21 +532,27 @@ class Generator:
         key = ev[0]
         self.logger.info('event "%s" on %s', key, chan)
 
-        keydic = { key: True, '': True }
-        pos = -1
+        # A handler for "foo.bar" also hears "foo.bar.baz", and a
+        # handler for "" hears everything. So look up every prefix.
+        keys = [ key ]
+        pos = len(key) - 1
         while (True):
             pos = key.rfind('.', 0, pos)
             if (pos < 0):
                 break
-            keydic[key[0 : pos]] = True
+            keys.append(key[0 : pos])
+        if (key):
+            keys.append('')
         
         hans = []
 
         while (chan):
-            subhans = [ han for han in chan.listenhandlers
-                if keydic.has_key(han.event) ]
-            if (subhans):
-                hans.extend(subhans)
+            index = chan.listenindex
+            if (index):
+                for val in keys:
+                    subhans = index.get(val)
+                    if (subhans):
+                        hans.extend(subhans)
             chan = chan.parent
 
         for han in hans:
@@ -340,6 +572,42 @@ class Generator:
                     ex.__class__.__name__, ex,
                     exc_info=True)
 
+    def next_wakeup(self, nexttime):
+        """next_wakeup(nexttime) -> int or None
+
+        Work out when run_agents() next has work to do, given that the
+        next buffer starts at nexttime. This returns a frame time: the
+        cboodle module need not call run_agents() again until it reaches
+        the buffer which contains that time (unless a note ends before
+        then). This is never more than a second past nexttime. If
+        run_agents() must be called for every buffer -- that is, if there
+        are listeners to poll -- this returns None.
+        """
+
+        if (self.listeners):
+            return None
+        if (self.stoplist or self.postqueue or self.maybeempty):
+            return nexttime
+
+        wake = self.lastunload + UNLOADTIME + 1
+        queue = self.queue
+        while (queue and queue[0][2] is None):
+            heapq.heappop(queue)
+        if (queue and queue[0][0] < wake):
+            wake = queue[0][0]
+        for wheel in (self.farqueue, self.farnotes):
+            if (not (wheel.nexttime is None) and wheel.nexttime < wake):
+                wake = wheel.nexttime
+        fps = cboodle.framespersec()
+        if (not (self.stats_interval is None)):
+            wake = min(wake, self.last_stats_dump
+                + int(self.stats_interval * fps) + 1)
+        # Check in at least once per second of sound. This keeps the
+        # progress reports (which are in real time) coming, and lets the
+        # Python side see signals promptly.
+        wake = min(wake, nexttime + fps)
+        return max(wake, nexttime)
+
     def dump_stats(self, fl=None):
         """dump_stats(fl=sys.stdout) -> None
         
@@ -351,7 +619,7 @@ class Generator:
         write = fl.write
 
         write('...\n')
-        numagent = len(self.queue)
+        numagent = len(self.queueindex)
         write('%d agents\n' % (numagent,))
         numchan = len(self.channels)
         write('%d channels\n' % (numchan,))
@@ -362,18 +630,59 @@ class Generator:
         numsamploaded = 0
         numsampunloaded = 0
         numsampvirt = 0
+        numsamploading = 0
         numnotes = 0
         for samp in sample.cache.values():
             numnotes = numnotes + samp.refcount
             if (samp.csamp is None):
                 numsampvirt += 1
+            elif (not (samp.loading is None or samp.loading.isSet())):
+                numsamploading += 1
             elif (cboodle.is_sample_loaded(samp.csamp)):
                 numsamploaded += 1
             else:
                 numsampunloaded += 1
-        write('%d samples (%d loaded, %d unloaded, %d virtual)\n'
-            % (numsamp, numsamploaded, numsampunloaded, numsampvirt))
+        write('%d samples (%d loaded, %d unloaded, %d loading, %d virtual)\n'
+            % (numsamp, numsamploaded, numsampunloaded, numsamploading,
+            numsampvirt))
+        (used, budget, hits, misses, evictions) = sample.get_memory_stats()
+        if (budget is None):
+            write('sample memory: %d bytes (no limit)\n' % (used,))
+        else:
+            write('sample memory: %d of %d bytes\n' % (used, budget))
+        write('sample use: %d hits, %d misses, %d evictions\n'
+            % (hits, misses, evictions))
+        (numstreams, numresident, residentbytes,
+            starved, decodedbytes) = cboodle.stream_stats()
+        if (numstreams):
+            write('%d samples streamed (%d blocks, %d bytes in memory, %d notes starved)\n'
+                % (numstreams, numresident, residentbytes, starved))
+        ls = sample.get_compression_stats()
+        if (ls):
+            compressed = sum([ tup[2] for tup in ls ])
+            full = sum([ tup[3] for tup in ls ])
+            decoded = sum([ tup[4] for tup in ls ])
+            blocks = sum([ tup[5] for tup in ls ])
+            decodetime = sum([ tup[6] for tup in ls ])
+            write('%d samples compressed (%d bytes, from %d; %d bytes decoded in memory)\n'
+                % (len(ls), compressed, full, decoded))
+            write('sample decoding: %d blocks in %.3f seconds\n'
+                % (blocks, decodetime))
+            # The samples which have cost the most to decode.
+            ls.sort(key=lambda tup: tup[6], reverse=True)
+            for (filename, mode, compressed, full, decoded, blocks,
+                decodetime) in ls[ : 10 ]:
+                write('    %s: %s, %d bytes, from %d; %d blocks in %.3f seconds\n'
+                    % (filename, mode, compressed, full, blocks, decodetime))
         write('%d notes\n' % (numnotes,))
+        if (self.farnotecount):
+            write('%d notes deferred\n' % (self.farnotecount,))
+        (numpending, numactive, poolsize, poolfree, poollimit,
+            peak, overflow) = cboodle.note_stats()
+        write('%d notes queued (%d sounding, %d pending)\n'
+            % (numactive+numpending, numactive, numpending))
+        write('note pool: %d of %d in use (limit %d, peak %d notes, %d outside pool)\n'
+            % (poolsize-poolfree, poolsize, poollimit, peak, overflow))
 
 class Channel:
     """Channel: a class for creating hierarchical trees of sounds and
@@ -387,7 +696,9 @@ class Channel:
     parent -- the parent of the channel (None if root)
     get_root_channel() -- return the root channel of the tree
     set_volume() -- change the volume of the channel
+    set_volume_envelope() -- change the volume through a series of levels
     set_pan() -- change the channel to a new pan position
+    set_pan_envelope() -- move the channel through a series of pan positions
     stop() -- stop the channel immediately
     get_prop() -- get a property from this channel
     has_prop() -- see whether this channel has a given property
@@ -397,9 +708,11 @@ class Channel:
     Internal methods:
 
     realstop() -- do the work of stopping the channel
+    subtree() -- return a list of the channel and all its descendants
     close() -- shut down the channel
     addnote() -- note that a note has been added to the channel
-    remnote() -- note that a note has been removed from the channel
+    push_volume() -- copy the volume into the native channel object
+    push_stereo() -- copy the stereo position into the native channel object
 
     Class method:
 
@@ -416,12 +729,16 @@ class Channel:
             Channel.logger = logging.getLogger('channel')
         Channel.ordinal += 1
         self.ordinal = Channel.ordinal
-        self.volume = (0, 0, startvol, startvol)
-        self.stereo = (0, 0, pan, pan)
+        self.volume = [ (0, startvol) ]
+        self.stereo = [ (0, stereo.extend_tuple(pan)) ]
         self.notecount = 0
+        self.farnotes = {}
         self.agentcount = 0
+        self.agents = {}
         self.childcount = 0
+        self.children = {}
         self.listenhandlers = {}
+        self.listenindex = {}
         self.listenholds = 0
         self.runhandlers = {}
         self.runholds = 0
@@ -432,19 +749,25 @@ class Channel:
             self.depth = 0
             self.ancestors = {}
             self.rootchannel = self
+            self.cchan = cboodle.new_channel(None)
         else:
             self.depth = parent.depth+1
             parent.childcount += 1
+            parent.children[self] = self
             self.ancestors = parent.ancestors.copy()
             self.ancestors[parent] = parent
             self.rootchannel = parent.rootchannel
-            
+            self.cchan = cboodle.new_channel(parent.cchan)
+        self.push_volume()
+        self.push_stereo()
+
         if (createagent is None):
             self.creatorname = '<boodler>'
         else:
             (dummy, self.creatorname, dummy2) = createagent.get_class_name()
             
         gen.channels[self] = self
+        gen.maybeempty[self] = self
         self.logger.info('opened %s', self)
 
     def __str__(self):
@@ -481,17 +804,26 @@ class Channel:
             self.parent.childcount -= 1
             if (self.parent.childcount < 0):
                 raise BoodleInternalError('channel childcount negative')
+            if (self.parent.childcount == 0):
+                self.generator.maybeempty[self.parent] = self.parent
+            self.parent.children.pop(self)
                 
         self.logger.info('closed %s', self)
         gen = self.generator
         self.active = False
         self.generator = None
         self.listenhandlers = None
+        self.listenindex = None
+        self.farnotes = None
         self.runhandlers = None
+        self.agents = None
+        self.children = None
         self.depth = None
         self.ancestors.clear()
         self.ancestors = None
         self.parent = None
+        cboodle.delete_channel(self.cchan)
+        self.cchan = None
         del gen.channels[self]
 
     def stop(self):
@@ -520,6 +852,10 @@ class Channel:
         in the channel (and its subchannels), and all agents, and then
         closes all the subchannels. Finally it closes the channel itself.
 
+        This only looks at the channel's own subtree (and the notes,
+        agents, and handlers in it), so the cost does not depend on
+        how much else is going on.
+
         Internal method. (The stop() method queues this up in stoplist.)
         """
         
@@ -527,27 +863,42 @@ class Channel:
             raise ChannelError('cannot stop an inactive channel')
         gen = self.generator
         
-        cboodle.stop_notes(self)
-        
-        agents = [ tup[1] for tup in gen.queue
-            if (tup[1].channel is self 
-                or tup[1].channel.ancestors.has_key(self)) ]
+        gen.remnotes(cboodle.stop_notes(self.cchan))
+
+        chans = self.subtree()
+        gen.remfarnotes(chans)
+
+        agents = []
+        for ch in chans:
+            agents.extend(ch.agents)
         for ag in agents:
             gen.remagent(ag)
 
-        hans = [ han for han in gen.allhandlers
-            if ((han.runchannel is self
-                    or han.runchannel.ancestors.has_key(self))
-                or (han.listenchannel is self
-                    or han.listenchannel.ancestors.has_key(self))) ]
+        hans = []
+        for ch in chans:
+            hans.extend(ch.runhandlers)
+            hans.extend(ch.listenhandlers)
         gen.remhandlers(hans)
             
-        chans = [ ch for ch in gen.channels
-            if (ch is self or ch.ancestors.has_key(self)) ]
         chans.sort(Channel.compare)
         for ch in chans:
             ch.close()
 
+    def subtree(self):
+        """subtree() -> list of Channel
+
+        Return a list of this channel and all of its descendants.
+
+        Internal method.
+        """
+        
+        res = [ self ]
+        ix = 0
+        while (ix < len(res)):
+            res.extend(res[ix].children)
+            ix += 1
+        return res
+
     def addnote(self):
         """addnote() -> None
 
@@ -558,17 +909,29 @@ class Channel:
         
         self.notecount = self.notecount + 1
 
-    def remnote(self):
-        """remnote() -> None
+    def push_volume(self):
+        """push_volume() -> None
 
-        Note that a note has been removed from the channel.
+        Copy the channel's volume envelope into the native channel object.
+        The mixer works from the native copy, so this must be called
+        whenever self.volume changes.
 
-        Internal method. (Called from the callback to cboodle.create_note.)
+        Internal method.
         """
-        
-        self.notecount = self.notecount - 1
-        if (self.notecount < 0):
-            raise BoodleInternalError('channel notecount negative')
+
+        cboodle.set_channel_volume(self.cchan, self.volume)
+
+    def push_stereo(self):
+        """push_stereo() -> None
+
+        Copy the channel's stereo envelope into the native channel object.
+        The mixer works from the native copy, so this must be called
+        whenever self.stereo changes.
+
+        Internal method.
+        """
+
+        cboodle.set_channel_pan(self.cchan, self.stereo)
 
     def get_root_channel(self):
         """get_root_channel() -> channel
@@ -591,37 +954,49 @@ class Channel:
         it will sound instantaneous. (You should not use an interval
         shorter than 0.005; it can cause undesirable clicks and pops.)
 
-        Due to the way the volume code is written (a cheap and dirty hack),
-        two volume changes scheduled too close together on the same channel
-        (within about one second) can interfere with each other. The earlier
-        one may be ignored entirely in favor of the later. Therefore, you
-        should not rely on rapid sequences of set_volume() calls for your
-        sound effects. Set volumes on individual notes instead, or else
-        create several channels.
+        The change starts from wherever the volume is at that moment,
+        and replaces any volume changes which were still to come. (So
+        if you call set_volume() while an earlier change is under way,
+        the earlier one is cut short.)
         """
 
-        starttm = self.generator.agentruntime
+        gen = self.generator
+        starttm = gen.agentruntime
         endtm = starttm + int(interval * cboodle.framespersec())
 
-        (oldstarttm, oldendtm, oldstartvol, oldendvol) = self.volume
-        if (endtm < oldendtm):
-            # The current fade runs past this one, so we leave it in place.
-            return
-            
-        # Work out the volume at the start of this buffer -- not at
-        # agentruntime. This is because we're discarding the old volume
-        # change. It's not going to have a chance to run up to the correct
-        # changeover point.
-
-        attm = self.generator.bufferstarttime
-        if (attm >= oldendtm):
-            atstart = oldendvol
-        elif (attm >= oldstarttm):
-            atstart = (attm - oldstarttm) / float(oldendtm - oldstarttm) * (oldendvol - oldstartvol) + oldstartvol
-        else:
-            atstart = oldstartvol
-            
-        self.volume = (starttm, endtm, atstart, newvol)
+        self.volume = splice_envelope(self.volume, gen.bufferstarttime,
+            starttm, [ (endtm, newvol) ], interpolate_volume)
+        self.push_volume()
+
+    def set_volume_envelope(self, points):
+        """set_volume_envelope(points) -> None
+
+        Change the volume of the channel through a series of levels. The
+        points are a list of (delay, volume) pairs. Each delay is a time
+        (in seconds) measured from now, as for sched_note(); they must
+        not decrease. The volume moves smoothly from its current level
+        to the first volume, arriving at the first delay; then on to
+        the second volume, and so on. It remains at the last volume.
+        (Two points with the same delay make an abrupt change.)
+
+        As with set_volume(), this replaces any volume changes which
+        were still to come. The mixer follows the envelope on its own,
+        so no agent needs to run while it plays out.
+        """
+
+        gen = self.generator
+        newpoints = []
+        lasttime = gen.agentruntime
+        for (delay, vol) in points:
+            tm = gen.select_time(delay)
+            if (tm < lasttime):
+                raise ScheduleError('envelope times out of order')
+            newpoints.append( (tm, float(vol)) )
+            lasttime = tm
+
+        self.volume = splice_envelope(self.volume, gen.bufferstarttime,
+            gen.agentruntime, newpoints, interpolate_volume)
+        self.push_volume()
 
     def set_pan(self, newpan, interval=0.5):
         """set_pan(newpan, interval=0.5) -> None
@@ -641,43 +1016,44 @@ class Channel:
         interval; it may not be rendered correctly, particularly for
         large changes.
 
-        Due to the way the stereo code is written (a cheap and dirty hack),
-        two stereo changes scheduled too close together on the same channel
-        (within about one second) can interfere with each other. The earlier
-        one may be ignored entirely in favor of the later. Therefore, you
-        should not rely on rapid sequences of set_pan() calls for your
-        sound effects. Set pan positions on individual notes instead, or
-        else create several channels.
+        The change starts from wherever the channel is at that moment,
+        and replaces any pan changes which were still to come.
         """
 
-        newpan = stereo.cast(newpan)
-        starttm = self.generator.agentruntime
+        newpan = stereo.extend_tuple(stereo.cast(newpan))
+        gen = self.generator
+        starttm = gen.agentruntime
         endtm = starttm + int(interval * cboodle.framespersec())
 
-        (oldstarttm, oldendtm, oldstartpan, oldendpan) = self.stereo
-        if (endtm < oldendtm):
-            # The current swoop runs past this one, so we leave it in place.
-            return
+        self.stereo = splice_envelope(self.stereo, gen.bufferstarttime,
+            starttm, [ (endtm, newpan) ], interpolate_pan)
+        self.push_stereo()
 
-        # Work out the pan position at the start of this buffer -- not at
-        # agentruntime. This is because we're discarding the old pan
-        # change. It's not going to have a chance to run up to the correct
-        # changeover point.
-
-        attm = self.generator.bufferstarttime
-        if (attm >= oldendtm):
-            atstart = oldendpan
-        elif (attm >= oldstarttm):
-            pan0 = stereo.extend_tuple(oldstartpan)
-            pan1 = stereo.extend_tuple(oldendpan)
-            ratio = (attm - oldstarttm) / float(oldendtm - oldstarttm)
-            atstart = [ (ratio * (pan1[ix] - pan0[ix]) + pan0[ix])
-                for ix in range(4) ]
-            atstart = tuple(atstart)
-        else:
-            atstart = oldstartpan
-            
-        self.stereo = (starttm, endtm, atstart, newpan)
+    def set_pan_envelope(self, points):
+        """set_pan_envelope(points) -> None
+
+        Move the channel through a series of pan positions. The points
+        are a list of (delay, pan) pairs, where each pan is a value as
+        for set_pan(). The delays work as for set_volume_envelope().
+
+        As with set_pan(), this replaces any pan changes which were
+        still to come. Pan changes much shorter than a buffer (about a
+        tenth of a second) are not rendered precisely.
+        """
+
+        gen = self.generator
+        newpoints = []
+        lasttime = gen.agentruntime
+        for (delay, pan) in points:
+            tm = gen.select_time(delay)
+            if (tm < lasttime):
+                raise ScheduleError('envelope times out of order')
+            newpoints.append( (tm, stereo.extend_tuple(stereo.cast(pan))) )
+            lasttime = tm
+
+        self.stereo = splice_envelope(self.stereo, gen.bufferstarttime,
+            gen.agentruntime, newpoints, interpolate_pan)
+        self.push_stereo()
 
     def get_prop(self, key, default=None):
         """get_prop(key, default=None) -> any
@@ -771,69 +1147,254 @@ class FrameCount:
         self.frames = long(frames)
 
 
-TRIMTIME   = 26460000   # ten minutes
-TRIMOFFSET = 13230000   # five minutes
+class TimerWheel:
+    """TimerWheel: holds entries scheduled for the far future, until
+    their time comes near.
+
+    This is a hierarchical timer wheel. Each level sorts entries into
+    buckets of a fixed span (in frames) -- seconds, minutes, hours --
+    keyed by their time divided by the span. Only buckets which have
+    something in them exist. When a bucket's time approaches, its
+    entries are sorted into finer buckets; when the finest bucket comes
+    due, its entries leave the wheel. So an entry is handled at most
+    once per level, however far out it is scheduled, and a buffer in
+    which nothing comes due costs one comparison.
+
+    Everything in this class is private to Boodler.
+
+    Each entry is a list whose first element is its time (in frames)
+    and whose third element is None if it has been discarded. Discarded
+    entries are dropped when their bucket comes due, or by sweep().
+
+    TimerWheel(spans) -- constructor.
+
+    The spans are a tuple of bucket sizes in frames, finest first. Each
+    should be many times the one before.
+
+    Fields:
+
+    now -- the time passed to the last advance() call
+    horizon -- the earliest time which insert() accepts
+    nexttime -- the time at which advance() will next have something
+        to do, or None if the wheel is empty
+    count -- the number of entries in the wheel, including discarded ones
+
+    Methods:
+
+    insert() -- add an entry to the wheel, if it is far enough out
+    advance() -- move the wheel on, and return the entries which leave it
+    sweep() -- drop all discarded entries
+    """
+
+    def __init__(self, spans):
+        self.spans = spans
+        self.buckets = [ {} for span in spans ]
+        self.heaps = [ [] for span in spans ]
+        self.now = 0
+        self.horizon = 2 * spans[0]
+        self.nexttime = None
+        self.count = 0
+
+    def insert(self, entry):
+        """insert(entry) -> bool
+
+        Add an entry to the wheel, and return True -- if the entry's
+        time is at or beyond the horizon. If not, return False; the
+        entry belongs in a near-term queue instead.
+        """
+
+        time = entry[0]
+        if (time < self.horizon):
+            return False
+
+        # Use the coarsest level in which the entry is at least two
+        # buckets ahead. A bucket comes due a bucket's span early, so
+        # its entries always have somewhere finer to go.
+        spans = self.spans
+        level = len(spans) - 1
+        while (level > 0):
+            span = spans[level]
+            if (time // span > self.now // span + 1):
+                break
+            level -= 1
+        span = spans[level]
+
+        num = time // span
+        buckets = self.buckets[level]
+        bucket = buckets.get(num)
+        if (bucket is None):
+            bucket = []
+            buckets[num] = bucket
+            heapq.heappush(self.heaps[level], num)
+            due = (num-1) * span
+            if (self.nexttime is None or due < self.nexttime):
+                self.nexttime = due
+        bucket.append(entry)
+        self.count += 1
+        return True
+
+    def advance(self, now):
+        """advance(now) -> list
+
+        Move the wheel on to the given time. Return the entries which
+        have come within the horizon, and so leave the wheel. (These
+        are all at or after now.)
+        """
+
+        spans = self.spans
+        self.now = now
+        self.horizon = (now // spans[0] + 2) * spans[0]
+        if (self.nexttime is None or now < self.nexttime):
+            return []
+
+        released = []
+        for level in range(len(spans)):
+            span = spans[level]
+            buckets = self.buckets[level]
+            heap = self.heaps[level]
+            while (heap and (heap[0]-1) * span <= now):
+                bucket = buckets.pop(heapq.heappop(heap))
+                self.count -= len(bucket)
+                for entry in bucket:
+                    if (entry[2] is None):
+                        continue
+                    if (not self.insert(entry)):
+                        released.append(entry)
+
+        self.find_nexttime()
+        return released
+
+    def sweep(self):
+        """sweep() -> None
+
+        Drop all discarded entries from the wheel.
+        """
+
+        self.count = 0
+        for level in range(len(self.spans)):
+            buckets = self.buckets[level]
+            for (num, bucket) in buckets.items():
+                bucket = [ entry for entry in bucket
+                    if (not (entry[2] is None)) ]
+                if (bucket):
+                    buckets[num] = bucket
+                    self.count += len(bucket)
+                else:
+                    del buckets[num]
+            heap = buckets.keys()
+            heapq.heapify(heap)
+            self.heaps[level] = heap
+        self.find_nexttime()
+
+    def find_nexttime(self):
+        """find_nexttime() -> None
+
+        Work out when the next bucket comes due. (Internal method.)
+        """
+
+        self.nexttime = None
+        for level in range(len(self.spans)):
+            heap = self.heaps[level]
+            if (heap):
+                due = (heap[0]-1) * self.spans[level]
+                if (self.nexttime is None or due < self.nexttime):
+                    self.nexttime = due
+
+
+def splice_envelope(points, basetime, attime, newpoints, interpolate):
+    """splice_envelope(points, basetime, attime, newpoints, interpolate)
+        -> list
+
+    Work out a channel's new envelope, when a list of breakpoints takes
+    over from the old one at attime. Each breakpoint is a (time, value)
+    tuple. The new envelope runs from the old one's value at attime
+    into the new breakpoints. Old breakpoints at or after attime are
+    dropped, as are those before basetime (the start of the current
+    buffer) -- except the last of those, which still sets the level.
+
+    The interpolate argument is a function (val0, val1, ratio) -> val.
+
+    This is an internal function of Channel.
+    """
+
+    pos = 0
+    while (pos+1 < len(points) and points[pos+1][0] <= basetime):
+        pos += 1
+    ix = pos
+    while (ix < len(points) and points[ix][0] < attime):
+        ix += 1
+
+    if (ix == pos):
+        val = points[pos][1]
+    elif (ix == len(points)):
+        val = points[-1][1]
+    else:
+        (tm0, val0) = points[ix-1]
+        (tm1, val1) = points[ix]
+        val = interpolate(val0, val1, (attime - tm0) / float(tm1 - tm0))
+
+    res = points[pos:ix]
+    res.append( (attime, val) )
+    res.extend(newpoints)
+    return res
+
+def interpolate_volume(vol0, vol1, ratio):
+    return ratio * (vol1 - vol0) + vol0
+
+def interpolate_pan(pan0, pan1, ratio):
+    return tuple([ (ratio * (pan1[ix] - pan0[ix]) + pan0[ix])
+        for ix in range(4) ])
+
+# The far-future wheels sort agents and notes into buckets of about
+# 1.5 seconds, 1.5 minutes, and 1.7 hours (at 44100 frames per second).
+WHEELSPANS = (65536, 4194304, 268435456)
+
+# How often the generator wakes up to check the sample memory budget,
+# even if it has nothing else to do. (Samples loaded in the background
+# may have pushed it over.)
 UNLOADTIME =  1323000   # 30 seconds
-UNLOADAGE  = 10000000   # 4-ish minutes
 
 # Small values, for debugging
-# TRIMTIME   =  80000
-# TRIMOFFSET =  50000
 # UNLOADTIME =  50000
-# UNLOADAGE  = 110000
 
-def run_agents(starttime, gen):
-    """run_agents(starttime, gen) -> None
+def run_agents(starttime, gen, finished):
+    """run_agents(starttime, gen, finished) -> int or None
 
     The big function that does everything. This is called regularly from
     inside the cboodle module. Its task is to push notes into the note
     queue, and also manage everything required to do that -- agents,
     channels, listeners, etc.
 
+    The finished argument is a list of (Sample, Channel) pairs, one for
+    each note which ended since the previous call.
+
+    This returns the frame time at which it next has work to do, or
+    None if it must be called for every buffer. (See
+    Generator.next_wakeup.) In between, the cboodle module goes on
+    mixing without calling it -- except that it is called for any
+    buffer in which notes have ended.
+
     Raises StopGeneration when the soundscape is over (i.e., when all
     channels have expired).
     """
     
     gen.logger.debug('beginning run cycle at %d', starttime)
 
-    # A lot of internal scheduling is kept in frame units (meaning
-    # 1/44000 of a second or whatever). That'll overflow a long
-    # integer eventually. So at regular intervals, we have to reset
-    # the clock. That means going through every data structure that 
-    # stores a time value, and subtracting a constant from it.
-
-    if (starttime >= TRIMTIME):
-        starttime -= TRIMOFFSET
-        gen.logger.debug('trimming timebase, now %d', starttime)
-        cboodle.adjust_timebase(TRIMOFFSET)
-        gen.lastunload -= TRIMOFFSET
-        sample.adjust_timebase(TRIMOFFSET, UNLOADAGE)
-        for tup in gen.queue:
-            tup[0] -= TRIMOFFSET
-        for chan in gen.channels:
-            (starttm, endtm, startvol, endvol) = chan.volume
-            if (endtm <= starttime):
-                continue
-            starttm -= TRIMOFFSET
-            endtm -= TRIMOFFSET
-            chan.volume = (starttm, endtm, startvol, endvol)
-        for chan in gen.channels:
-            (starttm, endtm, startpan, endpan) = chan.stereo
-            if (endtm <= starttime):
-                continue
-            starttm -= TRIMOFFSET
-            endtm -= TRIMOFFSET
-            chan.stereo = (starttm, endtm, startpan, endpan)
-        if (not (gen.stats_interval is None)):
-            gen.last_stats_dump -= TRIMOFFSET
+    # First, account for the notes that ended since the last cycle.
 
-    # We also look at the database of sound samples at regular intervals.
-    # Any samples that aren't being used right now get unloaded from
-    # memory.
+    if (finished):
+        gen.remnotes(finished)
+
+    # If the loaded sound samples have outgrown their memory budget,
+    # the least recently used ones which aren't playing get unloaded.
+    # This is checked when samples have been loaded since the last
+    # check, and every UNLOADTIME regardless.
 
     if (gen.lastunload + UNLOADTIME < starttime):
         gen.lastunload = starttime
-        sample.unload_unused(starttime-UNLOADAGE)
+        sample.unload_excess()
+    elif (sample.memory_grown):
+        sample.unload_excess()
 
     # We might dump stats at regular intervals.
 
@@ -845,11 +1406,21 @@ def run_agents(starttime, gen):
             gen.statslogger.warning(fl.getvalue())
             fl.close()
 
+    # Or report the progress of an offline render.
+
+    if (not (gen.progress_interval is None)):
+        gen.report_progress(starttime)
+
     # Now, the work of generating sound. We will play every note and run
     # every agent which is scheduled between starttime and nexttime.
 
     nexttime = starttime + cboodle.framesperbuf()
 
+    # Agents and notes scheduled far ahead wait in the generator's timer
+    # wheels. Bring in the ones which are coming within reach.
+
+    gen.cascade(nexttime)
+
     if (gen.stoplist):
         for chan in gen.stoplist:
             if (chan.active):
@@ -866,10 +1437,16 @@ def run_agents(starttime, gen):
         ev = gen.postqueue.pop(0)
         gen.sendevent(ev, gen.rootchannel)
 
-    while (gen.queue and gen.queue[0][0] < nexttime):
-        (runtime, ag, handle) = gen.queue.pop(0)
+    while (True):
+        tup = gen.nextagent(nexttime)
+        if (tup is None):
+            break
+        (runtime, ag, handle) = tup
         ag.queued = False
         ag.channel.agentcount -= 1
+        ag.channel.agents.pop(ag)
+        if (ag.channel.agentcount == 0):
+            gen.maybeempty[ag.channel] = ag.channel
         ag.logger.info('running')
         try:
             if (not ag.channel.active):
@@ -885,13 +1462,20 @@ def run_agents(starttime, gen):
     gen.bufferstarttime = None
     gen.agentruntime = None
     
-    ls = [ chan for chan in gen.channels
-        if (chan.notecount == 0
+    # Close the channels which have nothing left in them. Only channels
+    # whose counts have dropped to zero need to be looked at. (Closing
+    # one may empty another, such as its parent; that one will be in
+    # maybeempty again, for the next buffer.)
+    
+    ls = [ chan for chan in gen.maybeempty
+        if (chan.active
+            and chan.notecount == 0
             and chan.agentcount == 0
             and chan.listenholds == 0
             and chan.runholds == 0
             and chan.childcount == 0)
     ]
+    gen.maybeempty.clear()
     for chan in ls:
         if (chan.runhandlers):
             gen.remhandlers(list(chan.runhandlers))
@@ -902,6 +1486,8 @@ def run_agents(starttime, gen):
     if (not gen.channels):
         raise StopGeneration()
 
+    return gen.next_wakeup(nexttime)
+
 
 # Late imports.
 
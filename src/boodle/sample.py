@@ -12,6 +12,16 @@ Public functions:
 
 get() -- load a sample object, given a filename or File object
 get_info() -- measure the expected running time and looping params of a sound
+prefetch() -- begin loading samples in the background
+prefetch_package() -- begin loading all the sounds in a package
+is_ready() -- see whether a sample can be played without waiting for it
+set_cache_dir() -- set the directory for the decoded-sample cache
+set_cache_limit() -- limit the size of the decoded-sample cache
+set_memory_budget() -- limit the memory used by loaded sample data
+get_memory_stats() -- report on the memory used by loaded sample data
+set_stream_threshold() -- set how large a sample must be to be streamed
+set_compression() -- keep samples compressed in memory, decoding as they play
+get_compression_stats() -- report on the samples kept compressed
 """
 
 import fileinput
@@ -21,7 +31,11 @@ import aifc
 import wave
 import sunau
 import struct
+import time
 import bisect
+import hashlib
+import threading
+import Queue
 
 # Maps File objects, and also str/unicode pathnames, to Samples.
 cache = {}
@@ -36,6 +50,71 @@ if struct.pack("h", 1) == "\000\001":
 else:
     big_endian = 0
 
+# The directory in which decoded sample data is cached, or None if there
+# is no cache. (See set_cache_dir.)
+cache_dir = None
+# The most bytes the cache may hold, or None for no limit. When it holds
+# more, the least recently used cache files are deleted. (See
+# set_cache_limit.)
+cache_limit = 1024*1024*1024
+# The number of bytes in the cache, as of the last time it was tidied
+# (plus files written since then), or None if it has not been measured.
+cache_used = None
+# A temporary cache file older than this many seconds was left behind
+# by a crash, and is deleted when the cache is tidied.
+cache_stale_age = 3600
+# Guards cache_used, since background threads write cache files too.
+cache_lock = threading.Lock()
+
+# A cache file is a header (padded to cache_offset bytes) followed by
+# the sample data, as native-endian 16-bit values.
+cache_magic = 'BooPCM\0\1'
+cache_header = '=8siqqqi'
+cache_offset = 64
+
+# The memory budget for loaded sample data, in bytes, or None for no
+# limit. (See set_memory_budget.)
+memory_budget = 256*1024*1024
+# The number of bytes of sample data loaded at the moment (not counting
+# the decoded blocks of compressed samples, which come and go as they
+# play; see memory_in_use), and counts
+# of the notes which found their sample loaded (hits), the times a
+# sample had to be loaded when it was wanted (misses), and the samples
+# unloaded to stay within the budget (evictions). Background threads
+# update these too, so they are guarded by memory_lock.
+memory_used = 0
+# Set when memory_used grows, so that the generator knows to check the
+# budget before its usual time. (See unload_excess.)
+memory_grown = False
+memory_hits = 0
+memory_misses = 0
+memory_evictions = 0
+memory_lock = threading.Lock()
+
+# Samples whose decoded data is at least this many bytes are streamed
+# from disk as they play, rather than held in memory; or None to never
+# stream. (See set_stream_threshold.)
+stream_threshold = 32*1024*1024
+# The number of frames decoded at a time, when a sample is decoded
+# into the cache to be streamed.
+stream_chunk_frames = 65536
+
+# The compression modes samples can be kept in, and the codes cboodle
+# uses for them. (See set_compression.)
+compression_modes = { '8bit': 1, 'adpcm': 2 }
+# The compression mode for all samples, or None to not compress.
+compression = None
+# Maps package names to compression modes, for packages which differ
+# from the global mode.
+package_compression = {}
+
+# The number of threads which load samples in the background. (See
+# prefetch.) They are started when first needed.
+prefetch_threads = 2
+# The queue of Samples waiting for a background thread, or None if the
+# threads have not been started.
+prefetch_queue = None
+
 class Sample:
     """Sample: represents a sound file, held in memory.
 
@@ -45,6 +124,18 @@ class Sample:
     """
     
     reloader = None
+    # While a background thread is loading the sample, this is a
+    # threading.Event which is set when it finishes. No other thread
+    # may touch the csamp until then. (See prefetch.)
+    loading = None
+    # The exception raised by a background load, if it failed.
+    loaderror = None
+    # The number of bytes of data loaded for this sample (as counted
+    # in memory_used).
+    size = 0
+    # True if get() loaded the sample and counted that as a miss; the
+    # first note played doesn't count again.
+    newlyloaded = False
 
     def __init__(self, filename, csamp):
         self.filename = filename
@@ -55,21 +146,86 @@ class Sample:
     def __repr__(self):
         return '<Sample at ' + str(self.filename) + '>'
         
-    def queue_note(self, pitch, volume, pan, starttime, chan):
+    def check_playable(self):
+        """check_playable() -> None
+
+        Make sure the sample is loaded and ready to play, reloading it
+        if necessary. Raises SampleError if it can't be played.
+        """
+        if (not (self.loading is None)):
+            if (not self.loading.isSet()):
+                count_access(False)
+            self.finish_loading()
         if (cboodle.is_sample_error(self.csamp)):
             raise SampleError('sample is unplayable')
         if (not cboodle.is_sample_loaded(self.csamp)):
+            count_access(False)
+            self.newlyloaded = False
             if (not (self.reloader is None)):
                 self.reloader.reload(self)
             if (not cboodle.is_sample_loaded(self.csamp)):
                 raise SampleError('sample is unloaded')
+        elif (self.newlyloaded):
+            self.newlyloaded = False
+        else:
+            count_access(True)
+
+    def finish_loading(self):
+        """finish_loading() -> None
+
+        If the sample is being loaded in the background, wait for that
+        to finish. If the load failed, its exception is raised (once).
+        """
+        ev = self.loading
+        if (ev is None):
+            return
+        ev.wait()
+        self.loading = None
+        ex = self.loaderror
+        if (not (ex is None)):
+            self.loaderror = None
+            raise ex
+
+    def is_ready(self):
+        """is_ready() -> bool
+
+        Return whether the sample can be played without waiting for it
+        to load. (A sample which cannot be loaded at all counts as
+        ready; playing it will raise SampleError without delay.)
+        """
+        ev = self.loading
+        if (not (ev is None)):
+            return ev.isSet()
+        return bool(cboodle.is_sample_loaded(self.csamp)
+            or cboodle.is_sample_error(self.csamp))
+
+    def components(self):
+        """components() -> list
+
+        Return the samples (or filenames, or Files) which must be loaded
+        for this sample to play. For a plain sample, that's itself.
+        """
+        return [self]
+
+    def resolve(self, pitch, volume):
+        """resolve(pitch, volume) -> (Sample, pitch, volume)
+
+        Work out which sample (and what pitch and volume) a note of
+        this sample really plays. For a plain sample, that's itself.
+        """
+        return (self, pitch, volume)
+
+    def queue_note(self, pitch, volume, pan, starttime, chan):
+        self.check_playable()
+        gen = chan.generator
+        if (starttime >= gen.farnotes.horizon):
+            gen.defer_note((self, pitch, volume, stereo.extend_tuple(pan),
+                starttime, 0), chan)
+            return cboodle.note_duration(self.csamp, pitch, 0)
         (panscx, panshx, panscy, panshy) = stereo.extend_tuple(pan)
-        def closure(samp=self, chan=chan):
-            samp.refcount -= 1
-            chan.remnote()
         dur = cboodle.create_note(self.csamp, pitch, volume,
             panscx, panshx, panscy, panshy,
-            starttime, chan, closure)
+            starttime, chan, chan.cchan, self)
         chan.addnote()
         self.refcount += 1
         if (self.lastused < starttime + dur):
@@ -77,20 +233,16 @@ class Sample:
         return dur
 
     def queue_note_duration(self, pitch, volume, pan, starttime, duration, chan):
-        if (cboodle.is_sample_error(self.csamp)):
-            raise SampleError('sample is unplayable')
-        if (not cboodle.is_sample_loaded(self.csamp)):
-            if (not (self.reloader is None)):
-                self.reloader.reload(self)
-            if (not cboodle.is_sample_loaded(self.csamp)):
-                raise SampleError('sample is unloaded')
+        self.check_playable()
+        gen = chan.generator
+        if (starttime >= gen.farnotes.horizon):
+            gen.defer_note((self, pitch, volume, stereo.extend_tuple(pan),
+                starttime, duration), chan)
+            return cboodle.note_duration(self.csamp, pitch, duration)
         (panscx, panshx, panscy, panshy) = stereo.extend_tuple(pan)
-        def closure(samp=self, chan=chan):
-            samp.refcount -= 1
-            chan.remnote()
         dur = cboodle.create_note_duration(self.csamp, pitch, volume,
             panscx, panshx, panscy, panshy,
-            starttime, duration, chan, closure)
+            starttime, duration, chan, chan.cchan, self)
         chan.addnote()
         self.refcount += 1
         if (self.lastused < starttime + dur):
@@ -98,6 +250,8 @@ class Sample:
         return dur
 
     def get_info(self, pitch=1.0):
+        if (not (self.loading is None)):
+            self.finish_loading()
         if (cboodle.is_sample_error(self.csamp)):
             raise SampleError('sample is unplayable')
         res = cboodle.sample_info(self.csamp)
@@ -140,6 +294,27 @@ class MixinSample(Sample):
             
         raise SampleError(str(pitch) + ' is outside mixin ranges')
 
+    def is_ready(self):
+        for sname in self.components():
+            if (not is_ready(sname)):
+                return False
+        return True
+
+    def components(self):
+        ls = [ rn.sample for rn in self.ranges ]
+        if (not (self.default is None)):
+            ls.append(self.default.sample)
+        return ls
+
+    def resolve(self, pitch, volume):
+        rn = self.find(pitch)
+        if (not (rn.pitch is None)):
+            pitch *= rn.pitch
+        if (not (rn.volume is None)):
+            volume *= rn.volume
+        samp = get(rn.sample)
+        return samp.resolve(pitch, volume)
+
     def queue_note(self, pitch, volume, pan, starttime, chan):
         rn = self.find(pitch)
         if (not (rn.pitch is None)):
@@ -165,18 +340,283 @@ class MixinSample(Sample):
         samp = get(rn.sample)
         return samp.get_info(pitch)
 
-def unload_unused(deathtime):
-    for samp in list(cache.values()):
-        if (samp.refcount == 0
-            and (not (samp.csamp is None))
-            and deathtime >= samp.lastused
-            and cboodle.is_sample_loaded(samp.csamp)):
-                cboodle.unload_sample(samp.csamp)
+def queue_notes(notes, chan):
+    """queue_notes(notes, chan) -> list of int
+
+    Queue a batch of notes in a channel, with a single call to the
+    cboodle module. Each note is a tuple (samp, pitch, volume, pan,
+    starttime, duration), where samp is a Sample which has already been
+    resolved (see Sample.resolve), pan is a stereo 4-tuple, and the
+    times are in frames. A duration of 0 means once through the sample.
+    The tuple may go on with (attack, release, curve): the frames over
+    which the note fades in and out, and the shape of the fades (one of
+    the Agent.note_curves values).
+
+    This returns the durations of the notes, in frames. If any sample
+    cannot be played, this raises SampleError, and no notes are queued.
+
+    Notes which start far in the future are held by the generator
+    (see Generator.defer_note) rather than queued now.
+    """
+
+    # A batch of one plain note is cheaper to queue the usual way.
+    if (len(notes) == 1 and len(notes[0]) == 6):
+        (samp, pitch, volume, pan, starttime, duration) = notes[0]
+        return [ samp.queue_note_duration(pitch, volume, pan, starttime,
+            duration, chan) ]
+    
+    samps = {}
+    for note in notes:
+        samps[note[0]] = True
+    for samp in samps:
+        samp.check_playable()
+
+    gen = chan.generator
+    horizon = gen.farnotes.horizon
+    near = notes
+    for note in notes:
+        if (note[4] >= horizon):
+            near = [ note for note in notes if (note[4] < horizon) ]
+            break
+
+    durs = cboodle.create_notes(chan, chan.cchan, near)
+    
+    for (note, dur) in zip(near, durs):
+        samp = note[0]
+        samp.refcount += 1
+        endtime = note[4] + dur
+        if (samp.lastused < endtime):
+            samp.lastused = endtime
+    chan.notecount += len(durs)
+    if (len(durs) < len(near)):
+        raise MemoryError('unable to queue notes')
+    if (near is notes):
+        return durs
+
+    # Defer the rest, and put the durations back in order.
+    res = []
+    pos = 0
+    for note in notes:
+        if (note[4] < horizon):
+            res.append(durs[pos])
+            pos += 1
+        else:
+            gen.defer_note(note, chan)
+            res.append(cboodle.note_duration(note[0].csamp, note[1],
+                note[5]))
+    return res
+
+def set_memory_budget(val):
+    """set_memory_budget(val) -> None
+
+    Limit the memory used by loaded sample data to the given number
+    of bytes. When there is more than that, the samples which have gone
+    longest without being played are unloaded. (Samples which are
+    playing are never unloaded, so the limit may be exceeded if they
+    do not fit.) Pass None to remove the limit.
+    """
+
+    global memory_budget
+    if (not (val is None)):
+        val = int(val)
+        if (val < 0):
+            raise ValueError('memory budget must not be negative')
+    memory_budget = val
+
+def set_stream_threshold(val):
+    """set_stream_threshold(val) -> None
+
+    Stream samples whose decoded data is at least the given number of
+    bytes. A streamed sample is read from disk as it plays, a few
+    seconds ahead, so only the parts being played are in memory. This
+    is for very long sounds, such as hour-long recordings. Pass None
+    to never stream.
+
+    Only samples which can be mapped from disk are streamed: WAV files
+    already in the form the mixer uses, and anything in the decoded-
+    sample cache. (See set_cache_dir.) Other long samples are loaded
+    into memory whole.
+    """
+
+    global stream_threshold
+    if (not (val is None)):
+        val = int(val)
+        if (val < 0):
+            raise ValueError('stream threshold must not be negative')
+    stream_threshold = val
+
+def is_streamable(numframes, numchannels):
+    """is_streamable(numframes, numchannels) -> bool
+
+    Decide whether a sample of the given size should be streamed. (See
+    set_stream_threshold.)
+    """
+
+    if (stream_threshold is None):
+        return False
+    size = numframes * min(numchannels, 2) * 2
+    return (size >= stream_threshold)
+
+def set_compression(mode, pkgname=None):
+    """set_compression(mode, pkgname=None) -> None
+
+    Keep samples compressed in memory, and decode them a piece at a
+    time as they play. This saves memory at some cost in processor
+    time. The mode may be:
+
+        '8bit' -- keep 8-bit sounds at 8 bits, rather than expanding
+            them to 16. Nothing is lost. Other sounds are unaffected.
+        'adpcm' -- keep all sounds as IMA ADPCM, at 4 bits per value.
+            This loses a little quality.
+        None -- do not compress.
+
+    If pkgname is given, the mode applies to the sounds of that package
+    only. Otherwise it applies to all sounds (except those of packages
+    given their own mode). Sounds already loaded are not affected until
+    they are next loaded.
+
+    Sounds large enough to be streamed from disk are streamed, rather
+    than compressed. (See set_stream_threshold.)
+    """
+
+    global compression
+    if (not (mode is None or mode in compression_modes)):
+        raise ValueError('unknown compression mode: ' + str(mode))
+    if (pkgname is None):
+        compression = mode
+    else:
+        package_compression[pkgname] = mode
+
+def get_compression(filename):
+    """get_compression(filename) -> str or None
+
+    Return the compression mode which applies to a File or filename.
+    """
+
+    if (isinstance(filename, boopak.pinfo.File)
+        and not (filename.package is None)):
+        pkgname = filename.package.name
+        if (pkgname in package_compression):
+            return package_compression[pkgname]
+    return compression
+
+def get_compression_stats():
+    """get_compression_stats() -> list
+
+    Report on the samples which are loaded and kept compressed. This
+    returns a list of tuples, one per sample:
 
-def adjust_timebase(trimoffset, maxage):
+        (filename, mode, compressed, full, decoded, blocks, time)
+
+    The compressed value is the number of bytes of compressed data;
+    full is the number of bytes it would take uncompressed; decoded
+    is the number of bytes decoded and in memory at the moment. The
+    blocks value is the number of blocks decoded so far, and time is
+    the number of seconds spent decoding them.
+    """
+
+    modenames = dict([ (val, key) for (key, val)
+        in compression_modes.items() ])
+    res = []
     for samp in cache.values():
-        if (samp.lastused >= -maxage):
-            samp.lastused = samp.lastused - trimoffset
+        if (samp.csamp is None or not samp.is_ready()):
+            continue
+        tup = cboodle.sample_compression(samp.csamp)
+        if (tup is None):
+            continue
+        (mode, compressed, full, decoded, blocks, time) = tup
+        res.append( (samp.filename, modenames.get(mode), compressed, full,
+            decoded, blocks, time) )
+    return res
+
+def get_memory_stats():
+    """get_memory_stats() -> (used, budget, hits, misses, evictions)
+
+    Report on the memory used by loaded sample data: the number of
+    bytes in memory (see memory_in_use), the budget (or None), the number of times a note
+    found its sample loaded, the number of times a sample had to be
+    loaded (or waited for) when it was wanted, and the number of
+    samples unloaded to stay within the budget.
+    """
+
+    return (memory_in_use(), memory_budget, memory_hits, memory_misses,
+        memory_evictions)
+
+def memory_in_use():
+    """memory_in_use() -> int
+
+    The number of bytes of sample data in memory: the loaded data
+    counted in memory_used, plus the blocks of compressed samples which
+    are decoded at the moment.
+    """
+
+    return memory_used + cboodle.stream_stats()[4]
+
+def count_access(hit):
+    """count_access(hit) -> None
+
+    Count a note's use of a sample, which either found it loaded (a hit)
+    or did not (a miss).
+    """
+
+    global memory_hits, memory_misses
+    memory_lock.acquire()
+    try:
+        if (hit):
+            memory_hits += 1
+        else:
+            memory_misses += 1
+    finally:
+        memory_lock.release()
+
+def count_loaded(samp):
+    """count_loaded(samp) -> None
+
+    Bring memory_used up to date with the sample's data, after it is
+    loaded or unloaded. This may be called from any thread.
+    """
+
+    global memory_used, memory_grown
+    size = cboodle.sample_size(samp.csamp)
+    memory_lock.acquire()
+    try:
+        memory_used += (size - samp.size)
+        if (size > samp.size):
+            memory_grown = True
+        samp.size = size
+    finally:
+        memory_lock.release()
+
+def unload_excess():
+    """unload_excess() -> None
+
+    If the loaded sample data is over the memory budget, unload the
+    least recently used samples which are not playing, until it fits.
+    This must be called from the main thread, when no agent is in the
+    middle of scheduling notes.
+
+    The generator calls this whenever samples have been loaded (see
+    memory_grown), and every UNLOADTIME otherwise, to catch the blocks
+    decoded for compressed samples.
+    """
+
+    global memory_evictions, memory_grown
+    memory_grown = False
+    if (memory_budget is None or memory_in_use() <= memory_budget):
+        return
+
+    ls = [ (samp.lastused, samp) for samp in cache.values()
+        if (samp.size and samp.refcount == 0
+            and (samp.loading is None or samp.loading.isSet())) ]
+    ls.sort()
+    for (lastused, samp) in ls:
+        if (memory_in_use() <= memory_budget):
+            break
+        cboodle.unload_sample(samp.csamp)
+        count_loaded(samp)
+        memory_lock.acquire()
+        memory_evictions += 1
+        memory_lock.release()
 
 def get(sname):
     """get(sample) -> Sample
@@ -203,6 +643,25 @@ def get(sname):
     if (not (samp is None)):
         return samp
 
+    (filename, suffix) = find_file(sname)
+    loader = find_loader(suffix)
+    samp = loader.load(filename, suffix)
+    if (not (samp.csamp is None)):
+        count_access(False)
+        samp.newlyloaded = True
+
+    # Cache under the original key (may be File, str, or unicode)
+    cache[sname] = samp
+    return samp
+
+def find_file(sname):
+    """find_file(sname) -> (filename, suffix)
+
+    Locate a sound file, given a filename or File object. Return the
+    File or (absolute) filename, and its lower-cased suffix. Raises
+    SampleError if the file cannot be read.
+    """
+
     suffix = None
         
     if (isinstance(sname, boopak.pinfo.MemFile)):
@@ -229,14 +688,122 @@ def get(sname):
         else:
             raise SampleError('file not readable: ' + sname)
 
-    suffix = suffix.lower()
-    
-    loader = find_loader(suffix)
-    samp = loader.load(filename, suffix)
+    return (filename, suffix.lower())
 
-    # Cache under the original key (may be File, str, or unicode)
-    cache[sname] = samp
-    return samp
+def prefetch(snames, usetime=0):
+    """prefetch(snames, usetime=0) -> None
+
+    Begin loading a list of samples (filenames, File objects, or Sample
+    objects) in the background. This returns at once; the decoding
+    happens on separate threads, so that it does not hold up the sound
+    output. A sample which is played before it has finished loading
+    is waited for.
+
+    The usetime, if given, is the current frame time. It counts as the
+    samples' most recent use, so that they are not the first to be
+    unloaded when memory is short (see unload_excess).
+
+    Raises SampleError if a file cannot be found. (Problems decoding
+    the file are reported when the sample is played.)
+    """
+
+    for sname in snames:
+        samp = cache.get(sname)
+        if (samp is None):
+            if (isinstance(sname, Sample)):
+                samp = sname
+            else:
+                (filename, suffix) = find_file(sname)
+                loader = find_loader(suffix)
+                samp = loader.create(filename, suffix)
+                cache[sname] = samp
+
+        if (isinstance(samp, MixinSample)):
+            prefetch(samp.components(), usetime)
+            continue
+
+        if (samp.lastused < usetime):
+            samp.lastused = usetime
+        ev = samp.loading
+        if (not (ev is None)):
+            # Already prefetched. If that finished (and succeeded), the
+            # sample may since have been unloaded; check again.
+            if (not ev.isSet() or not (samp.loaderror is None)):
+                continue
+            samp.loading = None
+        if (samp.reloader is None or samp.is_ready()):
+            continue
+
+        if (prefetch_queue is None):
+            start_prefetch_threads()
+        samp.loading = threading.Event()
+        prefetch_queue.put(samp)
+
+def prefetch_package(pkg):
+    """prefetch_package(pkg) -> None
+
+    Begin loading, in the background, every sound resource in a package
+    (a PackageInfo whose content has been imported). Sounds which cannot
+    be found are skipped.
+    """
+
+    ls = []
+    for res in pkg.resources.resources():
+        if (res.get_one('boodler.use') != 'sound'):
+            continue
+        try:
+            ls.append(pkg.loader.load_item_by_name(res.key, package=pkg))
+        except ValueError:
+            pass
+    for sname in ls:
+        try:
+            prefetch([sname])
+        except SampleError:
+            pass
+
+def is_ready(sname):
+    """is_ready(sample) -> bool
+
+    Return whether a sample (filename, File, or Sample object) can be
+    played without waiting for it to load.
+    """
+
+    if (isinstance(sname, Sample)):
+        samp = sname
+    else:
+        samp = cache.get(sname)
+        if (samp is None):
+            return False
+    return samp.is_ready()
+
+def start_prefetch_threads():
+    """start_prefetch_threads() -> None
+
+    Start the threads which load samples in the background.
+    """
+
+    global prefetch_queue
+    prefetch_queue = Queue.Queue()
+    for ix in range(prefetch_threads):
+        thread = threading.Thread(target=prefetch_worker,
+            name='sample-prefetch-%d' % (ix,))
+        thread.setDaemon(True)
+        thread.start()
+
+def prefetch_worker():
+    """prefetch_worker() -> None
+
+    The body of a background loading thread. It loads queued samples,
+    forever.
+    """
+
+    while True:
+        samp = prefetch_queue.get()
+        try:
+            samp.reloader.reload(samp)
+        except Exception, ex:
+            samp.loaderror = ex
+        samp.loading.set()
 
 def get_info(samp, pitch=1):
     """get_info(sample, pitch=1) -> tuple
@@ -378,16 +945,343 @@ class SampleLoader:
     def load(self, filename, suffix):
         csamp = cboodle.new_sample()
         try:
-            self.raw_load(filename, csamp)
+            self.cache_load(filename, csamp)
         except Exception, ex:
             cboodle.delete_sample(csamp)
             raise
         samp = Sample(filename, csamp)
         samp.reloader = self
+        count_loaded(samp)
+        return samp
+
+    def create(self, filename, suffix):
+        """create(filename, suffix) -> Sample
+
+        Create a Sample for the file, without loading its data. (The
+        data is loaded by reload(), when the sample is first played or
+        prefetched.)
+        """
+        csamp = cboodle.new_sample()
+        samp = Sample(filename, csamp)
+        samp.reloader = self
         return samp
 
     def reload(self, samp):
-        self.raw_load(samp.filename, samp.csamp)
+        self.cache_load(samp.filename, samp.csamp)
+        count_loaded(samp)
+
+    def cache_load(self, filename, csamp):
+        """cache_load(filename, csamp) -> None
+
+        Load the sample data. If the decoded-sample cache has a copy,
+        it is mapped into memory, which costs next to nothing. If not,
+        the file is decoded with raw_load(), and the result is written
+        into the cache for next time. (A sample too long to hold in
+        memory is decoded straight into the cache, and streamed from
+        there; see stream_load().)
+
+        A sample which is to be kept compressed (see set_compression) is
+        always decoded from its file, and not cached; the compressed
+        form is small, and the cached form would not be.
+
+        (raw_load() returns the parameters it passed to load_sample, or
+        None if it was able to map the file in place, or streamed it --
+        in which case there is nothing more worth caching.)
+        """
+
+        compress = get_compression(filename)
+        pathname = file_pathname(filename)
+        cachename = None
+        if (not (pathname is None)):
+            cachename = cache_pathname(pathname)
+        if (not (cachename is None)):
+            # A sample which is to be compressed is not mapped from the
+            # cache, unless it is large enough to stream.
+            if (map_cache_file(cachename, csamp, not (compress is None))):
+                return
+
+        params = self.raw_load(filename, csamp, cachename, compress)
+
+        if (not (cachename is None or params is None)
+            and cboodle.sample_compression(csamp) is None):
+            write_cache_file(cachename, csamp, params)
+
+    def stream_load(self, fl, cachename, csamp, params):
+        """stream_load(fl, cachename, csamp, params) -> bool
+
+        Load a sample which is too long to hold in memory, by decoding
+        it into the cache a piece at a time, and then streaming it from
+        the cache file. The fl is an open aifc, wave, or sunau reader,
+        at the start of its frames; the params are those which would
+        be passed to load_sample, with None for the data.
+
+        Return False if there is no cache, or the cache file could not
+        be written. The reader is then rewound, so the caller can load
+        the sample the usual way.
+        """
+
+        if (cachename is None):
+            return False
+        (framerate, numframes, dat, loopstart, loopend, numchannels,
+            samplebits, issigned, isbigend) = params
+        tempname = '%s.%d.tmp' % (cachename, os.getpid())
+        try:
+            outfl = open(tempname, 'wb')
+            try:
+                outfl.write(cache_file_header(params))
+                count = 0
+                while (count < numframes):
+                    dat = fl.readframes(min(stream_chunk_frames,
+                        numframes - count))
+                    if (not dat):
+                        break
+                    outfl.write(cboodle.convert_sample_data(dat,
+                        numchannels, samplebits, issigned, isbigend))
+                    count += len(dat) // (numchannels * (samplebits // 8))
+            finally:
+                outfl.close()
+            if (count == numframes):
+                os.rename(tempname, cachename)
+                cache_added(cachename)
+                if (map_cache_file(cachename, csamp)):
+                    return True
+        except (IOError, OSError, ValueError):
+            pass
+        try:
+            os.remove(tempname)
+        except OSError:
+            pass
+        fl.rewind()
+        return False
+
+def set_cache_dir(dirname):
+    """set_cache_dir(dirname) -> None
+
+    Keep decoded sample data in the given directory. When a sample is
+    loaded again -- in a later session, or after unload_excess() has
+    dropped it -- the data is mapped straight into memory rather than
+    decoded again. Pass None to turn the cache off.
+
+    The directory is created if it does not exist. If that fails, the
+    cache is turned off. If it does exist, it is tidied (see
+    clean_cache).
+    """
+
+    global cache_dir, cache_used
+    if (not (dirname is None) and not os.path.isdir(dirname)):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            dirname = None
+    cache_dir = dirname
+    cache_used = None
+    clean_cache()
+
+def set_cache_limit(val):
+    """set_cache_limit(val) -> None
+
+    Limit the decoded-sample cache to the given number of bytes. When
+    it holds more, the cache files which have gone longest without
+    being used are deleted. Pass None to remove the limit.
+    """
+
+    global cache_limit
+    if (not (val is None)):
+        val = int(val)
+        if (val < 0):
+            raise ValueError('cache limit must not be negative')
+    cache_limit = val
+    clean_cache()
+
+def clean_cache(keep=None):
+    """clean_cache(keep=None) -> None
+
+    Tidy the decoded-sample cache. Temporary files left behind by a
+    crash are deleted. Then, if the cache is over its limit, the cache
+    files used least recently are deleted until it fits. (A cache file
+    counts as used when it is written or mapped.) The file named keep,
+    if any, is never deleted.
+
+    Deleting a cache file which is mapped does no harm; the mapping
+    lasts until the sample is unloaded.
+    """
+
+    global cache_used
+    if (cache_dir is None):
+        return
+    now = time.time()
+    cache_lock.acquire()
+    try:
+        try:
+            names = os.listdir(cache_dir)
+        except OSError:
+            return
+        entries = []
+        total = 0
+        for name in names:
+            path = os.path.join(cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (name.endswith('.tmp')):
+                if (now - st.st_mtime > cache_stale_age):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            if (not name.endswith('.pcm')):
+                continue
+            total += st.st_size
+            entries.append( (st.st_mtime, st.st_size, path) )
+        if (not (cache_limit is None) and total > cache_limit):
+            entries.sort()
+            for (mtime, size, path) in entries:
+                if (total <= cache_limit):
+                    break
+                if (path == keep):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+        cache_used = total
+    finally:
+        cache_lock.release()
+
+def cache_added(cachename):
+    """cache_added(cachename) -> None
+
+    Note that a file has been written into the cache, and tidy the
+    cache if that takes it over its limit.
+    """
+
+    global cache_used
+    try:
+        size = os.path.getsize(cachename)
+    except OSError:
+        return
+    cache_lock.acquire()
+    try:
+        if (not (cache_used is None)):
+            cache_used += size
+        over = (not (cache_limit is None)
+            and (cache_used is None or cache_used > cache_limit))
+    finally:
+        cache_lock.release()
+    if (over):
+        clean_cache(cachename)
+
+def file_pathname(filename):
+    """file_pathname(filename) -> str or None
+
+    Return the native pathname of a File or filename. If it is not a
+    file on disk (a MemFile), return None.
+    """
+
+    if (isinstance(filename, boopak.pinfo.MemFile)):
+        return None
+    if (isinstance(filename, boopak.pinfo.File)):
+        return filename.pathname
+    return filename
+
+def cache_pathname(pathname):
+    """cache_pathname(pathname) -> str or None
+
+    Return the pathname of the cache file for a sound file. The cache
+    file is named after the sound file's absolute pathname, size, and
+    modification time, so a changed sound file gets a new cache file.
+    If there is no cache, or the sound file cannot be examined, return
+    None.
+    """
+
+    if (cache_dir is None):
+        return None
+    try:
+        st = os.stat(pathname)
+    except OSError:
+        return None
+    key = repr((os.path.abspath(pathname), st.st_size, st.st_mtime,
+        big_endian))
+    return os.path.join(cache_dir, hashlib.sha1(key).hexdigest() + '.pcm')
+
+def map_cache_file(cachename, csamp, streamonly=False):
+    """map_cache_file(cachename, csamp, streamonly=False) -> bool
+
+    Map the sample data from a cache file into memory. (If it is large
+    enough, it is streamed; see set_stream_threshold.) Return False if
+    the cache file does not exist or is not valid -- or, if streamonly
+    is True, if it is not large enough to stream.
+    """
+
+    try:
+        fl = open(cachename, 'rb')
+        try:
+            dat = fl.read(struct.calcsize(cache_header))
+        finally:
+            fl.close()
+        (magic, framerate, numframes, loopstart, loopend,
+            numchannels) = struct.unpack(cache_header, dat)
+    except (IOError, struct.error):
+        return False
+    if (magic != cache_magic):
+        return False
+    if (streamonly and not is_streamable(numframes, numchannels)):
+        return False
+
+    params = (cachename, cache_offset, framerate, numframes,
+        loopstart, loopend, numchannels)
+    if (not cboodle.load_sample_mapped(csamp, params,
+        is_streamable(numframes, numchannels))):
+        return False
+    # Mark the file as recently used, so that clean_cache() keeps it.
+    try:
+        os.utime(cachename, None)
+    except OSError:
+        pass
+    return True
+
+def write_cache_file(cachename, csamp, params):
+    """write_cache_file(cachename, csamp, params) -> None
+
+    Write the (loaded) sample data into a cache file. The params are
+    those which the sample was loaded with. The file is written under
+    a temporary name and then renamed, so a cache file is never seen
+    half-written. Failure is not an error; the sample just isn't cached.
+    """
+
+    header = cache_file_header(params)
+    tempname = '%s.%d.tmp' % (cachename, os.getpid())
+    if (cboodle.save_sample(csamp, tempname, header)):
+        try:
+            os.rename(tempname, cachename)
+            cache_added(cachename)
+            return
+        except OSError:
+            pass
+    try:
+        os.remove(tempname)
+    except OSError:
+        pass
+
+def cache_file_header(params):
+    """cache_file_header(params) -> str
+
+    Build the header of a cache file, padded to cache_offset bytes. The
+    params are those which the sample was (or would be) loaded with.
+    """
+
+    (framerate, numframes, dat, loopstart, loopend, numchannels,
+        samplebits, issigned, isbigend) = params
+    # The loaded data has one channel, or two. (Any beyond the first
+    # two are dropped.)
+    numchannels = min(numchannels, 2)
+
+    header = struct.pack(cache_header, cache_magic, framerate, numframes,
+        loopstart, loopend, numchannels)
+    return header + '\0' * (cache_offset - len(header))
 
 def find_loader(suffix):
     """find_loader(suffix) -> SampleLoader
@@ -406,7 +1300,7 @@ def find_loader(suffix):
 class AifcLoader(SampleLoader):
     suffixlist = ['.aifc', '.aiff', '.aif']
     
-    def raw_load(self, filename, csamp):
+    def raw_load(self, filename, csamp, cachename=None, compress=None):
         if (isinstance(filename, boopak.pinfo.File)):
             afl = filename.open(True)
         else:
@@ -414,37 +1308,45 @@ class AifcLoader(SampleLoader):
         try:
             fl = aifc.open(afl)
             numframes = fl.getnframes()
-            dat = fl.readframes(numframes)
             numchannels = fl.getnchannels()
             samplebits = fl.getsampwidth()*8
             framerate = fl.getframerate()
             markers = fl.getmarkers()
+            
+            loopstart = -1
+            loopend = -1
+            if (not (markers is None)):
+                for (mark, pos, name) in markers:
+                    if (mark == 1):
+                        loopstart = pos
+                    elif (mark == 2):
+                        loopend = pos
+            if (loopstart < 0 or loopend < 0):
+                loopstart = -1
+                loopend = -1
+            params = (framerate, numframes, None, loopstart, loopend, numchannels, samplebits, 1, 1)
+            if (is_streamable(numframes, numchannels)
+                and self.stream_load(fl, cachename, csamp, params)):
+                fl.close()
+                return None
+            dat = fl.readframes(numframes)
             fl.close()
         finally:
             afl.close()
             
-        loopstart = -1
-        loopend = -1
-        if (not (markers is None)):
-            for (mark, pos, name) in markers:
-                if (mark == 1):
-                    loopstart = pos
-                elif (mark == 2):
-                    loopend = pos
-        if (loopstart < 0 or loopend < 0):
-            loopstart = -1
-            loopend = -1
         params = (framerate, numframes, dat, loopstart, loopend, numchannels, samplebits, 1, 1)
-        res = cboodle.load_sample(csamp, params)
+        res = cboodle.load_sample(csamp, params,
+            compression_modes.get(compress, 0))
         if (not res):
             raise SampleError('unable to load aiff data')
+        return params
 
 aifc_loader = AifcLoader()
 
 class WavLoader(SampleLoader):
     suffixlist = ['.wav']
     
-    def raw_load(self, filename, csamp):
+    def raw_load(self, filename, csamp, cachename=None, compress=None):
         if (isinstance(filename, boopak.pinfo.File)):
             afl = filename.open(True)
         else:
@@ -452,25 +1354,79 @@ class WavLoader(SampleLoader):
         try:
             fl = wave.open(afl)
             numframes = fl.getnframes()
-            dat = fl.readframes(numframes)
             numchannels = fl.getnchannels()
             samplebits = fl.getsampwidth()*8
             framerate = fl.getframerate()
+            # 16-bit mono or stereo WAV data is already in the form the
+            # mixer uses, on a little-endian machine. If the file is on
+            # disk, it can be mapped in place.
+            pathname = file_pathname(filename)
+            if (not big_endian and samplebits == 16
+                and numchannels <= 2 and not (pathname is None)
+                and (compress is None
+                    or is_streamable(numframes, numchannels))):
+                offset = wav_data_offset(pathname)
+                params = (pathname, offset, framerate, numframes,
+                    -1, -1, numchannels)
+                if (not (offset is None)
+                    and cboodle.load_sample_mapped(csamp, params,
+                        is_streamable(numframes, numchannels))):
+                    fl.close()
+                    return None
+            params = (framerate, numframes, None, -1, -1, numchannels, samplebits, 1, big_endian)
+            if (is_streamable(numframes, numchannels)
+                and self.stream_load(fl, cachename, csamp, params)):
+                fl.close()
+                return None
+            dat = fl.readframes(numframes)
             fl.close()
         finally:
             afl.close()
         
         params = (framerate, numframes, dat, -1, -1, numchannels, samplebits, 1, big_endian)
-        res = cboodle.load_sample(csamp, params)
+        res = cboodle.load_sample(csamp, params,
+            compression_modes.get(compress, 0))
         if (not res):
             raise SampleError('unable to load wav data')
+        return params
 
 wav_loader = WavLoader()
 
+def wav_data_offset(pathname):
+    """wav_data_offset(pathname) -> int or None
+
+    Find where the sample data begins in a WAV file, by walking its
+    RIFF chunk headers. Return None if the file cannot be read, or has
+    no data chunk.
+    """
+
+    try:
+        fl = open(pathname, 'rb')
+        try:
+            dat = fl.read(12)
+            if (len(dat) < 12 or dat[0:4] != 'RIFF' or dat[8:12] != 'WAVE'):
+                return None
+            pos = 12
+            while True:
+                fl.seek(pos)
+                dat = fl.read(8)
+                if (len(dat) < 8):
+                    return None
+                (chunkid, size) = struct.unpack('<4sI', dat)
+                pos += 8
+                if (chunkid == 'data'):
+                    return pos
+                # Chunks are padded to an even length.
+                pos += size + (size & 1)
+        finally:
+            fl.close()
+    except IOError:
+        return None
+
 class SunAuLoader(SampleLoader):
     suffixlist = ['.au']
     
-    def raw_load(self, filename, csamp):
+    def raw_load(self, filename, csamp, cachename=None, compress=None):
         if (isinstance(filename, boopak.pinfo.File)):
             afl = filename.open(True)
         else:
@@ -478,18 +1434,25 @@ class SunAuLoader(SampleLoader):
         try:
             fl = sunau.open(afl, 'r')
             numframes = fl.getnframes()
-            dat = fl.readframes(numframes)
             numchannels = fl.getnchannels()
             samplebits = fl.getsampwidth()*8
             framerate = fl.getframerate()
+            params = (framerate, numframes, None, -1, -1, numchannels, samplebits, 1, 1)
+            if (is_streamable(numframes, numchannels)
+                and self.stream_load(fl, cachename, csamp, params)):
+                fl.close()
+                return None
+            dat = fl.readframes(numframes)
             fl.close()
         finally:
             afl.close()
             
         params = (framerate, numframes, dat, -1, -1, numchannels, samplebits, 1, 1)
-        res = cboodle.load_sample(csamp, params)
+        res = cboodle.load_sample(csamp, params,
+            compression_modes.get(compress, 0))
         if (not res):
             raise SampleError('unable to load au data')
+        return params
 
 sunau_loader = SunAuLoader()
 
@@ -544,6 +1507,10 @@ class MixinLoader(SampleLoader):
         MixIn.sort_mixin_ranges(ranges)
         return MixinSample(filename, ranges, defval, modname)
 
+    def create(self, filename, suffix):
+        # A mixin has no data of its own; its description is read now.
+        return self.load(filename, suffix)
+
     def parseparam(self, filename, dirname, tok):
         if (dirname is None):
             pkg = filename.package
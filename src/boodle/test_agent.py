@@ -0,0 +1,263 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import unittest
+import random
+import math
+
+import boodle
+from boodle import agent, generator, sample, stereo
+from boodle.generator import FrameCount
+from boodle.test_util import RenderTestCase, RATE
+
+class Idle(agent.Agent):
+    def run(self):
+        pass
+
+class TestSchedNotes(unittest.TestCase):
+
+    def setUp(self):
+        # The file driver is the one which is always built. No sound is
+        # played; every note here fails before it reaches cboodle.
+        boodle.set_driver('file')
+        self.gen = generator.Generator(1.0)
+        self.agent = Idle()
+        self.gen.addagent(self.agent, self.gen.rootchannel, 0,
+            self.agent.run)
+        # As if the agent were running.
+        self.gen.agentruntime = 0
+        self.samp = sample.Sample('blip.wav', None)
+
+    def tearDown(self):
+        self.gen.close()
+
+    def assertNothingQueued(self):
+        self.assertEqual(self.samp.refcount, 0)
+        self.assertEqual(self.gen.rootchannel.notecount, 0)
+        self.assertEqual(self.gen.farnotes.count, 0)
+
+    def test_unscheduled(self):
+        ag = Idle()
+        self.assertRaises(generator.ScheduleError,
+            ag.sched_notes, [ (self.samp,) ])
+
+    def test_inactive_channel(self):
+        chan = generator.Channel(self.gen.rootchannel, self.gen, None,
+            1.0, ())
+        chan.close()
+        self.assertRaises(generator.ChannelError,
+            self.agent.sched_notes, [ (self.samp,) ], chan)
+
+    def test_bad_tuples(self):
+        ls = [
+            self.samp,
+            [ self.samp, 1.0 ],
+            (),
+            (self.samp, 1.0, 1.0, 0, None, 0, 0, 0, None, 'extra'),
+            None,
+        ]
+        for spec in ls:
+            self.assertRaises(TypeError, self.agent.sched_notes, [ spec ])
+        self.assertNothingQueued()
+
+    def test_bad_times(self):
+        ls = [
+            (self.samp, 1.0, 1.0, -1),
+            (self.samp, 1.0, 1.0, 'soon'),
+            (self.samp, 1.0, 1.0, float('inf')),
+            (self.samp, 1.0, 1.0, 0, None, -2.0),
+            (self.samp, 1.0, 1.0, 0, None, 'long'),
+            (self.samp, 1.0, 1.0, 0, None, 0, -1.0),
+            (self.samp, 1.0, 1.0, 0, None, 0, 0, 'slow'),
+        ]
+        for spec in ls:
+            self.assertRaises(generator.ScheduleError,
+                self.agent.sched_notes, [ spec ])
+        self.assertNothingQueued()
+
+    def test_bad_curve(self):
+        self.assertRaises(generator.ScheduleError, self.agent.sched_notes,
+            [ (self.samp, 1.0, 1.0, 0, None, 0, 0.5, 0, 'wobbly') ])
+        self.assertNothingQueued()
+
+    def test_all_or_nothing(self):
+        # One bad note anywhere in the batch means no note is queued,
+        # including those which come before it.
+        ls = [
+            (self.samp,),
+            (self.samp, 1.0, 1.0, 0.5),
+            (self.samp, 1.0, 1.0, 3600.0),
+            (self.samp, 1.0, 1.0, -1),
+        ]
+        self.assertRaises(generator.ScheduleError,
+            self.agent.sched_notes, ls)
+        self.assertNothingQueued()
+
+class TestSchedNotesPlayed(RenderTestCase):
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        self.click = self.write_sample('click.wav', [1000] * 20)
+
+    def test_times_and_gains(self):
+        # Each note starts on its frame, at its own volume and pan.
+        ls = [
+            (FrameCount(1000), 1.0, None, (1000, 1000)),
+            (0.05, 0.5, None, (500, 500)),
+            (FrameCount(3000), 1.0, -1.0, (1000, 0)),
+            (0.1, 0.75, 1.0, (0, 750)),
+            (FrameCount(5000), 1.0, 0.5, (500, 1000)),
+            (FrameCount(6000), 0.5, stereo.shift(-0.5), (500, 250)),
+            (FrameCount(7000), 1.0, stereo.fixed(0), (1000, 1000)),
+        ]
+        notes = [ (self.click, 1.0, volume, delay, pan)
+            for (delay, volume, pan, wanted) in ls ]
+        durs = []
+        def run(ag):
+            durs.extend(ag.sched_notes(notes))
+        out = self.render(run, 0.3)
+
+        self.assertEqual(durs, [ 20.0 / RATE ] * len(ls))
+        starts = [ 1000, int(0.05*RATE), 3000, int(0.1*RATE), 5000, 6000,
+            7000 ]
+        for ((delay, volume, pan, wanted), pos) in zip(ls, starts):
+            self.assertEqual((out[2*pos-2], out[2*pos-1]), (0, 0))
+            self.assertEqual((out[2*pos], out[2*pos+1]), wanted)
+            self.assertEqual((out[2*pos+36], out[2*pos+37]), wanted)
+            self.assertEqual((out[2*pos+40], out[2*pos+41]), (0, 0))
+
+    def test_same_as_single(self):
+        # A batch plays exactly as the same notes scheduled one by one.
+        loop = self.write_sample('loop.aiff', [ (ix*37 % 2000) - 1000
+            for ix in range(3000) ], loop=(1000, 2000))
+        rand = random.Random(11)
+        notes = []
+        for ix in range(200):
+            samp = rand.choice([ self.click, loop ])
+            notes.append( (samp, rand.choice([ 1.0, 0.5, 1.5 ]),
+                rand.uniform(0.1, 1.0), rand.uniform(0, 1.0),
+                rand.choice([ None, -1.0, 0.3, stereo.shift(0.7) ]),
+                rand.choice([ 0, 0.2 ])) )
+        def run_batch(ag):
+            ag.sched_notes(notes)
+        def run_single(ag):
+            for (samp, pitch, volume, delay, pan, duration) in notes:
+                ag.sched_note_duration_pan(samp, duration, pan, pitch,
+                    volume, delay)
+        out = self.render(run_batch, 1.5)
+        self.assert_(max(out) > 0)
+        self.assert_(out == self.render(run_single, 1.5))
+
+class TestNoteFades(RenderTestCase):
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        self.flat = self.write_sample('flat.wav', [1000] * RATE)
+
+    def render_exact(self, run, seconds):
+        # With a fade block of one frame, every frame's gain is exact.
+        out = self.render(run, seconds, [ ('fadeblock', '1') ])
+        return out[0::2]
+
+    def assertEnvelope(self, left, start, length, attack, release, shape):
+        for pos in range(0, length, 250) + [ length-1 ]:
+            val = 1.0
+            if (pos < attack):
+                val = float(pos) / attack
+            if (length - pos < release):
+                val = min(val, float(length - pos) / release)
+            wanted = 1000.0 * shape(val)
+            got = left[start+pos]
+            self.assert_(abs(got - wanted) <= 2, (pos, got, wanted))
+
+    def test_linear(self):
+        # The note rises from silence over the attack and falls back over
+        # the release; in between it plays at its own volume.
+        def run(ag):
+            ag.sched_note(self.flat, 1.0, 1.0, FrameCount(1000),
+                attack=0.1, release=0.2)
+        left = self.render_exact(run, 1.2)
+        self.assertEqual(left[999], 0)
+        self.assertEqual(left[1000], 0)
+        self.assertEqual(left[1000 + RATE//2], 1000)
+        self.assertEnvelope(left, 1000, RATE, 0.1*RATE, 0.2*RATE,
+            lambda val: val)
+        self.assertEqual(left[1000 + RATE], 0)
+
+    def test_curves(self):
+        shapes = {
+            'linear': lambda val: val,
+            'sine': lambda val: math.sin(val * math.pi / 2),
+            'smooth': lambda val: val * val * (3.0 - 2.0 * val),
+        }
+        for (curve, shape) in shapes.items():
+            def run(ag):
+                ag.sched_note(self.flat, attack=0.2, release=0.3,
+                    curve=curve)
+            left = self.render_exact(run, 1.1)
+            self.assertEnvelope(left, 0, RATE, 0.2*RATE, 0.3*RATE, shape)
+        # Halfway through the attack, the curves part ways.
+        def run_mid(curve):
+            def run(ag):
+                ag.sched_note(self.flat, attack=0.2, curve=curve)
+            return self.render_exact(run, 0.2)[int(0.05*RATE)]
+        (lin, sine, smooth) = [ run_mid(curve)
+            for curve in ('linear', 'sine', 'smooth') ]
+        self.assert_(smooth < lin < sine, (smooth, lin, sine))
+
+    def test_overlap(self):
+        # When the attack and release overlap, the quieter one wins, so
+        # the note never reaches full volume.
+        length = int(0.2*RATE)
+        short = self.write_sample('short.wav', [1000] * length)
+        def run(ag):
+            ag.sched_note(short, attack=0.15, release=0.15)
+        left = self.render_exact(run, 0.3)
+        self.assertEnvelope(left, 0, length, 0.15*RATE, 0.15*RATE,
+            lambda val: val)
+        self.assert_(max(left) < 700, max(left))
+
+    def test_every_method(self):
+        # All the sched_note methods take the same fade arguments, and
+        # agree with sched_notes().
+        def run_batch(ag):
+            ag.sched_notes([
+                (self.flat, 1.0, 0.5, 0, None, 0, 0.1, 0.1, 'sine'),
+                (self.flat, 1.0, 0.5, 0.2, 0.5, 0, 0.1, 0, 'smooth'),
+                (self.flat, 1.0, 0.5, 0.4, None, 0.3, 0, 0.1),
+                (self.flat, 1.0, 0.5, 0.6, -0.5, 0.3, 0.05, 0.05),
+            ])
+        def run_single(ag):
+            ag.sched_note(self.flat, 1.0, 0.5, 0, attack=0.1, release=0.1,
+                curve='sine')
+            ag.sched_note_pan(self.flat, 0.5, 1.0, 0.5, 0.2, attack=0.1,
+                curve='smooth')
+            ag.sched_note_duration(self.flat, 0.3, 1.0, 0.5, 0.4,
+                release=0.1)
+            ag.sched_note_duration_pan(self.flat, 0.3, -0.5, 1.0, 0.5, 0.6,
+                attack=0.05, release=0.05)
+        def run_params(ag):
+            ag.sched_note_params(self.flat, volume=0.5, attack=0.1,
+                release=0.1, curve='sine')
+            ag.sched_note_params(self.flat, volume=0.5, delay=0.2, pan=0.5,
+                attack=0.1, curve='smooth')
+            ag.sched_note_params(self.flat, volume=0.5, delay=0.4,
+                duration=0.3, release=0.1)
+            ag.sched_note_params(self.flat, volume=0.5, delay=0.6,
+                pan=-0.5, duration=0.3, attack=0.05, release=0.05)
+        out = self.render(run_batch, 1.5)
+        self.assert_(out == self.render(run_single, 1.5))
+        self.assert_(out == self.render(run_params, 1.5))
+
+    def test_no_fade(self):
+        # Zero attack and release is a plain note.
+        def run_plain(ag):
+            ag.sched_note_pan(self.flat, 0.3, 1.0, 0.8, 0.1)
+        def run_zero(ag):
+            ag.sched_note_pan(self.flat, 0.3, 1.0, 0.8, 0.1, attack=0,
+                release=0, curve='sine')
+        out = self.render(run_plain, 1.5)
+        self.assert_(out == self.render(run_zero, 1.5))
@@ -0,0 +1,95 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import sys
+import os
+import os.path
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+import boodle
+
+# The benchmark suite, in the source tree. (These tests are skipped if
+# it is not there.)
+srcdir = os.path.dirname(os.path.dirname(os.path.abspath(boodle.__file__)))
+suitepath = os.path.join(os.path.dirname(srcdir), 'bench', 'suite.py')
+
+class TestBenchSuite(unittest.TestCase):
+
+    # The load group is left out: it writes minute-long sound files,
+    # which takes too long for a unit test.
+
+    def setUp(self):
+        if (not os.path.isfile(suitepath)):
+            self.skipTest('bench/suite.py not found')
+        self.tempdir = tempfile.mkdtemp(prefix='boodletest')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, True)
+
+    def run_suite(self, *args):
+        # Run the suite with tiny workloads, and return its stderr.
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [ srcdir ] + [ val for val in sys.path if val ])
+        proc = subprocess.Popen([ sys.executable, suitepath,
+            '-m', '2', '-v', '3,5', '-a', '20', '-r', '1' ] + list(args),
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        return (out, err)
+
+    def test_json(self):
+        outfile = os.path.join(self.tempdir, 'results.json')
+        self.run_suite('--label', 'smoke', '-o', outfile,
+            'mix', 'addagent', 'runagents')
+        fl = open(outfile)
+        report = json.load(fl)
+        fl.close()
+
+        self.assertEqual(report['label'], 'smoke')
+        self.assertEqual(report['options']['buffers'], 2)
+        self.assertEqual(report['options']['voices'], '3,5')
+        self.assertEqual(report['framesperbuf'], 4096)
+
+        groups = {}
+        for res in report['results']:
+            self.assert_(res['value'] > 0, res['name'])
+            self.assert_(res['name'].startswith(res['group'] + '/'))
+            groups[res['group']] = groups.get(res['group'], 0) + 1
+        # Mono and stereo, two pitches, fading or not, two voice counts.
+        self.assertEqual(groups, { 'mix':16, 'addagent':1, 'runagents':1 })
+        names = [ res['name'] for res in report['results'] ]
+        self.assert_('mix/stereo/pitch=1.37/fade/voices=5' in names)
+        self.assert_('runagents/agents=20' in names)
+
+    def test_compare(self):
+        # With no -o, the JSON goes to stdout; --compare then lines up
+        # each result with the same one from that earlier run.
+        (out, err) = self.run_suite('addagent', 'depth')
+        oldfile = os.path.join(self.tempdir, 'old.json')
+        fl = open(oldfile, 'w')
+        fl.write(out)
+        fl.close()
+        self.assertEqual(len(json.loads(out)['results']), 11)
+
+        (out, err) = self.run_suite('--compare', oldfile, 'addagent')
+        self.assert_(('compared with ' + oldfile) in err)
+        lines = [ line for line in err.splitlines()
+            if (line.startswith('addagent/agents=20')) ]
+        # Once as a result, once in the comparison: name, old value, new
+        # value, ratio.
+        self.assertEqual(len(lines), 2)
+        fields = lines[1].split()
+        self.assert_(fields[3].endswith('x'), lines[1])
+        ratio = float(fields[2]) / float(fields[1])
+        self.assertAlmostEqual(float(fields[3][:-1]), ratio, delta=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
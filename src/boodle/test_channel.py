@@ -0,0 +1,215 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import unittest
+
+from boodle import stereo
+from boodle.test_util import RenderTestCase, FuncAgent, RATE
+
+class TestChannelGain(RenderTestCase):
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        self.flat = self.write_sample('flat.wav', [1000] * RATE)
+
+    def frame(self, out, pos):
+        return (out[2*pos], out[2*pos+1])
+
+    def test_nested_volume(self):
+        # Channel volumes multiply down the tree, and the note's volume
+        # on top of that. (The mixer truncates, so 200 may come out 199.)
+        def run(ag):
+            outer = ag.new_channel(0.5)
+            inner = ag.new_channel(0.5, outer)
+            ag.sched_note(self.flat, 1.0, 0.8, 0, inner)
+        out = self.render(run, 0.1)
+        for pos in (0, 1000, 4095):
+            (left, right) = self.frame(out, pos)
+            self.assert_(199 <= left <= 200)
+            self.assert_(199 <= right <= 200)
+
+    def test_pan_positions(self):
+        ls = [
+            (stereo.shift(-1), (1000, 0)),
+            (stereo.shift(1), (0, 1000)),
+            (stereo.shift(-0.5), (1000, 500)),
+            (stereo.shift(0.5), (500, 1000)),
+            (stereo.shift(2), (0, 250)),
+            (stereo.fixed(0), (1000, 1000)),
+        ]
+        for (pan, wanted) in ls:
+            def run(ag):
+                chan = ag.new_channel_pan(pan)
+                ag.sched_note(self.flat, 1.0, 1.0, 0, chan)
+            out = self.render(run, 0.1)
+            self.assertEqual(self.frame(out, 1000), wanted)
+
+    def test_pan_composes(self):
+        # A channel's pan is relative to its parent's.
+        def run_nested(ag):
+            outer = ag.new_channel_pan(stereo.shift(0.5))
+            inner = ag.new_channel_pan(stereo.shift(0.5), 1.0, outer)
+            ag.sched_note(self.flat, 1.0, 1.0, 0, inner)
+        def run_flat(ag):
+            chan = ag.new_channel_pan(stereo.shift(1))
+            ag.sched_note(self.flat, 1.0, 1.0, 0, chan)
+        self.assertEqual(self.render(run_nested, 0.2),
+            self.render(run_flat, 0.2))
+
+    def test_change_while_sounding(self):
+        # A change to an ancestor channel reaches notes which are already
+        # playing in a descendant.
+        def run(ag):
+            outer = ag.new_channel(1.0)
+            inner = ag.new_channel(1.0, outer)
+            ag.sched_note(self.flat, 1.0, 1.0, 0, inner)
+            def change(ag2):
+                outer.set_volume(0.25, 0.005)
+                outer.set_pan(stereo.shift(-1), 0.005)
+            ag.sched_agent(FuncAgent(change), 0.25, outer)
+        out = self.render(run, 0.5)
+        # (Pan changes are followed a buffer at a time, so look at the
+        # buffers on either side of the change.)
+        self.assertEqual(self.frame(out, int(0.18 * RATE)), (1000, 1000))
+        self.assertEqual(self.frame(out, int(0.3 * RATE)), (250, 0))
+
+    def test_volume_ramp(self):
+        # The gain is followed through a slow change, not just set at the
+        # buffer boundaries.
+        def run(ag):
+            ag.channel.set_volume(0.0, 0.5)
+        def start(ag):
+            ag.sched_note(self.flat)
+            ag.sched_agent(FuncAgent(run), 0, ag.channel)
+        out = self.render(start, 0.5)
+        left = out[0::2]
+        for pos in range(0, int(0.5 * RATE), 1000):
+            wanted = 1000.0 * (1.0 - float(pos) / (0.5 * RATE))
+            self.assert_(abs(left[pos] - wanted) <= 2, (pos, left[pos]))
+
+class TestChannelStop(RenderTestCase):
+
+    def test_subtree(self):
+        # Stopping a channel silences it and everything beneath it --
+        # notes sounding, notes to come (near and far), and agents --
+        # and closes the channels. Its sibling plays on.
+        flat = self.write_sample('flat.wav', [1000] * (2*RATE))
+        runs = []
+        chans = {}
+        def tick(ag):
+            runs.append(ag.channel)
+            ag.resched(0.05)
+        def stopper(ag):
+            chans['left'].stop()
+        def run(ag):
+            left = ag.new_channel_pan(stereo.shift(-1))
+            inner = ag.new_channel(1.0, left)
+            right = ag.new_channel_pan(stereo.shift(1))
+            chans.update(left=left, inner=inner, right=right)
+            ag.sched_note(flat, 1.0, 1.0, 0, inner)
+            ag.sched_note(flat, 1.0, 1.0, 0.6, left)
+            ag.sched_note(flat, 1.0, 1.0, 5.0, inner)
+            ag.sched_note(flat, 1.0, 1.0, 0, right)
+            ag.sched_agent(FuncAgent(tick), 0, inner)
+            ag.sched_agent(FuncAgent(tick), 0, right)
+            ag.sched_agent(FuncAgent(stopper), 0.3, right)
+        out = self.render(run, 1.5)
+
+        # (The stop takes effect at the end of the buffer in which the
+        # stopping agent runs.)
+        self.assertEqual(self.frame(out, int(0.25 * RATE)), (1000, 1000))
+        for secs in (0.4, 0.7, 1.4):
+            self.assertEqual(self.frame(out, int(secs * RATE)), (0, 1000))
+
+        for key in ('left', 'inner'):
+            self.failIf(chans[key].active, key)
+        self.assert_(chans['right'].active)
+        self.failIf(chans['left'] in self.gen.channels)
+        self.assertEqual(self.gen.farnotecount, 0)
+        # The inner agent ran every 0.05 seconds up to the end of that
+        # buffer (at 0.37 seconds), and never again.
+        self.assertEqual(runs.count(chans['inner']), 8)
+        self.assert_(runs.count(chans['right']) >= 29)
+
+    def test_leaf(self):
+        # Stopping a channel leaves its parent alone.
+        flat = self.write_sample('flat.wav', [1000] * RATE)
+        chans = {}
+        def stopper(ag):
+            chans['inner'].stop()
+        def run(ag):
+            outer = ag.new_channel_pan(stereo.shift(-1))
+            inner = ag.new_channel(1.0, outer)
+            chans.update(outer=outer, inner=inner)
+            ag.sched_note(flat, 1.0, 1.0, 0, inner)
+            ag.sched_note(flat, 1.0, 0.5, 0, outer)
+            ag.sched_agent(FuncAgent(stopper), 0.3, outer)
+        out = self.render(run, 0.8)
+        self.assertEqual(self.frame(out, int(0.25 * RATE)), (1500, 0))
+        self.assertEqual(self.frame(out, int(0.5 * RATE)), (500, 0))
+        self.failIf(chans['inner'].active)
+        self.assertEqual(chans['outer'].childcount, 0)
+
+    def frame(self, out, pos):
+        return (out[2*pos], out[2*pos+1])
+
+class TestChannelReaping(RenderTestCase):
+
+    def render_watched(self, run, seconds, chans):
+        # Render, noting the start time of every run_agents() call, and
+        # the call in which each channel in chans (a dict, filled in by
+        # run) was closed.
+        calls = []
+        closed = {}
+        def watch(starttime, finished):
+            calls.append(starttime)
+        def start(ag):
+            run(ag)
+            for (key, chan) in chans.items():
+                def close(realclose=chan.close, key=key):
+                    closed[key] = calls[-1]
+                    realclose()
+                chan.close = close
+        self.render(start, seconds, watch=watch)
+        return (calls, closed)
+
+    def test_while_sleeping(self):
+        # Nothing wakes the generator for a long time, but the channel is
+        # closed as soon as its last note ends. (The root channel is kept
+        # open by a long note.)
+        short = self.write_sample('short.wav', [1000] * (RATE // 2))
+        hold = self.write_sample('hold.wav', [1000] * (5*RATE))
+        chans = {}
+        def run(ag):
+            chans['sub'] = ag.new_channel()
+            ag.sched_note(short, 1.0, 1.0, 0, chans['sub'])
+            ag.sched_note(hold)
+        (calls, closed) = self.render_watched(run, 2.0, chans)
+        framesperbuf = self.cboodle.framesperbuf()
+        # The note ends in the sixth buffer; it is accounted for at the
+        # start of the seventh.
+        self.assertEqual(closed['sub'], 6 * framesperbuf)
+        self.assert_(len(calls) < 6, calls)
+        self.failIf(chans['sub'].active)
+
+    def test_parents(self):
+        # Closing a channel may leave its parent empty; the parent is
+        # closed in turn, one buffer later.
+        short = self.write_sample('short.wav', [1000] * 1000)
+        hold = self.write_sample('hold.wav', [1000] * (5*RATE))
+        chans = {}
+        def run(ag):
+            chans['outer'] = ag.new_channel()
+            chans['inner'] = ag.new_channel(1.0, chans['outer'])
+            ag.sched_note(short, 1.0, 1.0, 0, chans['inner'])
+            ag.sched_note(hold)
+        (calls, closed) = self.render_watched(run, 1.0, chans)
+        framesperbuf = self.cboodle.framesperbuf()
+        self.assertEqual(closed['inner'], framesperbuf)
+        self.assertEqual(closed['outer'], 2 * framesperbuf)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,446 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import unittest
+import random
+
+import boodle
+from boodle import agent, generator
+from boodle.generator import TimerWheel, WHEELSPANS
+from boodle.generator import splice_envelope
+from boodle.generator import interpolate_volume, interpolate_pan
+
+class TestTimerWheel(unittest.TestCase):
+
+    def entry_level(self, wheel, entry):
+        for level in range(len(wheel.spans)):
+            for bucket in wheel.buckets[level].values():
+                if (entry in bucket):
+                    return level
+        return None
+
+    def run_wheel(self, wheel, entries, step, endtime):
+        # Advance the wheel to endtime, and check that each step
+        # releases exactly the entries which have come within the
+        # horizon -- never late, never twice.
+        pending = [ entry for entry in entries if (entry[2] is not None) ]
+        released = []
+        now = wheel.now
+        while (now < endtime):
+            now += step
+            got = wheel.advance(now)
+            for entry in got:
+                self.assert_(entry[0] >= now)
+                self.assert_(entry[0] < wheel.horizon)
+            wanted = [ entry for entry in pending
+                if (entry[0] < wheel.horizon and entry[2] is not None) ]
+            self.assertEqual(sorted(got), sorted(wanted))
+            for entry in got:
+                pending.remove(entry)
+            released.extend(got)
+        return released
+
+    def test_horizon(self):
+        wheel = TimerWheel(WHEELSPANS)
+        span = WHEELSPANS[0]
+        self.assertEqual(wheel.horizon, 2*span)
+        self.failIf(wheel.insert([0, 0, 'a']))
+        self.failIf(wheel.insert([2*span-1, 1, 'b']))
+        self.assert_(wheel.insert([2*span, 2, 'c']))
+        self.assertEqual(wheel.count, 1)
+        self.assertEqual(wheel.nexttime, span)
+
+        wheel.advance(5*span + 100)
+        self.assertEqual(wheel.horizon, 7*span)
+        self.failIf(wheel.insert([7*span-1, 3, 'd']))
+        self.assert_(wheel.insert([7*span, 4, 'e']))
+
+    def test_insert_levels(self):
+        wheel = TimerWheel(WHEELSPANS)
+        (span0, span1, span2) = WHEELSPANS
+
+        # An entry goes in the coarsest level where it is at least two
+        # buckets ahead.
+        ls = [
+            (2*span0, 0),
+            (2*span1-1, 0),
+            (2*span1, 1),
+            (2*span2-1, 1),
+            (2*span2, 2),
+            (50*span2+7, 2),
+        ]
+        for (ix, (time, level)) in enumerate(ls):
+            entry = [time, ix, 'x']
+            self.assert_(wheel.insert(entry))
+            self.assertEqual(self.entry_level(wheel, entry), level)
+        self.assertEqual(wheel.count, len(ls))
+
+    def test_cascade(self):
+        wheel = TimerWheel(WHEELSPANS)
+        (span0, span1, span2) = WHEELSPANS
+
+        # Entries on either side of each span boundary, so that they
+        # start at every level and cascade down through the others.
+        times = []
+        for span in WHEELSPANS:
+            for mult in (2, 3):
+                for delta in (-1, 0, 1):
+                    times.append(mult*span + delta)
+        # (The first of these is inside the horizon.)
+        times.remove(2*span0 - 1)
+        times.append(3*span2 + span1 + span0 + 5)
+        entries = [ [time, ix, 'x'] for (ix, time) in enumerate(times) ]
+        for entry in entries:
+            self.assert_(wheel.insert(entry))
+
+        released = self.run_wheel(wheel, entries, span0 // 2, 4*span2)
+        self.assertEqual(sorted(released), sorted(entries))
+        self.assertEqual(wheel.count, 0)
+        self.assertEqual(wheel.nexttime, None)
+
+    def test_cascade_uneven_steps(self):
+        wheel = TimerWheel(WHEELSPANS)
+        (span0, span1, span2) = WHEELSPANS
+
+        # Steps which do not divide the spans, so that buckets come due
+        # partway through a step.
+        times = [ 2*span1 + span0*ix + ix for ix in range(100) ]
+        times.extend([ 2*span2 + span1*ix + 3 for ix in range(10) ])
+        entries = [ [time, ix, 'x'] for (ix, time) in enumerate(times) ]
+        for entry in entries:
+            self.assert_(wheel.insert(entry))
+
+        released = self.run_wheel(wheel, entries, 40000, 2*span2 + 11*span1)
+        self.assertEqual(sorted(released), sorted(entries))
+        self.assertEqual(wheel.count, 0)
+
+    def test_cancel(self):
+        wheel = TimerWheel(WHEELSPANS)
+        (span0, span1, span2) = WHEELSPANS
+
+        times = [ 2*span0, 3*span0, 2*span1, 3*span1, 2*span2, 3*span2 ]
+        entries = [ [time, ix, 'x'] for (ix, time) in enumerate(times) ]
+        for entry in entries:
+            wheel.insert(entry)
+
+        # Discard one entry at each level before it moves.
+        for ix in (0, 2, 4):
+            entries[ix][2] = None
+        # And one after it has cascaded down from the top level.
+        released = self.run_wheel(wheel, entries, span0 // 2,
+            2*span2 + span0)
+        self.assertEqual(sorted(released), [entries[1], entries[3]])
+        self.assertEqual(self.entry_level(wheel, entries[5]), 1)
+        entries[5][2] = None
+
+        released = self.run_wheel(wheel, [entries[5]], span0 // 2, 4*span2)
+        self.assertEqual(released, [])
+        self.assertEqual(wheel.count, 0)
+        self.assertEqual(wheel.nexttime, None)
+
+    def test_sweep(self):
+        wheel = TimerWheel(WHEELSPANS)
+        (span0, span1, span2) = WHEELSPANS
+
+        times = [ 2*span0, 2*span1, 2*span2, 5*span2 ]
+        entries = [ [time, ix, 'x'] for (ix, time) in enumerate(times) ]
+        for entry in entries:
+            wheel.insert(entry)
+        entries[0][2] = None
+        entries[1][2] = None
+        entries[3][2] = None
+        self.assertEqual(wheel.count, 4)
+
+        wheel.sweep()
+        self.assertEqual(wheel.count, 1)
+        self.assertEqual(wheel.buckets[0], {})
+        self.assertEqual(wheel.buckets[1], {})
+        self.assertEqual(wheel.nexttime, span2)
+
+        entries[2][2] = None
+        wheel.sweep()
+        self.assertEqual(wheel.count, 0)
+        self.assertEqual(wheel.nexttime, None)
+        self.assertEqual(wheel.advance(10*span2), [])
+
+class TestSpliceEnvelope(unittest.TestCase):
+
+    def assertEnvelope(self, env, ls):
+        self.assertEqual(len(env), len(ls))
+        for ((tm, val), (wanttm, wantval)) in zip(env, ls):
+            self.assertEqual(tm, wanttm)
+            if (type(wantval) is tuple):
+                self.assertEqual(len(val), len(wantval))
+                for (v, wantv) in zip(val, wantval):
+                    self.assertAlmostEqual(v, wantv)
+            else:
+                self.assertAlmostEqual(val, wantval)
+
+    def test_after_last(self):
+        # The old envelope has settled; the new one starts from its level.
+        env = splice_envelope([ (0, 0.5) ], 100, 200, [ (300, 1.0) ],
+            interpolate_volume)
+        self.assertEnvelope(env, [ (0, 0.5), (200, 0.5), (300, 1.0) ])
+
+    def test_interpolate(self):
+        # Splicing partway through a ramp starts from the ramp's level
+        # at that point, and drops the rest of the ramp.
+        env = splice_envelope([ (0, 0.0), (1000, 1.0) ], 0, 250,
+            [ (500, 0.0) ], interpolate_volume)
+        self.assertEnvelope(env, [ (0, 0.0), (250, 0.25), (500, 0.0) ])
+
+    def test_drop_before_base(self):
+        # Breakpoints before the current buffer are dropped, except the
+        # last of them.
+        points = [ (0, 0.0), (100, 1.0), (200, 0.5), (1000, 0.0) ]
+        env = splice_envelope(points, 150, 600, [ (700, 1.0) ],
+            interpolate_volume)
+        self.assertEnvelope(env,
+            [ (100, 1.0), (200, 0.5), (600, 0.25), (700, 1.0) ])
+
+        env = splice_envelope(points, 2000, 3000, [ (4000, 1.0) ],
+            interpolate_volume)
+        self.assertEnvelope(env, [ (1000, 0.0), (3000, 0.0), (4000, 1.0) ])
+
+    def test_at_breakpoint(self):
+        # An old breakpoint at attime is replaced, at the same level.
+        points = [ (0, 0.0), (500, 1.0), (1000, 0.0) ]
+        env = splice_envelope(points, 0, 500, [ (800, 0.5) ],
+            interpolate_volume)
+        self.assertEnvelope(env, [ (0, 0.0), (500, 1.0), (800, 0.5) ])
+
+    def test_before_first(self):
+        # If attime comes at or before the only breakpoint still in
+        # play, nothing of the old envelope is kept but its level.
+        points = [ (100, 0.3), (1000, 0.8) ]
+        env = splice_envelope(points, 50, 100, [ (200, 1.0) ],
+            interpolate_volume)
+        self.assertEnvelope(env, [ (100, 0.3), (200, 1.0) ])
+
+    def test_no_newpoints(self):
+        env = splice_envelope([ (0, 0.0), (1000, 1.0) ], 0, 600, [],
+            interpolate_volume)
+        self.assertEnvelope(env, [ (0, 0.0), (600, 0.6) ])
+
+    def test_unchanged(self):
+        # The old list is not modified.
+        points = [ (0, 0.0), (1000, 1.0) ]
+        splice_envelope(points, 0, 600, [ (700, 0.0) ], interpolate_volume)
+        self.assertEqual(points, [ (0, 0.0), (1000, 1.0) ])
+
+    def test_pan(self):
+        pan0 = (1.0, -1.0, 1.0, 0.0)
+        pan1 = (1.0, 1.0, 1.0, 0.5)
+        env = splice_envelope([ (0, pan0), (400, pan1) ], 0, 100,
+            [ (500, pan0) ], interpolate_pan)
+        self.assertEnvelope(env, [ (0, pan0),
+            (100, (1.0, -0.5, 1.0, 0.125)), (500, pan0) ])
+
+class Idle(agent.Agent):
+    def run(self):
+        pass
+
+class TestAgentQueue(unittest.TestCase):
+
+    def setUp(self):
+        # No sound is played; the generator only needs channels.
+        boodle.set_driver('file')
+        self.gen = generator.Generator(1.0)
+        self.chan = self.gen.rootchannel
+
+    def tearDown(self):
+        self.gen.close()
+
+    def add(self, runtime):
+        ag = Idle()
+        self.gen.addagent(ag, self.chan, runtime, ag.run)
+        return ag
+
+    def drain(self, endtime):
+        # Pull agents off the queue, as run_agents() would.
+        res = []
+        while True:
+            self.gen.cascade(endtime)
+            tup = self.gen.nextagent(endtime)
+            if (tup is None):
+                return res
+            (runtime, ag, handle) = tup
+            ag.queued = False
+            res.append( (runtime, ag) )
+
+    def test_order(self):
+        rand = random.Random(3)
+        times = [ rand.randrange(100000) for ix in range(500) ]
+        agents = [ self.add(tm) for tm in times ]
+        got = self.drain(50000)
+        self.assertEqual([ tm for (tm, ag) in got ],
+            sorted([ tm for tm in times if (tm < 50000) ]))
+        got.extend(self.drain(100000))
+        self.assertEqual([ tm for (tm, ag) in got ], sorted(times))
+        self.assertEqual(self.gen.queueindex, {})
+
+    def test_ties(self):
+        # Agents scheduled for the same time run in the order they were
+        # scheduled, including those which come back from the far wheel.
+        far = 3 * WHEELSPANS[1]
+        first = [ self.add(500) for ix in range(10) ]
+        farls = [ self.add(far) for ix in range(10) ]
+        first.extend([ self.add(500) for ix in range(10) ])
+        got = self.drain(501)
+        self.assertEqual([ ag for (tm, ag) in got ], first)
+        got = self.drain(far+1)
+        self.assertEqual([ ag for (tm, ag) in got ], farls)
+
+    def test_remove_queued(self):
+        ls = [ self.add(tm) for tm in (100, 200, 300, 3 * WHEELSPANS[2]) ]
+        self.gen.remagent(ls[1])
+        self.gen.remagent(ls[3])
+        self.failIf(ls[1].queued)
+        self.assertEqual(self.chan.agentcount, 2)
+        self.failIf(ls[1] in self.chan.agents)
+        got = self.drain(4 * WHEELSPANS[2])
+        self.assertEqual(got, [ (100, ls[0]), (300, ls[2]) ])
+
+        # Taking the last agent off a channel marks it as maybe empty.
+        chan = generator.Channel(self.chan, self.gen, None, 1.0, ())
+        ag = Idle()
+        self.gen.addagent(ag, chan, 400, ag.run)
+        self.gen.maybeempty.clear()
+        self.gen.remagent(ag)
+        self.assertEqual(chan.agentcount, 0)
+        self.assertEqual(self.gen.maybeempty.keys(), [ chan ])
+        self.assertEqual(self.drain(1000), [])
+
+    def test_reschedule_after_remove(self):
+        # An agent taken off the queue can go back on, at a new time;
+        # it then runs once, at the new time only.
+        ag = self.add(1000)
+        other = self.add(1500)
+        self.assertRaises(generator.ScheduleError, self.gen.addagent,
+            ag, self.chan, 2000, ag.run)
+        self.gen.remagent(ag)
+        self.gen.addagent(ag, self.chan, 2000, ag.run)
+        self.assertEqual(self.drain(3000), [ (1500, other), (2000, ag) ])
+
+        # And at an earlier time than before.
+        self.gen.addagent(ag, self.chan, 5000, ag.run)
+        self.gen.remagent(ag)
+        self.gen.addagent(ag, self.chan, 4000, ag.run)
+        self.assertEqual(self.drain(6000), [ (4000, ag) ])
+
+    def test_dead_entries_swept(self):
+        # Removed agents do not pile up in the heap.
+        keep = [ self.add(1000 + ix) for ix in range(10) ]
+        for ix in range(1000):
+            ag = self.add(500 + ix)
+            self.gen.remagent(ag)
+        self.assert_(len(self.gen.queue) <= 2 * len(keep) + 64 + 1)
+        self.assertEqual([ ag for (tm, ag) in self.drain(2000) ], keep)
+
+class Listener(agent.Agent):
+    def init(self, name, heard):
+        self.name = name
+        self.heard = heard
+    def receive(self, *ev):
+        self.heard.append( (self.name,) + ev )
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        boodle.set_driver('file')
+        self.gen = generator.Generator(1.0)
+        self.gen.agentruntime = 0
+        self.heard = []
+
+    def tearDown(self):
+        self.gen.close()
+
+    def listener(self, name, event, chan=None, handle=None):
+        # A scheduled agent, listening for the event.
+        if (chan is None):
+            chan = self.gen.rootchannel
+        ag = Listener(name, self.heard)
+        self.gen.addagent(ag, chan, 1000, ag.run)
+        ag.listen(event, handle=handle)
+        return ag
+
+    def send(self, *ev):
+        del self.heard[:]
+        self.gen.sendevent(ev, self.gen.rootchannel)
+        return sorted([ tup[0] for tup in self.heard ])
+
+    def test_prefix(self):
+        # A listener hears events which equal its name, or extend it by
+        # whole dot-separated parts. The empty name hears everything.
+        for name in ('', 'foo', 'foo.bar', 'foo.bar.baz', 'foob', 'bar'):
+            self.listener(name or 'all', name)
+        self.assertEqual(self.send('foo.bar'), ['all', 'foo', 'foo.bar'])
+        self.assertEqual(self.send('foo.bar.baz.x'),
+            ['all', 'foo', 'foo.bar', 'foo.bar.baz'])
+        self.assertEqual(self.send('foobar'), ['all'])
+        self.assertEqual(self.send('foob'), ['all', 'foob'])
+        self.assertEqual(self.send('bar.foo'), ['all', 'bar'])
+
+    def test_channels(self):
+        # An event is heard on its own channel and every ancestor, but
+        # not in subchannels or elsewhere.
+        root = self.gen.rootchannel
+        sub = generator.Channel(root, self.gen, None, 1.0, ())
+        subsub = generator.Channel(sub, self.gen, None, 1.0, ())
+        other = generator.Channel(root, self.gen, None, 1.0, ())
+        for (name, chan) in [ ('root', root), ('sub', sub),
+            ('subsub', subsub), ('other', other) ]:
+            self.listener(name, 'ping', chan)
+        del self.heard[:]
+        self.gen.sendevent(('ping',), sub)
+        self.assertEqual(sorted([ tup[0] for tup in self.heard ]),
+            ['root', 'sub'])
+
+    def test_multiple(self):
+        # Every listener for the event hears it once, with its arguments;
+        # an agent listening twice hears it twice.
+        self.listener('a', 'tick')
+        self.listener('b', 'tick')
+        ag = self.listener('c', 'tick')
+        ag.listen('tick')
+        self.gen.sendevent(('tick', 1, 'x'), self.gen.rootchannel)
+        self.assertEqual(sorted(self.heard), [ ('a', 'tick', 1, 'x'),
+            ('b', 'tick', 1, 'x'), ('c', 'tick', 1, 'x'),
+            ('c', 'tick', 1, 'x') ])
+
+        # Dropping one leaves the rest.
+        ag.unlisten('tick')
+        self.assertEqual(self.send('tick'), ['a', 'b'])
+
+    def test_unlisten_while_dispatching(self):
+        # A handler may stop other listeners (which then do not hear the
+        # event) or itself, or start a new listener (which only hears
+        # later events).
+        ags = {}
+        def handle(*ev):
+            self.heard.append( ('first',) + ev )
+            if (ev[0] == 'go'):
+                for name in ('a', 'b'):
+                    ags[name].unlisten()
+                ags['first'].unlisten()
+                self.listener('late', 'go')
+        # Listeners on the channel where the event is sent are dispatched
+        # before those on its parent. So the handler goes in a
+        # subchannel, and the others in the root.
+        sub = generator.Channel(self.gen.rootchannel, self.gen, None,
+            1.0, ())
+        ags['first'] = self.listener('first', 'go', sub, handle=handle)
+        for name in ('a', 'b', 'c'):
+            ags[name] = self.listener(name, 'go')
+
+        del self.heard[:]
+        self.gen.sendevent(('go',), sub)
+        self.assertEqual(sorted([ tup[0] for tup in self.heard ]),
+            ['c', 'first'])
+        self.assertEqual(self.send('go'), ['c', 'late'])
+        self.assertEqual(sub.listenindex, {})
+        self.assertEqual(self.gen.rootchannel.listenindex.keys(), ['go'])
+        self.assertEqual(len(self.gen.rootchannel.listenindex['go']), 2)
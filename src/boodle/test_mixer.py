@@ -0,0 +1,509 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import os.path
+import unittest
+import random
+import math
+import time
+import signal
+import StringIO
+
+import boodle
+from boodle import stereo, sample
+from boodle.generator import FrameCount
+from boodle.test_util import RenderTestCase, FuncAgent, RATE
+
+def onsets(out):
+    # The frames at which the left channel goes from silence to sound.
+    left = out[0::2]
+    return [ pos for pos in xrange(len(left))
+        if (left[pos] and (pos == 0 or not left[pos-1])) ]
+
+def tone(frames, channels=1, period=50.0, level=8000):
+    # A sine tone, with the right channel (if any) a fifth above the left.
+    ls = []
+    for pos in xrange(frames):
+        for ch in range(channels):
+            ls.append(int(level * math.sin(pos * (1.0 + 0.5*ch) / period)))
+    return ls
+
+class TestNoteQueue(RenderTestCase):
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        self.click = self.write_sample('click.wav', [1000] * 5)
+
+    def test_out_of_order(self):
+        # Thousands of notes, queued in random order, each start on its
+        # own frame.
+        rand = random.Random(17)
+        times = rand.sample(xrange(0, 3*RATE, 8), 3000)
+        def run(ag):
+            for pos in times:
+                ag.sched_note(self.click, 1.0, 1.0, FrameCount(pos))
+        out = self.render(run, 3.5)
+        self.assertEqual(onsets(out), sorted(times))
+
+    def test_added_while_playing(self):
+        # Notes queued later, by other agents, may start before notes
+        # that were queued earlier.
+        def late(ag):
+            ag.sched_note(self.click, 1.0, 1.0, FrameCount(100))
+            ag.sched_note(self.click, 1.0, 1.0, FrameCount(9000))
+        def run(ag):
+            ag.sched_note(self.click, 1.0, 1.0, FrameCount(30000))
+            ag.sched_agent(FuncAgent(late), FrameCount(5000))
+        out = self.render(run, 1.0)
+        self.assertEqual(onsets(out), [5100, 14000, 30000])
+
+    def test_same_start(self):
+        # Notes which start together are all mixed.
+        def run(ag):
+            for ix in range(3):
+                ag.sched_note(self.click, 1.0, 1.0, FrameCount(5000))
+        out = self.render(run, 0.5)
+        self.assertEqual(onsets(out), [5000])
+        self.assertEqual(list(out[10000:10004]), [3000] * 4)
+
+    def test_cut_off(self):
+        # Notes still queued when a session ends are thrown away; they
+        # do not turn up in the next session.
+        def run(ag):
+            ag.sched_note(self.click, 1.0, 1.0, FrameCount(100))
+            ag.sched_note(self.click, 1.0, 1.0, FrameCount(RATE))
+            ag.sched_note_duration(self.click, 5.0)
+        self.render(run, 0.1)
+        (numpending, numactive, poolsize, poolfree) = (
+            self.cboodle.note_stats()[0:4])
+        self.assertEqual((numpending, numactive), (0, 0))
+        self.assertEqual(poolfree, poolsize)
+        def run2(ag):
+            ag.sched_note(self.click, 1.0, 1.0, FrameCount(3000))
+        out = self.render(run2, 1.5)
+        self.assertEqual(onsets(out), [3000])
+        self.assertEqual(self.cboodle.note_stats()[0:2], (0, 0))
+
+class TestNotePool(RenderTestCase):
+
+    # The pool outlives each session (slabs are never freed), so these
+    # tests look at how the figures change, not at their values.
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        self.click = self.write_sample('click.wav', [1000] * 5)
+
+    def test_recycled(self):
+        # Notes go back to the pool when they end, and a second run of
+        # the same soundscape is served from it without growing it.
+        seen = []
+        def check(ag):
+            seen.append(self.cboodle.note_stats())
+        def run(ag):
+            for ix in range(300):
+                ag.sched_note(self.click, 1.0, 1.0, FrameCount(30*ix))
+            # Between the first and second buffers, after notes 0 to 136
+            # have ended.
+            ag.sched_agent(FuncAgent(check), FrameCount(4096))
+        self.render(run, 0.25)
+        self.render(run, 0.25)
+        (numpending, numactive, poolsize, poolfree, poollimit, peak,
+            overflow) = self.cboodle.note_stats()
+        self.assertEqual((numpending, numactive), (0, 0))
+        self.assertEqual(poolfree, poolsize)
+        self.assert_(peak >= 300)
+
+        (stats1, stats2) = seen
+        self.assertEqual(stats1[0] + stats1[1], 163)
+        self.assertEqual(stats1[2] - stats1[3], 163)
+        self.assertEqual(stats1, stats2)
+
+    def test_limit(self):
+        # The pool grows up to the notepool limit and no further; notes
+        # beyond that are allocated on their own, and play just the same.
+        poolsize = self.cboodle.note_stats()[2]
+        overflow = self.cboodle.note_stats()[6]
+        count = poolsize + 150
+        def run(ag):
+            for ix in range(count):
+                ag.sched_note(self.click, 1.0, 1.0, FrameCount(8*ix))
+        out = self.render(run, 8*count / float(RATE),
+            [ ('notepool', str(poolsize + 100)) ])
+        self.assertEqual(onsets(out), range(0, 8*count, 8))
+
+        stats = self.cboodle.note_stats()
+        self.assertEqual(stats[2], poolsize + 100)
+        self.assertEqual(stats[3], stats[2])
+        self.assertEqual(stats[4], poolsize + 100)
+        self.assertEqual(stats[6], overflow + 50)
+
+        fl = StringIO.StringIO()
+        self.gen.dump_stats(fl)
+        self.assert_(('note pool: 0 of %d in use (limit %d,'
+            % (poolsize + 100, poolsize + 100)) in fl.getvalue())
+
+class TestFinishedNotes(RenderTestCase):
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        self.click = self.write_sample('click.wav', [1000] * 100)
+
+    def test_batches(self):
+        # The notes which end in a buffer come back to run_agents() in
+        # one list, at the start of the next buffer, as (sample, channel)
+        # pairs; and the counts they hold are released.
+        batches = []
+        def watch(starttime, finished):
+            if (finished):
+                batches.append( (starttime, list(finished)) )
+        chans = []
+        def run(ag):
+            chans.append(ag.new_channel())
+            for ix in range(50):
+                ag.sched_note(self.click, 1.0, 1.0, FrameCount(10*ix),
+                    chans[0])
+            for ix in range(30):
+                ag.sched_note(self.click, 1.0, 1.0, FrameCount(5000+ix))
+        self.render(run, 0.5, watch=watch)
+        samp = sample.get(self.click)
+        root = self.gen.rootchannel
+
+        framesperbuf = self.cboodle.framesperbuf()
+        self.assertEqual([ starttime for (starttime, ls) in batches ],
+            [ framesperbuf, 2 * framesperbuf ])
+        self.assertEqual(batches[0][1], [ (samp, chans[0]) ] * 50)
+        self.assertEqual(batches[1][1], [ (samp, root) ] * 30)
+        self.assertEqual(samp.refcount, 0)
+        self.assertEqual(root.notecount, 0)
+
+    def test_stop_notes(self):
+        # Stopping a channel's notes hands back one pair for each note in
+        # it or its subchannels, sounding or not yet begun, and leaves
+        # other notes alone.
+        stopped = []
+        chans = {}
+        def stopper(ag):
+            ls = self.cboodle.stop_notes(chans['outer'].cchan)
+            stopped.extend(ls)
+            ag.generator.remnotes(ls)
+        def run(ag):
+            chans['outer'] = ag.new_channel_pan(stereo.shift(-1))
+            chans['inner'] = ag.new_channel(1.0, chans['outer'])
+            chans['other'] = ag.new_channel_pan(stereo.shift(1))
+            flat = self.write_sample('flat.wav', [1000] * RATE)
+            for key in ('outer', 'inner', 'other'):
+                ag.sched_note(flat, 1.0, 0.5, 0, chans[key])
+                ag.sched_note(flat, 1.0, 0.5, FrameCount(9000), chans[key])
+            ag.sched_note(self.click, 1.0, 1.0, 0, chans['inner'])
+            ag.sched_agent(FuncAgent(stopper), FrameCount(5000))
+        out = self.render(run, 0.5)
+
+        flat = sample.get(os.path.join(self.tempdir, 'flat.wav'))
+        self.assertEqual(sorted(stopped), sorted(
+            [ (flat, chans['outer']) ] * 2 + [ (flat, chans['inner']) ] * 2))
+        self.assertEqual(chans['outer'].notecount, 0)
+        self.assertEqual(chans['inner'].notecount, 0)
+        # (The stop comes at the start of the buffer in which the stopping
+        # agent runs.)
+        self.assertEqual(tuple(out[2*4000:2*4000+2]), (1000, 500))
+        self.assertEqual(tuple(out[2*5000:2*5000+2]), (0, 500))
+        self.assertEqual(tuple(out[2*10000:2*10000+2]), (0, 1000))
+
+class TestWakeup(RenderTestCase):
+
+    def run_loop(self, runagents, seconds):
+        # Run the mixer loop with the given runagents function in place
+        # of the generator's, and return the number of frames written.
+        from boodle import generator
+        self.gen = generator.Generator(1.0)
+        outfile = os.path.join(self.tempdir, 'output.raw')
+        self.cboodle.init(outfile, RATE, 0, [ ('time', repr(seconds)) ])
+        try:
+            self.cboodle.loop(runagents, self.gen)
+        finally:
+            self.cboodle.final()
+            frames = os.path.getsize(outfile) // 4
+        return frames
+
+    def test_once_a_second(self):
+        # Even with nothing to do for a long time, run_agents() is called
+        # at least once per second of sound.
+        calls = []
+        def watch(starttime, finished):
+            calls.append(starttime)
+        def run(ag):
+            ag.sched_agent(FuncAgent(lambda ag2: None), 20)
+        self.render(run, 5.0, watch=watch)
+        framesperbuf = self.cboodle.framesperbuf()
+        self.assert_(len(calls) >= 5, calls)
+        for (prev, cur) in zip(calls, calls[1:]):
+            self.assert_(cur - prev <= RATE + framesperbuf, (prev, cur))
+        self.assert_(self.gen.next_wakeup(1000) <= 1000 + RATE)
+
+    def test_bad_result(self):
+        # A wakeup time which is not an int, or which does not fit in a
+        # frame time, stops the loop with an exception.
+        self.assertRaises(TypeError, self.run_loop,
+            lambda starttime, gen, finished: 'later', 1.0)
+        self.assertRaises(OverflowError, self.run_loop,
+            lambda starttime, gen, finished: 2**70, 1.0)
+        # None means every buffer.
+        calls = []
+        def runagents(starttime, gen, finished):
+            calls.append(starttime)
+            return None
+        frames = self.run_loop(runagents, 1.0)
+        self.assertEqual(len(calls) * self.cboodle.framesperbuf(), frames)
+
+    def test_signal_while_sleeping(self):
+        # A signal which arrives while run_agents() is asleep is noticed
+        # without waiting for the wakeup time.
+        class Interrupted(Exception):
+            pass
+        def handler(signum, frame):
+            raise Interrupted()
+        def runagents(starttime, gen, finished):
+            # Far past the end of the run.
+            return starttime + 1000 * RATE
+        oldhandler = signal.signal(signal.SIGALRM, handler)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0.01, 0.01)
+            try:
+                self.assertRaises(Interrupted, self.run_loop, runagents, 600)
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        finally:
+            signal.signal(signal.SIGALRM, oldhandler)
+        outfile = os.path.join(self.tempdir, 'output.raw')
+        self.assert_(os.path.getsize(outfile) < 4 * 600 * RATE)
+
+class TestLongRun(RenderTestCase):
+
+    def test_past_2_31(self):
+        # Frame times go past 2^31 without wrapping or trimming. (About
+        # half a day of sound; it is thrown away as it is rendered.)
+        from boodle import generator
+        click = self.write_sample('click.wav', [1000] * 20)
+        late = 2**31 + 5000
+        seen = {}
+        def check(ag):
+            seen['runtime'] = ag.generator.agentruntime
+            ag.sched_note(click, 1.0, 1.0, FrameCount(100))
+        def run(ag):
+            ag.sched_agent(FuncAgent(check), FrameCount(late))
+            ag.sched_note(click, 1.0, 1.0, FrameCount(late + 1000))
+        ag = FuncAgent(run)
+        self.gen = generator.Generator(1.0)
+        self.gen.addagent(ag, self.gen.rootchannel, 0, ag.run)
+
+        batches = []
+        def runagents(starttime, gen, finished):
+            if (finished):
+                batches.append( (starttime, len(finished)) )
+            return generator.run_agents(starttime, gen, finished)
+        seconds = float(late + 20000) / RATE
+        self.cboodle.init(os.devnull, RATE, 0, [ ('time', repr(seconds)) ])
+        try:
+            try:
+                self.cboodle.loop(runagents, self.gen)
+            finally:
+                self.cboodle.final()
+        except boodle.StopGeneration:
+            pass
+
+        self.assertEqual(seen['runtime'], late)
+        # Each note is accounted for at the start of the buffer after the
+        # one it ends in.
+        framesperbuf = self.cboodle.framesperbuf()
+        def nextbuf(pos):
+            return (pos // framesperbuf + 1) * framesperbuf
+        wanted = {}
+        for end in (late + 120, late + 1020):
+            wanted[nextbuf(end)] = wanted.get(nextbuf(end), 0) + 1
+        self.assertEqual(batches, sorted(wanted.items()))
+
+class MixerTestCase(RenderTestCase):
+    """MixerTestCase: base class for tests which compare the output of
+    the mixer's various modes. Each soundscape in self.soundscapes
+    exercises a different part of the mixer.
+    """
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        mono = self.write_sample('mono.wav', tone(20000))
+        stereo2 = self.write_sample('stereo.wav', tone(20000, 2), 2)
+        loop = self.write_sample('loop.aiff', tone(6000, period=7.0),
+            loop=(1000, 3100))
+        loop2 = self.write_sample('loop2.aiff', tone(6000, 2, 11.0), 2,
+            loop=(2000, 2999))
+
+        def plain(ag):
+            ag.sched_note(mono, 1.0, 0.8, FrameCount(1234))
+            ag.sched_note(stereo2, 1.0, 0.5, FrameCount(7000))
+        def pitched(ag):
+            ag.sched_note(mono, 0.73, 0.8)
+            ag.sched_note(mono, 1.5, 0.6, FrameCount(333))
+            ag.sched_note(stereo2, 1.21, 0.7, FrameCount(5000))
+            ag.sched_note_pan(stereo2, stereo.shift(0.4), 0.9)
+        def looped(ag):
+            ag.sched_note_duration(loop, 0.7, 1.0, 0.8)
+            ag.sched_note_duration(loop, 0.5, 0.91, 0.5, FrameCount(999))
+            ag.sched_note_duration(loop2, 0.6, 1.0, 0.7, FrameCount(4097))
+            ag.sched_note_duration(loop2, 0.6, 1.37, 0.7)
+        def fading(ag):
+            outer = ag.new_channel_pan(stereo.shift(-0.3), 0.9)
+            inner = ag.new_channel(1.0, outer)
+            outer.set_volume(0.2, 0.7)
+            inner.set_pan(stereo.shift(0.6), 0.4)
+            ag.sched_note(mono, 1.0, 0.8, 0, inner)
+            ag.sched_note(stereo2, 0.8, 0.8, 0.05, inner)
+            ag.sched_note_duration(loop, 0.8, 1.2, 0.8, 0.1, outer)
+
+        self.soundscapes = [ ('plain', plain), ('pitched', pitched),
+            ('looped', looped), ('fading', fading) ]
+
+    def assertSameOutput(self, extra1, extra2):
+        for (name, run) in self.soundscapes:
+            out1 = self.render(run, 1.0, extra1)
+            out2 = self.render(run, 1.0, extra2)
+            self.assert_(max(out1) > 1000, name)
+            self.assertEqual(len(out1), len(out2), name)
+            self.assert_(out1 == out2, name)
+
+class TestFastMix(MixerTestCase):
+
+    def test_same_output(self):
+        # The stretch-at-a-time mixer is only faster, not different.
+        self.assertSameOutput([ ('fastmix', '0') ], [ ('fastmix', '1') ])
+
+    def test_note_edges(self):
+        # Notes which start and end at every offset within a stretch.
+        click = self.write_sample('short.wav', tone(37, period=3.0))
+        def run(ag):
+            for ix in range(64):
+                ag.sched_note(click, 1.0, 0.5, FrameCount(4000 + 41*ix + ix%8))
+                ag.sched_note(click, 0.9, 0.5, FrameCount(4000 + 43*ix))
+        self.soundscapes = [ ('edges', run) ]
+        self.assertSameOutput([ ('fastmix', '0') ], [ ('fastmix', '1') ])
+
+class TestFadeBlock(MixerTestCase):
+
+    def test_exact(self):
+        # With a block of one frame, every frame of a fade is exact
+        # (but for the mixer's truncation).
+        flat = self.write_sample('flat.wav', [1000] * RATE)
+        def run(ag):
+            ag.sched_note(flat)
+            ag.channel.set_volume(0.0, 0.5)
+        out = self.render(run, 0.5, [ ('fadeblock', '1') ])
+        left = out[0::2]
+        for pos in xrange(0, RATE // 2):
+            wanted = 1000.0 * (1.0 - pos / (0.5 * RATE))
+            self.assert_(0 <= wanted - left[pos] < 2, pos)
+
+    def max_diff(self, out1, out2):
+        return max([ abs(val1 - val2) for (val1, val2) in zip(out1, out2) ])
+
+    def test_blocks_close(self):
+        # Interpolating across the default block size stays within a
+        # few steps of the exact fade, even with the pan moving (which
+        # is not linear). A very large block is visibly coarser.
+        (name, run) = self.soundscapes[-1]
+        exact = self.render(run, 1.0, [ ('fadeblock', '1') ])
+        out = self.render(run, 1.0)
+        self.assert_(self.max_diff(exact, out) <= 3)
+        out = self.render(run, 1.0, [ ('fadeblock', '4096') ])
+        self.assert_(self.max_diff(exact, out) > 3)
+
+    def test_no_fade(self):
+        # If nothing is fading, the block size makes no difference.
+        self.soundscapes = self.soundscapes[:-1]
+        self.assertSameOutput([ ('fadeblock', '1') ],
+            [ ('fadeblock', '4096') ])
+
+    def test_rounding(self):
+        # The block size is rounded down to a power of two.
+        self.soundscapes = self.soundscapes[-1:]
+        self.assertSameOutput([ ('fadeblock', '48') ],
+            [ ('fadeblock', '32') ])
+        self.assertSameOutput([ ('fadeblock', '100000') ],
+            [ ('fadeblock', '4096') ])
+
+class TestLookahead(MixerTestCase):
+
+    def test_same_output(self):
+        # Writing from the device thread changes nothing in the output,
+        # including where a run ends because the soundscape ran out.
+        self.assertSameOutput([ ('lookahead', '0') ], [ ('lookahead', '3') ])
+
+    def test_slow_agents(self):
+        # An agent which is slow to run holds up the mixing, but the
+        # buffers all come through, in order.
+        (name, run) = self.soundscapes[-1]
+        def slow(ag):
+            time.sleep(0.01)
+            ag.resched(0.05)
+        def start(ag):
+            run(ag)
+            ag.sched_agent(FuncAgent(slow))
+        out1 = self.render(start, 1.0, [ ('lookahead', '0') ])
+        out2 = self.render(start, 1.0, [ ('lookahead', '2') ])
+        self.assert_(out1 == out2)
+
+        framesperbuf = self.cboodle.framesperbuf()
+        (numbuffers, walltime, agenttime, mixtime, writetime) = (
+            self.cboodle.loop_stats())
+        self.assertEqual(numbuffers, len(out2) // (2*framesperbuf))
+        self.assert_(agenttime >= 0.1)
+
+class TestThreads(MixerTestCase):
+
+    def setUp(self):
+        MixerTestCase.setUp(self)
+        # Notes are only mixed in parallel when there are enough of them
+        # to go around, so add a crowd: the number of voices swells past
+        # a hundred and dies away again, in channels that fade and pan.
+        mono = self.write_sample('crowd.wav', tone(3000, period=13.0))
+        loop = self.write_sample('crowd2.aiff', tone(3000, 2, 5.0), 2,
+            loop=(500, 2500))
+        def crowd(ag):
+            rand = random.Random(5)
+            chans = [ ag.new_channel_pan(stereo.shift(0.2*ix - 0.5), 0.3)
+                for ix in range(6) ]
+            chans[1].set_volume(1.0, 0.8)
+            chans[4].set_pan(stereo.shift(1), 0.6)
+            for ix in range(400):
+                chan = rand.choice(chans)
+                pitch = rand.choice([1.0, 1.0, 0.5, 1.77])
+                delay = FrameCount(rand.randrange(RATE))
+                if (ix % 5):
+                    ag.sched_note(mono, pitch, 0.2, delay, chan)
+                else:
+                    ag.sched_note_duration(loop, 0.2, pitch, 0.2, delay, chan)
+        self.soundscapes.append( ('crowd', crowd) )
+
+    def test_same_output(self):
+        self.assertSameOutput([ ('threads', '1') ], [ ('threads', '4') ])
+
+    def test_odd_counts(self):
+        # Thread counts which do not divide the voices evenly, and one
+        # far beyond the number of voices.
+        self.soundscapes = self.soundscapes[-1:]
+        for count in ('3', '7', '64'):
+            self.assertSameOutput([ ('threads', '1') ],
+                [ ('threads', count) ])
+
+    def test_changing_count(self):
+        # The workers are set up again when a later session asks for a
+        # different number of them, or none.
+        (name, run) = self.soundscapes[-1]
+        serial = self.render(run, 1.0)
+        for count in ('2', '5', '1', 'auto', '2'):
+            out = self.render(run, 1.0, [ ('threads', count) ])
+            self.assert_(out == serial, count)
+
+if __name__ == '__main__':
+    unittest.main()
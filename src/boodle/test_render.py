@@ -0,0 +1,74 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import sys
+import os
+import os.path
+import array
+import subprocess
+import unittest
+
+import boodle
+from boodle import builtin
+from boodle.test_util import RenderTestCase, RATE
+
+# The boodler script, in the source tree. (The tests which run it are
+# skipped if it is not there.)
+srcdir = os.path.dirname(os.path.dirname(os.path.abspath(boodle.__file__)))
+scriptpath = os.path.join(os.path.dirname(srcdir), 'script', 'boodler')
+
+class TestRenderScript(RenderTestCase):
+
+    def setUp(self):
+        RenderTestCase.setUp(self)
+        if (not os.path.isfile(scriptpath)):
+            self.skipTest('boodler script not found')
+
+    def run_script(self, *args):
+        # Render into the scratch directory, and return the frames and
+        # the log output.
+        outfile = os.path.join(self.tempdir, 'render.raw')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [ srcdir ] + [ val for val in sys.path if val ])
+        env.pop('BOODLER_SAMPLE_CACHE', None)
+        proc = subprocess.Popen([ sys.executable, scriptpath,
+            '--data', self.tempdir, '--render', outfile ] + list(args),
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        (log, dummy) = proc.communicate()
+        self.assertEqual(proc.returncode, 0, log)
+        res = array.array('h')
+        fl = open(outfile, 'rb')
+        res.fromstring(fl.read())
+        fl.close()
+        return (res, log)
+
+    def test_ends_with_soundscape(self):
+        # The test melody lasts about two seconds; the render stops there,
+        # well short of the duration, and reports how it went.
+        (out, log) = self.run_script('--duration', '30',
+            '/boodle.builtin.TestSoundAgent')
+        secs = len(out) / (2.0 * RATE)
+        self.assert_(1.8 < secs < 2.5, secs)
+        self.assert_('rendered %.1f seconds in' % (secs,) in log, log)
+
+        # It is the same sound that the mixer produces in-process, at the
+        # script's default volume.
+        self.assert_(out == self.render(builtin.TestSoundAgent(), 30,
+            basevolume=0.5))
+
+    def test_duration(self):
+        # The duration cuts the melody off, at the end of the buffer
+        # in which it falls.
+        (out, log) = self.run_script('--duration', '1',
+            '/boodle.builtin.TestSoundAgent')
+        framesperbuf = 4096   # the file driver's buffer size
+        self.assertEqual(len(out) // 2,
+            framesperbuf * ((RATE + framesperbuf - 1) // framesperbuf))
+        self.assert_(max(out) > 1000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,656 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+import os
+import os.path
+import struct
+import math
+import aifc
+import unittest
+
+from boopak import pload
+from boodle import sample
+from boodle.generator import FrameCount
+from boodle.test_util import RenderTestCase, FuncAgent, RATE
+
+def wav_bytes(values, chunks=()):
+    # A 16-bit mono WAV file, with the given (id, data) chunks between
+    # the format chunk and the data chunk.
+    body = 'WAVE'
+    body += struct.pack('<4sIHHIIHH', 'fmt ', 16, 1, 1, RATE, 2*RATE, 2, 16)
+    for (chunkid, dat) in chunks:
+        body += struct.pack('<4sI', chunkid, len(dat)) + dat
+        if (len(dat) & 1):
+            body += '\0'
+    dat = struct.pack('<%dh' % (len(values),), *values)
+    body += struct.pack('<4sI', 'data', len(dat)) + dat
+    return struct.pack('<4sI', 'RIFF', len(body)) + body
+
+class SampleTestCase(RenderTestCase):
+
+    def tearDown(self):
+        # Let the next test create its own package loader.
+        pload.PackageLoader.global_loader = None
+        RenderTestCase.tearDown(self)
+
+    def write_file(self, name, dat):
+        pathname = os.path.join(self.tempdir, name)
+        fl = open(pathname, 'wb')
+        fl.write(dat)
+        fl.close()
+        return pathname
+
+    def forget(self, pathname):
+        # Drop a sample from the sample cache, so that the next get()
+        # loads it afresh.
+        samp = sample.cache.pop(pathname)
+        self.cboodle.unload_sample(samp.csamp)
+        sample.count_loaded(samp)
+        self.cboodle.delete_sample(samp.csamp)
+        samp.csamp = None
+
+    def make_package(self, name, sounds):
+        # Build a package in the scratch directory, whose resources are
+        # the given sounds (a dict mapping resource names to lists of
+        # sample values), and load it with a fresh PackageLoader. The
+        # package's content is not imported yet.
+        pkgdir = os.path.join(self.tempdir, name)
+        os.mkdir(pkgdir)
+        fl = open(os.path.join(pkgdir, pload.Filename_Metadata), 'w')
+        fl.write('boodler.package: %s\nboodler.version: 1.0\n' % (name,))
+        fl.close()
+        fl = open(os.path.join(pkgdir, pload.Filename_Resources), 'w')
+        for (key, values) in sounds.items():
+            self.write_sample(os.path.join(name, key + '.aiff'), values)
+            fl.write(':%s\nboodler.filename: %s.aiff\n' % (key, key))
+            fl.write('boodler.use: sound\n')
+        fl.close()
+
+        coldir = os.path.join(self.tempdir, 'Collection')
+        if (not os.path.isdir(coldir)):
+            os.mkdir(coldir)
+        pload.PackageLoader.global_loader = None
+        self.loader = pload.PackageLoader(coldir, importing_ok=True)
+        self.loader.add_external_package(pkgdir)
+        return self.loader.load(name)
+
+    def level(self, pathname, pos=100):
+        # Play the sound, and return the left channel's value at the
+        # given frame.
+        def run(ag):
+            ag.sched_note(pathname)
+        out = self.render(run, 0.05)
+        return out[2*pos]
+
+class TestWavDataOffset(SampleTestCase):
+
+    def test_plain(self):
+        pathname = self.write_file('plain.wav', wav_bytes([1000] * 10))
+        self.assertEqual(sample.wav_data_offset(pathname), 44)
+        # The wave module writes the same layout.
+        pathname = self.write_sample('written.wav', [1000] * 10)
+        self.assertEqual(sample.wav_data_offset(pathname), 44)
+
+    def test_extra_chunks(self):
+        # Chunks before the data are skipped, counting the pad byte
+        # after one of odd length.
+        chunks = [ ('LIST', 'x' * 26), ('junk', 'abcde'), ('fact', 'wxyz') ]
+        pathname = self.write_file('chunks.wav',
+            wav_bytes([1000] * 10, chunks))
+        self.assertEqual(sample.wav_data_offset(pathname),
+            44 + (8+26) + (8+6) + (8+4))
+
+    def test_odd_chunk_plays(self):
+        # A file mapped in place plays from the right spot.
+        values = [ 500 + ix for ix in range(1000) ]
+        pathname = self.write_file('odd.wav',
+            wav_bytes(values, [ ('junk', 'abc') ]))
+        self.assertEqual(sample.wav_data_offset(pathname), 44 + 12)
+        self.assertEqual(self.level(pathname, 0), 500)
+        self.assertEqual(self.level(pathname, 321), 821)
+
+    def test_unreadable(self):
+        whole = wav_bytes([1000] * 10, [ ('LIST', 'x' * 100) ])
+        ls = [
+            whole[:30],      # cut off in the format chunk
+            whole[:80],      # cut off inside the extra chunk
+            whole[:36] + whole[44+108:],   # no data chunk header
+            'RIFX' + whole[4:],
+            '',
+        ]
+        for (ix, dat) in enumerate(ls):
+            pathname = self.write_file('bad%d.wav' % (ix,), dat)
+            self.assertEqual(sample.wav_data_offset(pathname), None, ix)
+        self.assertEqual(sample.wav_data_offset(
+            os.path.join(self.tempdir, 'missing.wav')), None)
+
+class TestCompression(SampleTestCase):
+
+    def tearDown(self):
+        sample.set_compression(None)
+        sample.package_compression.clear()
+        SampleTestCase.tearDown(self)
+
+    def write_8bit(self, name, values):
+        # An 8-bit AIFF file (whose data is signed).
+        pathname = os.path.join(self.tempdir, name)
+        fl = aifc.open(pathname, 'wb')
+        fl.setnchannels(1)
+        fl.setsampwidth(1)
+        fl.setframerate(RATE)
+        fl.writeframes(struct.pack('%db' % (len(values),), *values))
+        fl.close()
+        return pathname
+
+    def play(self, pathname, seconds=1.1):
+        # Play the sound twice over, the second time pitched up, and
+        # return the output and the durations.
+        durs = []
+        def run(ag):
+            durs.append(ag.sched_note(pathname))
+            durs.append(ag.sched_note(pathname, 1.5, 0.5, 0.2))
+        out = self.render(run, seconds)
+        return (out, durs)
+
+    def stats(self, pathname):
+        for tup in sample.get_compression_stats():
+            if (tup[0] == pathname):
+                return tup
+        return None
+
+    def test_8bit(self):
+        # 8-bit data kept at 8 bits plays exactly as it would expanded.
+        values = [ int(120 * math.sin(ix / 20.0)) for ix in range(RATE) ]
+        paths = [ self.write_8bit('snd%d.aiff' % (ix,), values)
+            for ix in range(2) ]
+        sample.set_compression('8bit')
+        (out, durs) = self.play(paths[0])
+        sample.set_compression(None)
+        (wanted, wanteddurs) = self.play(paths[1])
+        self.assert_(max(wanted) > 0)
+        self.assert_(out == wanted)
+        self.assertEqual(durs, wanteddurs)
+
+        (filename, mode, compressed, full, decoded, blocks,
+            secs) = self.stats(paths[0])
+        self.assertEqual(mode, '8bit')
+        self.assertEqual(compressed, RATE)
+        self.assertEqual(full, 2 * RATE)
+        self.assert_(blocks > 0)
+        self.assertEqual(self.stats(paths[1]), None)
+
+    def test_8bit_skips_16bit(self):
+        # The 8bit mode leaves 16-bit sounds alone.
+        pathname = self.write_sample('snd.aiff', [1000] * 2000)
+        sample.set_compression('8bit')
+        self.assertEqual(self.level(pathname), 1000)
+        self.assertEqual(self.stats(pathname), None)
+
+    def test_adpcm(self):
+        # ADPCM loses a little, but the sound keeps its length, and stays
+        # close to the original.
+        values = [ int(8000 * math.sin(ix / 20.0)
+            + 3000 * math.sin(ix / 3.1)) for ix in range(RATE) ]
+        paths = [ self.write_sample('snd%d.aiff' % (ix,), values)
+            for ix in range(2) ]
+        sample.set_compression('adpcm')
+        (out, durs) = self.play(paths[0])
+        sample.set_compression(None)
+        (wanted, wanteddurs) = self.play(paths[1])
+        self.assertEqual(durs, wanteddurs)
+        self.assertEqual(len(out), len(wanted))
+
+        def last_sound(arr):
+            pos = len(arr) - 1
+            while (pos > 0 and arr[pos] == 0):
+                pos -= 1
+            return pos
+        self.assertEqual(last_sound(out) // 2, last_sound(wanted) // 2)
+
+        # The error stays within a few percent of the peak level, and is
+        # much smaller on average.
+        peak = max([ abs(val) for val in wanted ])
+        diffs = [ abs(val1 - val2) for (val1, val2) in zip(out, wanted) ]
+        self.assert_(max(diffs) < 0.03 * peak, (max(diffs), peak))
+        mean = sum(diffs) / float(len(diffs))
+        self.assert_(mean < 0.01 * peak, (mean, peak))
+
+        (filename, mode, compressed, full, decoded, blocks,
+            secs) = self.stats(paths[0])
+        self.assertEqual(mode, 'adpcm')
+        self.assertEqual(full, 2 * RATE)
+        self.assert_(compressed < full // 3, compressed)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, sample.set_compression, 'mp3')
+        self.assertRaises(ValueError, sample.set_compression, 'mp3', 'pkg')
+
+    def test_package(self):
+        # A package's own mode overrides the global one, either way.
+        values = [ int(8000 * math.sin(ix / 20.0)) for ix in range(4000) ]
+        pkgname = 'org.boodler.test.sounds'
+        pkg = self.make_package(pkgname, { 'tone': values })
+        mod = pkg.get_content()
+        plain = self.write_sample('plain.aiff', values)
+
+        sample.set_compression('adpcm', pkgname)
+        self.assertEqual(sample.get_compression(mod.tone), 'adpcm')
+        self.assertEqual(sample.get_compression(plain), None)
+        sample.get(mod.tone)
+        sample.get(plain)
+        self.assertEqual(self.stats(mod.tone)[1], 'adpcm')
+        self.assertEqual(self.stats(plain), None)
+        self.forget(mod.tone)
+        self.forget(plain)
+
+        sample.set_compression('adpcm')
+        sample.set_compression(None, pkgname)
+        self.assertEqual(sample.get_compression(mod.tone), None)
+        self.assertEqual(sample.get_compression(plain), 'adpcm')
+        sample.get(mod.tone)
+        sample.get(plain)
+        self.assertEqual(self.stats(mod.tone), None)
+        self.assertEqual(self.stats(plain)[1], 'adpcm')
+
+class TestDecodedCache(SampleTestCase):
+
+    def setUp(self):
+        SampleTestCase.setUp(self)
+        self.oldlimit = sample.cache_limit
+        self.cachedir = os.path.join(self.tempdir, 'cache')
+        sample.set_cache_limit(None)
+        sample.set_cache_dir(self.cachedir)
+
+    def tearDown(self):
+        sample.set_cache_dir(None)
+        sample.set_cache_limit(self.oldlimit)
+        SampleTestCase.tearDown(self)
+
+    def cache_files(self):
+        return sorted([ name for name in os.listdir(self.cachedir)
+            if (name.endswith('.pcm')) ])
+
+    def load(self, name, val, frames=2000):
+        # Write an AIFF file (which has to be decoded, and so is cached),
+        # and load it.
+        pathname = self.write_sample(name, [val] * frames)
+        sample.get(pathname)
+        return pathname
+
+    def tamper(self, cachename, val):
+        # Rewrite the data in a cache file, so that it is plain whether
+        # the file is used.
+        size = os.path.getsize(cachename) - sample.cache_offset
+        fl = open(cachename, 'r+b')
+        fl.seek(sample.cache_offset)
+        fl.write(struct.pack('=%dh' % (size // 2,), *([val] * (size // 2))))
+        fl.close()
+
+    def test_reused(self):
+        pathname = self.load('snd.aiff', 1000)
+        cachename = sample.cache_pathname(pathname)
+        self.assertEqual(self.cache_files(), [ os.path.basename(cachename) ])
+        self.assertEqual(os.path.getsize(cachename),
+            sample.cache_offset + 2*2000)
+
+        self.tamper(cachename, 1234)
+        self.forget(pathname)
+        self.assertEqual(self.level(pathname), 1234)
+
+    def test_stale(self):
+        # A cache entry made for an older version of the sound file --
+        # a different modification time, or a different size -- is not
+        # used.
+        pathname = self.load('snd.aiff', 1000)
+        oldcache = sample.cache_pathname(pathname)
+        self.tamper(oldcache, 1234)
+        self.forget(pathname)
+
+        st = os.stat(pathname)
+        os.utime(pathname, (st.st_atime, st.st_mtime - 100))
+        newcache = sample.cache_pathname(pathname)
+        self.assertNotEqual(newcache, oldcache)
+        self.assertEqual(self.level(pathname), 1000)
+        self.assertEqual(self.cache_files(), sorted([
+            os.path.basename(oldcache), os.path.basename(newcache) ]))
+        self.forget(pathname)
+
+        mtime = os.stat(pathname).st_mtime
+        self.write_sample('snd.aiff', [700] * 3000)
+        os.utime(pathname, (mtime, mtime))
+        self.failIf(sample.cache_pathname(pathname)
+            in (oldcache, newcache))
+        self.assertEqual(self.level(pathname), 700)
+
+    def test_limit(self):
+        # When the cache outgrows its limit, the files used least
+        # recently are deleted. Mapping a file counts as a use.
+        paths = [ self.load('snd%d.aiff' % (ix,), 1000 + ix)
+            for ix in range(4) ]
+        names = [ sample.cache_pathname(path) for path in paths ]
+        for (ix, cachename) in enumerate(names):
+            os.utime(cachename, (1000000 + ix, 1000000 + ix))
+        size = os.path.getsize(names[0])
+
+        sample.set_cache_limit(3 * size)
+        self.assertEqual(sample.cache_used, 3 * size)
+        self.failIf(os.path.exists(names[0]))
+        self.assert_(os.path.exists(names[1]))
+
+        # Sound 1 is used again, so sound 2 is the oldest when a new
+        # file goes in. The new file itself is kept.
+        self.forget(paths[1])
+        self.assertEqual(self.level(paths[1]), 1001)
+        self.load('snd4.aiff', 1004)
+        newname = sample.cache_pathname(
+            os.path.join(self.tempdir, 'snd4.aiff'))
+        self.assertEqual(self.cache_files(), sorted([
+            os.path.basename(val) for val in
+            (names[1], names[3], newname) ]))
+        self.assertEqual(sample.cache_used, 3 * size)
+
+        # A file larger than the whole limit is kept, alone.
+        sample.set_cache_limit(size // 2)
+        self.assertEqual(self.cache_files(), [])
+        big = self.load('big.aiff', 900, 5000)
+        self.assertEqual(self.cache_files(),
+            [ os.path.basename(sample.cache_pathname(big)) ])
+
+class TestPrefetch(SampleTestCase):
+
+    def test_prefetch(self):
+        # A prefetched sound is loaded in the background, and plays
+        # without counting a miss.
+        pathname = self.write_sample('snd.aiff', [1000] * 2000)
+        misses = sample.get_memory_stats()[3]
+        sample.prefetch([pathname])
+        samp = sample.cache[pathname]
+        self.assert_(samp.loading is not None)
+        samp.finish_loading()
+        self.assert_(sample.is_ready(pathname))
+        self.assert_(sample.get(pathname) is samp)
+        self.assertEqual(self.level(pathname), 1000)
+        self.assertEqual(sample.get_memory_stats()[3], misses)
+
+        # Prefetching it again does nothing.
+        sample.prefetch([pathname])
+        self.assert_(samp.loading is None)
+
+    def test_many(self):
+        paths = [ self.write_sample('snd%d.aiff' % (ix,), [100*ix] * 5000)
+            for ix in range(20) ]
+        sample.prefetch(paths)
+        for (ix, pathname) in enumerate(paths):
+            self.assertEqual(self.level(pathname), 100*ix)
+            self.assert_(sample.is_ready(pathname))
+
+    def test_reload(self):
+        # A sample which has been unloaded is not ready; prefetching
+        # loads it again.
+        pathname = self.write_sample('snd.aiff', [1000] * 2000)
+        samp = sample.get(pathname)
+        self.assert_(sample.is_ready(samp))
+        self.cboodle.unload_sample(samp.csamp)
+        sample.count_loaded(samp)
+        self.failIf(sample.is_ready(samp))
+        sample.prefetch([samp], 5000)
+        samp.finish_loading()
+        self.assert_(sample.is_ready(samp))
+        self.assertEqual(samp.lastused, 5000)
+        self.assertEqual(self.level(pathname), 1000)
+
+    def test_errors(self):
+        # A missing file is reported at once; a file which cannot be
+        # decoded, when it is played.
+        self.assertRaises(sample.SampleError, sample.prefetch,
+            [ os.path.join(self.tempdir, 'missing.aiff') ])
+        pathname = self.write_file('bad.wav', 'not a sound file' * 10)
+        sample.prefetch([pathname])
+        samp = sample.cache[pathname]
+        samp.loading.wait()
+        self.assert_(sample.is_ready(pathname))
+        self.assertRaises(Exception, samp.check_playable)
+        self.failIf(self.cboodle.is_sample_loaded(samp.csamp))
+
+    def test_agent(self):
+        # An agent preloads sounds, which count as used at the time it
+        # runs, and can ask whether they are ready.
+        first = self.write_sample('first.aiff', [1000] * 2000)
+        second = self.write_sample('second.aiff', [500] * 2000)
+        seen = []
+        def preload(ag):
+            ag.preload_samples([first, second])
+            sample.cache[first].finish_loading()
+            seen.append(ag.is_sample_ready(first))
+            ag.sched_note(first, 1.0, 1.0, FrameCount(100))
+        def run(ag):
+            seen.append(ag.is_sample_ready(first))
+            ag.sched_agent(FuncAgent(preload), FrameCount(5000))
+        out = self.render(run, 0.3)
+        self.assertEqual(seen, [ False, True ])
+        self.assertEqual(out[2*5200], 1000)
+        self.assertEqual(sample.cache[second].lastused, 5000)
+        sample.cache[second].finish_loading()
+        self.assert_(sample.is_ready(second))
+
+    def test_package(self):
+        # Importing a package's content prefetches its sounds, when the
+        # loader's import hook is set to prefetch_package.
+        pkg = self.make_package('org.boodler.test.sounds',
+            { 'low': [300] * 2000, 'high': [600] * 2000 })
+        self.loader.import_hook = sample.prefetch_package
+        self.assertEqual([ key for key in sample.cache
+            if (sample.file_pathname(key) or '').startswith(self.tempdir) ],
+            [])
+        mod = pkg.get_content()
+        for (name, val) in [ ('low', 300), ('high', 600) ]:
+            fileobj = getattr(mod, name)
+            samp = sample.cache[fileobj]
+            self.assert_(samp.loading is not None)
+            samp.finish_loading()
+            self.assert_(sample.is_ready(fileobj))
+            self.assertEqual(self.level(fileobj), val)
+
+class TestMemoryBudget(SampleTestCase):
+
+    def setUp(self):
+        SampleTestCase.setUp(self)
+        self.oldbudget = sample.memory_budget
+
+    def tearDown(self):
+        sample.set_memory_budget(self.oldbudget)
+        SampleTestCase.tearDown(self)
+
+    def is_loaded(self, pathname):
+        return bool(self.cboodle.is_sample_loaded(
+            sample.cache[pathname].csamp))
+
+    def test_lru(self):
+        # The samples played least recently are unloaded first.
+        paths = [ self.write_sample('snd%d.aiff' % (ix,), [1000] * 2000)
+            for ix in range(4) ]
+        order = [ 2, 0, 3, 1 ]
+        def run(ag):
+            for (pos, ix) in enumerate(order):
+                ag.sched_note(paths[ix], 1.0, 1.0, FrameCount(5000*pos))
+        self.render(run, 0.5)
+        size = sample.cache[paths[0]].size
+        self.assert_(size > 0)
+        # (A note counts as a use of its sample until it ends.)
+        lastused = [ sample.cache[path].lastused for path in paths ]
+        self.assertEqual(lastused, [ 7000, 17000, 2000, 12000 ])
+
+        evictions = sample.get_memory_stats()[4]
+        used = sample.memory_in_use()
+        for (count, ix) in enumerate(order):
+            sample.set_memory_budget(used - (count+1) * size)
+            sample.unload_excess()
+            self.failIf(self.is_loaded(paths[ix]), ix)
+            for later in order[count+1 : ]:
+                self.assert_(self.is_loaded(paths[later]), later)
+            self.assertEqual(sample.get_memory_stats()[4],
+                evictions + count + 1)
+        self.assertEqual(sample.memory_in_use(), used - 4 * size)
+
+        # An unloaded sample is loaded again when it is played.
+        self.assertEqual(self.level(paths[0]), 1000)
+
+    def test_playing_kept(self):
+        # A sample which is playing is not unloaded, even when the
+        # budget cannot be met without it.
+        long = self.write_sample('long.aiff', [1000] * RATE)
+        idle = self.write_sample('idle.aiff', [500] * 2000)
+        seen = []
+        def squeeze(ag):
+            sample.set_memory_budget(0)
+            sample.unload_excess()
+            seen.append( (self.is_loaded(long), self.is_loaded(idle)) )
+        def run(ag):
+            sample.get(idle)
+            ag.sched_note(long)
+            ag.sched_agent(FuncAgent(squeeze), 0.2)
+        out = self.render(run, 0.5)
+        self.assertEqual(seen, [ (True, False) ])
+        self.assertEqual(out[2*int(0.4*RATE)], 1000)
+
+    def test_when_checked(self):
+        # The generator checks the budget after samples are loaded, not
+        # on every cycle.
+        paths = [ self.write_sample('snd%d.aiff' % (ix,), [1000] * RATE)
+            for ix in range(2) ]
+        calls = []
+        cycle = []
+        def watch(starttime, finished):
+            cycle.append(starttime)
+        realunload = sample.unload_excess
+        def unload_excess():
+            calls.append(cycle[-1])
+            realunload()
+        def load(ag):
+            ag.sched_note(paths[1])
+            # Over budget now, with only the first sample not playing.
+            sample.set_memory_budget(sample.memory_in_use()
+                - sample.cache[paths[0]].size)
+        def tick(ag):
+            ag.resched(FrameCount(4096))
+        def run(ag):
+            sample.get(paths[0])
+            ag.sched_agent(FuncAgent(tick))
+            ag.sched_agent(FuncAgent(load), FrameCount(3 * 4096))
+        sample.set_memory_budget(None)
+        sample.unload_excess()
+        sample.unload_excess = unload_excess
+        try:
+            self.render(run, 0.5, watch=watch)
+        finally:
+            sample.unload_excess = realunload
+        # Once in the cycle after the root agent's load, and once in the
+        # cycle after the second.
+        framesperbuf = self.cboodle.framesperbuf()
+        self.assertEqual(calls, [ framesperbuf, 4 * framesperbuf ])
+        self.failIf(self.is_loaded(paths[0]))
+        self.assert_(self.is_loaded(paths[1]))
+
+class TestStreaming(SampleTestCase):
+
+    def setUp(self):
+        SampleTestCase.setUp(self)
+        self.oldthreshold = sample.stream_threshold
+        sample.set_cache_dir(os.path.join(self.tempdir, 'cache'))
+
+    def tearDown(self):
+        sample.set_stream_threshold(self.oldthreshold)
+        sample.set_cache_dir(None)
+        SampleTestCase.tearDown(self)
+
+    def write_pair(self, name, values, **opts):
+        # Write the same sound under two names, so that one copy can be
+        # streamed and the other loaded whole.
+        (base, suffix) = os.path.splitext(name)
+        return (self.write_sample(base + '-1' + suffix, values, **opts),
+            self.write_sample(base + '-2' + suffix, values, **opts))
+
+    def test_same_output(self):
+        # Streamed sounds play exactly as they would from memory: at
+        # other pitches, across block boundaries, and around loops.
+        # (Stereo WAV data is mapped in place; the looped AIFF is
+        # decoded into the cache and streamed from there.)
+        frames = 3 * RATE
+        wavs = self.write_pair('ramp.wav',
+            [ (ix * 37) % 4000 - 2000 for ix in range(2 * frames) ],
+            channels=2)
+        aiffs = self.write_pair('loop.aiff',
+            [ (ix * 13) % 3000 for ix in range(frames) ],
+            loop=(20000, 90000))
+        def runner(wav, aiff):
+            def run(ag):
+                ag.sched_note(wav)
+                ag.sched_note_pan(wav, 0.5, 1.5, 0.5, 0.3)
+                ag.sched_note_duration(aiff, 8.0, 0.75, 0.5, 0.1)
+            return run
+        extra = [ ('streamwait', 'none') ]
+
+        sample.set_stream_threshold(100000)
+        starved = self.cboodle.stream_stats()[3]
+        streamed = self.render(runner(wavs[0], aiffs[0]), 9.0, extra)
+        for pathname in (wavs[0], aiffs[0]):
+            self.assertEqual(sample.cache[pathname].size, 0)
+        self.assertEqual(self.cboodle.stream_stats()[0], 2)
+        self.assertEqual(self.cboodle.stream_stats()[3], starved)
+
+        sample.set_stream_threshold(None)
+        whole = self.render(runner(wavs[1], aiffs[1]), 9.0, extra)
+        self.assertEqual(sample.cache[wavs[1]].size, 2 * 2 * frames)
+        self.assert_(max(whole) > 0)
+        self.assert_(streamed == whole)
+
+    def test_memory(self):
+        # Only the blocks near the playing position are in memory, and
+        # none of it counts against the memory budget.
+        frames = 60 * RATE
+        pathname = self.write_sample('long.wav',
+            [ (ix % 1000) + 1 for ix in range(frames) ])
+        sample.set_stream_threshold(100000)
+        seen = []
+        def check(ag):
+            seen.append(self.cboodle.stream_stats())
+        def run(ag):
+            ag.sched_note(pathname)
+            for secs in (10, 30, 50):
+                ag.sched_agent(FuncAgent(check), secs)
+        used = sample.memory_in_use()
+        out = self.render(run, 61.0, [ ('streamwait', 'none') ])
+        self.assertEqual(sample.memory_in_use(), used)
+        for (numstreams, numresident, residentbytes, starved,
+            decodedbytes) in seen:
+            self.assertEqual(numstreams, 1)
+            self.assert_(0 < residentbytes < (2 * frames) // 4,
+                residentbytes)
+        # (The last frame of a note is not mixed.)
+        left = out[0:2*(frames-1):2]
+        self.assertEqual(min(left), 1)
+        self.assertEqual(left[45 * RATE], (45 * RATE) % 1000 + 1)
+
+    def test_info(self):
+        # get_info() does not care whether a sound is streamed.
+        paths = self.write_pair('snd.aiff', [1000] * (2 * RATE),
+            loop=(1000, 50000))
+        infos = []
+        def run(ag):
+            # (The durations depend on the output rate, so this is done
+            # while the driver is running.)
+            sample.set_stream_threshold(100000)
+            infos.append(sample.get_info(paths[0], 1.5))
+            sample.set_stream_threshold(None)
+            infos.append(sample.get_info(paths[1], 1.5))
+        self.render(run, 0.1)
+        self.assertEqual(sample.cache[paths[0]].size, 0)
+        self.assertEqual(sample.cache[paths[1]].size, 2 * 2 * RATE)
+        self.assertEqual(infos[0], infos[1])
+        self.assertAlmostEqual(infos[0][0], 2.0 / 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# Boodler: a programmable soundscape tool
+# Copyright 2007-2011 by Andrew Plotkin <erkyrath@eblong.com>
+#   <http://boodler.org/>
+# This program is distributed under the LGPL.
+# See the LGPL document, or the above URL, for details.
+
+"""Fixtures shared by the boodle unit tests. (This module contains no
+tests of its own.)
+
+RenderTestCase gives each test a scratch directory to write sound files
+into, and a render() method which runs a soundscape through the real
+mixer and returns the frames it produced.
+"""
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+import array
+import wave
+import aifc
+import unittest
+
+import boodle
+from boodle import agent, generator, sample
+
+# The rate used for rendering, and for the sound files written by
+# write_sample(), so that one frame of sample data is one frame of
+# output.
+RATE = 44100
+
+class FuncAgent(agent.Agent):
+    """FuncAgent: an agent which calls a function when it runs, passing
+    itself as the argument.
+    """
+    def init(self, func):
+        self.func = func
+    def run(self):
+        self.func(self)
+
+class RenderTestCase(unittest.TestCase):
+    """RenderTestCase: base class for tests which play sounds.
+
+    The file driver is used, since it is the one which is always built.
+    """
+
+    def setUp(self):
+        self.cboodle = boodle.set_driver('file')
+        self.tempdir = tempfile.mkdtemp(prefix='boodletest')
+        self.gen = None
+
+    def tearDown(self):
+        if (self.gen is not None):
+            self.gen.close()
+            self.gen = None
+        # Forget the sounds loaded from the scratch directory, so that a
+        # later test cannot pick them up by name. (Any still loading in
+        # the background are waited for.)
+        for (name, samp) in sample.cache.items():
+            pathname = sample.file_pathname(name)
+            if (type(pathname) in [str, unicode]
+                and pathname.startswith(self.tempdir)):
+                del sample.cache[name]
+                if (samp.loading is not None):
+                    samp.loading.wait()
+                if (samp.csamp is not None):
+                    self.cboodle.unload_sample(samp.csamp)
+                    sample.count_loaded(samp)
+                    self.cboodle.delete_sample(samp.csamp)
+                    samp.csamp = None
+        shutil.rmtree(self.tempdir, True)
+
+    def write_sample(self, name, values, channels=1, rate=RATE, loop=None):
+        """write_sample(name, values, channels=1, rate=RATE, loop=None)
+            -> str
+
+        Write a 16-bit sound file in the scratch directory, and return
+        its pathname. The values are the sample values, interleaved if
+        there is more than one channel. The file is AIFF if the name
+        ends with ".aiff", and WAV otherwise. The loop, if given, is a
+        (start, end) pair of frame positions; it requires AIFF.
+        """
+        pathname = os.path.join(self.tempdir, name)
+        dat = array.array('h', values)
+        if (name.endswith('.aiff')):
+            if (sys.byteorder == 'little'):
+                dat.byteswap()
+            fl = aifc.open(pathname, 'wb')
+        else:
+            if (sys.byteorder == 'big'):
+                dat.byteswap()
+            fl = wave.open(pathname, 'wb')
+        fl.setnchannels(channels)
+        fl.setsampwidth(2)
+        fl.setframerate(rate)
+        fl.writeframes(dat.tostring())
+        if (loop is not None):
+            (start, end) = loop
+            fl.setmark(1, start, 'start')
+            fl.setmark(2, end, 'end')
+        fl.close()
+        return pathname
+
+    def render(self, ag, seconds, extra=(), basevolume=1.0, watch=None):
+        """render(ag, seconds, extra=(), basevolume=1.0, watch=None)
+            -> array
+
+        Run a soundscape whose root agent is ag (an Agent, or a function
+        to be wrapped in a FuncAgent), for the given number of seconds,
+        and return the output as an array of 16-bit values, left and
+        right interleaved. The extra list holds additional driver
+        options, as (key, val) pairs.
+
+        If watch is given, it is called as watch(starttime, finished)
+        before every run_agents() call, with that call's arguments.
+
+        The output is rounded up to a whole number of buffers. It stops
+        early if the soundscape runs out of channels. The generator is
+        left in self.gen, for the test to inspect.
+        """
+        if (not isinstance(ag, agent.Agent)):
+            ag = FuncAgent(ag)
+        if (self.gen is not None):
+            self.gen.close()
+        self.gen = generator.Generator(basevolume)
+        self.gen.addagent(ag, self.gen.rootchannel, 0, ag.run)
+
+        runagents = generator.run_agents
+        if (watch is not None):
+            def runagents(starttime, gen, finished):
+                watch(starttime, finished)
+                return generator.run_agents(starttime, gen, finished)
+
+        outfile = os.path.join(self.tempdir, 'output.raw')
+        opts = [ ('time', repr(seconds)) ] + list(extra)
+        self.cboodle.init(outfile, RATE, 0, opts)
+        try:
+            try:
+                self.cboodle.loop(runagents, self.gen)
+            finally:
+                self.cboodle.final()
+        except boodle.StopGeneration:
+            pass
+
+        res = array.array('h')
+        fl = open(outfile, 'rb')
+        res.fromstring(fl.read())
+        fl.close()
+        return res
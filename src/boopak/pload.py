@@ -79,6 +79,11 @@ class PackageLoader:
     currently_importing -- during an import operation, the package which is
         being imported (at the moment)
 
+    Publicly writable field:
+
+    import_hook -- a function which is called with each PackageInfo, just
+        after its content is imported (or None)
+
     Public methods:
 
     load() -- load a package, given its name and a version spec
@@ -145,6 +150,7 @@ class PackageLoader:
         self.collection_scanned = False
         self.all_deps = None
         self.currently_importing = None
+        self.import_hook = None
 
         if (importing_ok):
             if (PackageLoader.global_loader):
@@ -788,6 +794,9 @@ class PackageLoader:
         self.module_info[mod] = pkg
         pkg.content = mod
 
+        if (not (self.import_hook is None)):
+            self.import_hook(pkg)
+
     def load_item_by_name(self, name, package=None):
         """load_item_by_name(name, package=None) -> value
 
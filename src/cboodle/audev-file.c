@@ -23,7 +23,7 @@ static long sound_rate = 0; /* frames per second */
 static int sound_channels = 0;
 static int sound_format = 0; /* TRUE for big-endian, FALSE for little */
 static long sound_buffersize = 0; /* bytes */
-static long maxtime = 0, curtime = 0;
+static frametime_t maxtime = 0, curtime = 0;
 
 static long samplesperbuf = 0;
 static long framesperbuf = 0;
@@ -105,10 +105,10 @@ int audev_init_device(char *devname, long ratewanted, int verbose, extraopt_t *e
       channels, rate, (format?"big-endian":"little-endian"));
   }
 
-  maxtime = (long)(maxsecs * (double)rate);
+  maxtime = (frametime_t)(maxsecs * (double)rate);
   curtime = 0;
   if (verbose) {
-    printf("%g seconds of output (%ld frames)\n", maxsecs, maxtime);
+    printf("%g seconds of output (%lld frames)\n", maxsecs, maxtime);
   }
 
   sound_rate = rate;
@@ -28,7 +28,7 @@
 static FILE *device = NULL;
 static long sound_rate = 0; /* frames per second */
 static int sound_channels = 0;
-static long maxtime = 0, curtime = 0;
+static frametime_t maxtime = 0, curtime = 0;
 
 static long samplesperbuf = 0;
 static long framesperbuf = 0;
@@ -119,10 +119,10 @@ int audev_init_device(char *devname, long ratewanted, int verbose, extraopt_t *e
       channels, rate);
   }
 
-  maxtime = (long)(maxsecs * (double)rate);
+  maxtime = (frametime_t)(maxsecs * (double)rate);
   curtime = 0;
   if (verbose) {
-    printf("%g seconds of output (%ld frames)\n", maxsecs, maxtime);
+    printf("%g seconds of output (%lld frames)\n", maxsecs, maxtime);
   }
 
   sound_rate = rate;
@@ -23,15 +23,21 @@
 #include "common.h"
 #include "audev.h"
 #include "sample.h"
+#include "channel.h"
 #include "noteq.h"
+#include "mixthread.h"
+#include "stream.h"
+#include "compress.h"
 
 typedef struct run_agents_rock_struct {
   PyObject *runagents;
   PyObject *generator;
+  int sleeping; /* has runagents asked to be left alone until wakeup? */
+  frametime_t wakeup;
 } run_agents_rock_t;
 
 extern void initcboodle_lame(void);
-static int run_python_agents(long curtime, void *rock);
+static int run_python_agents(frametime_t curtime, void *rock);
 
 static PyObject *cboodle_init(PyObject *self, PyObject *args)
 {
@@ -46,12 +52,6 @@ static PyObject *cboodle_init(PyObject *self, PyObject *args)
   if (!PyArg_ParseTuple(args, "|ziiO:init", &devname, &ratewanted, &verbose, &extras))
     return NULL;
 
-  res = noteq_init();
-  if (!res) {
-    PyErr_SetString(PyExc_IOError, "unable to initialize note queue");
-    return NULL;
-  }
-
   if (extras && PyList_Check(extras)) {
     int count = PyList_Size(extras);
 
@@ -94,6 +94,24 @@ static PyObject *cboodle_init(PyObject *self, PyObject *args)
     opts[count].val = NULL;
   }
 
+  res = noteq_init(opts?opts:(&dummyopt));
+  if (!res) {
+    PyErr_SetString(PyExc_IOError, "unable to initialize note queue");
+    if (opts) {
+      free(opts);
+    }
+    return NULL;
+  }
+
+  res = mixthread_init(opts?opts:(&dummyopt));
+  if (!res) {
+    PyErr_SetString(PyExc_IOError, "unable to initialize sound thread");
+    if (opts) {
+      free(opts);
+    }
+    return NULL;
+  }
+
   res = audev_init_device(devname, ratewanted, (verbose!=0),
     (opts?opts:(&dummyopt)));
   if (!res) {
@@ -118,6 +136,7 @@ static PyObject *cboodle_final(PyObject *self, PyObject *args)
     return NULL;
 
   audev_close_device();
+  noteq_final();
 
   Py_INCREF(Py_None);
   return Py_None;
@@ -125,7 +144,7 @@ static PyObject *cboodle_final(PyObject *self, PyObject *args)
 
 static PyObject *cboodle_loop(PyObject *self, PyObject *args)
 {
-  run_agents_rock_t dat = {NULL, NULL};
+  run_agents_rock_t dat = {NULL, NULL, FALSE, 0};
   int res;
 
   if (!PyArg_ParseTuple(args, "OO:loop", &dat.runagents, &dat.generator))
@@ -136,7 +155,7 @@ static PyObject *cboodle_loop(PyObject *self, PyObject *args)
     return NULL;
   }
 
-  res = audev_loop(noteq_generate, run_python_agents, &dat);
+  res = mixthread_loop(noteq_generate, run_python_agents, &dat);
   if (res) {
     /* run_python_agents() returned TRUE, meaning that a Python
        exception occurred in runagents. */
@@ -148,13 +167,34 @@ static PyObject *cboodle_loop(PyObject *self, PyObject *args)
   return Py_None;
 }
 
-static int run_python_agents(long curtime, void *rock)
+static int run_python_agents(frametime_t curtime, void *rock)
 {
   run_agents_rock_t *dat = rock;
+  PyObject *finished;
   PyObject *arglist;
   PyObject *result;
 
-  arglist = Py_BuildValue("(iO)", curtime, dat->generator);
+  /* If runagents has nothing to do before the wakeup time, and no
+     notes have ended, there's no need to call into Python at all. */
+  if (dat->sleeping && curtime + audev_get_framesperbuf() <= dat->wakeup
+    && noteq_count_finished() == 0) {
+    /* Python only notices a signal (such as a KeyboardInterrupt) when
+       it runs bytecode, so check for one here. */
+    if (PyErr_CheckSignals() < 0) {
+      return TRUE;
+    }
+    return FALSE;
+  }
+
+  /* The notes which ended since the last call are passed along, as a
+     list of (sample, channel) tuples. */
+  finished = noteq_collect_finished(0);
+  if (!finished) {
+    return TRUE;
+  }
+
+  arglist = Py_BuildValue("(LON)", (PY_LONG_LONG)curtime, dat->generator,
+    finished);
   if (!arglist) {
     return TRUE;
   }
@@ -166,6 +206,24 @@ static int run_python_agents(long curtime, void *rock)
     return TRUE;
   }
 
+  /* runagents returns the frame time at which it next has work to do,
+     or None to be called for every buffer. Anything else is an error. */
+  dat->sleeping = FALSE;
+  if (PyInt_Check(result) || PyLong_Check(result)) {
+    dat->wakeup = PyLong_AsLongLong(result);
+    if (dat->wakeup == -1 && PyErr_Occurred()) {
+      Py_DECREF(result);
+      return TRUE;
+    }
+    dat->sleeping = TRUE;
+  }
+  else if (result != Py_None) {
+    PyErr_SetString(PyExc_TypeError,
+      "runagents must return an int or None");
+    Py_DECREF(result);
+    return TRUE;
+  }
+
   Py_DECREF(result);
 
   return FALSE;
@@ -295,6 +353,58 @@ static PyObject *cboodle_is_sample_loaded(PyObject *self, PyObject *args)
   return Py_BuildValue("i", retval);
 }
 
+static PyObject *cboodle_sample_size(PyObject *self, PyObject *args)
+{
+  sample_t *samp;
+  char *sampstr;
+  int samplen;
+  size_t size;
+
+  if (!PyArg_ParseTuple(args, "s#:sample_size", &sampstr, &samplen))
+    return NULL;
+
+  if (!sampstr || samplen != sizeof(sample_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "sample_size: argument must be a string returned by new_sample");
+    return NULL;
+  }
+
+  samp = *((sample_t **)sampstr);
+  size = sample_data_size(samp);
+  
+  return Py_BuildValue("L", (PY_LONG_LONG)size);
+}
+
+static PyObject *cboodle_sample_compression(PyObject *self, PyObject *args)
+{
+  sample_t *samp;
+  char *sampstr;
+  int samplen;
+  compressstats_t stats;
+
+  if (!PyArg_ParseTuple(args, "s#:sample_compression", &sampstr, &samplen))
+    return NULL;
+
+  if (!sampstr || samplen != sizeof(sample_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "sample_compression: argument must be a string returned by new_sample");
+    return NULL;
+  }
+
+  samp = *((sample_t **)sampstr);
+
+  if (!samp->loaded || !samp->compressed) {
+    Py_INCREF(Py_None);
+    return Py_None;
+  }
+
+  compress_get_stats(samp->compressed, &stats);
+
+  return Py_BuildValue("(illlld)", stats.mode, stats.datasize, 
+    stats.fullsize, stream_resident_bytes(samp), 
+    stats.decodes, stats.decodetime);
+}
+
 static PyObject *cboodle_sample_info(PyObject *self, PyObject *args)
 {
   sample_t *samp;
@@ -337,11 +447,18 @@ static PyObject *cboodle_load_sample(PyObject *self, PyObject *args)
   int numchannels;
   int samplebits;
   int issigned, isbigend;
+  int compress = COMPRESS_NONE;
 
-  if (!PyArg_ParseTuple(args, "s#(ils#lliiii):load_sample", 
+  if (!PyArg_ParseTuple(args, "s#(ils#lliiii)|i:load_sample", 
     &sampstr, &samplen, &framerate, &numframes,
     &data, &datalen, &loopstart, &loopend,
-    &numchannels, &samplebits, &issigned, &isbigend)) {
+    &numchannels, &samplebits, &issigned, &isbigend, &compress)) {
+    return NULL;
+  }
+
+  if (compress < COMPRESS_NONE || compress > COMPRESS_ADPCM) {
+    PyErr_SetString(PyExc_ValueError, 
+      "load_sample: unknown compression mode");
     return NULL;
   }
 
@@ -367,13 +484,311 @@ static PyObject *cboodle_load_sample(PyObject *self, PyObject *args)
     numchannels, samplebits, issigned, isbigend);
   */
 
-  retval = sample_load(samp, framerate, numframes, data,
-    loopstart, loopend, numchannels, samplebits,
-    issigned, isbigend);
+  /* Decoding touches nothing but the sample, so other Python threads
+     may run meanwhile. (Samples are loaded in the background this way;
+     see sample.prefetch().) */
+  Py_BEGIN_ALLOW_THREADS
+  if (compress == COMPRESS_NONE)
+    retval = sample_load(samp, framerate, numframes, data,
+      loopstart, loopend, numchannels, samplebits,
+      issigned, isbigend);
+  else
+    retval = sample_load_compressed(samp, framerate, numframes, data,
+      loopstart, loopend, numchannels, samplebits,
+      issigned, isbigend, compress);
+  Py_END_ALLOW_THREADS
 
   return Py_BuildValue("i", retval);
 }
 
+static PyObject *cboodle_load_sample_mapped(PyObject *self, PyObject *args)
+{
+  int retval;
+  sample_t *samp;
+  char *sampstr;
+  int samplen;
+
+  char *pathname;
+  long offset;
+  int framerate;
+  long numframes;
+  long loopstart, loopend;
+  int numchannels;
+  int streamed = FALSE;
+
+  if (!PyArg_ParseTuple(args, "s#(slillli)|i:load_sample_mapped", 
+    &sampstr, &samplen, &pathname, &offset, &framerate, &numframes,
+    &loopstart, &loopend, &numchannels, &streamed)) {
+    return NULL;
+  }
+
+  if (!sampstr || samplen != sizeof(sample_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "load_sample_mapped: argument must be a string returned by new_sample");
+    return NULL;
+  }
+
+  samp = *((sample_t **)sampstr);
+
+  Py_BEGIN_ALLOW_THREADS
+  retval = sample_load_mapped(samp, pathname, offset, framerate,
+    numframes, loopstart, loopend, numchannels, streamed);
+  Py_END_ALLOW_THREADS
+
+  return Py_BuildValue("i", retval);
+}
+
+static PyObject *cboodle_save_sample(PyObject *self, PyObject *args)
+{
+  int retval;
+  sample_t *samp;
+  char *sampstr;
+  int samplen;
+  char *pathname;
+  char *header;
+  int headerlen;
+
+  if (!PyArg_ParseTuple(args, "s#ss#:save_sample", 
+    &sampstr, &samplen, &pathname, &header, &headerlen)) {
+    return NULL;
+  }
+
+  if (!sampstr || samplen != sizeof(sample_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "save_sample: argument must be a string returned by new_sample");
+    return NULL;
+  }
+
+  samp = *((sample_t **)sampstr);
+
+  Py_BEGIN_ALLOW_THREADS
+  retval = sample_save(samp, pathname, header, headerlen);
+  Py_END_ALLOW_THREADS
+
+  return Py_BuildValue("i", retval);
+}
+
+static PyObject *cboodle_convert_sample_data(PyObject *self, 
+  PyObject *args)
+{
+  PyObject *result;
+  void *data;
+  int datalen;
+  int numchannels;
+  int samplebits;
+  int issigned, isbigend;
+  long framesize, numframes;
+  int numchanout;
+  int retval;
+
+  if (!PyArg_ParseTuple(args, "s#iiii:convert_sample_data", 
+    &data, &datalen, &numchannels, &samplebits, &issigned, &isbigend)) {
+    return NULL;
+  }
+
+  if (numchannels < 1 || (samplebits != 8 && samplebits != 16)) {
+    PyErr_SetString(PyExc_ValueError, 
+      "convert_sample_data: only 8 and 16 bits per sample supported");
+    return NULL;
+  }
+
+  framesize = numchannels * (samplebits/8);
+  if (datalen % framesize) {
+    PyErr_SetString(PyExc_ValueError, 
+      "convert_sample_data: data length is not a whole number of frames");
+    return NULL;
+  }
+  numframes = datalen / framesize;
+  numchanout = ((numchannels == 1) ? 1 : 2);
+
+  result = PyString_FromStringAndSize(NULL, 
+    sizeof(value_t) * numchanout * numframes);
+  if (!result)
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  retval = sample_convert((value_t *)PyString_AS_STRING(result), data,
+    numframes, numchannels, samplebits, issigned, isbigend);
+  Py_END_ALLOW_THREADS
+
+  if (!retval) {
+    Py_DECREF(result);
+    PyErr_SetString(PyExc_ValueError, 
+      "convert_sample_data: wrong number of samples in data");
+    return NULL;
+  }
+
+  return result;
+}
+
+static PyObject *cboodle_new_channel(PyObject *self, PyObject *args)
+{
+  channel_t *chan;
+  channel_t *parent;
+  char *parentstr;
+  int parentlen;
+
+  if (!PyArg_ParseTuple(args, "z#:new_channel", &parentstr, &parentlen))
+    return NULL;
+
+  if (parentstr && parentlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "new_channel: argument must be None or a string returned by new_channel");
+    return NULL;
+  }
+
+  parent = (parentstr ? *((channel_t **)parentstr) : NULL);
+  chan = channel_create(parent);
+  if (!chan) {
+    PyErr_SetString(PyExc_MemoryError, "unable to allocate channel");
+    return NULL;
+  }
+
+  return Py_BuildValue("s#", (void *)&chan, sizeof(channel_t *));
+}
+
+static PyObject *cboodle_delete_channel(PyObject *self, PyObject *args)
+{
+  channel_t *chan;
+  char *chanstr;
+  int chanlen;
+
+  if (!PyArg_ParseTuple(args, "s#:delete_channel", &chanstr, &chanlen))
+    return NULL;
+
+  if (!chanstr || chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "delete_channel: argument must be a string returned by new_channel");
+    return NULL;
+  }
+
+  /* Notes may still hold references to the channel; it will be freed
+     when they are gone. */
+  chan = *((channel_t **)chanstr);
+  channel_release(chan);
+
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+static PyObject *cboodle_set_channel_volume(PyObject *self, PyObject *args)
+{
+  channel_t *chan;
+  char *chanstr;
+  int chanlen;
+  PyObject *points;
+  volpoint_t *specs;
+  int ix, count, res;
+
+  if (!PyArg_ParseTuple(args, "s#O!:set_channel_volume",
+    &chanstr, &chanlen, &PyList_Type, &points))
+    return NULL;
+
+  if (!chanstr || chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "set_channel_volume: argument must be a string returned by new_channel");
+    return NULL;
+  }
+
+  count = PyList_GET_SIZE(points);
+  if (count < 1) {
+    PyErr_SetString(PyExc_ValueError, 
+      "set_channel_volume: envelope must have at least one point");
+    return NULL;
+  }
+
+  specs = (volpoint_t *)malloc(sizeof(volpoint_t) * count);
+  if (!specs) {
+    PyErr_SetString(PyExc_MemoryError, "unable to allocate envelope");
+    return NULL;
+  }
+
+  /* Each point is a tuple (time, volume). */
+  for (ix=0; ix<count; ix++) {
+    PyObject *item = PyList_GET_ITEM(points, ix);
+    if (!PyTuple_Check(item)
+      || !PyArg_ParseTuple(item, "Ld:set_channel_volume",
+	&specs[ix].time, &specs[ix].vol)) {
+      if (!PyErr_Occurred())
+	PyErr_SetString(PyExc_TypeError,
+	  "set_channel_volume: each point must be a tuple");
+      free(specs);
+      return NULL;
+    }
+  }
+
+  chan = *((channel_t **)chanstr);
+  res = channel_set_volume(chan, specs, count);
+  free(specs);
+  if (!res) {
+    PyErr_SetString(PyExc_MemoryError, "unable to allocate envelope");
+    return NULL;
+  }
+
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+static PyObject *cboodle_set_channel_pan(PyObject *self, PyObject *args)
+{
+  channel_t *chan;
+  char *chanstr;
+  int chanlen;
+  PyObject *points;
+  panpoint_t *specs;
+  int ix, count, res;
+
+  if (!PyArg_ParseTuple(args, "s#O!:set_channel_pan",
+    &chanstr, &chanlen, &PyList_Type, &points))
+    return NULL;
+
+  if (!chanstr || chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "set_channel_pan: argument must be a string returned by new_channel");
+    return NULL;
+  }
+
+  count = PyList_GET_SIZE(points);
+  if (count < 1) {
+    PyErr_SetString(PyExc_ValueError, 
+      "set_channel_pan: envelope must have at least one point");
+    return NULL;
+  }
+
+  specs = (panpoint_t *)malloc(sizeof(panpoint_t) * count);
+  if (!specs) {
+    PyErr_SetString(PyExc_MemoryError, "unable to allocate envelope");
+    return NULL;
+  }
+
+  /* Each point is a tuple (time, pan), where pan is a 4-tuple. */
+  for (ix=0; ix<count; ix++) {
+    PyObject *item = PyList_GET_ITEM(points, ix);
+    stereo_t *pan = &specs[ix].pan;
+    if (!PyTuple_Check(item)
+      || !PyArg_ParseTuple(item, "L(dddd):set_channel_pan",
+	&specs[ix].time, 
+	&pan->scalex, &pan->shiftx, &pan->scaley, &pan->shifty)) {
+      if (!PyErr_Occurred())
+	PyErr_SetString(PyExc_TypeError,
+	  "set_channel_pan: each point must be a tuple");
+      free(specs);
+      return NULL;
+    }
+  }
+
+  chan = *((channel_t **)chanstr);
+  res = channel_set_pan(chan, specs, count);
+  free(specs);
+  if (!res) {
+    PyErr_SetString(PyExc_MemoryError, "unable to allocate envelope");
+    return NULL;
+  }
+
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
 static PyObject *cboodle_create_note(PyObject *self, PyObject *args)
 {
   sample_t *samp;
@@ -382,15 +797,18 @@ static PyObject *cboodle_create_note(PyObject *self, PyObject *args)
   double pitch;
   double volume;
   stereo_t pan;
-  long starttime;
-  long retval;
-  PyObject *channel, *removefunc;
-
-  if (!PyArg_ParseTuple(args, "s#ddddddlOO:create_note", 
+  frametime_t starttime;
+  frametime_t retval;
+  PyObject *channel, *sampobj;
+  channel_t *cchan;
+  char *chanstr;
+  int chanlen;
+
+  if (!PyArg_ParseTuple(args, "s#ddddddLOz#O:create_note", 
     &sampstr, &samplen,
     &pitch, &volume, 
     &pan.scalex, &pan.shiftx, &pan.scaley, &pan.shifty,
-    &starttime, &channel, &removefunc))
+    &starttime, &channel, &chanstr, &chanlen, &sampobj))
     return NULL;
 
   if (!sampstr || samplen != sizeof(sample_t *)) {
@@ -399,10 +817,18 @@ static PyObject *cboodle_create_note(PyObject *self, PyObject *args)
     return NULL;
   }
 
+  if (chanstr && chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "create_note: channel must be a string returned by new_channel");
+    return NULL;
+  }
+
   samp = *((sample_t **)sampstr);
-  retval = note_create(samp, pitch, volume, &pan, starttime, channel, removefunc);
+  cchan = (chanstr ? *((channel_t **)chanstr) : NULL);
+  retval = note_create(samp, pitch, volume, &pan, starttime,
+    channel, cchan, sampobj);
 
-  return Py_BuildValue("l", retval);
+  return Py_BuildValue("L", (PY_LONG_LONG)retval);
 }
 
 static PyObject *cboodle_create_note_reps(PyObject *self, PyObject *args)
@@ -413,16 +839,19 @@ static PyObject *cboodle_create_note_reps(PyObject *self, PyObject *args)
   double pitch;
   double volume;
   stereo_t pan;
-  long starttime;
+  frametime_t starttime;
   int reps;
-  long retval;
-  PyObject *channel, *removefunc;
+  frametime_t retval;
+  PyObject *channel, *sampobj;
+  channel_t *cchan;
+  char *chanstr;
+  int chanlen;
 
-  if (!PyArg_ParseTuple(args, "s#ddddddliOO:create_note",
+  if (!PyArg_ParseTuple(args, "s#ddddddLiOz#O:create_note",
     &sampstr, &samplen,
     &pitch, &volume,
     &pan.scalex, &pan.shiftx, &pan.scaley, &pan.shifty,
-    &starttime, &reps, &channel, &removefunc))
+    &starttime, &reps, &channel, &chanstr, &chanlen, &sampobj))
     return NULL;
 
   if (!sampstr || samplen != sizeof(sample_t *)) {
@@ -431,10 +860,18 @@ static PyObject *cboodle_create_note_reps(PyObject *self, PyObject *args)
     return NULL;
   }
 
+  if (chanstr && chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "create_note: channel must be a string returned by new_channel");
+    return NULL;
+  }
+
   samp = *((sample_t **)sampstr);
-  retval = note_create_reps(samp, pitch, volume, &pan, starttime, reps, channel, removefunc);
+  cchan = (chanstr ? *((channel_t **)chanstr) : NULL);
+  retval = note_create_reps(samp, pitch, volume, &pan, starttime, reps,
+    channel, cchan, sampobj);
 
-  return Py_BuildValue("l", retval);
+  return Py_BuildValue("L", (PY_LONG_LONG)retval);
 }
 
 static PyObject *cboodle_create_note_duration(PyObject *self, PyObject *args)
@@ -445,16 +882,19 @@ static PyObject *cboodle_create_note_duration(PyObject *self, PyObject *args)
   double pitch;
   double volume;
   stereo_t pan;
-  long starttime;
-  long duration;
-  long retval;
-  PyObject *channel, *removefunc;
-
-  if (!PyArg_ParseTuple(args, "s#ddddddllOO:create_note",
+  frametime_t starttime;
+  frametime_t duration;
+  frametime_t retval;
+  PyObject *channel, *sampobj;
+  channel_t *cchan;
+  char *chanstr;
+  int chanlen;
+
+  if (!PyArg_ParseTuple(args, "s#ddddddLLOz#O:create_note",
     &sampstr, &samplen,
     &pitch, &volume,
     &pan.scalex, &pan.shiftx, &pan.scaley, &pan.shifty,
-    &starttime, &duration, &channel, &removefunc))
+    &starttime, &duration, &channel, &chanstr, &chanlen, &sampobj))
     return NULL;
 
   if (!sampstr || samplen != sizeof(sample_t *)) {
@@ -463,36 +903,218 @@ static PyObject *cboodle_create_note_duration(PyObject *self, PyObject *args)
     return NULL;
   }
 
+  if (chanstr && chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "create_note: channel must be a string returned by new_channel");
+    return NULL;
+  }
+
+  samp = *((sample_t **)sampstr);
+  cchan = (chanstr ? *((channel_t **)chanstr) : NULL);
+  retval = note_create_duration(samp, pitch, volume, &pan, starttime, duration,
+    channel, cchan, sampobj);
+
+  return Py_BuildValue("L", (PY_LONG_LONG)retval);
+}
+
+static PyObject *cboodle_create_notes(PyObject *self, PyObject *args)
+{
+  PyObject *channel, *notes, *item, *result;
+  PyObject *lastobj, *csamp;
+  channel_t *cchan;
+  sample_t *lastsamp;
+  char *chanstr;
+  int chanlen;
+  char *sampstr;
+  Py_ssize_t samplen;
+  notespec_t *specs;
+  notespec_t *spec;
+  frametime_t *durations;
+  long ix, count, created;
+
+  if (!PyArg_ParseTuple(args, "Oz#O!:create_notes",
+    &channel, &chanstr, &chanlen, &PyList_Type, &notes))
+    return NULL;
+
+  if (chanstr && chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "create_notes: channel must be a string returned by new_channel");
+    return NULL;
+  }
+
+  cchan = (chanstr ? *((channel_t **)chanstr) : NULL);
+  count = PyList_GET_SIZE(notes);
+
+  specs = (notespec_t *)malloc(sizeof(notespec_t) * (count+1));
+  durations = (frametime_t *)malloc(sizeof(frametime_t) * (count+1));
+  if (!specs || !durations) {
+    if (specs)
+      free(specs);
+    if (durations)
+      free(durations);
+    PyErr_SetString(PyExc_MemoryError, "unable to allocate notes");
+    return NULL;
+  }
+
+  /* Check every note before creating any of them, so that a bad entry
+     leaves the queue untouched. Each note is a tuple (sampobj, pitch,
+     volume, pan, starttime, duration), where pan is a 4-tuple and
+     sampobj.csamp is the string returned by new_sample. The tuple may
+     go on with (attack, release, curve), for a note which fades in or
+     out. Runs of notes with the same sample are common, so the last
+     sample is cached. */
+  lastobj = NULL;
+  lastsamp = NULL;
+  for (ix=0; ix<count; ix++) {
+    spec = &(specs[ix]);
+    spec->attack = 0;
+    spec->release = 0;
+    spec->curve = NOTE_CURVE_LINEAR;
+    item = PyList_GET_ITEM(notes, ix);
+    if (!PyTuple_Check(item)
+      || !PyArg_ParseTuple(item, "Odd(dddd)LL|LLi:create_notes",
+	&spec->sampobj, &spec->pitch, &spec->volume,
+	&spec->pan.scalex, &spec->pan.shiftx,
+	&spec->pan.scaley, &spec->pan.shifty,
+	&spec->starttime, &spec->duration,
+	&spec->attack, &spec->release, &spec->curve)) {
+      if (!PyErr_Occurred())
+	PyErr_SetString(PyExc_TypeError,
+	  "create_notes: each note must be a tuple");
+      free(specs);
+      free(durations);
+      return NULL;
+    }
+    if (spec->sampobj != lastobj) {
+      csamp = PyObject_GetAttrString(spec->sampobj, "csamp");
+      if (!csamp || PyString_AsStringAndSize(csamp, &sampstr, &samplen) < 0
+	|| samplen != sizeof(sample_t *)) {
+	Py_XDECREF(csamp);
+	PyErr_Clear();
+	PyErr_SetString(PyExc_TypeError, 
+	  "create_notes: sample must have a csamp returned by new_sample");
+	free(specs);
+	free(durations);
+	return NULL;
+      }
+      lastobj = spec->sampobj;
+      lastsamp = *((sample_t **)sampstr);
+      /* The sample object holds its csamp, so the pointer stays good. */
+      Py_DECREF(csamp);
+    }
+    spec->sample = lastsamp;
+    if (!spec->sample->loaded || spec->sample->error) {
+      PyErr_SetString(PyExc_ValueError, 
+	"create_notes: sample is not loaded");
+      free(specs);
+      free(durations);
+      return NULL;
+    }
+  }
+
+  created = note_create_batch(specs, count, channel, cchan, durations);
+
+  /* The result lists the durations of the notes that were created.
+     (It's short only if memory ran out.) */
+  result = PyList_New(created);
+  if (result) {
+    for (ix=0; ix<created; ix++) {
+      PyList_SET_ITEM(result, ix, PyLong_FromLongLong(durations[ix]));
+    }
+  }
+
+  free(specs);
+  free(durations);
+  return result;
+}
+
+static PyObject *cboodle_note_duration(PyObject *self, PyObject *args)
+{
+  sample_t *samp;
+  char *sampstr;
+  int samplen;
+  double pitch;
+  frametime_t duration;
+  frametime_t retval;
+
+  if (!PyArg_ParseTuple(args, "s#dL:note_duration",
+    &sampstr, &samplen, &pitch, &duration))
+    return NULL;
+
+  if (!sampstr || samplen != sizeof(sample_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "note_duration: argument must be a string returned by new_sample");
+    return NULL;
+  }
+
   samp = *((sample_t **)sampstr);
-  retval = note_create_duration(samp, pitch, volume, &pan, starttime, duration, channel, removefunc);
+  retval = note_duration(samp, pitch, duration);
 
-  return Py_BuildValue("l", retval);
+  return Py_BuildValue("L", (PY_LONG_LONG)retval);
 }
 
 static PyObject *cboodle_stop_notes(PyObject *self, PyObject *args)
 {
-  PyObject *channel;
+  channel_t *chan;
+  char *chanstr;
+  int chanlen;
+  long start;
 
-  if (!PyArg_ParseTuple(args, "O:stop_notes", &channel))
+  if (!PyArg_ParseTuple(args, "s#:stop_notes", &chanstr, &chanlen))
     return NULL;
 
-  note_destroy_by_channel(channel);
+  if (!chanstr || chanlen != sizeof(channel_t *)) {
+    PyErr_SetString(PyExc_TypeError, 
+      "stop_notes: argument must be a string returned by new_channel");
+    return NULL;
+  }
 
-  Py_INCREF(Py_None);
-  return Py_None;
+  chan = *((channel_t **)chanstr);
+  start = noteq_count_finished();
+  note_destroy_by_channel(chan);
+
+  /* Return the (sample, channel) tuples of the notes just destroyed. */
+  return noteq_collect_finished(start);
 }
 
-static PyObject *cboodle_adjust_timebase(PyObject *self, PyObject *args)
+static PyObject *cboodle_note_stats(PyObject *self, PyObject *args)
 {
-  long offset;
+  noteq_stats_t stats;
 
-  if (!PyArg_ParseTuple(args, "l:adjust_timebase", &offset))
+  if (!PyArg_ParseTuple(args, ":note_stats"))
     return NULL;
 
-  noteq_adjust_timebase(offset);
+  noteq_get_stats(&stats);
 
-  Py_INCREF(Py_None);
-  return Py_None;
+  return Py_BuildValue("(lllllll)", stats.numpending, stats.numactive,
+    stats.poolsize, stats.poolfree, stats.poollimit, 
+    stats.peak, stats.overflow);
+}
+
+static PyObject *cboodle_loop_stats(PyObject *self, PyObject *args)
+{
+  mixstats_t stats;
+
+  if (!PyArg_ParseTuple(args, ":loop_stats"))
+    return NULL;
+
+  mixthread_get_stats(&stats);
+
+  return Py_BuildValue("(ldddd)", stats.numbuffers, stats.walltime,
+    stats.agenttime, stats.mixtime, stats.writetime);
+}
+
+static PyObject *cboodle_stream_stats(PyObject *self, PyObject *args)
+{
+  streamstats_t stats;
+
+  if (!PyArg_ParseTuple(args, ":stream_stats"))
+    return NULL;
+
+  stream_get_stats(&stats);
+
+  return Py_BuildValue("(lllll)", stats.numstreams, stats.numresident,
+    stats.residentbytes, stats.starved, stats.decodedbytes);
 }
 
 static PyMethodDef methods[] = {
@@ -504,15 +1126,28 @@ static PyMethodDef methods[] = {
   {"new_sample", cboodle_new_sample, METH_VARARGS},
   {"delete_sample", cboodle_delete_sample, METH_VARARGS},
   {"load_sample", cboodle_load_sample, METH_VARARGS},
+  {"load_sample_mapped", cboodle_load_sample_mapped, METH_VARARGS},
+  {"save_sample", cboodle_save_sample, METH_VARARGS},
+  {"convert_sample_data", cboodle_convert_sample_data, METH_VARARGS},
   {"unload_sample", cboodle_unload_sample, METH_VARARGS},
   {"is_sample_error", cboodle_is_sample_error, METH_VARARGS},
   {"is_sample_loaded", cboodle_is_sample_loaded, METH_VARARGS},
   {"sample_info", cboodle_sample_info, METH_VARARGS},
+  {"sample_size", cboodle_sample_size, METH_VARARGS},
+  {"sample_compression", cboodle_sample_compression, METH_VARARGS},
+  {"new_channel", cboodle_new_channel, METH_VARARGS},
+  {"delete_channel", cboodle_delete_channel, METH_VARARGS},
+  {"set_channel_volume", cboodle_set_channel_volume, METH_VARARGS},
+  {"set_channel_pan", cboodle_set_channel_pan, METH_VARARGS},
   {"create_note", cboodle_create_note, METH_VARARGS},
   {"create_note_reps", cboodle_create_note_reps, METH_VARARGS},
   {"create_note_duration", cboodle_create_note_duration, METH_VARARGS},
+  {"create_notes", cboodle_create_notes, METH_VARARGS},
+  {"note_duration", cboodle_note_duration, METH_VARARGS},
   {"stop_notes", cboodle_stop_notes, METH_VARARGS},
-  {"adjust_timebase", cboodle_adjust_timebase, METH_VARARGS},
+  {"note_stats", cboodle_note_stats, METH_VARARGS},
+  {"loop_stats", cboodle_loop_stats, METH_VARARGS},
+  {"stream_stats", cboodle_stream_stats, METH_VARARGS},
   {NULL, NULL}
 };
 
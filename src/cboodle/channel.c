@@ -0,0 +1,377 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "common.h"
+#include "channel.h"
+
+static stereo_t identity_pan = { 1.0, 0.0, 1.0, 0.0 };
+
+static void interpolate_pan(channel_t *chan, frametime_t attime,
+  stereo_t *result);
+static int stereo_equal(stereo_t *pan1, stereo_t *pan2);
+
+/* A channel_t is reference-counted. The Python Channel object holds
+   one reference (from channel_create() until the channel is closed);
+   each subchannel holds one on its parent; and each note holds one on
+   the channel it plays in. So a channel_t never vanishes while the
+   mixer can still reach it.
+
+   Each channel is also on its parent's list of children, from
+   creation until it is freed. */
+
+channel_t *channel_create(channel_t *parent)
+{
+  channel_t *chan;
+
+  chan = (channel_t *)malloc(sizeof(channel_t));
+  if (!chan)
+    return NULL;
+
+  chan->volpoints = (volpoint_t *)malloc(sizeof(volpoint_t) * 2);
+  chan->panpoints = (panpoint_t *)malloc(sizeof(panpoint_t) * 2);
+  if (!chan->volpoints || !chan->panpoints) {
+    if (chan->volpoints)
+      free(chan->volpoints);
+    if (chan->panpoints)
+      free(chan->panpoints);
+    free(chan);
+    return NULL;
+  }
+
+  chan->refcount = 1;
+  chan->parent = parent;
+  chan->firstchild = NULL;
+  chan->prevsibling = NULL;
+  chan->nextsibling = NULL;
+  chan->firstnote = NULL;
+  if (parent) {
+    channel_retain(parent);
+    chan->nextsibling = parent->firstchild;
+    if (parent->firstchild)
+      parent->firstchild->prevsibling = chan;
+    parent->firstchild = chan;
+  }
+
+  chan->numvolpoints = 1;
+  chan->maxvolpoints = 2;
+  chan->volpos = 0;
+  chan->volpoints[0].time = 0;
+  chan->volpoints[0].vol = 1.0;
+  chan->numpanpoints = 1;
+  chan->maxpanpoints = 2;
+  chan->panpos = 0;
+  chan->panpoints[0].time = 0;
+  chan->panpoints[0].pan = identity_pan;
+
+  chan->stamp = -1;
+  chan->curvol = 1.0;
+  chan->numranges = 0;
+  chan->maxranges = 0;
+  chan->ranges = NULL;
+  chan->bothpans = FALSE;
+  chan->pan0 = identity_pan;
+  chan->pan1 = identity_pan;
+
+  return chan;
+}
+
+void channel_retain(channel_t *chan)
+{
+  chan->refcount++;
+}
+
+void channel_release(channel_t *chan)
+{
+  channel_t *parent;
+
+  chan->refcount--;
+  if (chan->refcount > 0)
+    return;
+
+  parent = chan->parent;
+  chan->parent = NULL;
+
+  /* A channel with children, or with notes, still has references; so
+     by now it has neither. It only has to leave its parent's list. */
+  if (parent) {
+    if (chan->prevsibling)
+      chan->prevsibling->nextsibling = chan->nextsibling;
+    else
+      parent->firstchild = chan->nextsibling;
+    if (chan->nextsibling)
+      chan->nextsibling->prevsibling = chan->prevsibling;
+    chan->prevsibling = NULL;
+    chan->nextsibling = NULL;
+  }
+
+  if (chan->ranges) {
+    free(chan->ranges);
+    chan->ranges = NULL;
+  }
+  chan->maxranges = 0;
+  free(chan->volpoints);
+  chan->volpoints = NULL;
+  free(chan->panpoints);
+  chan->panpoints = NULL;
+  free(chan);
+
+  if (parent)
+    channel_release(parent);
+}
+
+/* Replace the channel's volume envelope with a new list of
+   breakpoints (at least one, in time order). Returns FALSE if memory
+   could not be allocated, in which case the envelope is unchanged. */
+int channel_set_volume(channel_t *chan, volpoint_t *points, int count)
+{
+  if (count > chan->maxvolpoints) {
+    volpoint_t *newpoints;
+    int newmax = chan->maxvolpoints;
+    while (newmax < count)
+      newmax *= 2;
+    newpoints = (volpoint_t *)realloc(chan->volpoints,
+      sizeof(volpoint_t) * newmax);
+    if (!newpoints)
+      return FALSE;
+    chan->volpoints = newpoints;
+    chan->maxvolpoints = newmax;
+  }
+
+  memcpy(chan->volpoints, points, sizeof(volpoint_t) * count);
+  chan->numvolpoints = count;
+  chan->volpos = 0;
+  return TRUE;
+}
+
+/* Replace the channel's stereo envelope, in the same way. */
+int channel_set_pan(channel_t *chan, panpoint_t *points, int count)
+{
+  if (count > chan->maxpanpoints) {
+    panpoint_t *newpoints;
+    int newmax = chan->maxpanpoints;
+    while (newmax < count)
+      newmax *= 2;
+    newpoints = (panpoint_t *)realloc(chan->panpoints,
+      sizeof(panpoint_t) * newmax);
+    if (!newpoints)
+      return FALSE;
+    chan->panpoints = newpoints;
+    chan->maxpanpoints = newmax;
+  }
+
+  memcpy(chan->panpoints, points, sizeof(panpoint_t) * count);
+  chan->numpanpoints = count;
+  chan->panpos = 0;
+  return TRUE;
+}
+
+/* Compute the combined volume and stereo state of a channel (and all
+   its ancestors) for the buffer running from curtime to endtime. The
+   results are cached in the channel, tagged with stamp; a second call
+   with the same stamp does nothing. So every note in the channel --
+   and every note in every subchannel -- shares a single computation.
+
+   Returns FALSE if memory could not be allocated.
+
+   A channel's volume is an envelope of linear segments. If the volume
+   is constant across the buffer, it is folded into curvol. If the
+   channel is in the middle of a fade, the envelope segments which
+   overlap the buffer go onto the ranges list instead, as a single
+   chained run. (The ranges list is consulted once per fade block, as
+   notes are generated.)
+
+   A stereo transform is (xscale, xshift, yscale, yshift). Transforms
+   are composed with the parent's, so pan0 is the transform from the
+   channel's coordinates to the root's. As with the volumes, some
+   channel might be in the middle of a pan change. Once that happens,
+   we keep track of two transforms: that at the beginning of the
+   buffer, and that at the end. (The bothpans flag indicates whether
+   we've hit such a change. If not, pan1 is a copy of pan0.) If a
+   stereo envelope has several segments within one buffer, only its
+   ends are seen; the pan moves straight from one to the other.
+*/
+int channel_prepare(channel_t *chan, long stamp,
+  frametime_t curtime, frametime_t endtime)
+{
+  channel_t *parent = chan->parent;
+  int numranges, pos, count, segs, ix;
+  volpoint_t *volpoints;
+  panpoint_t *panpoints;
+
+  if (chan->stamp == stamp)
+    return TRUE;
+
+  if (parent) {
+    if (!channel_prepare(parent, stamp, curtime, endtime))
+      return FALSE;
+    chan->curvol = parent->curvol;
+    numranges = parent->numranges;
+  }
+  else {
+    chan->curvol = 1.0;
+    numranges = 0;
+  }
+
+  /* Skip past the volume breakpoints which have gone by, and count the
+     envelope segments which overlap the buffer. (Before the first
+     breakpoint, the first segment is used; it starts out flat.) */
+  volpoints = chan->volpoints;
+  count = chan->numvolpoints;
+  pos = chan->volpos;
+  while (pos+1 < count && volpoints[pos+1].time <= curtime)
+    pos++;
+  chan->volpos = pos;
+  segs = 0;
+  while (pos+segs+1 < count && volpoints[pos+segs].time < endtime)
+    segs++;
+  if (segs == 1 && volpoints[pos].vol == volpoints[pos+1].vol)
+    segs = 0;
+
+  /* Make sure there is room for the parent's ranges plus ours. */
+  if (numranges+segs > chan->maxranges) {
+    volrange_t *newranges;
+    int newmax = chan->maxranges;
+    if (newmax < 2)
+      newmax = 2;
+    while (newmax < numranges+segs)
+      newmax *= 2;
+    newranges = (volrange_t *)realloc(chan->ranges,
+      sizeof(volrange_t) * newmax);
+    if (!newranges)
+      return FALSE;
+    chan->ranges = newranges;
+    chan->maxranges = newmax;
+  }
+  if (numranges) {
+    memcpy(chan->ranges, parent->ranges, sizeof(volrange_t) * numranges);
+  }
+
+  if (segs == 0) {
+    /* Channel volume is constant across the buffer. */
+    chan->curvol *= volpoints[pos].vol;
+  }
+  else {
+    /* This is the nasty case; we're in the middle of a fade. Rather
+       than multiplying curvol, we add a new range for each segment. */
+    for (ix=0; ix<segs; ix++) {
+      volrange_t *range = &(chan->ranges[numranges]);
+      volpoint_t *point = &(volpoints[pos+ix]);
+      range->start = point[0].time;
+      range->end = point[1].time;
+#ifdef BOODLER_INTMATH
+      range->istartvol = (long)(point[0].vol * 65536.0);
+      range->iendvol = (long)(point[1].vol * 65536.0);
+#else
+      range->startvol = point[0].vol;
+      range->endvol = point[1].vol;
+#endif
+      range->chain = segs-1-ix;
+      numranges++;
+    }
+  }
+  chan->numranges = numranges;
+
+  /* The same for the stereo breakpoints. */
+  panpoints = chan->panpoints;
+  count = chan->numpanpoints;
+  pos = chan->panpos;
+  while (pos+1 < count && panpoints[pos+1].time <= curtime)
+    pos++;
+  chan->panpos = pos;
+  segs = 0;
+  while (pos+segs+1 < count && panpoints[pos+segs].time < endtime)
+    segs++;
+  if (segs == 1 && stereo_equal(&panpoints[pos].pan, &panpoints[pos+1].pan))
+    segs = 0;
+
+  if (segs == 0) {
+    /* Stereo is constant across the buffer. */
+    stereo_t *usepan = &panpoints[pos].pan;
+    if (parent) {
+      stereo_compose(&parent->pan0, usepan, &chan->pan0);
+      if (parent->bothpans)
+        stereo_compose(&parent->pan1, usepan, &chan->pan1);
+      else
+        chan->pan1 = chan->pan0;
+      chan->bothpans = parent->bothpans;
+    }
+    else {
+      chan->pan0 = *usepan;
+      chan->pan1 = *usepan;
+      chan->bothpans = FALSE;
+    }
+  }
+  else {
+    /* Nasty case: we're in the middle of a stereo swoop. Record the
+       pan positions at the start and end of the buffer. */
+    stereo_t pan0, pan1;
+    interpolate_pan(chan, curtime, &pan0);
+    interpolate_pan(chan, endtime, &pan1);
+    if (parent) {
+      stereo_compose(&parent->pan0, &pan0, &chan->pan0);
+      stereo_compose(&parent->pan1, &pan1, &chan->pan1);
+    }
+    else {
+      chan->pan0 = pan0;
+      chan->pan1 = pan1;
+    }
+    chan->bothpans = TRUE;
+  }
+
+  chan->stamp = stamp;
+  return TRUE;
+}
+
+/* Work out the channel's own stereo transform at a given time. (The
+   time must not be before the current buffer.) */
+static void interpolate_pan(channel_t *chan, frametime_t attime,
+  stereo_t *result)
+{
+  panpoint_t *points = chan->panpoints;
+  int count = chan->numpanpoints;
+  int pos = chan->panpos;
+  stereo_t *tuplestart, *tupleend;
+
+  while (pos+1 < count && points[pos+1].time <= attime)
+    pos++;
+
+  if (pos+1 >= count || attime <= points[pos].time) {
+    *result = points[pos].pan;
+  }
+  else {
+    double ratio = ((double)(attime - points[pos].time))
+      / ((double)(points[pos+1].time - points[pos].time));
+    tuplestart = &points[pos].pan;
+    tupleend = &points[pos+1].pan;
+    result->scalex = ratio * (tupleend->scalex - tuplestart->scalex) + tuplestart->scalex;
+    result->shiftx = ratio * (tupleend->shiftx - tuplestart->shiftx) + tuplestart->shiftx;
+    result->scaley = ratio * (tupleend->scaley - tuplestart->scaley) + tuplestart->scaley;
+    result->shifty = ratio * (tupleend->shifty - tuplestart->shifty) + tuplestart->shifty;
+  }
+}
+
+static int stereo_equal(stereo_t *pan1, stereo_t *pan2)
+{
+  return (pan1->scalex == pan2->scalex && pan1->shiftx == pan2->shiftx
+    && pan1->scaley == pan2->scaley && pan1->shifty == pan2->shifty);
+}
+
+/* Apply the stereo transform outer on top of inner. (This is the
+   equivalent of the Python stereo.compose().) It is safe for result to
+   be the same as inner. */
+void stereo_compose(stereo_t *outer, stereo_t *inner, stereo_t *result)
+{
+  result->scalex = inner->scalex * outer->scalex;
+  result->shiftx = (inner->shiftx * outer->scalex) + outer->shiftx;
+  result->scaley = inner->scaley * outer->scaley;
+  result->shifty = (inner->shifty * outer->scaley) + outer->shifty;
+}
@@ -0,0 +1,102 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+/* A stereo transform. (See the description of stereo objects in
+   channel_prepare().) */
+struct stereo_struct {
+  double scalex;
+  double shiftx;
+  double scaley;
+  double shifty;
+};
+
+/* This represents a linear volume fade, starting and ending at
+   particular times. A channel whose envelope has several segments in
+   one buffer contributes a run of these, one per segment; chain is
+   the number of ranges after this one which belong to the same run.
+   (Only the ranges list of a channel uses chain.) */
+typedef struct volrange_struct {
+  frametime_t start, end;
+#ifdef BOODLER_INTMATH
+  long istartvol, iendvol;
+#else
+  double startvol, endvol;
+#endif
+  int chain;
+} volrange_t;
+
+/* A breakpoint in a channel's volume envelope. */
+typedef struct volpoint_struct {
+  frametime_t time;
+  double vol;
+} volpoint_t;
+
+/* A breakpoint in a channel's stereo envelope. */
+typedef struct panpoint_struct {
+  frametime_t time;
+  stereo_t pan;
+} panpoint_t;
+
+/* The native mirror of a generator.Channel object. The Python object
+   pushes its volume and stereo state in here whenever they change, so
+   that the mixer never has to look at Python attributes. */
+struct channel_struct {
+  int refcount;
+  channel_t *parent;
+
+  /* The volume envelope: a list of breakpoints, in time order. The
+     volume runs linearly from each breakpoint to the next. Before the
+     first it is flat at the first value; after the last, flat at the
+     last value. There is always at least one breakpoint. volpos is
+     the breakpoint at or before the current buffer (or 0), so that
+     breakpoints which have gone by are never looked at again. */
+  int numvolpoints;
+  int maxvolpoints;
+  int volpos;
+  volpoint_t *volpoints;
+
+  /* The stereo envelope works the same way. */
+  int numpanpoints;
+  int maxpanpoints;
+  int panpos;
+  panpoint_t *panpoints;
+
+  /* The following fields are computed by channel_prepare(), once per
+     buffer. They describe the combined effect of this channel and all
+     of its ancestors. */
+  long stamp; /* the buffer for which these fields are valid */
+  double curvol; /* constant volume factor */
+  int numranges; /* volume factors which fade during the buffer */
+  int maxranges;
+  volrange_t *ranges;
+  int bothpans; /* if FALSE, pan1 is the same as pan0 */
+  stereo_t pan0; /* stereo transform at the start of the buffer */
+  stereo_t pan1; /* ...and at the end of the buffer */
+
+  /* The channel tree, seen from the top down, and the notes playing
+     directly in this channel. These let a channel's subtree be
+     stopped without looking at anything outside it. (The note list is
+     maintained by noteq.c.) */
+  channel_t *firstchild;
+  channel_t *prevsibling, *nextsibling;
+  note_t *firstnote;
+};
+
+extern channel_t *channel_create(channel_t *parent);
+extern void channel_retain(channel_t *chan);
+extern void channel_release(channel_t *chan);
+
+extern int channel_set_volume(channel_t *chan,
+  volpoint_t *points, int count);
+extern int channel_set_pan(channel_t *chan,
+  panpoint_t *points, int count);
+
+extern int channel_prepare(channel_t *chan, long stamp,
+  frametime_t curtime, frametime_t endtime);
+extern void stereo_compose(stereo_t *outer, stereo_t *inner,
+  stereo_t *result);
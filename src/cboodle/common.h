@@ -22,11 +22,19 @@
 /* must be able to hold a value between -0x7FFF and 0x7FFF */
 typedef signed short value_t; 
 
+/* A frame time: a count of sound frames since generation began. This
+   is 64 bits wide, so it will not overflow for as long as anybody is
+   likely to listen (millions of years, at 44100 frames per second). */
+typedef long long frametime_t;
+
 typedef struct stereo_struct stereo_t;
 typedef struct sample_struct sample_t;
 typedef struct note_struct note_t;
+typedef struct channel_struct channel_t;
+typedef struct stream_struct stream_t;
+typedef struct compress_struct compress_t;
 
-typedef int (*generate_func_t)(long curtime, void *rock);
+typedef int (*generate_func_t)(frametime_t curtime, void *rock);
 typedef int (*mix_func_t)(long *buffer, generate_func_t genfunc, void *rock);
 
 typedef struct extraopt_struct {
@@ -0,0 +1,337 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/time.h>
+
+#include "common.h"
+#include "sample.h"
+#include "stream.h"
+#include "compress.h"
+
+/* Compressed sample data.
+
+   A compressed sample keeps its data in one of these forms, rather
+   than as 16-bit values:
+
+   COMPRESS_8BIT: one byte per value. This is only used for sources
+   which were 8-bit to begin with, so nothing is lost.
+
+   COMPRESS_ADPCM: IMA ADPCM, four bits per value. This loses a little
+   quality, which is rarely audible in ambient sound.
+
+   Either way, the data is divided into blocks of STREAM_BLOCK frames,
+   each of which can be decoded by itself. The mixer never sees the
+   compressed form. The sample's data is an anonymous mapping, as big
+   as the decoded sample would be, and blocks are decoded into it as
+   notes need them, and dropped when they are no longer needed -- by
+   the same machinery that streams long samples from disk. (See
+   stream.c.) So only the blocks being played take up decoded memory.
+
+   An ADPCM block begins with a four-byte header for each channel: the
+   first value of the block (16 bits, little-endian) and the step index
+   (one byte, plus one of padding). The rest of the block's values
+   follow as four-bit codes, in frame order, two per byte, low half
+   first. */
+
+struct compress_struct {
+  int mode;
+  int numchannels;
+  long numframes;
+  long numblocks;
+  long blockbytes; /* each block (but the last, which may be shorter)
+		      takes up this many bytes of data */
+  long datasize;
+  unsigned char *data;
+
+  int encindex[2]; /* the ADPCM step index, carried from block to block
+		      while encoding (and seeded from the first block) */
+
+  long decodes;
+  double decodetime;
+};
+
+static long block_size(int mode, int numchannels, long count);
+static int adpcm_seed_index(int diff);
+static int adpcm_encode(int val, int *predptr, int *indexptr);
+static void adpcm_step(int code, int *predptr, int *indexptr);
+static double get_time(void);
+
+static const int index_table[16] = {
+  -1, -1, -1, -1, 2, 4, 6, 8,
+  -1, -1, -1, -1, 2, 4, 6, 8
+};
+
+static const int step_table[89] = {
+  7, 8, 9, 10, 11, 12, 13, 14, 16, 17,
+  19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+  50, 55, 60, 66, 73, 80, 88, 97, 107, 118,
+  130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+  337, 371, 408, 449, 494, 544, 598, 658, 724, 796,
+  876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+  2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358,
+  5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899,
+  15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+};
+
+/* Create an empty compressed sample, with room for numframes frames
+   of one or two channels. The data must then be filled in with
+   compress_encode_block(), one block at a time, in order. */
+compress_t *compress_create(int mode, long numframes, int numchannels)
+{
+  compress_t *comp;
+
+  if (mode != COMPRESS_8BIT && mode != COMPRESS_ADPCM)
+    return NULL;
+  if (numchannels < 1 || numchannels > 2 || numframes <= 0)
+    return NULL;
+
+  comp = (compress_t *)malloc(sizeof(compress_t));
+  if (!comp)
+    return NULL;
+
+  comp->mode = mode;
+  comp->numchannels = numchannels;
+  comp->numframes = numframes;
+  comp->numblocks = (numframes + STREAM_BLOCK - 1) / STREAM_BLOCK;
+  comp->blockbytes = block_size(mode, numchannels, STREAM_BLOCK);
+  comp->datasize = (comp->numblocks-1) * comp->blockbytes
+    + block_size(mode, numchannels,
+      numframes - (comp->numblocks-1) * STREAM_BLOCK);
+  comp->encindex[0] = 0;
+  comp->encindex[1] = 0;
+  comp->decodes = 0;
+  comp->decodetime = 0.0;
+
+  comp->data = (unsigned char *)malloc(comp->datasize);
+  if (!comp->data) {
+    free(comp);
+    return NULL;
+  }
+
+  return comp;
+}
+
+void compress_destroy(compress_t *comp)
+{
+  free(comp->data);
+  comp->data = NULL;
+  free(comp);
+}
+
+/* Compress count frames of 16-bit values into block bx. (Every block
+   but the last has STREAM_BLOCK frames.) */
+void compress_encode_block(compress_t *comp, long bx, value_t *src,
+  long count)
+{
+  unsigned char *dat = comp->data + bx * comp->blockbytes;
+  int numchannels = comp->numchannels;
+  long ix, numvals;
+
+  numvals = count * numchannels;
+
+  if (comp->mode == COMPRESS_8BIT) {
+    for (ix=0; ix<numvals; ix++) {
+      dat[ix] = (unsigned char)(src[ix] >> 8);
+    }
+  }
+  else {
+    int pred[2], index[2];
+    int ch, code;
+    long nib;
+
+    /* The first block has no step index to carry over. Starting from
+       the smallest step would smear a sharp attack over many frames,
+       so start from one which fits the first change in value. */
+    if (bx == 0 && count > 1) {
+      for (ch=0; ch<numchannels; ch++)
+	comp->encindex[ch] = adpcm_seed_index(src[numchannels+ch] - src[ch]);
+    }
+
+    for (ch=0; ch<numchannels; ch++) {
+      pred[ch] = src[ch];
+      index[ch] = comp->encindex[ch];
+      dat[0] = pred[ch] & 0xFF;
+      dat[1] = (pred[ch] >> 8) & 0xFF;
+      dat[2] = index[ch];
+      dat[3] = 0;
+      dat += 4;
+    }
+
+    nib = 0;
+    for (ix=numchannels; ix<numvals; ix++) {
+      ch = ix % numchannels;
+      code = adpcm_encode(src[ix], &pred[ch], &index[ch]);
+      if (!(nib & 1))
+	dat[nib >> 1] = code;
+      else
+	dat[nib >> 1] |= (code << 4);
+      nib++;
+    }
+
+    for (ch=0; ch<numchannels; ch++)
+      comp->encindex[ch] = index[ch];
+  }
+}
+
+/* Decode block bx, which has count frames, into 16-bit values. This
+   is called by the read-ahead thread in stream.c. */
+void compress_decode_block(compress_t *comp, long bx, value_t *dest,
+  long count)
+{
+  unsigned char *dat = comp->data + bx * comp->blockbytes;
+  int numchannels = comp->numchannels;
+  long ix, numvals;
+  double starttime = get_time();
+
+  numvals = count * numchannels;
+
+  if (comp->mode == COMPRESS_8BIT) {
+    for (ix=0; ix<numvals; ix++) {
+      dest[ix] = ((signed char)dat[ix]) * 0x100;
+    }
+  }
+  else {
+    int pred[2], index[2];
+    int ch, code;
+    long nib;
+
+    for (ch=0; ch<numchannels; ch++) {
+      pred[ch] = (signed short)(dat[0] | (dat[1] << 8));
+      index[ch] = dat[2];
+      if (index[ch] > 88)
+	index[ch] = 88;
+      dest[ch] = pred[ch];
+      dat += 4;
+    }
+
+    nib = 0;
+    for (ix=numchannels; ix<numvals; ix++) {
+      ch = ix % numchannels;
+      if (!(nib & 1))
+	code = dat[nib >> 1] & 0x0F;
+      else
+	code = (dat[nib >> 1] >> 4) & 0x0F;
+      nib++;
+      adpcm_step(code, &pred[ch], &index[ch]);
+      dest[ix] = pred[ch];
+    }
+  }
+
+  comp->decodes++;
+  comp->decodetime += get_time() - starttime;
+}
+
+/* The number of bytes of memory the compressed data occupies. */
+long compress_data_size(compress_t *comp)
+{
+  return comp->datasize;
+}
+
+void compress_get_stats(compress_t *comp, compressstats_t *stats)
+{
+  stats->mode = comp->mode;
+  stats->datasize = compress_data_size(comp);
+  stats->fullsize = comp->numframes * comp->numchannels * sizeof(value_t);
+  stats->decodes = comp->decodes;
+  stats->decodetime = comp->decodetime;
+}
+
+/* The number of bytes a block of count frames takes up. */
+static long block_size(int mode, int numchannels, long count)
+{
+  if (mode == COMPRESS_8BIT)
+    return count * numchannels;
+  else
+    return 4 * numchannels + ((count-1) * numchannels + 1) / 2;
+}
+
+/* The smallest step index whose step covers a change of diff. */
+static int adpcm_seed_index(int diff)
+{
+  int index;
+
+  if (diff < 0)
+    diff = -diff;
+  for (index=0; index<88; index++) {
+    if (step_table[index] >= diff)
+      break;
+  }
+  return index;
+}
+
+/* Choose the ADPCM code which best moves the predicted value toward
+   val, and update the prediction just as the decoder will. */
+static int adpcm_encode(int val, int *predptr, int *indexptr)
+{
+  int step = step_table[*indexptr];
+  int diff = val - *predptr;
+  int code = 0;
+
+  if (diff < 0) {
+    code = 8;
+    diff = -diff;
+  }
+  if (diff >= step) {
+    code |= 4;
+    diff -= step;
+  }
+  step >>= 1;
+  if (diff >= step) {
+    code |= 2;
+    diff -= step;
+  }
+  step >>= 1;
+  if (diff >= step) {
+    code |= 1;
+  }
+
+  adpcm_step(code, predptr, indexptr);
+  return code;
+}
+
+/* Apply one ADPCM code to the predicted value and step index. */
+static void adpcm_step(int code, int *predptr, int *indexptr)
+{
+  int step = step_table[*indexptr];
+  int diffq = step >> 3;
+  int pred, index;
+
+  if (code & 4)
+    diffq += step;
+  if (code & 2)
+    diffq += (step >> 1);
+  if (code & 1)
+    diffq += (step >> 2);
+
+  pred = *predptr;
+  if (code & 8)
+    pred -= diffq;
+  else
+    pred += diffq;
+  if (pred > 0x7FFF)
+    pred = 0x7FFF;
+  else if (pred < -0x8000)
+    pred = -0x8000;
+  *predptr = pred;
+
+  index = *indexptr + index_table[code];
+  if (index < 0)
+    index = 0;
+  else if (index > 88)
+    index = 88;
+  *indexptr = index;
+}
+
+static double get_time()
+{
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  return (double)tv.tv_sec + (double)tv.tv_usec * 0.000001;
+}
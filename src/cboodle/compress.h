@@ -0,0 +1,29 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+#define COMPRESS_NONE (0)
+#define COMPRESS_8BIT (1)
+#define COMPRESS_ADPCM (2)
+
+typedef struct compressstats_struct {
+  int mode; /* COMPRESS_8BIT or COMPRESS_ADPCM */
+  long datasize; /* bytes of compressed data */
+  long fullsize; /* bytes the data would take decoded */
+  long decodes; /* blocks decoded so far */
+  double decodetime; /* seconds spent decoding them */
+} compressstats_t;
+
+extern compress_t *compress_create(int mode, long numframes,
+  int numchannels);
+extern void compress_destroy(compress_t *comp);
+extern void compress_encode_block(compress_t *comp, long bx,
+  value_t *src, long count);
+extern void compress_decode_block(compress_t *comp, long bx,
+  value_t *dest, long count);
+extern long compress_data_size(compress_t *comp);
+extern void compress_get_stats(compress_t *comp, compressstats_t *stats);
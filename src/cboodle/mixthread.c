@@ -0,0 +1,331 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <pthread.h>
+#include <sys/time.h>
+#include <Python.h>
+
+#include "common.h"
+#include "audev.h"
+#include "mixthread.h"
+
+/* The threaded device writer: decoupling the sound device from the
+   Python thread.
+
+   Left to itself, the driver's audev_loop() calls the mixer, which
+   calls into Python to run agents, and then writes the buffer to the
+   device. A slow agent run() therefore delays the write, and the
+   device underruns.
+
+   Instead, we can run audev_loop() on a thread of its own. Its mix
+   function just takes finished buffers off a ring. The Python thread
+   runs agents and mixes buffers into the ring, up to lookahead
+   buffers ahead of the device, and sleeps (with the Python lock
+   released) when the ring is full. A spike in agent latency is then
+   absorbed by the ring, as long as it is shorter than the lookahead.
+
+   The ring has exactly one producer (the Python thread) and one
+   consumer (the device thread). The producer alone writes head, and
+   the consumer alone writes tail, so the buffers themselves are
+   passed without locking. The mutex and condition variable are used
+   only to sleep when the ring is full or empty, and to signal the end
+   of the run.
+
+   Only the writing moves to the device thread. Running agents,
+   scheduling notes, and mixing all stay on the Python thread, so no
+   other part of cboodle has to be thread-safe.
+
+   This is turned on by the "lookahead" extra option. It is off by
+   default (a lookahead of 0), in which case audev_loop() runs on the
+   Python thread as it always has. The lookahead is also how far ahead
+   of the sound the agents run: with a lookahead of N, an external
+   event is heard N buffers later than it otherwise would be.
+
+   Either way, we keep track of where the time goes -- running agents,
+   mixing, and in the driver itself -- for mixthread_get_stats().
+   (When the device has its own thread, these overlap, so they may add
+   up to more than the wall-clock time.)
+*/
+
+#define DEFAULT_LOOKAHEAD (0)
+
+typedef struct ring_struct {
+  long numslots;
+  long slotsize; /* longs per slot */
+  long *data;
+
+  long head; /* count of buffers produced */
+  long tail; /* count of buffers consumed */
+
+  int ended; /* the producer will add no more buffers */
+  int finished; /* audev_loop() has returned */
+
+  pthread_mutex_t mutex;
+  pthread_cond_t cond;
+} ring_t;
+
+#define RING_LOAD(ptr) __atomic_load_n((ptr), __ATOMIC_ACQUIRE)
+#define RING_STORE(ptr, val) __atomic_store_n((ptr), (val), __ATOMIC_RELEASE)
+
+typedef struct loopwrap_struct {
+  mix_func_t mixfunc;
+  generate_func_t genfunc;
+  void *rock;
+} loopwrap_t;
+
+static long lookahead = DEFAULT_LOOKAHEAD;
+
+/* The producer side updates agenttime and mixtime; the device side
+   updates numbuffers, writetime, and lasthandoff (the moment it last
+   got a buffer to write). */
+static mixstats_t stats;
+static double lasthandoff = 0.0;
+
+static void *device_thread(void *rock);
+static int ring_mix(long *buffer, generate_func_t genfunc, void *rock);
+static void ring_signal(ring_t *ring);
+static int direct_mix(long *buffer, generate_func_t genfunc, void *rock);
+static int timed_mix(long *buffer, loopwrap_t *wrap);
+static int timed_generate(frametime_t curtime, void *rock);
+static double get_time(void);
+
+int mixthread_init(extraopt_t *extra)
+{
+  extraopt_t *opt;
+
+  lookahead = DEFAULT_LOOKAHEAD;
+  for (opt=extra; opt->key; opt++) {
+    if (!strcmp(opt->key, "lookahead") && opt->val) {
+      lookahead = atol(opt->val);
+      if (lookahead < 0)
+	lookahead = 0;
+    }
+  }
+
+  return TRUE;
+}
+
+/* Run the sound loop. The arguments and result are those of
+   audev_loop(): mixfunc(buffer, genfunc, rock) fills a buffer, and
+   returns TRUE to end the loop. So this returns TRUE if mixfunc did,
+   and FALSE if the driver stopped on its own. This must be called
+   with the Python lock held, and returns with it held. */
+int mixthread_loop(mix_func_t mixfunc, generate_func_t genfunc, void *rock)
+{
+  ring_t ring;
+  pthread_t thread;
+  loopwrap_t wrap;
+  double starttime;
+  int res;
+
+  wrap.mixfunc = mixfunc;
+  wrap.genfunc = genfunc;
+  wrap.rock = rock;
+
+  memset(&stats, 0, sizeof(stats));
+  starttime = get_time();
+  lasthandoff = starttime;
+
+  if (lookahead <= 0) {
+    res = audev_loop(direct_mix, NULL, &wrap);
+    stats.writetime += get_time() - lasthandoff;
+    stats.walltime = get_time() - starttime;
+    return res;
+  }
+
+  ring.numslots = lookahead;
+  ring.slotsize = 2 * audev_get_framesperbuf();
+  ring.head = 0;
+  ring.tail = 0;
+  ring.ended = FALSE;
+  ring.finished = FALSE;
+  ring.data = (long *)malloc(sizeof(long) * ring.slotsize * ring.numslots);
+  if (!ring.data) {
+    fprintf(stderr, "Unable to allocate mixing ring.\n");
+    return FALSE;
+  }
+
+  pthread_mutex_init(&ring.mutex, NULL);
+  pthread_cond_init(&ring.cond, NULL);
+
+  if (pthread_create(&thread, NULL, device_thread, &ring)) {
+    fprintf(stderr, "Unable to start sound thread.\n");
+    pthread_cond_destroy(&ring.cond);
+    pthread_mutex_destroy(&ring.mutex);
+    free(ring.data);
+    return FALSE;
+  }
+
+  res = FALSE;
+
+  while (1) {
+    long head = ring.head;
+    long *slot;
+
+    if (head - RING_LOAD(&ring.tail) >= ring.numslots) {
+      /* The ring is full. Wait for the device to take a buffer. */
+      Py_BEGIN_ALLOW_THREADS
+      pthread_mutex_lock(&ring.mutex);
+      while (head - RING_LOAD(&ring.tail) >= ring.numslots 
+	&& !ring.finished)
+	pthread_cond_wait(&ring.cond, &ring.mutex);
+      pthread_mutex_unlock(&ring.mutex);
+      Py_END_ALLOW_THREADS
+    }
+
+    if (RING_LOAD(&ring.finished))
+      break;
+
+    slot = ring.data + (head % ring.numslots) * ring.slotsize;
+    if (timed_mix(slot, &wrap)) {
+      res = TRUE;
+      break;
+    }
+
+    RING_STORE(&ring.head, head+1);
+    ring_signal(&ring);
+  }
+
+  /* Let the device play out whatever is left in the ring, and wait
+     for it to finish. */
+  pthread_mutex_lock(&ring.mutex);
+  ring.ended = TRUE;
+  pthread_cond_broadcast(&ring.cond);
+  pthread_mutex_unlock(&ring.mutex);
+
+  Py_BEGIN_ALLOW_THREADS
+  pthread_join(thread, NULL);
+  Py_END_ALLOW_THREADS
+
+  pthread_cond_destroy(&ring.cond);
+  pthread_mutex_destroy(&ring.mutex);
+  free(ring.data);
+
+  stats.walltime = get_time() - starttime;
+  return res;
+}
+
+/* Report the timing of the most recent mixthread_loop(). */
+void mixthread_get_stats(mixstats_t *result)
+{
+  *result = stats;
+}
+
+/* The body of the device thread. This never touches Python. */
+static void *device_thread(void *rock)
+{
+  ring_t *ring = rock;
+
+  audev_loop(ring_mix, NULL, ring);
+  stats.writetime += get_time() - lasthandoff;
+
+  pthread_mutex_lock(&ring->mutex);
+  RING_STORE(&ring->finished, TRUE);
+  pthread_cond_broadcast(&ring->cond);
+  pthread_mutex_unlock(&ring->mutex);
+
+  return NULL;
+}
+
+/* The mix function which the device thread hands to audev_loop(). It
+   copies the next buffer off the ring, waiting for one if necessary.
+   Returns TRUE (ending the loop) once the ring is empty and the
+   producer has ended. */
+static int ring_mix(long *buffer, generate_func_t genfunc, void *rock)
+{
+  ring_t *ring = rock;
+  long tail = ring->tail;
+  long *slot;
+
+  stats.writetime += get_time() - lasthandoff;
+
+  if (RING_LOAD(&ring->head) == tail) {
+    pthread_mutex_lock(&ring->mutex);
+    while (RING_LOAD(&ring->head) == tail && !ring->ended)
+      pthread_cond_wait(&ring->cond, &ring->mutex);
+    pthread_mutex_unlock(&ring->mutex);
+
+    if (RING_LOAD(&ring->head) == tail) {
+      lasthandoff = get_time();
+      return TRUE;
+    }
+  }
+
+  slot = ring->data + (tail % ring->numslots) * ring->slotsize;
+  memcpy(buffer, slot, sizeof(long) * ring->slotsize);
+
+  RING_STORE(&ring->tail, tail+1);
+  ring_signal(ring);
+
+  stats.numbuffers++;
+  lasthandoff = get_time();
+  return FALSE;
+}
+
+/* Wake the other thread, if it's waiting. */
+static void ring_signal(ring_t *ring)
+{
+  pthread_mutex_lock(&ring->mutex);
+  pthread_cond_broadcast(&ring->cond);
+  pthread_mutex_unlock(&ring->mutex);
+}
+
+/* The mix function which audev_loop() calls directly, when there is
+   no device thread. */
+static int direct_mix(long *buffer, generate_func_t genfunc, void *rock)
+{
+  int res;
+
+  stats.writetime += get_time() - lasthandoff;
+
+  res = timed_mix(buffer, rock);
+  if (!res)
+    stats.numbuffers++;
+
+  lasthandoff = get_time();
+  return res;
+}
+
+/* Call the real mix function, timing it (less the time spent in the
+   generate function). */
+static int timed_mix(long *buffer, loopwrap_t *wrap)
+{
+  double starttime = get_time();
+  double startagents = stats.agenttime;
+  int res;
+
+  res = wrap->mixfunc(buffer, 
+    (wrap->genfunc ? timed_generate : NULL), wrap);
+
+  stats.mixtime += (get_time() - starttime) 
+    - (stats.agenttime - startagents);
+  return res;
+}
+
+/* Call the real generate function, timing it. */
+static int timed_generate(frametime_t curtime, void *rock)
+{
+  loopwrap_t *wrap = rock;
+  double starttime = get_time();
+  int res;
+
+  res = wrap->genfunc(curtime, wrap->rock);
+
+  stats.agenttime += get_time() - starttime;
+  return res;
+}
+
+static double get_time()
+{
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  return (double)tv.tv_sec + (double)tv.tv_usec * 0.000001;
+}
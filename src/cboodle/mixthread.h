@@ -0,0 +1,20 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+typedef struct mixstats_struct {
+  long numbuffers; /* buffers handed to the driver */
+  double walltime; /* the whole run */
+  double agenttime; /* in the generate function, running agents */
+  double mixtime; /* in the mix function, apart from the agents */
+  double writetime; /* in the driver, encoding and writing buffers */
+} mixstats_t;
+
+extern int mixthread_init(extraopt_t *extra);
+extern int mixthread_loop(mix_func_t mixfunc, generate_func_t genfunc,
+  void *rock);
+extern void mixthread_get_stats(mixstats_t *stats);
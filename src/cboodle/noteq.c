@@ -8,36 +8,203 @@
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <limits.h>
+#include <unistd.h>
+#include <pthread.h>
 #include <Python.h>
 
 #include "common.h"
+#include "channel.h"
 #include "noteq.h"
 #include "audev.h"
 #include "sample.h"
-
-/* This represents a linear volume fade, starting and ending at
-   particular times. */
-typedef struct volrange_struct {
-  long start, end;
+#include "stream.h"
+
+/* Notes live in one of two places. A note which has not yet started
+   is in the pending queue: a binary heap ordered by starting time, so
+   that the earliest note is always pending[0]. Once a note's start
+   time falls within the buffer being mixed, it moves to the active
+   array, which is unordered. The mixer only ever walks the active
+   array.
+
+   Each note records where it is (note->isactive and note->queuepos),
+   and is also on its channel's list of notes. So the notes of one
+   channel can be found, and pulled out of either place, without
+   looking at any other notes. */
+static note_t **pending = NULL;
+static long numpending = 0;
+static long maxpending = 0;
+
+static note_t **active = NULL;
+static long numactive = 0;
+static long maxactive = 0;
+
+static frametime_t current_time = 0;
+
+/* Incremented for every buffer; used to tag the per-buffer state
+   cached in channel_t objects. */
+static long mix_stamp = 0;
+
+/* When a note is destroyed, its Python objects (the sample and the
+   channel) are not released. The pair goes onto the finished list
+   instead, still holding the note's references, and the whole list
+   is handed back to Python in one batch by noteq_collect_finished().
+   This saves calling into Python for every note that ends. */
+typedef struct finished_struct {
+  PyObject *sampobj;
+  PyObject *channel;
+} finished_t;
+
+static finished_t *finished = NULL;
+static long numfinished = 0;
+static long maxfinished = 0;
+
+/* Note structures are carved out of slabs of NOTE_SLAB_SIZE, and
+   recycled through a free list rather than handed back to malloc.
+   The pool grows a slab at a time, up to pool_limit notes; beyond
+   that, notes are malloced and freed one at a time. (Slabs are never
+   freed, so pool_limit is a high-water mark for the pool's memory.)
+   The limit can be set with the "notepool" extra option. */
+#define NOTE_SLAB_SIZE (256)
+#define DEFAULT_POOL_LIMIT (16384)
+
+typedef struct noteslab_struct noteslab_t;
+struct noteslab_struct {
+  noteslab_t *next;
+  note_t *notes;
+};
+
+static noteslab_t *slabs = NULL;
+static note_t *freenotes = NULL;
+static long pool_limit = DEFAULT_POOL_LIMIT;
+static long pool_size = 0; /* notes in all slabs */
+static long pool_free = 0; /* notes on the free list */
+static long notes_live = 0; /* notes in existence, pooled or not */
+static long notes_peak = 0;
+static long notes_overflow = 0; /* count of notes that missed the pool */
+
+/* If TRUE, notes are mixed in stretches by the mix_*_const() and
+   mix_*_ramp() functions, rather than frame by frame. Setting the
+   "fastmix" extra option to 0 turns this off (for benchmarking). The
+   output is the same either way. */
+static int fastmix = TRUE;
+
+/* When some channel is fading (or the pan is changing), the volume
+   is worked out exactly at the start of every block of fadeblock
+   frames, and linearly interpolated in between. This saves a lot of
+   division. The "fadeblock" extra option changes the block size; it
+   must be a power of two (fadeblock == 1 << fadeshift). A value of 1
+   means the volume is worked out exactly at every frame. */
+#ifndef BOODLER_FADEBLOCK
+#define BOODLER_FADEBLOCK (32)
+#endif
+static long fadeblock = 1;
+static int fadeshift = 0;
+
+/* Everything compute_gains() needs to know about a note. The gains
+   are the final (16.16 fixed-point) multipliers from each input
+   channel to each output channel: two of them for a mono sample
+   (left, right), four for stereo (0-left, 0-right, 1-left, 1-right). */
+typedef struct notegain_struct {
+  int numranges;
+  volrange_t *ranges;
+  note_t *envnote; /* the note, if it is fading in or out; else NULL */
+  int bothpans;
+  int numgains;
+  volrange_t panranges[4];
 #ifdef BOODLER_INTMATH
-  long istartvol, iendvol;
+  long ibase[4];
 #else
-  double startvol, endvol;
+  double volume;
+  double base[4];
 #endif
-} volrange_t;
-
-/* A queue of notes, ordered by starting time, past to future. */
-static note_t *queue = NULL;
-
-static long current_time = 0; /* frame time */
-
-static volrange_t *ranges = NULL;
-int maxranges = 0;
-
-static note_t *last_added = NULL;
-
+} notegain_t;
+
+/* Parallel mixing. If the "threads" extra option is more than 1, a
+   pool of (threads-1) worker threads is started. For each buffer, the
+   active notes are dealt out among the workers and the main thread:
+   thread k takes notes k, k+threads, k+2*threads, and so on. Each
+   worker mixes its notes into a private buffer, and the main thread
+   then adds the private buffers into the real one. Integer addition
+   doesn't care about order, so the result is identical to the serial
+   mix.
+
+   The workers never touch Python. Channels are prepared before the
+   workers start, and finished notes are destroyed after they stop;
+   both on the main thread. Destroying a note doesn't call into Python
+   either. Its sample and channel references go onto the finished list,
+   which is handed to Python in one batch per buffer (see
+   noteq_collect_finished()). */
+#define PARALLEL_MIN_NOTES (4)
+
+typedef struct mixworker_struct {
+  pthread_t thread;
+  int index;
+  long *buffer; /* 2*framesperbuf longs */
+  long seen; /* the last job generation this worker has picked up */
+} mixworker_t;
+
+static int numthreads = 1; /* requested */
+static int numworkers = 0; /* running */
+static mixworker_t *workers = NULL;
+static long workerbufsize = 0; /* longs */
+
+static pthread_mutex_t pool_mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t pool_cond = PTHREAD_COND_INITIALIZER;
+static long pool_generation = 0; /* incremented to start each buffer */
+static int pool_busy = 0; /* workers still mixing the current buffer */
+static int pool_quit = FALSE;
+static long job_framesperbuf;
+static frametime_t job_end_time;
+
+static int mix_parallel(long *buffer, long framesperbuf,
+  frametime_t end_time);
+static int pool_start(long framesperbuf);
+static void pool_stop(void);
+static void *pool_worker(void *rock);
+static int mix_note(note_t *note, long *buffer, long framesperbuf,
+  frametime_t end_time);
+static int skip_note(note_t *note, long lpitch, long count);
+static void set_fadeblock(long val);
+static void compute_gains(notegain_t *gains, frametime_t curtime,
+  long *result);
+static double note_envelope(note_t *note, frametime_t curtime);
+
+static note_t *note_alloc(void);
+static void note_free(note_t *note);
+static int grow_array(note_t ***arrayptr, long *maxptr, long wanted);
+static void finished_append(PyObject *sampobj, PyObject *channel);
+static int duration_reps(sample_t *samp, double pitch,
+  frametime_t duration);
+static frametime_t reps_length(sample_t *samp, double pitch, int *repsptr);
+static note_t *note_build(sample_t *samp, double pitch, double volume,
+  stereo_t *pan,
+  frametime_t starttime, int reps, PyObject *channel, channel_t *cchan,
+  PyObject *sampobj, frametime_t *durptr);
+static void pending_sift_up(long pos);
+static void pending_sift_down(long pos);
+static note_t *pending_pop(void);
+static void pending_remove(long pos);
+static void active_remove(long pos);
+static long collect_channel_notes(channel_t *chan, note_t **doomed,
+  long numdoomed);
 static void leftright_volumes(double shiftx, double shifty,
   double *outlft, double *outrgt);
+static long const_span(long framepos, long framefrac, long lpitch,
+  long bound, long maxframes);
+static void mix_mono_const(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long ivollft, long ivolrgt);
+static void mix_stereo_const(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long ivol0lft, long ivol0rgt, long ivol1lft, long ivol1rgt);
+static void mix_mono_ramp(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long *gain0, long *gain1, long blockpos);
+static void mix_stereo_ramp(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long *gain0, long *gain1, long blockpos);
 
 /* A quick introduction to Python reference-counting:
    (See <http://docs.python.org/api/api.html> for full docs.)
@@ -58,94 +225,507 @@ static void leftright_volumes(double shiftx, double shifty,
    Py_DECREF when we release it.
  */
 
-int noteq_init()
+int noteq_init(extraopt_t *extra)
 {
-  last_added = NULL;
+  extraopt_t *opt;
+
+  numpending = 0;
+  numactive = 0;
+  current_time = 0;
+
+  pool_limit = DEFAULT_POOL_LIMIT;
+  fastmix = TRUE;
+  set_fadeblock(BOODLER_FADEBLOCK);
+  numthreads = 1;
+  for (opt=extra; opt->key; opt++) {
+    if (!strcmp(opt->key, "notepool") && opt->val) {
+      pool_limit = atol(opt->val);
+      if (pool_limit < 0)
+	pool_limit = 0;
+    }
+    else if (!strcmp(opt->key, "fastmix") && opt->val) {
+      fastmix = (atoi(opt->val) != 0);
+    }
+    else if (!strcmp(opt->key, "fadeblock") && opt->val) {
+      set_fadeblock(atol(opt->val));
+    }
+    else if (!strcmp(opt->key, "threads") && opt->val) {
+      if (!strcmp(opt->val, "auto")) {
+	numthreads = 1;
+#ifdef _SC_NPROCESSORS_ONLN
+	numthreads = sysconf(_SC_NPROCESSORS_ONLN);
+#endif
+      }
+      else {
+	numthreads = atoi(opt->val);
+      }
+      if (numthreads < 1)
+	numthreads = 1;
+    }
+  }
 
-  maxranges = 2;
-  ranges = (volrange_t *)malloc(sizeof(volrange_t) * maxranges);
-  if (!ranges)
+  if (!grow_array(&pending, &maxpending, 64))
+    return FALSE;
+  if (!grow_array(&active, &maxactive, 64))
+    return FALSE;
+
+  if (!stream_init(extra))
     return FALSE;
 
   return TRUE;
 }
 
-static void noteq_add(note_t *note)
+/* Shut down anything noteq_init() or noteq_generate() started. */
+void noteq_final()
 {
-  long starttime = note->starttime;
-  note_t **nptr;
+  long ix;
+
+  pool_stop();
+  stream_final();
+
+  /* Destroy the notes which are still queued, so that the next
+     session starts empty and the pool gets them back. */
+  for (ix=0; ix<numactive; ix++)
+    note_destroy(active[ix]);
+  numactive = 0;
+  for (ix=0; ix<numpending; ix++)
+    note_destroy(pending[ix]);
+  numpending = 0;
+
+  for (ix=0; ix<numfinished; ix++) {
+    Py_XDECREF(finished[ix].sampobj);
+    Py_XDECREF(finished[ix].channel);
+  }
+  numfinished = 0;
+}
 
-  if (last_added && starttime >= last_added->starttime) {
-    nptr = &(last_added->next);
+/* Set the fade block size, rounding down to a power of two between 1
+   and 4096. */
+static void set_fadeblock(long val)
+{
+  fadeblock = 1;
+  fadeshift = 0;
+  while (fadeshift < 12 && (fadeblock << 1) <= val) {
+    fadeblock <<= 1;
+    fadeshift++;
+  }
+}
+
+/* Fetch a note structure from the pool, growing the pool if that's
+   allowed, or else from malloc. Returns NULL if memory could not be
+   allocated. */
+static note_t *note_alloc()
+{
+  note_t *note;
+
+  if (!freenotes && pool_size < pool_limit) {
+    noteslab_t *slab;
+    long ix, count;
+
+    count = pool_limit - pool_size;
+    if (count > NOTE_SLAB_SIZE)
+      count = NOTE_SLAB_SIZE;
+
+    slab = (noteslab_t *)malloc(sizeof(noteslab_t));
+    if (slab) {
+      slab->notes = (note_t *)malloc(sizeof(note_t) * count);
+      if (!slab->notes) {
+	free(slab);
+	slab = NULL;
+      }
+    }
+
+    if (slab) {
+      slab->next = slabs;
+      slabs = slab;
+      for (ix=0; ix<count; ix++) {
+	note = &(slab->notes[ix]);
+	note->pooled = TRUE;
+	note->nextfree = freenotes;
+	freenotes = note;
+      }
+      pool_size += count;
+      pool_free += count;
+    }
+  }
+
+  if (freenotes) {
+    note = freenotes;
+    freenotes = note->nextfree;
+    note->nextfree = NULL;
+    pool_free--;
   }
   else {
-    nptr = &queue;
+    note = (note_t *)malloc(sizeof(note_t));
+    if (!note)
+      return NULL;
+    note->pooled = FALSE;
+    note->nextfree = NULL;
+    notes_overflow++;
   }
 
-  while ((*nptr) && starttime > (*nptr)->starttime) {
-    nptr = &((*nptr)->next);
+  notes_live++;
+  if (notes_live > notes_peak)
+    notes_peak = notes_live;
+
+  return note;
+}
+
+/* Return a note structure to wherever it came from. */
+static void note_free(note_t *note)
+{
+  notes_live--;
+
+  if (note->pooled) {
+    note->nextfree = freenotes;
+    freenotes = note;
+    pool_free++;
   }
+  else {
+    free(note);
+  }
+}
 
-  note->next = (*nptr);
-  (*nptr) = note;
-  last_added = note;
+/* Report on the note queue and the note pool. */
+void noteq_get_stats(noteq_stats_t *stats)
+{
+  stats->numpending = numpending;
+  stats->numactive = numactive;
+  stats->poolsize = pool_size;
+  stats->poolfree = pool_free;
+  stats->poollimit = pool_limit;
+  stats->peak = notes_peak;
+  stats->overflow = notes_overflow;
 }
 
-static void noteq_remove(note_t **noteptr)
+/* Make sure an array of note pointers has room for at least wanted
+   entries. Returns FALSE if memory could not be allocated. */
+static int grow_array(note_t ***arrayptr, long *maxptr, long wanted)
 {
-  note_t *note = (*noteptr);
-  (*noteptr) = note->next;
-  note->next = NULL;
+  note_t **newarray;
+  long newmax;
 
-  last_added = NULL;
+  if (wanted <= *maxptr)
+    return TRUE;
+
+  newmax = *maxptr;
+  if (newmax < 16)
+    newmax = 16;
+  while (newmax < wanted)
+    newmax *= 2;
+
+  newarray = (note_t **)realloc(*arrayptr, sizeof(note_t *) * newmax);
+  if (!newarray)
+    return FALSE;
+
+  *arrayptr = newarray;
+  *maxptr = newmax;
+  return TRUE;
 }
 
-long note_create(sample_t *samp, double pitch, double volume,
-  stereo_t *pan,
-  long starttime, PyObject *channel, PyObject *removefunc)
+/* Add a sample and channel to the finished list. The list takes over
+   the caller's references. If the list cannot grow, the references
+   are dropped, and Python never hears that the note ended. */
+static void finished_append(PyObject *sampobj, PyObject *channel)
 {
-  return note_create_reps(samp, pitch, volume, pan, starttime, 1, channel, removefunc);
+  if (numfinished >= maxfinished) {
+    finished_t *newarray;
+    long newmax = maxfinished * 2;
+    if (newmax < 64)
+      newmax = 64;
+    newarray = (finished_t *)realloc(finished, sizeof(finished_t) * newmax);
+    if (!newarray) {
+      fprintf(stderr, "unable to record finished note\n");
+      Py_XDECREF(sampobj);
+      Py_XDECREF(channel);
+      return;
+    }
+    finished = newarray;
+    maxfinished = newmax;
+  }
+
+  finished[numfinished].sampobj = sampobj;
+  finished[numfinished].channel = channel;
+  numfinished++;
 }
 
-long note_create_duration(sample_t *samp, double pitch, double volume,
-  stereo_t *pan,
-  long starttime, long duration, PyObject *channel, PyObject *removefunc)
+/* Return the length of the finished list. */
+long noteq_count_finished()
 {
-  int reps;
+  return numfinished;
+}
 
-  if (!samp->hasloop) {
-    reps = 1;
+/* Take the entries from position start onwards off the finished list,
+   and return them as a new Python list of (sample, channel) tuples.
+   (A missing object appears as None.) Returns NULL, with a Python
+   exception set, if memory could not be allocated; the finished list
+   is then left as it was. */
+PyObject *noteq_collect_finished(long start)
+{
+  PyObject *list, *tup;
+  long ix;
+
+  if (start < 0 || start > numfinished)
+    start = numfinished;
+
+  list = PyList_New(numfinished - start);
+  if (!list)
+    return NULL;
+
+  for (ix=start; ix<numfinished; ix++) {
+    finished_t *fin = &(finished[ix]);
+    tup = PyTuple_Pack(2, (fin->sampobj ? fin->sampobj : Py_None),
+      (fin->channel ? fin->channel : Py_None));
+    if (!tup) {
+      Py_DECREF(list);
+      return NULL;
+    }
+    PyList_SET_ITEM(list, ix-start, tup);
   }
-  else {
-    long looplen = samp->looplen;
-    long margins = samp->numframes - looplen;
-    duration = (long)((double)duration * (samp->framerate * pitch));
-    reps = (duration - margins + (looplen-1)) / looplen;
+
+  /* The tuples hold their own references now. */
+  for (ix=start; ix<numfinished; ix++) {
+    Py_XDECREF(finished[ix].sampobj);
+    Py_XDECREF(finished[ix].channel);
   }
+  numfinished = start;
 
-  return note_create_reps(samp, pitch, volume, pan, starttime, reps, channel, removefunc);
+  return list;
 }
 
-long note_create_reps(sample_t *samp, double pitch, double volume,
+/* The usual binary-heap operations on the pending queue. */
+
+static void pending_sift_up(long pos)
+{
+  note_t *note = pending[pos];
+  frametime_t starttime = note->starttime;
+
+  while (pos > 0) {
+    long parent = (pos-1) / 2;
+    if (pending[parent]->starttime <= starttime)
+      break;
+    pending[pos] = pending[parent];
+    pending[pos]->queuepos = pos;
+    pos = parent;
+  }
+  pending[pos] = note;
+  note->queuepos = pos;
+}
+
+static void pending_sift_down(long pos)
+{
+  note_t *note = pending[pos];
+  frametime_t starttime = note->starttime;
+
+  while (1) {
+    long child = 2*pos + 1;
+    if (child >= numpending)
+      break;
+    if (child+1 < numpending 
+      && pending[child+1]->starttime < pending[child]->starttime)
+      child++;
+    if (starttime <= pending[child]->starttime)
+      break;
+    pending[pos] = pending[child];
+    pending[pos]->queuepos = pos;
+    pos = child;
+  }
+  pending[pos] = note;
+  note->queuepos = pos;
+}
+
+static note_t *pending_pop()
+{
+  note_t *note = pending[0];
+
+  numpending--;
+  if (numpending > 0) {
+    pending[0] = pending[numpending];
+    pending_sift_down(0);
+  }
+  return note;
+}
+
+/* Take the note at the given position out of the pending queue. */
+static void pending_remove(long pos)
+{
+  note_t *moved;
+
+  numpending--;
+  if (pos < numpending) {
+    moved = pending[numpending];
+    pending[pos] = moved;
+    pending_sift_down(pos);
+    pending_sift_up(moved->queuepos);
+  }
+}
+
+/* Take the note at the given position out of the active array, by
+   filling the hole with the last active note. */
+static void active_remove(long pos)
+{
+  numactive--;
+  if (pos < numactive) {
+    active[pos] = active[numactive];
+    active[pos]->queuepos = pos;
+  }
+}
+
+frametime_t note_create(sample_t *samp, double pitch, double volume,
   stereo_t *pan,
-  long starttime, int reps, PyObject *channel, PyObject *removefunc)
+  frametime_t starttime, PyObject *channel, channel_t *cchan,
+  PyObject *sampobj)
+{
+  return note_create_reps(samp, pitch, volume, pan, starttime, 1,
+    channel, cchan, sampobj);
+}
+
+frametime_t note_create_duration(sample_t *samp, double pitch,
+  double volume, stereo_t *pan,
+  frametime_t starttime, frametime_t duration,
+  PyObject *channel, channel_t *cchan,
+  PyObject *sampobj)
+{
+  int reps = duration_reps(samp, pitch, duration);
+
+  return note_create_reps(samp, pitch, volume, pan, starttime, reps,
+    channel, cchan, sampobj);
+}
+
+frametime_t note_create_reps(sample_t *samp, double pitch,
+  double volume, stereo_t *pan,
+  frametime_t starttime, int reps, PyObject *channel, channel_t *cchan,
+  PyObject *sampobj)
 {
   note_t *note;
-  long duration;
-  double ratio;
+  frametime_t duration;
 
-  note = (note_t *)malloc(sizeof(note_t));
+  if (!grow_array(&pending, &maxpending, numpending+1))
+    return 0;
+
+  note = note_build(samp, pitch, volume, pan, starttime, reps,
+    channel, cchan, sampobj, &duration);
   if (!note)
     return 0;
-  
+
+  pending[numpending] = note;
+  numpending++;
+  pending_sift_up(numpending-1);
+
+  return duration;
+}
+
+/* Create a batch of notes, all in the same channel. The duration of
+   each note (in frames) is stored in durations. Returns the number of
+   notes created, which is less than count only if memory ran out. */
+long note_create_batch(notespec_t *specs, long count,
+  PyObject *channel, channel_t *cchan, frametime_t *durations)
+{
+  note_t *note;
+  notespec_t *spec;
+  long ix, oldcount, pos;
+  int reps;
+
+  if (!grow_array(&pending, &maxpending, numpending+count))
+    return 0;
+
+  oldcount = numpending;
+
+  for (ix=0; ix<count; ix++) {
+    spec = &(specs[ix]);
+    reps = duration_reps(spec->sample, spec->pitch, spec->duration);
+    note = note_build(spec->sample, spec->pitch, spec->volume, &spec->pan,
+      spec->starttime, reps, channel, cchan, spec->sampobj,
+      &(durations[ix]));
+    if (!note)
+      break;
+    note->attack = spec->attack;
+    note->release = spec->release;
+    note->curve = spec->curve;
+    note->queuepos = numpending;
+    pending[numpending] = note;
+    numpending++;
+  }
+
+  /* If the batch is bigger than the queue it's joining, it's cheaper
+     to rebuild the heap from scratch than to sift up each new note. */
+  if (numpending - oldcount > oldcount) {
+    for (pos = numpending/2 - 1; pos >= 0; pos--)
+      pending_sift_down(pos);
+  }
+  else {
+    for (pos = oldcount; pos < numpending; pos++)
+      pending_sift_up(pos);
+  }
+
+  return numpending - oldcount;
+}
+
+/* Work out how many times a note must go through its sample's loop to
+   last the given duration (in frames). */
+static int duration_reps(sample_t *samp, double pitch,
+  frametime_t duration)
+{
+  long looplen, margins;
+
+  if (!samp->hasloop)
+    return 1;
+
+  looplen = samp->looplen;
+  margins = samp->numframes - looplen;
+  duration = (frametime_t)((double)duration * (samp->framerate * pitch));
+  duration = (duration - margins + (looplen-1)) / looplen;
+  if (duration > INT_MAX)
+    return INT_MAX;
+  return (int)duration;
+}
+
+/* Work out how long (in frames) a note lasts, if it goes through its
+   sample's loop the given number of times. The count is stored back,
+   adjusted to 1 if the sample has no loop. */
+static frametime_t reps_length(sample_t *samp, double pitch, int *repsptr)
+{
+  double ratio;
+
   ratio = (samp->framerate * pitch);
-  if (!samp->hasloop || reps <= 1) {
-    reps = 1;
-    duration = (double)(samp->numframes) / ratio;
+  if (!samp->hasloop || *repsptr <= 1) {
+    *repsptr = 1;
+    return (double)(samp->numframes) / ratio;
   }
   else {
-    duration = (double)(samp->numframes + samp->looplen * (reps-1)) / ratio;
+    return ((double)(samp->numframes) 
+      + (double)(samp->looplen) * (*repsptr-1)) / ratio;
   }
+}
+
+/* Work out how long (in frames) a note would last, without creating
+   it. The duration is as for note_create_duration(); 0 means once
+   through the sample. */
+frametime_t note_duration(sample_t *samp, double pitch,
+  frametime_t duration)
+{
+  int reps = duration_reps(samp, pitch, duration);
+
+  return reps_length(samp, pitch, &reps);
+}
+
+/* Allocate a note and fill it in, and put it on its channel's list of
+   notes. The note is not yet in the pending queue; the caller must put
+   it there. The note's duration (in frames) is stored in durptr.
+   Returns NULL if memory could not be allocated. */
+static note_t *note_build(sample_t *samp, double pitch, double volume,
+  stereo_t *pan,
+  frametime_t starttime, int reps, PyObject *channel, channel_t *cchan,
+  PyObject *sampobj, frametime_t *durptr)
+{
+  note_t *note;
+  frametime_t duration;
+
+  note = note_alloc();
+  if (!note)
+    return NULL;
+  
+  duration = reps_length(samp, pitch, &reps);
 
   note->sample = samp;
   note->pitch = pitch;
@@ -155,59 +735,73 @@ long note_create_reps(sample_t *samp, double pitch, double volume,
   note->pan = *pan;
   note->starttime = starttime;
   note->repetitions = reps;
+  note->endtime = starttime + duration;
+  note->attack = 0;
+  note->release = 0;
+  note->curve = NOTE_CURVE_LINEAR;
   note->channel = channel;
   if (note->channel) {
     Py_INCREF(note->channel);
   }
-  note->removefunc = removefunc;
-  if (note->removefunc) {
-    Py_INCREF(note->removefunc);
+  note->cchan = cchan;
+  if (note->cchan) {
+    channel_retain(note->cchan);
+  }
+  note->sampobj = sampobj;
+  if (note->sampobj) {
+    Py_INCREF(note->sampobj);
   }
 
   note->framepos = 0;
   note->framefrac = 0;
   note->repsleft = reps-1;
-  note->next = NULL;
+  note->finished = FALSE;
+
+  note->chanprev = NULL;
+  note->channext = NULL;
+  if (cchan) {
+    note->channext = cchan->firstnote;
+    if (cchan->firstnote)
+      cchan->firstnote->chanprev = note;
+    cchan->firstnote = note;
+  }
 
-  noteq_add(note);
+  note->isactive = FALSE;
 
-  /* printf("Added note %p, samp %p, pitch %g, vol %g, starttime %ld, reps %d, duration %ld\n",
+  /* printf("Added note %p, samp %p, pitch %g, vol %g, starttime %lld, reps %d, duration %lld\n",
      note, samp, pitch, volume, starttime, reps, duration); */
 
-  return duration;
+  *durptr = duration;
+  return note;
 }
 
-void note_destroy(note_t **noteptr)
+/* Destroy a note, putting its sample and channel on the finished
+   list. The caller must already have taken it out of the pending
+   queue or the active array. */
+void note_destroy(note_t *note)
 {
-  note_t *note = (*noteptr);
   /* printf("Removed note %p (samp %p)\n", note, note->sample); */
 
-  noteq_remove(noteptr);
-
-  if (note->removefunc && PyCallable_Check(note->removefunc)) {
-    PyObject *result;
-    result = PyObject_CallFunction(note->removefunc, NULL);
-    if (result) {
-      Py_DECREF(result);
-    }
-    else {
-      fprintf(stderr, "exception calling note remover\n");
-      PyErr_Clear();
-    }
-  }
-
-  if (note->channel) {
-    Py_DECREF(note->channel);
+  if (note->sampobj || note->channel) {
+    finished_append(note->sampobj, note->channel);
+    note->sampobj = NULL;
     note->channel = NULL;
   }
-  if (note->removefunc) {
-    Py_DECREF(note->removefunc);
-    note->removefunc = NULL;
+  if (note->cchan) {
+    if (note->chanprev)
+      note->chanprev->channext = note->channext;
+    else
+      note->cchan->firstnote = note->channext;
+    if (note->channext)
+      note->channext->chanprev = note->chanprev;
+    note->chanprev = NULL;
+    note->channext = NULL;
+    channel_release(note->cchan);
+    note->cchan = NULL;
   }
-
   note->sample = NULL;
   note->starttime = 0;
-  free(note);
+  note_free(note);
 }
 
 /* The following macro breaks every rule of C style and moral
@@ -262,764 +856,1078 @@ void note_destroy(note_t **noteptr)
 
 #endif /* BOODLER_INTMATH */
 
-int noteq_generate(long *buffer, generate_func_t genfunc, void *rock)
+/* Work out a note's gains at a particular time, taking into account
+   every range on its channel's ranges list, the note's own attack or
+   release (if it is in one), and (if the pan is changing) its pan
+   ranges. The results go into result[0] through result[numgains-1]. */
+static void compute_gains(notegain_t *gains, frametime_t curtime,
+  long *result)
 {
-  note_t **nptr;
-  long framesperbuf = audev_get_framesperbuf();
-  long end_time;
-
-  /* These could be declared inside the loop, but if I put them
-     outside I can initialize them early, which squashes some stupid
-     compiler warnings. */
-  stereo_t pan0, pan1;
-  volrange_t range0lft, range0rgt, range1lft, range1rgt;
+  int ix;
+#ifdef BOODLER_INTMATH
+  /* Start with 0x4000, instead of 0x10000, to allow some headroom
+     when we multiply by values over 0x10000. We'll compensate later
+     by downshifting >>14 instead of >>16. */
+  long ivarvols = 0x4000;
+#else
+  double varvols = 1.0;
+#endif
 
-  if (genfunc) {
-    int res = (*genfunc)(current_time, rock);
-    if (res)
-      return TRUE;
+  for (ix=0; ix<gains->numranges; ix++) {
+    volrange_t *range = &(gains->ranges[ix]);
+    /* A chained run of ranges is one channel's envelope; only the
+       segment which covers curtime applies. */
+    while (range->chain && curtime >= range->end)
+      range++;
+    APPLY_RANGE((*range), curtime, varvols, ivarvols);
+    ix = (range - gains->ranges) + range->chain;
   }
-  /* Remember, genfunc might have called noteq_adjust_timebase() to
-     change the current_time */
 
-  end_time = current_time + framesperbuf;
+  if (gains->envnote) {
+#ifdef BOODLER_INTMATH
+    long ienv = (long)(note_envelope(gains->envnote, curtime) * 65536.0);
+    ivarvols = ((ivarvols * ienv) >> 16);
+#else
+    varvols *= note_envelope(gains->envnote, curtime);
+#endif
+  }
 
-  /* Squash stupid compiler warnings. */
-  memset(&pan1, 0, sizeof(pan1));
-  memset(&range0lft, 0, sizeof(range0lft));
-  range0rgt = range1lft = range1rgt = range0lft;
+  for (ix=0; ix<gains->numgains; ix++) {
+#ifdef BOODLER_INTMATH
+    long ivarpan = ivarvols;
+    if (gains->bothpans) {
+      APPLY_RANGE(gains->panranges[ix], curtime, varpan, ivarpan);
+    }
+    result[ix] = ((ivarpan * gains->ibase[ix]) >> 14);
+#else
+    double varpan = varvols;
+    if (gains->bothpans) {
+      APPLY_RANGE(gains->panranges[ix], curtime, varpan, ivarpan);
+    }
+    result[ix] = (long)(gains->volume * varpan * gains->base[ix] * 65536.0);
+#endif
+  }
+}
 
-  /* The following code is unapologetically long, repetitive, and nasty.
-     This is the bottom loop for mixing sound, so we don't trade off
-     cycles for anything. */
+/* Work out the volume factor of a note's own attack and release at a
+   particular time. Where the two overlap (in a note shorter than both
+   together), the quieter one wins. */
+static double note_envelope(note_t *note, frametime_t curtime)
+{
+  double val = 1.0;
+  frametime_t offset;
+
+  offset = curtime - note->starttime;
+  if (offset < note->attack) {
+    if (offset <= 0)
+      val = 0.0;
+    else
+      val = (double)offset / (double)note->attack;
+  }
 
-  memset(buffer, 0, sizeof(long) * 2 * framesperbuf);
+  offset = note->endtime - curtime;
+  if (offset < note->release) {
+    if (offset <= 0)
+      val = 0.0;
+    else if ((double)offset / (double)note->release < val)
+      val = (double)offset / (double)note->release;
+  }
 
-  /* Loop through all the notes in the queue. (At least up to the
-     point where they're past the current buffer. For each note, add
-     its contribution into the buffer. */
-  nptr = &queue;
-  while (1) {
-    note_t *note = (*nptr);
-    sample_t *samp;
-    int willdelete = FALSE;
-    long notestart;
-    double pitch;
-    long lpitch;
-    double volume;
-    int bothpans;
-    int numranges;
-    long *valptr;
-    value_t *sampdata;
-    long framepos, framefrac;
-    long numframes;
-
-    if (!note || (note->starttime >= end_time)) {
-      break;
-    }
+  if (val >= 1.0)
+    return 1.0;
 
-    samp = note->sample;
-
-    pan0 = note->pan;
-    bothpans = FALSE;
-    volume = note->volume;
-    numranges = 0;
-
-    /* We must compute a total volume, by multiplying the note's
-       volume by the volume factor of every channel it's in. We do
-       this by iterating up the channel tree. 
-
-       The tricky part is that some channels might be in the middle of
-       a volume change, which means we can't just multiply in a
-       constant factor. Those channels (only) go onto the ranges list.
-       (The ranges list will be consulted once per frame, as we
-       generate the note.)
-
-       While we're at it, we compose all the stereo pans. As with the
-       volumes, we have to worry about channels that are in the middle
-       of a pan change. However, the solution is different. Once a pan
-       change appears, we keep track of two pan positions: that at the
-       beginning of the buffer, and that at the end. (Before the first
-       change appears, these are identical. The bothpans flag
-       indicates whether we've hit that first change yet.) */
-
-    if (note->channel) {
-      PyObject *chan = note->channel;
-      Py_INCREF(chan);
-
-      while (1) {
-	PyObject *newchan;
-	PyObject *stereo;
-	PyObject *vol = PyObject_GetAttrString(chan, "volume");
-	if (vol) {
-	  if (PyTuple_Check(vol) && PyTuple_Size(vol) == 4) {
-	    /* A channel's volume is a 4-tuple: 
-
-	       (int starttime, int endtime, float startvol, float endvol)
-
-	       This is the general case: the volume fades from
-	       startvol to endvol over an interval. Before starttime,
-	       we assume the volume is flat at startvol; after
-	       endtime, we assume endvol. 
-
-	       If the volume is completely constant, endtime will be
-	       zero, or perhaps just before current_time. (This fits
-	       nicely into the general case.) */
-
-	    long endtm;
-	    double endvol;
-	    endtm = PyInt_AsLong(PyTuple_GET_ITEM(vol, 1));
-	    endvol = PyFloat_AsDouble(PyTuple_GET_ITEM(vol, 3));
-
-	    if (current_time >= endtm) {
-	      /* Channel volume is constant across the buffer. */
-	      volume *= endvol;
-	    }
-	    else {
-	      long starttm;
-	      double startvol;
-	      starttm = PyInt_AsLong(PyTuple_GET_ITEM(vol, 0));
-	      startvol = PyFloat_AsDouble(PyTuple_GET_ITEM(vol, 2));
-	      if (starttm >= end_time) {
-		/* Channel volume is constant across the buffer. */
-		volume *= startvol;
-	      }
-	      else {
-		/* This is the nasty case; we're in the middle of a
-		   fade. Rather than multiplying volume, we create a
-		   new range in the ranges list. */
-
-		if (numranges >= maxranges) {
-		  maxranges *= 2;
-		  ranges = (volrange_t *)realloc(ranges, 
-		    sizeof(volrange_t) * maxranges);
-		  if (!ranges)
-		    return TRUE;
-		}
-		ranges[numranges].start = starttm;
-		ranges[numranges].end = endtm;
-#ifdef BOODLER_INTMATH
-		ranges[numranges].istartvol = (long)(startvol * 65536.0);
-		ranges[numranges].iendvol = (long)(endvol * 65536.0);
-#else
-		ranges[numranges].startvol = startvol;
-		ranges[numranges].endvol = endvol;
-#endif
-		numranges++;
-	      }
-	    }
+  switch (note->curve) {
+  case NOTE_CURVE_SINE:
+    return sin(val * 1.5707963267948966);
+  case NOTE_CURVE_SMOOTH:
+    return val * val * (3.0 - 2.0 * val);
+  default:
+    return val;
+  }
+}
 
-	  }
-	  Py_DECREF(vol);
-	}
-	vol = NULL;
-
-	stereo = PyObject_GetAttrString(chan, "stereo");
-	if (stereo) {
-	  if (PyTuple_Check(stereo) && PyTuple_Size(stereo) == 4) {
-	    /* A channel's stereo value is a 4-tuple:
-	       (int starttime, int endtime, tuple startpan, tuple endpan)
-
-	       Like the volume tuple, this is the general case. The
-	       startpan and endpan values are stereo objects. 
-
-	       A stereo object is a 0-, 2-, or 4-tuple. In full form:
-	       (xscale, xshift, yscale, yshift)
-	       Missing entries are presumed to be (1,0,1,0) in that order. */
-
-	    PyObject *usepan = NULL;
-
-	    long starttm = 0;
-	    PyObject *startpan = NULL;
-	    long endtm = PyInt_AsLong(PyTuple_GET_ITEM(stereo, 1));
-	    PyObject *endpan = PyTuple_GET_ITEM(stereo, 3);
-
-	    if (current_time >= endtm) {
-	      /* Stereo is constant across the buffer. */
-	      usepan = endpan;
-	    }
-	    else {
-	      starttm = PyInt_AsLong(PyTuple_GET_ITEM(stereo, 0));
-	      startpan = PyTuple_GET_ITEM(stereo, 2);
-
-	      if (starttm >= end_time) {
-		/* Stereo is constant across the buffer. */
-		usepan = startpan;
-	      }
-	      else {
-		/* Nasty case: we're in the middle of a stereo swoop. */
-		usepan = NULL;
-	      }
-	    }
-
-	    /* The value in usepan is now NULL if we're in a swoop, or
-	       a stereo object if we're in the constant case. */
-
-	    if (usepan) {
-	      /* Apply constant transform to the pan value. (If we're
-		 already keeping track of two pan values, apply it to
-		 both of them.) */
-	      int tuplesize = 0;
-	      if (PyTuple_Check(usepan))
-		tuplesize = PyTuple_Size(usepan);
-	      if (tuplesize >= 2) {
-		double chshift, chscale;
-		chscale = PyFloat_AsDouble(PyTuple_GET_ITEM(usepan, 0));
-		chshift = PyFloat_AsDouble(PyTuple_GET_ITEM(usepan, 1));
-		pan0.scalex = pan0.scalex * chscale;
-		pan0.shiftx = (pan0.shiftx * chscale) + chshift;
-		if (bothpans) {
-		  pan1.scalex = pan1.scalex * chscale;
-		  pan1.shiftx = (pan1.shiftx * chscale) + chshift;
-		}
-	      }
-	      if (tuplesize >= 4) {
-		double chshift, chscale;
-		chscale = PyFloat_AsDouble(PyTuple_GET_ITEM(usepan, 2));
-		chshift = PyFloat_AsDouble(PyTuple_GET_ITEM(usepan, 3));
-		pan0.scaley = pan0.scaley * chscale;
-		pan0.shifty = (pan0.shifty * chscale) + chshift;
-		if (bothpans) {
-		  pan1.scaley = pan1.scaley * chscale;
-		  pan1.shifty = (pan1.shifty * chscale) + chshift;
-		}
-	      }
-	    }
-	    else {
-	      /* Record the pan positions at the start and end of the 
-		 buffer (current_time and end_time). */
-	      if (!bothpans) {
-		/* This is the first non-constant pan we've hit. Set
-		   up pan1 to be the same as what we've computed so
-		   far. */
-		pan1 = pan0;
-		bothpans = TRUE;
-	      }
-	      /* Extract the stereo object values into stereo_t structs. */
-	      stereo_t tuplestart, tupleend;
-	      int tuplesizestart = 0;
-	      int tuplesizeend = 0;
-	      if (PyTuple_Check(startpan))
-		tuplesizestart = PyTuple_Size(startpan);
-	      if (tuplesizestart >= 2) {
-		tuplestart.scalex = PyFloat_AsDouble(PyTuple_GET_ITEM(startpan, 0));
-		tuplestart.shiftx = PyFloat_AsDouble(PyTuple_GET_ITEM(startpan, 1));
-	      }
-	      else {
-		tuplestart.scalex = 1.0;
-		tuplestart.shiftx = 0.0;
-	      }
-	      if (tuplesizestart >= 4) {
-		tuplestart.scaley = PyFloat_AsDouble(PyTuple_GET_ITEM(startpan, 2));
-		tuplestart.shifty = PyFloat_AsDouble(PyTuple_GET_ITEM(startpan, 3));
-	      }
-	      else {
-		tuplestart.scaley = 1.0;
-		tuplestart.shifty = 0.0;
-	      }
-	      if (PyTuple_Check(endpan))
-		tuplesizeend = PyTuple_Size(endpan);
-	      if (tuplesizeend >= 2) {
-		tupleend.scalex = PyFloat_AsDouble(PyTuple_GET_ITEM(endpan, 0));
-		tupleend.shiftx = PyFloat_AsDouble(PyTuple_GET_ITEM(endpan, 1));
-	      }
-	      else {
-		tupleend.scalex = 1.0;
-		tupleend.shiftx = 0.0;
-	      }
-	      if (tuplesizeend >= 4) {
-		tupleend.scaley = PyFloat_AsDouble(PyTuple_GET_ITEM(endpan, 2));
-		tupleend.shifty = PyFloat_AsDouble(PyTuple_GET_ITEM(endpan, 3));
-	      }
-	      else {
-		tupleend.scaley = 1.0;
-		tupleend.shifty = 0.0;
-	      }
-
-	      /* Interpolate for current_time, into pan0. */
-	      stereo_t usetuple;
-	      if (current_time >= endtm) {
-		usetuple = tupleend;
-	      }
-	      else if (current_time >= starttm) {
-		double ratio = ((double)(current_time - starttm)) / ((double)(endtm - starttm));
-		usetuple.scalex = ratio * (tupleend.scalex - tuplestart.scalex) + tuplestart.scalex;
-		usetuple.shiftx = ratio * (tupleend.shiftx - tuplestart.shiftx) + tuplestart.shiftx;
-		usetuple.scaley = ratio * (tupleend.scaley - tuplestart.scaley) + tuplestart.scaley;
-		usetuple.shifty = ratio * (tupleend.shifty - tuplestart.shifty) + tuplestart.shifty;
-	      }
-	      else {
-		usetuple = tuplestart;
-	      }
-	      pan0.scalex = pan0.scalex * usetuple.scalex;
-	      pan0.shiftx = (pan0.shiftx * usetuple.scalex) + usetuple.shiftx;
-	      pan0.scaley = pan0.scaley * usetuple.scaley;
-	      pan0.shifty = (pan0.shifty * usetuple.scaley) + usetuple.shifty;
-
-	      /* Interpolate for end_time, into pan1. */
-	      if (end_time >= endtm) {
-		usetuple = tupleend;
-	      }
-	      else if (end_time >= starttm) {
-		double ratio = ((double)(end_time - starttm)) / ((double)(endtm - starttm));
-		usetuple.scalex = ratio * (tupleend.scalex - tuplestart.scalex) + tuplestart.scalex;
-		usetuple.shiftx = ratio * (tupleend.shiftx - tuplestart.shiftx) + tuplestart.shiftx;
-		usetuple.scaley = ratio * (tupleend.scaley - tuplestart.scaley) + tuplestart.scaley;
-		usetuple.shifty = ratio * (tupleend.shifty - tuplestart.shifty) + tuplestart.shifty;
-	      }
-	      else {
-		usetuple = tuplestart;
-	      }
-	      pan1.scalex = pan1.scalex * usetuple.scalex;
-	      pan1.shiftx = (pan1.shiftx * usetuple.scalex) + usetuple.shiftx;
-	      pan1.scaley = pan1.scaley * usetuple.scaley;
-	      pan1.shifty = (pan1.shifty * usetuple.scaley) + usetuple.shifty;
-	    }
-	  }
-
-	  Py_DECREF(stereo);
-	}
-	stereo = NULL;
+/* The constant-volume fast path.
+
+   When no volume range or pan change is in effect, a note's
+   contribution to a stretch of the buffer is just a resampling at a
+   fixed gain. As long as the stretch doesn't touch a loop point or the
+   end of the sample, none of the per-frame checks in noteq_generate()
+   can fire, so the stretch can be mixed in one tight loop. The loops
+   below do exactly the same arithmetic as the general code, so the
+   output is identical. When the pitch is exactly the sample rate (the
+   usual case), the frame position advances by one each frame, and the
+   loops are simple enough for the compiler to vectorize.
+
+   const_span() works out how many frames the fast path can handle.
+   The stretch must stop before the frame position reaches bound-1,
+   where bound is the loop end (if the note has repetitions left) or
+   else the end of the sample. */
+
+static long const_span(long framepos, long framefrac, long lpitch,
+  long bound, long maxframes)
+{
+  double room;
+  long count;
 
-	/*
-	printf("pan0: %.3f %.3f %.3f %.3f. pan1: %.3f %.3f %.3f %.3f.\n",
-	  pan0.scalex, pan0.shiftx, pan0.scaley, pan0.shifty,
-	  pan1.scalex, pan1.shiftx, pan1.scaley, pan1.shifty); */
+  /* We may take count frames if framepos + ((framefrac + count*lpitch)
+     >> 16) + 1 < bound. */
+  room = (double)(bound - 1 - framepos) * 65536.0 - (double)framefrac;
+  if (room <= 0.0)
+    return 0;
 
-	/* Point chan at chan.parent, and continue the loop (unless
-	   we've reached the top of the tree). */
+  room = (room - 1.0) / (double)lpitch;
+  if (room >= (double)maxframes)
+    return maxframes;
+  count = (long)room;
+  return count;
+}
 
-	newchan = PyObject_GetAttrString(chan, "parent");
-	Py_DECREF(chan);
-	chan = NULL;
-	if (!newchan) {
-	  break;
-	}
-	if (newchan == Py_None) {
-	  Py_DECREF(newchan);
-	  break;
-	}
-	chan = newchan;
+static void mix_mono_const(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long ivollft, long ivolrgt)
+{
+  long framepos = *frameposptr;
+  long framefrac = *framefracptr;
+  long lx;
+
+  if (lpitch == 0x10000) {
+    value_t *src = sampdata + framepos;
+    long frac1 = framefrac;
+    long frac0 = 0x10000 - framefrac;
+
+    if (frac1 == 0) {
+      for (lx=0; lx<count; lx++) {
+	long result = (long)src[lx];
+	valptr[2*lx] += (result * ivollft) >> 16;
+	valptr[2*lx+1] += (result * ivolrgt) >> 16;
+      }
+    }
+    else {
+      for (lx=0; lx<count; lx++) {
+	long result = ((long)src[lx] * frac0) + ((long)src[lx+1] * frac1);
+	result >>= 16;
+	valptr[2*lx] += (result * ivollft) >> 16;
+	valptr[2*lx+1] += (result * ivolrgt) >> 16;
       }
     }
 
-    pitch = samp->framerate * note->pitch;
-    lpitch = (long)(pitch * (double)0x10000);
-    if (lpitch < 1)
-      lpitch = 1;
-    else if (lpitch > 0x10000000)
-      lpitch = 0x10000000;
+    framepos += count;
+  }
+  else {
+    for (lx=0; lx<count; lx++) {
+      long result = ((long)sampdata[framepos] * (0x10000-framefrac))
+	+ ((long)sampdata[framepos+1] * framefrac);
+      result >>= 16;
+      valptr[2*lx] += (result * ivollft) >> 16;
+      valptr[2*lx+1] += (result * ivolrgt) >> 16;
+
+      framefrac += lpitch;
+      framepos += (framefrac >> 16);
+      framefrac &= 0xFFFF;
+    }
+  }
 
-    framepos = note->framepos;
-    framefrac = note->framefrac;
-    numframes = samp->numframes;
-    sampdata = samp->data;
+  *frameposptr = framepos;
+  *framefracptr = framefrac;
+}
 
-    if (note->starttime >= current_time) {
-      notestart = note->starttime - current_time;
+static void mix_stereo_const(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long ivol0lft, long ivol0rgt, long ivol1lft, long ivol1rgt)
+{
+  long framepos = *frameposptr;
+  long framefrac = *framefracptr;
+  long lx;
+
+  if (lpitch == 0x10000) {
+    value_t *src = sampdata + 2*framepos;
+    long frac1 = framefrac;
+    long frac0 = 0x10000 - framefrac;
+
+    if (frac1 == 0) {
+      for (lx=0; lx<count; lx++) {
+	long resch0 = (long)src[2*lx];
+	long resch1 = (long)src[2*lx+1];
+	valptr[2*lx] += ((resch0 * ivol0lft) >> 16) 
+	  + ((resch1 * ivol1lft) >> 16);
+	valptr[2*lx+1] += ((resch0 * ivol0rgt) >> 16) 
+	  + ((resch1 * ivol1rgt) >> 16);
+      }
     }
     else {
-      notestart = 0;
+      for (lx=0; lx<count; lx++) {
+	long resch0 = ((long)src[2*lx] * frac0) + ((long)src[2*lx+2] * frac1);
+	long resch1 = ((long)src[2*lx+1] * frac0) + ((long)src[2*lx+3] * frac1);
+	resch0 >>= 16;
+	resch1 >>= 16;
+	valptr[2*lx] += ((resch0 * ivol0lft) >> 16) 
+	  + ((resch1 * ivol1lft) >> 16);
+	valptr[2*lx+1] += ((resch0 * ivol0rgt) >> 16) 
+	  + ((resch1 * ivol1rgt) >> 16);
+      }
     }
-    
-    valptr = &buffer[notestart*2];
 
-    if (samp->numchannels == 1) {
-      long lx;
+    framepos += count;
+  }
+  else {
+    for (lx=0; lx<count; lx++) {
+      long cursamp = framepos*2;
+      long resch0 = ((long)sampdata[cursamp] * (0x10000-framefrac))
+	+ ((long)sampdata[cursamp+2] * framefrac);
+      long resch1 = ((long)sampdata[cursamp+1] * (0x10000-framefrac))
+	+ ((long)sampdata[cursamp+3] * framefrac);
+      resch0 >>= 16;
+      resch1 >>= 16;
+      valptr[2*lx] += ((resch0 * ivol0lft) >> 16) 
+	+ ((resch1 * ivol1lft) >> 16);
+      valptr[2*lx+1] += ((resch0 * ivol0rgt) >> 16) 
+	+ ((resch1 * ivol1rgt) >> 16);
+
+      framefrac += lpitch;
+      framepos += (framefrac >> 16);
+      framefrac &= 0xFFFF;
+    }
+  }
 
-      /* Compute the volume adjustment for the left and right output
-	 channels, based on the pan position. */
-      double vollft, volrgt;
+  *frameposptr = framepos;
+  *framefracptr = framefrac;
+}
 
-      if (!bothpans) {
-	leftright_volumes(pan0.shiftx, pan0.shifty, &vollft, &volrgt);
-      }
-      else {
-	/* The pan position is changing, so don't put anything in
-	   vollft/volrgt. Instead, work out the left and right volume
-	   ranges. */
-	double tmp0lft, tmp0rgt;
-	double tmp1lft, tmp1rgt;
-
-	vollft = 1.0;
-	volrgt = 1.0;
-	range0lft.start = current_time;
-	range0rgt.start = current_time;
-	range0lft.end = end_time;
-	range0rgt.end = end_time;
-
-	leftright_volumes(pan0.shiftx, pan0.shifty, &tmp0lft, &tmp0rgt);
-	leftright_volumes(pan1.shiftx, pan1.shifty, &tmp1lft, &tmp1rgt);
-#ifdef BOODLER_INTMATH
-	range0lft.istartvol = (long)(tmp0lft * 65536.0);
-	range0lft.iendvol = (long)(tmp1lft * 65536.0);
-	range0rgt.istartvol = (long)(tmp0rgt * 65536.0);
-	range0rgt.iendvol = (long)(tmp1rgt * 65536.0);
-#else
-	range0lft.startvol = tmp0lft;
-	range0lft.endvol = tmp1lft;
-	range0rgt.startvol = tmp0rgt;
-	range0rgt.endvol = tmp1rgt;
-#endif
-      }
+/* The fade-block fast path. These are like the mix_*_const()
+   functions, but the gains move linearly from gain0 (at the start of
+   the fade block) towards gain1 (at its end). The stretch must lie
+   within one fade block, starting blockpos frames into it. */
 
-      long ivollft, ivolrgt;
-#ifdef BOODLER_INTMATH
-      long ivollftbase, ivolrgtbase;
-#endif
-      ivollft = (long)(volume * vollft * 65536.0);
-      ivolrgt = (long)(volume * volrgt * 65536.0);
-#ifdef BOODLER_INTMATH
-      ivollftbase = ivollft;
-      ivolrgtbase = ivolrgt;
-#endif
+static void mix_mono_ramp(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long *gain0, long *gain1, long blockpos)
+{
+  long framepos = *frameposptr;
+  long framefrac = *framefracptr;
+  long dlft = gain1[0] - gain0[0];
+  long drgt = gain1[1] - gain0[1];
+  long lx;
+
+  for (lx=0; lx<count; lx++) {
+    long ivollft = gain0[0] + ((dlft * (blockpos+lx)) >> fadeshift);
+    long ivolrgt = gain0[1] + ((drgt * (blockpos+lx)) >> fadeshift);
+    long result = ((long)sampdata[framepos] * (0x10000-framefrac))
+      + ((long)sampdata[framepos+1] * framefrac);
+    result >>= 16;
+    valptr[2*lx] += (result * ivollft) >> 16;
+    valptr[2*lx+1] += (result * ivolrgt) >> 16;
+
+    framefrac += lpitch;
+    framepos += (framefrac >> 16);
+    framefrac &= 0xFFFF;
+  }
 
-      for (lx=notestart; lx<framesperbuf; lx++) {
-	long cursamp, nextsamp;
-	long val0, val1;
-	long result, reslef, resrgt;
+  *frameposptr = framepos;
+  *framefracptr = framefrac;
+}
 
-	cursamp = framepos;
-	if (framepos+1 == samp->loopend && note->repsleft > 0) {
-	  nextsamp = (framepos + 1 - samp->looplen);
-	}
-	else {
-	  nextsamp = cursamp+1;
-	}
+static void mix_stereo_ramp(long *valptr, value_t *sampdata, long count,
+  long *frameposptr, long *framefracptr, long lpitch,
+  long *gain0, long *gain1, long blockpos)
+{
+  long framepos = *frameposptr;
+  long framefrac = *framefracptr;
+  long d0lft = gain1[0] - gain0[0];
+  long d0rgt = gain1[1] - gain0[1];
+  long d1lft = gain1[2] - gain0[2];
+  long d1rgt = gain1[3] - gain0[3];
+  long lx;
+
+  for (lx=0; lx<count; lx++) {
+    long pos = blockpos + lx;
+    long ivol0lft = gain0[0] + ((d0lft * pos) >> fadeshift);
+    long ivol0rgt = gain0[1] + ((d0rgt * pos) >> fadeshift);
+    long ivol1lft = gain0[2] + ((d1lft * pos) >> fadeshift);
+    long ivol1rgt = gain0[3] + ((d1rgt * pos) >> fadeshift);
+    long cursamp = framepos*2;
+    long resch0 = ((long)sampdata[cursamp] * (0x10000-framefrac))
+      + ((long)sampdata[cursamp+2] * framefrac);
+    long resch1 = ((long)sampdata[cursamp+1] * (0x10000-framefrac))
+      + ((long)sampdata[cursamp+3] * framefrac);
+    resch0 >>= 16;
+    resch1 >>= 16;
+    valptr[2*lx] += ((resch0 * ivol0lft) >> 16) 
+      + ((resch1 * ivol1lft) >> 16);
+    valptr[2*lx+1] += ((resch0 * ivol0rgt) >> 16) 
+      + ((resch1 * ivol1rgt) >> 16);
+
+    framefrac += lpitch;
+    framepos += (framefrac >> 16);
+    framefrac &= 0xFFFF;
+  }
 
-	val0 = (long)sampdata[cursamp];
-	val1 = (long)sampdata[nextsamp];
-	result = (val0 * (0x10000-framefrac)) + (val1 * framefrac);
+  *frameposptr = framepos;
+  *framefracptr = framefrac;
+}
 
-	if (numranges || bothpans) {
-	  int ranx;
-	  long curtime = current_time + lx;
-#ifdef BOODLER_INTMATH
-	  /* Start with 0x4000, instead of 0x10000, to allow some
-	     headroom when we multiply by values over 0x10000. We'll
-	     compensate later by downshifting >>14 instead of >>16. */
-	  long ivarvols = 0x4000;
-#else
-	  double varvols = 1.0;
-#endif
-	  for (ranx=0; ranx<numranges; ranx++) {
-	    APPLY_RANGE(ranges[ranx], curtime, varvols, ivarvols);
-	  }
+/* Mix the active notes using the worker pool, if parallel mixing is
+   turned on and worthwhile. Each note's finished flag is set. Returns
+   FALSE (having done nothing) if the caller should mix serially. */
+static int mix_parallel(long *buffer, long framesperbuf,
+  frametime_t end_time)
+{
+  long ix, jx;
+  int wx;
+  int stride;
 
-	  if (!bothpans) {
-	    /* Done. */
-#ifdef BOODLER_INTMATH
-	    ivollft = ((ivarvols * ivollftbase) >> 14);
-	    ivolrgt = ((ivarvols * ivolrgtbase) >> 14);
-#else
-	    ivollft = (long)(volume * varvols * vollft * 65536.0);
-	    ivolrgt = (long)(volume * varvols * volrgt * 65536.0);
+  if (numthreads <= 1 || numactive < PARALLEL_MIN_NOTES * numthreads) {
+    if (numworkers && numthreads <= 1)
+      pool_stop();
+    return FALSE;
+  }
+
+  if (numworkers != numthreads-1 || workerbufsize != 2*framesperbuf) {
+    pool_stop();
+    if (!pool_start(framesperbuf))
+      return FALSE;
+  }
+
+  stride = numworkers+1;
+
+  pthread_mutex_lock(&pool_mutex);
+  job_framesperbuf = framesperbuf;
+  job_end_time = end_time;
+  pool_busy = numworkers;
+  pool_generation++;
+  pthread_cond_broadcast(&pool_cond);
+  pthread_mutex_unlock(&pool_mutex);
+
+  /* The main thread takes share zero, mixing straight into the real
+     buffer. */
+  for (ix=0; ix<numactive; ix+=stride) {
+    note_t *note = active[ix];
+    note->finished = mix_note(note, buffer, framesperbuf, end_time);
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  pthread_mutex_lock(&pool_mutex);
+  while (pool_busy > 0)
+    pthread_cond_wait(&pool_cond, &pool_mutex);
+  pthread_mutex_unlock(&pool_mutex);
+  Py_END_ALLOW_THREADS
+
+  for (wx=0; wx<numworkers; wx++) {
+    long *wbuf = workers[wx].buffer;
+    for (jx=0; jx<workerbufsize; jx++)
+      buffer[jx] += wbuf[jx];
+  }
+
+  return TRUE;
+}
+
+/* Start numthreads-1 workers, with private buffers of the given size.
+   Returns FALSE if that failed (in which case nothing is running). */
+static int pool_start(long framesperbuf)
+{
+  int wx;
+
+  workers = (mixworker_t *)malloc(sizeof(mixworker_t) * (numthreads-1));
+  if (!workers)
+    return FALSE;
+  workerbufsize = 2*framesperbuf;
+  pool_quit = FALSE;
+
+  for (wx=0; wx<numthreads-1; wx++) {
+    mixworker_t *worker = &workers[wx];
+    worker->index = wx+1;
+    worker->seen = pool_generation;
+    worker->buffer = (long *)malloc(sizeof(long) * workerbufsize);
+    if (!worker->buffer)
+      break;
+    if (pthread_create(&worker->thread, NULL, pool_worker, worker)) {
+      free(worker->buffer);
+      break;
+    }
+    numworkers++;
+  }
+
+  if (numworkers < numthreads-1) {
+    fprintf(stderr, "Unable to start mixing threads.\n");
+    pool_stop();
+    numthreads = 1;
+    return FALSE;
+  }
+
+  return TRUE;
+}
+
+static void pool_stop()
+{
+  int wx;
+
+  if (!workers)
+    return;
+
+  pthread_mutex_lock(&pool_mutex);
+  pool_quit = TRUE;
+  pthread_cond_broadcast(&pool_cond);
+  pthread_mutex_unlock(&pool_mutex);
+
+  for (wx=0; wx<numworkers; wx++) {
+    pthread_join(workers[wx].thread, NULL);
+    free(workers[wx].buffer);
+    workers[wx].buffer = NULL;
+  }
+
+  free(workers);
+  workers = NULL;
+  numworkers = 0;
+  workerbufsize = 0;
+}
+
+/* The body of a worker thread. */
+static void *pool_worker(void *rock)
+{
+  mixworker_t *worker = rock;
+  long ix;
+
+  pthread_mutex_lock(&pool_mutex);
+  while (1) {
+    long framesperbuf;
+    frametime_t end_time;
+    int stride;
+
+    while (pool_generation == worker->seen && !pool_quit)
+      pthread_cond_wait(&pool_cond, &pool_mutex);
+    if (pool_quit)
+      break;
+    worker->seen = pool_generation;
+    framesperbuf = job_framesperbuf;
+    end_time = job_end_time;
+    stride = numworkers+1;
+    pthread_mutex_unlock(&pool_mutex);
+
+    memset(worker->buffer, 0, sizeof(long) * 2 * framesperbuf);
+    for (ix=worker->index; ix<numactive; ix+=stride) {
+      note_t *note = active[ix];
+      note->finished = mix_note(note, worker->buffer, framesperbuf, 
+	end_time);
+    }
+
+    pthread_mutex_lock(&pool_mutex);
+    pool_busy--;
+    if (pool_busy == 0)
+      pthread_cond_broadcast(&pool_cond);
+  }
+  pthread_mutex_unlock(&pool_mutex);
+
+  return NULL;
+}
+
+/* Mix one note's contribution into the buffer. The note's channel
+   must already have been prepared for this buffer. Returns TRUE if
+   the note has finished playing.
+
+   The following code is unapologetically long, repetitive, and nasty.
+   This is the bottom loop for mixing sound, so we don't trade off
+   cycles for anything. */
+static int mix_note(note_t *note, long *buffer, long framesperbuf,
+  frametime_t end_time)
+{
+  sample_t *samp;
+  int willdelete = FALSE;
+  long notestart;
+  double pitch;
+  long lpitch;
+  double volume;
+  int bothpans;
+  int numranges;
+  volrange_t *ranges;
+  long *valptr;
+  value_t *sampdata;
+  long framepos, framefrac;
+  long numframes;
+  int varying, usefast;
+  note_t *envnote;
+  notegain_t gains;
+  long gain0[4], gain1[4];
+  long blockend;
+
+  /* These could be declared inside the branches, but if I put them
+     outside I can initialize them early, which squashes some stupid
+     compiler warnings. */
+  stereo_t pan0, pan1;
+  volrange_t range0lft, range0rgt, range1lft, range1rgt;
+
+  /* Squash stupid compiler warnings. */
+  memset(&pan1, 0, sizeof(pan1));
+  memset(&range0lft, 0, sizeof(range0lft));
+  range0rgt = range1lft = range1rgt = range0lft;
+
+  samp = note->sample;
+
+  pan0 = note->pan;
+  bothpans = FALSE;
+  volume = note->volume;
+  numranges = 0;
+  ranges = NULL;
+
+  /* We must compute a total volume, by multiplying the note's
+     volume by the volume factor of every channel it's in; and a
+     total stereo position, by composing the note's pan with the
+     transform of every channel it's in. The channel_t objects do
+     that work, once per buffer, and cache the result. (See
+     channel_prepare(), which noteq_generate() has already called.)
+
+     The tricky part is that some channels might be in the middle of
+     a volume change. Those channels (only) appear on the channel's
+     ranges list, which will be consulted once per frame, as we
+     generate the note. Similarly, if some channel is in the middle
+     of a pan change, the channel keeps track of two stereo
+     transforms: that at the beginning of the buffer, and that at
+     the end. The bothpans flag indicates this case. */
+
+  if (note->cchan) {
+    channel_t *chan = note->cchan;
+    volume *= chan->curvol;
+    numranges = chan->numranges;
+    ranges = chan->ranges;
+    stereo_compose(&chan->pan0, &note->pan, &pan0);
+    if (chan->bothpans) {
+      stereo_compose(&chan->pan1, &note->pan, &pan1);
+      bothpans = TRUE;
+    }
+  }
+
+  pitch = samp->framerate * note->pitch;
+  lpitch = (long)(pitch * (double)0x10000);
+  if (lpitch < 1)
+    lpitch = 1;
+  else if (lpitch > 0x10000000)
+    lpitch = 0x10000000;
+
+  framepos = note->framepos;
+  framefrac = note->framefrac;
+  numframes = samp->numframes;
+  sampdata = samp->data;
+
+  if (note->starttime >= current_time) {
+    notestart = (long)(note->starttime - current_time);
+  }
+  else {
+    notestart = 0;
+  }
+
+  /* A streamed sample might not be in memory yet. If it can't be
+     read in time, the note is silent for this buffer. */
+  if (samp->stream && !stream_prepare(samp, framepos, note->repsleft,
+      pitch, framesperbuf - notestart, mix_stamp))
+    return skip_note(note, lpitch, framesperbuf - notestart);
+
+  valptr = &buffer[notestart*2];
+
+  /* A note with an attack or release is fading only in the buffers
+     which overlap those fades. The rest of the time it costs nothing
+     extra. */
+  envnote = NULL;
+  if ((note->attack && current_time < note->starttime + note->attack)
+    || (note->release && end_time > note->endtime - note->release))
+    envnote = note;
+
+  varying = (numranges || bothpans || envnote);
+  /* The fast path is no help if every frame is its own fade block. */
+  usefast = (fastmix && !(varying && fadeblock == 1));
+
+  /* If some volume or pan is changing (or the note is fading in or
+     out), compute_gains() will be called once per fade block. These
+     fields are the same for every block; the rest are filled in
+     below. */
+  gains.numranges = numranges;
+  gains.ranges = ranges;
+  gains.envnote = envnote;
+  gains.bothpans = bothpans;
+#ifndef BOODLER_INTMATH
+  gains.volume = volume;
 #endif
-	  }
-	  else {
-	    /* More to do -- we need to throw range0lft/range0rgt into
-	       the mix. */
+  blockend = 0;
+  /* Squash stupid compiler warnings. */
+  memset(gain0, 0, sizeof(gain0));
+
+  if (samp->numchannels == 1) {
+    long lx;
+    long ivollft, ivolrgt;
+
+    /* Compute the volume adjustment for the left and right output
+       channels, based on the pan position. */
+    double vollft, volrgt;
+
+    if (!bothpans) {
+      leftright_volumes(pan0.shiftx, pan0.shifty, &vollft, &volrgt);
+    }
+    else {
+      /* The pan position is changing, so don't put anything in
+	 vollft/volrgt. Instead, work out the left and right volume
+	 ranges. */
+      double tmp0lft, tmp0rgt;
+      double tmp1lft, tmp1rgt;
+
+      vollft = 1.0;
+      volrgt = 1.0;
+      range0lft.start = current_time;
+      range0rgt.start = current_time;
+      range0lft.end = end_time;
+      range0rgt.end = end_time;
+
+      leftright_volumes(pan0.shiftx, pan0.shifty, &tmp0lft, &tmp0rgt);
+      leftright_volumes(pan1.shiftx, pan1.shifty, &tmp1lft, &tmp1rgt);
 #ifdef BOODLER_INTMATH
-	    long ivarvolslft = ivarvols;
-	    long ivarvolsrgt = ivarvols;
+      range0lft.istartvol = (long)(tmp0lft * 65536.0);
+      range0lft.iendvol = (long)(tmp1lft * 65536.0);
+      range0rgt.istartvol = (long)(tmp0rgt * 65536.0);
+      range0rgt.iendvol = (long)(tmp1rgt * 65536.0);
 #else
-	    double varvolslft = varvols;
-	    double varvolsrgt = varvols;
+      range0lft.startvol = tmp0lft;
+      range0lft.endvol = tmp1lft;
+      range0rgt.startvol = tmp0rgt;
+      range0rgt.endvol = tmp1rgt;
 #endif
-	    APPLY_RANGE(range0lft, curtime, varvolslft, ivarvolslft);
-	    APPLY_RANGE(range0rgt, curtime, varvolsrgt, ivarvolsrgt);
+    }
 
+    ivollft = (long)(volume * vollft * 65536.0);
+    ivolrgt = (long)(volume * volrgt * 65536.0);
+
+    if (varying) {
+      gains.numgains = 2;
+      gains.panranges[0] = range0lft;
+      gains.panranges[1] = range0rgt;
 #ifdef BOODLER_INTMATH
-	    ivollft = ((ivarvolslft * ivollftbase) >> 14);
-	    ivolrgt = ((ivarvolsrgt * ivolrgtbase) >> 14);
+      gains.ibase[0] = ivollft;
+      gains.ibase[1] = ivolrgt;
 #else
-	    ivollft = (long)(volume * varvolslft * vollft * 65536.0);
-	    ivolrgt = (long)(volume * varvolsrgt * volrgt * 65536.0);
+      gains.base[0] = vollft;
+      gains.base[1] = volrgt;
 #endif
-	  }
-	}
-
-	/* All of the volume and pan information has been boiled down
-	   into ivollft/ivolrgt. Apply it to the sample. */
-
-	reslef = ((result >> 16) * ivollft) >> 16;
-	resrgt = ((result >> 16) * ivolrgt) >> 16;
-	
-	*valptr += reslef;
-	valptr++;
-	*valptr += resrgt;
-	valptr++;
-
-	framefrac += lpitch;
-	framepos += (framefrac >> 16);
-	framefrac &= 0xFFFF;
+      blockend = notestart;
+      compute_gains(&gains, current_time + notestart, gain1);
+    }
 
-	while (note->repsleft > 0 && framepos >= samp->loopend) {
-	  framepos -= samp->looplen;
-	  note->repsleft--;
-	}
+    for (lx=notestart; lx<framesperbuf; lx++) {
+      long cursamp, nextsamp;
+      long val0, val1;
+      long result, reslef, resrgt;
+
+      if (varying && lx >= blockend) {
+	/* Start a new fade block. Its starting gains are the previous
+	   block's ending gains. */
+	gain0[0] = gain1[0];
+	gain0[1] = gain1[1];
+	blockend = lx + fadeblock;
+	compute_gains(&gains, current_time + blockend, gain1);
+      }
 
-	if (framepos+1 >= numframes && note->repsleft == 0) {
-	  willdelete = TRUE;
-	  break;
+      if (usefast) {
+	long limit = framesperbuf;
+	long count;
+	if (varying && blockend < limit)
+	  limit = blockend;
+	count = const_span(framepos, framefrac, lpitch,
+	  ((note->repsleft > 0) ? samp->loopend : numframes), limit - lx);
+	if (count > 0) {
+	  if (!varying)
+	    mix_mono_const(valptr, sampdata, count, &framepos, &framefrac,
+	      lpitch, ivollft, ivolrgt);
+	  else
+	    mix_mono_ramp(valptr, sampdata, count, &framepos, &framefrac,
+	      lpitch, gain0, gain1, lx + fadeblock - blockend);
+	  valptr += 2*count;
+	  lx += (count-1);
+	  continue;
 	}
       }
-    }
-    else { /* samp->numchannels == 2 */
-      long lx;
-
-      /* Compute the volume adjustment for the left and right output
-	 channels, based on the pan position. We have to do this
-	 twice: for input channel 0 and for input channel 1. */
-      double vol0lft, vol0rgt, vol1lft, vol1rgt;
-
-      if (!bothpans) {
-	leftright_volumes(pan0.shiftx - pan0.scalex, pan0.shifty,
-	  &vol0lft, &vol0rgt); 
-	leftright_volumes(pan0.shiftx + pan0.scalex, pan0.shifty,
-	  &vol1lft, &vol1rgt);
+
+      cursamp = framepos;
+      if (framepos+1 == samp->loopend && note->repsleft > 0) {
+	nextsamp = (framepos + 1 - samp->looplen);
       }
       else {
-	/* The pan position is changing, so don't put anything in
-	   vol#lft/vol#rgt. Instead, work out the left and right volume
-	   ranges for each channel. */
-	double tmp0lft, tmp0rgt;
-	double tmp1lft, tmp1rgt;
-
-	vol0lft = 1.0;
-	vol0rgt = 1.0;
-	range0lft.start = current_time;
-	range0rgt.start = current_time;
-	range0lft.end = end_time;
-	range0rgt.end = end_time;
-
-	leftright_volumes(pan0.shiftx - pan0.scalex, pan0.shifty,
-	  &tmp0lft, &tmp0rgt);
-	leftright_volumes(pan1.shiftx - pan1.scalex, pan1.shifty,
-	  &tmp1lft, &tmp1rgt);
-#ifdef BOODLER_INTMATH
-	range0lft.istartvol = (long)(tmp0lft * 65536.0);
-	range0lft.iendvol = (long)(tmp1lft * 65536.0);
-	range0rgt.istartvol = (long)(tmp0rgt * 65536.0);
-	range0rgt.iendvol = (long)(tmp1rgt * 65536.0);
-#else
-	range0lft.startvol = tmp0lft;
-	range0lft.endvol = tmp1lft;
-	range0rgt.startvol = tmp0rgt;
-	range0rgt.endvol = tmp1rgt;
-#endif
+	nextsamp = cursamp+1;
+      }
 
-	vol1lft = 1.0;
-	vol1rgt = 1.0;
-	range1lft.start = current_time;
-	range1rgt.start = current_time;
-	range1lft.end = end_time;
-	range1rgt.end = end_time;
-
-	leftright_volumes(pan0.shiftx + pan0.scalex, pan0.shifty,
-	  &tmp0lft, &tmp0rgt);
-	leftright_volumes(pan1.shiftx + pan1.scalex, pan1.shifty,
-	  &tmp1lft, &tmp1rgt);
-#ifdef BOODLER_INTMATH
-	range1lft.istartvol = (long)(tmp0lft * 65536.0);
-	range1lft.iendvol = (long)(tmp1lft * 65536.0);
-	range1rgt.istartvol = (long)(tmp0rgt * 65536.0);
-	range1rgt.iendvol = (long)(tmp1rgt * 65536.0);
-#else
-	range1lft.startvol = tmp0lft;
-	range1lft.endvol = tmp1lft;
-	range1rgt.startvol = tmp0rgt;
-	range1rgt.endvol = tmp1rgt;
-#endif
+      val0 = (long)sampdata[cursamp];
+      val1 = (long)sampdata[nextsamp];
+      result = (val0 * (0x10000-framefrac)) + (val1 * framefrac);
+
+      if (varying) {
+	long blockpos = lx + fadeblock - blockend;
+	ivollft = gain0[0] + (((gain1[0] - gain0[0]) * blockpos) >> fadeshift);
+	ivolrgt = gain0[1] + (((gain1[1] - gain0[1]) * blockpos) >> fadeshift);
       }
 
-      /* printf("(%gA+%gB , %gA+%gB)\n", vol0lft, vol1lft, vol0rgt, vol1rgt); */
+      /* All of the volume and pan information has been boiled down
+	 into ivollft/ivolrgt. Apply it to the sample. */
 
-      long ivol0lft, ivol0rgt, ivol1lft, ivol1rgt;
-#ifdef BOODLER_INTMATH
-      long ivol0lftbase, ivol0rgtbase;
-      long ivol1lftbase, ivol1rgtbase;
-#endif      
-      ivol0lft = (long)(volume * vol0lft * 65536.0);
-      ivol0rgt = (long)(volume * vol0rgt * 65536.0);
-      ivol1lft = (long)(volume * vol1lft * 65536.0);
-      ivol1rgt = (long)(volume * vol1rgt * 65536.0);
-#ifdef BOODLER_INTMATH
-      ivol0lftbase = ivol0lft;
-      ivol0rgtbase = ivol0rgt;
-      ivol1lftbase = ivol1lft;
-      ivol1rgtbase = ivol1rgt;
-#endif
-      
-      for (lx=notestart; lx<framesperbuf; lx++) {
-	long cursamp, nextsamp;
-	long val0, val1;
-	long resch0, resch1;
-	long res0lef, res0rgt, res1lef, res1rgt;
-
-	cursamp = framepos*2;
-	if (framepos+1 == samp->loopend && note->repsleft > 0) {
-	  nextsamp = (framepos + 1 - samp->looplen)*2;
-	}
-	else {
-	  nextsamp = cursamp+2;
-	}
+      reslef = ((result >> 16) * ivollft) >> 16;
+      resrgt = ((result >> 16) * ivolrgt) >> 16;
 
-	val0 = (long)sampdata[cursamp];
-	val1 = (long)sampdata[nextsamp];
-	resch0 = (val0 * (0x10000-framefrac)) + (val1 * framefrac);
-	val0 = (long)sampdata[cursamp+1];
-	val1 = (long)sampdata[nextsamp+1];
-	resch1 = (val0 * (0x10000-framefrac)) + (val1 * framefrac);
+      *valptr += reslef;
+      valptr++;
+      *valptr += resrgt;
+      valptr++;
 
-	if (numranges || bothpans) {
-	  int ranx;
-	  long curtime = current_time + lx;
-#ifdef BOODLER_INTMATH
-	  long ivarvols = 0x4000;
-#else
-	  double varvols = 1.0;
-#endif
-	  for (ranx=0; ranx<numranges; ranx++) {
-	    APPLY_RANGE(ranges[ranx], curtime, varvols, ivarvols);
-	  }
+      framefrac += lpitch;
+      framepos += (framefrac >> 16);
+      framefrac &= 0xFFFF;
 
-	  if (!bothpans) {
-	    /* Done. */
+      while (note->repsleft > 0 && framepos >= samp->loopend) {
+	framepos -= samp->looplen;
+	note->repsleft--;
+      }
+
+      if (framepos+1 >= numframes && note->repsleft == 0) {
+	willdelete = TRUE;
+	break;
+      }
+    }
+  }
+  else { /* samp->numchannels == 2 */
+    long lx;
+    long ivol0lft, ivol0rgt, ivol1lft, ivol1rgt;
+
+    /* Compute the volume adjustment for the left and right output
+       channels, based on the pan position. We have to do this
+       twice: for input channel 0 and for input channel 1. */
+    double vol0lft, vol0rgt, vol1lft, vol1rgt;
+
+    if (!bothpans) {
+      leftright_volumes(pan0.shiftx - pan0.scalex, pan0.shifty,
+	&vol0lft, &vol0rgt); 
+      leftright_volumes(pan0.shiftx + pan0.scalex, pan0.shifty,
+	&vol1lft, &vol1rgt);
+    }
+    else {
+      /* The pan position is changing, so don't put anything in
+	 vol#lft/vol#rgt. Instead, work out the left and right volume
+	 ranges for each channel. */
+      double tmp0lft, tmp0rgt;
+      double tmp1lft, tmp1rgt;
+
+      vol0lft = 1.0;
+      vol0rgt = 1.0;
+      range0lft.start = current_time;
+      range0rgt.start = current_time;
+      range0lft.end = end_time;
+      range0rgt.end = end_time;
+
+      leftright_volumes(pan0.shiftx - pan0.scalex, pan0.shifty,
+	&tmp0lft, &tmp0rgt);
+      leftright_volumes(pan1.shiftx - pan1.scalex, pan1.shifty,
+	&tmp1lft, &tmp1rgt);
 #ifdef BOODLER_INTMATH
-	    ivol0lft = ((ivarvols * ivol0lftbase) >> 14);
-	    ivol0rgt = ((ivarvols * ivol0rgtbase) >> 14);
-	    ivol1lft = ((ivarvols * ivol1lftbase) >> 14);
-	    ivol1rgt = ((ivarvols * ivol1rgtbase) >> 14);
+      range0lft.istartvol = (long)(tmp0lft * 65536.0);
+      range0lft.iendvol = (long)(tmp1lft * 65536.0);
+      range0rgt.istartvol = (long)(tmp0rgt * 65536.0);
+      range0rgt.iendvol = (long)(tmp1rgt * 65536.0);
 #else
-	    ivol0lft = (long)(volume * vol0lft * varvols * 65536.0);
-	    ivol0rgt = (long)(volume * vol0rgt * varvols * 65536.0);
-	    ivol1lft = (long)(volume * vol1lft * varvols * 65536.0);
-	    ivol1rgt = (long)(volume * vol1rgt * varvols * 65536.0);
+      range0lft.startvol = tmp0lft;
+      range0lft.endvol = tmp1lft;
+      range0rgt.startvol = tmp0rgt;
+      range0rgt.endvol = tmp1rgt;
 #endif
-	  }
-	  else {
-	    /* More to do -- we need to throw range*lft/range*rgt into
-	       the mix. */
+
+      vol1lft = 1.0;
+      vol1rgt = 1.0;
+      range1lft.start = current_time;
+      range1rgt.start = current_time;
+      range1lft.end = end_time;
+      range1rgt.end = end_time;
+
+      leftright_volumes(pan0.shiftx + pan0.scalex, pan0.shifty,
+	&tmp0lft, &tmp0rgt);
+      leftright_volumes(pan1.shiftx + pan1.scalex, pan1.shifty,
+	&tmp1lft, &tmp1rgt);
 #ifdef BOODLER_INTMATH
-	    long ivarvolslft0 = ivarvols;
-	    long ivarvolsrgt0 = ivarvols;
-	    long ivarvolslft1 = ivarvols;
-	    long ivarvolsrgt1 = ivarvols;
+      range1lft.istartvol = (long)(tmp0lft * 65536.0);
+      range1lft.iendvol = (long)(tmp1lft * 65536.0);
+      range1rgt.istartvol = (long)(tmp0rgt * 65536.0);
+      range1rgt.iendvol = (long)(tmp1rgt * 65536.0);
 #else
-	    double varvolslft0 = varvols;
-	    double varvolsrgt0 = varvols;
-	    double varvolslft1 = varvols;
-	    double varvolsrgt1 = varvols;
+      range1lft.startvol = tmp0lft;
+      range1lft.endvol = tmp1lft;
+      range1rgt.startvol = tmp0rgt;
+      range1rgt.endvol = tmp1rgt;
 #endif
-	    APPLY_RANGE(range0lft, curtime, varvolslft0, ivarvolslft0);
-	    APPLY_RANGE(range0rgt, curtime, varvolsrgt0, ivarvolsrgt0);
-	    APPLY_RANGE(range1lft, curtime, varvolslft1, ivarvolslft1);
-	    APPLY_RANGE(range1rgt, curtime, varvolsrgt1, ivarvolsrgt1);
+    }
+
+    /* printf("(%gA+%gB , %gA+%gB)\n", vol0lft, vol1lft, vol0rgt, vol1rgt); */
 
+    ivol0lft = (long)(volume * vol0lft * 65536.0);
+    ivol0rgt = (long)(volume * vol0rgt * 65536.0);
+    ivol1lft = (long)(volume * vol1lft * 65536.0);
+    ivol1rgt = (long)(volume * vol1rgt * 65536.0);
+
+    if (varying) {
+      gains.numgains = 4;
+      gains.panranges[0] = range0lft;
+      gains.panranges[1] = range0rgt;
+      gains.panranges[2] = range1lft;
+      gains.panranges[3] = range1rgt;
 #ifdef BOODLER_INTMATH
-	    ivol0lft = ((ivarvolslft0 * ivol0lftbase) >> 14);
-	    ivol0rgt = ((ivarvolsrgt0 * ivol0rgtbase) >> 14);
-	    ivol1lft = ((ivarvolslft1 * ivol1lftbase) >> 14);
-	    ivol1rgt = ((ivarvolsrgt1 * ivol1rgtbase) >> 14);
+      gains.ibase[0] = ivol0lft;
+      gains.ibase[1] = ivol0rgt;
+      gains.ibase[2] = ivol1lft;
+      gains.ibase[3] = ivol1rgt;
 #else
-	    ivol0lft = (long)(volume * vol0lft * varvolslft0 * 65536.0);
-	    ivol0rgt = (long)(volume * vol0rgt * varvolsrgt0 * 65536.0);
-	    ivol1lft = (long)(volume * vol1lft * varvolslft1 * 65536.0);
-	    ivol1rgt = (long)(volume * vol1rgt * varvolsrgt1 * 65536.0);
+      gains.base[0] = vol0lft;
+      gains.base[1] = vol0rgt;
+      gains.base[2] = vol1lft;
+      gains.base[3] = vol1rgt;
 #endif
-	  }
-	}
+      blockend = notestart;
+      compute_gains(&gains, current_time + notestart, gain1);
+    }
 
-	/* All of the volume and pan information has been boiled down
-	   into ivol#lft/ivol#rgt. Apply it to the sample. */
+    for (lx=notestart; lx<framesperbuf; lx++) {
+      long cursamp, nextsamp;
+      long val0, val1;
+      long resch0, resch1;
+      long res0lef, res0rgt, res1lef, res1rgt;
+
+      if (varying && lx >= blockend) {
+	gain0[0] = gain1[0];
+	gain0[1] = gain1[1];
+	gain0[2] = gain1[2];
+	gain0[3] = gain1[3];
+	blockend = lx + fadeblock;
+	compute_gains(&gains, current_time + blockend, gain1);
+      }
 
-	res0lef = ((resch0 >> 16) * ivol0lft) >> 16;
-	res0rgt = ((resch0 >> 16) * ivol0rgt) >> 16;
-	res1lef = ((resch1 >> 16) * ivol1lft) >> 16;
-	res1rgt = ((resch1 >> 16) * ivol1rgt) >> 16;
-      
-	*valptr += (res0lef+res1lef);
-	valptr++;
-	*valptr += (res0rgt+res1rgt);
-	valptr++;
-
-	framefrac += lpitch;
-	framepos += (framefrac >> 16);
-	framefrac &= 0xFFFF;
-
-	while (note->repsleft > 0 && framepos >= samp->loopend) {
-	  framepos -= samp->looplen;
-	  note->repsleft--;
+      if (usefast) {
+	long limit = framesperbuf;
+	long count;
+	if (varying && blockend < limit)
+	  limit = blockend;
+	count = const_span(framepos, framefrac, lpitch,
+	  ((note->repsleft > 0) ? samp->loopend : numframes), limit - lx);
+	if (count > 0) {
+	  if (!varying)
+	    mix_stereo_const(valptr, sampdata, count, &framepos, &framefrac,
+	      lpitch, ivol0lft, ivol0rgt, ivol1lft, ivol1rgt);
+	  else
+	    mix_stereo_ramp(valptr, sampdata, count, &framepos, &framefrac,
+	      lpitch, gain0, gain1, lx + fadeblock - blockend);
+	  valptr += 2*count;
+	  lx += (count-1);
+	  continue;
 	}
+      }
 
-	if (framepos+1 >= numframes && note->repsleft == 0) {
-	  willdelete = TRUE;
-	  break;
-	}
+      cursamp = framepos*2;
+      if (framepos+1 == samp->loopend && note->repsleft > 0) {
+	nextsamp = (framepos + 1 - samp->looplen)*2;
+      }
+      else {
+	nextsamp = cursamp+2;
+      }
+
+      val0 = (long)sampdata[cursamp];
+      val1 = (long)sampdata[nextsamp];
+      resch0 = (val0 * (0x10000-framefrac)) + (val1 * framefrac);
+      val0 = (long)sampdata[cursamp+1];
+      val1 = (long)sampdata[nextsamp+1];
+      resch1 = (val0 * (0x10000-framefrac)) + (val1 * framefrac);
+
+      if (varying) {
+	long blockpos = lx + fadeblock - blockend;
+	ivol0lft = gain0[0] + (((gain1[0] - gain0[0]) * blockpos) >> fadeshift);
+	ivol0rgt = gain0[1] + (((gain1[1] - gain0[1]) * blockpos) >> fadeshift);
+	ivol1lft = gain0[2] + (((gain1[2] - gain0[2]) * blockpos) >> fadeshift);
+	ivol1rgt = gain0[3] + (((gain1[3] - gain0[3]) * blockpos) >> fadeshift);
+      }
+
+      /* All of the volume and pan information has been boiled down
+	 into ivol#lft/ivol#rgt. Apply it to the sample. */
+
+      res0lef = ((resch0 >> 16) * ivol0lft) >> 16;
+      res0rgt = ((resch0 >> 16) * ivol0rgt) >> 16;
+      res1lef = ((resch1 >> 16) * ivol1lft) >> 16;
+      res1rgt = ((resch1 >> 16) * ivol1rgt) >> 16;
+
+      *valptr += (res0lef+res1lef);
+      valptr++;
+      *valptr += (res0rgt+res1rgt);
+      valptr++;
+
+      framefrac += lpitch;
+      framepos += (framefrac >> 16);
+      framefrac &= 0xFFFF;
+
+      while (note->repsleft > 0 && framepos >= samp->loopend) {
+	framepos -= samp->looplen;
+	note->repsleft--;
+      }
+
+      if (framepos+1 >= numframes && note->repsleft == 0) {
+	willdelete = TRUE;
+	break;
       }
     }
+  }
+
+  note->framepos = framepos;
+  note->framefrac = framefrac;
 
-    note->framepos = framepos;
-    note->framefrac = framefrac;
+  return willdelete;
+}
 
-    if (!willdelete) {
-      nptr = &((*nptr)->next);
+/* Move a note forward count frames without mixing it, as if it had
+   played. Returns TRUE if the note has finished playing. */
+static int skip_note(note_t *note, long lpitch, long count)
+{
+  sample_t *samp = note->sample;
+  long framepos = note->framepos;
+  long framefrac = note->framefrac;
+  int willdelete = FALSE;
+  long lx;
+
+  for (lx=0; lx<count; lx++) {
+    framefrac += lpitch;
+    framepos += (framefrac >> 16);
+    framefrac &= 0xFFFF;
+
+    while (note->repsleft > 0 && framepos >= samp->loopend) {
+      framepos -= samp->looplen;
+      note->repsleft--;
     }
-    else {
-      note_destroy(nptr);
+
+    if (framepos+1 >= samp->numframes && note->repsleft == 0) {
+      willdelete = TRUE;
+      break;
     }
   }
 
-  current_time = end_time;
-  return FALSE;
+  note->framepos = framepos;
+  note->framefrac = framefrac;
+
+  return willdelete;
 }
 
-void note_destroy_by_channel(PyObject *channel)
+int noteq_generate(long *buffer, generate_func_t genfunc, void *rock)
 {
-  note_t **nptr;
+  long ix;
+  long framesperbuf = audev_get_framesperbuf();
+  frametime_t end_time;
 
-  nptr = &queue;
-  while (1) {
-    note_t *note = (*nptr);
-    int willdelete = FALSE;
+  if (genfunc) {
+    int res = (*genfunc)(current_time, rock);
+    if (res)
+      return TRUE;
+  }
 
-    if (!note) {
-      break;
-    }
+  end_time = current_time + framesperbuf;
+  mix_stamp++;
 
-    if (note->channel == channel) {
-      willdelete = TRUE;
-    }
-    else {
-      if (note->channel && channel) {
-	PyObject *ancs = PyObject_GetAttrString(note->channel, "ancestors");
-	if (ancs) {
-	  if (PyMapping_HasKey(ancs, channel))
-	    willdelete = TRUE;
-	  Py_DECREF(ancs);
-	}
-      }
+  memset(buffer, 0, sizeof(long) * 2 * framesperbuf);
+
+  /* Move every note which starts during this buffer from the pending
+     queue to the active array. */
+  while (numpending > 0 && pending[0]->starttime < end_time) {
+    note_t *note;
+    if (!grow_array(&active, &maxactive, numactive+1))
+      return TRUE;
+    note = pending_pop();
+    note->isactive = TRUE;
+    note->queuepos = numactive;
+    active[numactive] = note;
+    numactive++;
+  }
+
+  /* Bring every active note's channel up to date for this buffer.
+     This is done before any mixing, because the mixing may be spread
+     across several threads, and the channel cache is not thread-safe. */
+  for (ix=0; ix<numactive; ix++) {
+    channel_t *chan = active[ix]->cchan;
+    if (chan && !channel_prepare(chan, mix_stamp, current_time, end_time))
+      return TRUE;
+  }
+
+  /* For each active note, add its contribution into the buffer. */
+  if (!mix_parallel(buffer, framesperbuf, end_time)) {
+    for (ix=0; ix<numactive; ix++) {
+      note_t *note = active[ix];
+      note->finished = mix_note(note, buffer, framesperbuf, end_time);
     }
+  }
 
-    if (!willdelete) {
-      nptr = &((*nptr)->next);
+  /* Remove the notes which have finished. */
+  ix = 0;
+  while (ix < numactive) {
+    note_t *note = active[ix];
+    if (!note->finished) {
+      ix++;
     }
     else {
-      note_destroy(nptr);
+      /* The hole is filled with the last active note, which we'll
+         look at next time around. */
+      active_remove(ix);
+      note_destroy(note);
     }
   }
+
+  /* Let go of streamed sample data that no note is using. */
+  stream_sweep(mix_stamp);
+
+  current_time = end_time;
+  return FALSE;
+}
+
+/* Destroy every note in the channel and in all its subchannels. This
+   walks only that part of the channel tree, and the notes in it. */
+void note_destroy_by_channel(channel_t *chan)
+{
+  note_t **doomed;
+  long numdoomed;
+  long ix;
+
+  numdoomed = collect_channel_notes(chan, NULL, 0);
+  if (!numdoomed)
+    return;
+
+  doomed = (note_t **)malloc(sizeof(note_t *) * numdoomed);
+  if (!doomed)
+    return;
+
+  /* Pull the notes out of the queues first, and only then destroy
+     them. (Destroying a note may free a channel we'd otherwise still
+     be walking.) */
+  numdoomed = collect_channel_notes(chan, doomed, 0);
+
+  for (ix=0; ix<numdoomed; ix++) {
+    note_destroy(doomed[ix]);
+  }
+
+  free(doomed);
 }
 
-void noteq_adjust_timebase(long offset)
+/* Count the notes in a channel and its subchannels. If doomed is not
+   NULL, also take each note out of its queue and append it to doomed.
+   Returns the new count. */
+static long collect_channel_notes(channel_t *chan, note_t **doomed,
+  long numdoomed)
 {
   note_t *note;
+  channel_t *child;
+
+  for (note = chan->firstnote; note; note = note->channext) {
+    if (doomed) {
+      if (note->isactive)
+	active_remove(note->queuepos);
+      else
+	pending_remove(note->queuepos);
+      doomed[numdoomed] = note;
+    }
+    numdoomed++;
+  }
 
-  current_time -= offset;
+  for (child = chan->firstchild; child; child = child->nextsibling) {
+    numdoomed = collect_channel_notes(child, doomed, numdoomed);
+  }
 
-  for (note = queue; note; note = note->next) {
-    note->starttime -= offset;
-  }  
+  return numdoomed;
 }
 
 /* Given a point-source of sound at (shiftx, shifty), determine the
@@ -6,45 +6,88 @@
    See the LGPL or GPL documents, or the above URL, for details.
 */
 
-struct stereo_struct {
-  double scalex;
-  double shiftx;
-  double scaley;
-  double shifty;
-};
-
 struct note_struct {
   sample_t *sample;
-  long starttime; /* frame time */
+  frametime_t starttime;
   double pitch; /* 1.0 means the sample's natural pitch */
   double volume; /* 0.0 is mute; 1.0 is full volume; higher to overdrive */
-  stereo_t pan; /* see above */
+  stereo_t pan; /* see channel.h */
   int repetitions; /* number of times through loop section */
+  frametime_t endtime; /* starttime plus the note's duration */
+  frametime_t attack; /* frames of fade-in at the start (or 0) */
+  frametime_t release; /* frames of fade-out at the end (or 0) */
+  int curve; /* the shape of the fades; a NOTE_CURVE_* value */
   PyObject *channel; /* Python channel object */
-  PyObject *removefunc; /* Python object to call when note is removed */
+  channel_t *cchan; /* ...and its native mirror */
+  PyObject *sampobj; /* Python sample object */
 
   long framepos; /* position in sample */
   long framefrac; /* ...and fraction, in 0.16 fixed-pt */
   int repsleft;
+  int finished; /* set by the mixer when the note has played out */
+
+  int isactive; /* in the active array, rather than the pending queue? */
+  long queuepos; /* index in the active array or the pending queue */
+  note_t *chanprev, *channext; /* the list of notes in cchan */
 
-  note_t *next;
+  int pooled; /* allocated from the note pool? */
+  note_t *nextfree; /* used only while on the pool's free list */
 };
 
-extern int noteq_init(void);
+/* The shapes of a note's attack and release fades. */
+#define NOTE_CURVE_LINEAR (0)
+#define NOTE_CURVE_SINE (1) /* quarter sine wave; equal-power crossfades */
+#define NOTE_CURVE_SMOOTH (2) /* S-curve, flat at both ends */
+
+/* One note of a batch, for note_create_batch(). */
+typedef struct notespec_struct {
+  sample_t *sample;
+  PyObject *sampobj; /* Python sample object */
+  double pitch;
+  double volume;
+  stereo_t pan;
+  frametime_t starttime;
+  frametime_t duration; /* in frames; 0 means once through the sample */
+  frametime_t attack, release; /* in frames; 0 means none */
+  int curve;
+} notespec_t;
+
+typedef struct noteq_stats_struct {
+  long numpending; /* notes waiting to start */
+  long numactive; /* notes currently sounding */
+  long poolsize; /* note structures in the pool */
+  long poolfree; /* ...of which are unused */
+  long poollimit; /* the pool's high-water mark */
+  long peak; /* most notes ever in existence at once */
+  long overflow; /* notes allocated outside the pool */
+} noteq_stats_t;
+
+extern int noteq_init(extraopt_t *extra);
+extern void noteq_final(void);
 extern int noteq_generate(long *buffer, 
   generate_func_t genfunc, void *rock);
-extern void note_destroy_by_channel(PyObject *channel);
-extern void noteq_adjust_timebase(long offset);
+extern void note_destroy_by_channel(channel_t *chan);
+extern void noteq_get_stats(noteq_stats_t *stats);
+extern long noteq_count_finished(void);
+extern PyObject *noteq_collect_finished(long start);
 
-extern long note_create(sample_t *samp, double pitch, double volume,
-  stereo_t *pan,
-  long starttime, PyObject *channel, PyObject *removefunc);
-extern long note_create_reps(sample_t *samp, double pitch, double volume,
-  stereo_t *pan,
-  long starttime, int reps, PyObject *channel, PyObject *removefunc);
-extern long note_create_duration(sample_t *samp, double pitch, double volume,
+extern frametime_t note_create(sample_t *samp, double pitch, double volume,
   stereo_t *pan,
-  long starttime, long duration, PyObject *channel, PyObject *removefunc);
-extern void note_destroy(note_t **noteptr);
+  frametime_t starttime, PyObject *channel, channel_t *cchan,
+  PyObject *sampobj);
+extern frametime_t note_create_reps(sample_t *samp, double pitch,
+  double volume, stereo_t *pan,
+  frametime_t starttime, int reps, PyObject *channel, channel_t *cchan,
+  PyObject *sampobj);
+extern frametime_t note_create_duration(sample_t *samp, double pitch,
+  double volume, stereo_t *pan,
+  frametime_t starttime, frametime_t duration,
+  PyObject *channel, channel_t *cchan,
+  PyObject *sampobj);
+extern long note_create_batch(notespec_t *specs, long count,
+  PyObject *channel, channel_t *cchan, frametime_t *durations);
+extern frametime_t note_duration(sample_t *samp, double pitch,
+  frametime_t duration);
+extern void note_destroy(note_t *note);
 
 
@@ -8,10 +8,21 @@
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
 
 #include "common.h"
 #include "audev.h"
 #include "sample.h"
+#include "stream.h"
+#include "compress.h"
+
+static void sample_free_data(sample_t *samp);
+static void sample_set_params(sample_t *samp, int framerate,
+  long numframes, long loopstart, long loopend, int numchannels);
 
 sample_t *sample_create()
 {
@@ -25,6 +36,10 @@ sample_t *sample_create()
   samp->loaded = FALSE;
   samp->numframes = 0;
   samp->data = NULL;
+  samp->mapbase = NULL;
+  samp->maplen = 0;
+  samp->stream = NULL;
+  samp->compressed = NULL;
 
   return samp;
 }
@@ -32,8 +47,7 @@ sample_t *sample_create()
 void sample_destroy(sample_t *samp)
 {
   if (samp->data) {
-    free(samp->data);
-    samp->data = NULL;
+    sample_free_data(samp);
     samp->loaded = FALSE;
   }
 
@@ -48,23 +62,55 @@ void sample_unload(sample_t *samp)
     return;
 
   if (samp->data) {
-    free(samp->data);
-    samp->data = NULL;
+    sample_free_data(samp);
   }
   samp->loaded = FALSE;
 }
 
+/* The number of bytes of memory the sample's data occupies (whether
+   malloc'd or mapped), or zero if it is not loaded. A streamed sample
+   counts as zero; only the parts of it being played are in memory,
+   and the stream module keeps track of those. A compressed sample
+   counts the size of its compressed data. */
+size_t sample_data_size(sample_t *samp)
+{
+  if (!samp->loaded || !samp->data)
+    return 0;
+  if (samp->compressed)
+    return compress_data_size(samp->compressed);
+  if (samp->stream)
+    return 0;
+  return sizeof(value_t) * samp->numchannels * samp->numframes;
+}
+
+/* Release the sample's data, whether it is malloc'd, mapped, or
+   compressed. */
+static void sample_free_data(sample_t *samp)
+{
+  if (samp->mapbase) {
+    stream_detach(samp);
+    munmap(samp->mapbase, samp->maplen);
+    samp->mapbase = NULL;
+    samp->maplen = 0;
+  }
+  else {
+    free(samp->data);
+  }
+  samp->data = NULL;
+
+  if (samp->compressed) {
+    compress_destroy(samp->compressed);
+    samp->compressed = NULL;
+  }
+}
+
 int sample_load(sample_t *samp, int framerate,
   long numframes, void *data, long loopstart, long loopend,
   int numchannels, int samplebits,
   int issigned, int isbigend)
 {
   value_t *snd;
-  value_t *sptr;
-  int val;
   int numchanout;
-  long fx;
-  int bval, bval2;
 
   if (samp->error)
     return FALSE;
@@ -91,6 +137,154 @@ int sample_load(sample_t *samp, int framerate,
     return FALSE;
   }
 
+  if (!sample_convert(snd, data, numframes, numchannels, samplebits,
+	issigned, isbigend)) {
+    free(snd);
+    samp->error = TRUE;
+    return FALSE;
+  }
+
+  samp->data = snd;
+  sample_set_params(samp, framerate, numframes, loopstart, loopend,
+    numchanout);
+
+  samp->loaded = TRUE;
+
+  return TRUE;
+}
+
+/* Load a sample, keeping its data compressed in memory: at 8 bits
+   (COMPRESS_8BIT, only for data which is 8-bit to begin with) or as
+   IMA ADPCM (COMPRESS_ADPCM). The data is decoded a block at a time,
+   as notes play it; see compress.c. If the mode doesn't apply to this
+   data, the sample is loaded uncompressed, as by sample_load(). */
+int sample_load_compressed(sample_t *samp, int framerate,
+  long numframes, void *data, long loopstart, long loopend,
+  int numchannels, int samplebits,
+  int issigned, int isbigend, int mode)
+{
+  compress_t *comp;
+  value_t *buf;
+  void *base;
+  size_t maplen;
+  long framesize;
+  int numchanout;
+  long bx, count;
+
+  if (mode == COMPRESS_8BIT && samplebits != 8)
+    mode = COMPRESS_NONE;
+  if (mode == COMPRESS_NONE || numframes <= 0)
+    return sample_load(samp, framerate, numframes, data,
+      loopstart, loopend, numchannels, samplebits, issigned, isbigend);
+
+  if (samp->error)
+    return FALSE;
+  if (samp->loaded)
+    return TRUE;
+
+  if (samplebits != 8 && samplebits != 16) {
+    fprintf(stderr, 
+      "Unable to load sound data at %d bits per sample (only 8 and 16 supported)\n", 
+      samplebits);
+    samp->error = TRUE;
+    return FALSE;
+  }
+
+  if (numchannels == 1)
+    numchanout = 1;
+  else
+    numchanout = 2;
+  framesize = numchannels * (samplebits / 8);
+
+  comp = compress_create(mode, numframes, numchanout);
+  buf = (value_t *)malloc(sizeof(value_t) * numchanout * STREAM_BLOCK);
+  if (!comp || !buf) {
+    fprintf(stderr, "Unable to allocate memory for sound data\n");
+    if (comp)
+      compress_destroy(comp);
+    free(buf);
+    samp->error = TRUE;
+    return FALSE;
+  }
+
+  /* Convert and compress a block at a time, so the whole sample is
+     never in memory decoded. */
+  for (bx=0; bx*STREAM_BLOCK < numframes; bx++) {
+    count = numframes - bx*STREAM_BLOCK;
+    if (count > STREAM_BLOCK)
+      count = STREAM_BLOCK;
+    if (!sample_convert(buf, (char *)data + bx*STREAM_BLOCK*framesize,
+	  count, numchannels, samplebits, issigned, isbigend)) {
+      compress_destroy(comp);
+      free(buf);
+      samp->error = TRUE;
+      return FALSE;
+    }
+    compress_encode_block(comp, bx, buf, count);
+  }
+  free(buf);
+
+  /* The mixer reads the decoded data from this mapping. Its pages
+     only take up memory while a block is decoded into them. */
+  maplen = sizeof(value_t) * numchanout * numframes;
+#ifdef MAP_NORESERVE
+  base = mmap(NULL, maplen, PROT_READ | PROT_WRITE,
+    MAP_PRIVATE | MAP_ANON | MAP_NORESERVE, -1, 0);
+#else
+  base = mmap(NULL, maplen, PROT_READ | PROT_WRITE,
+    MAP_PRIVATE | MAP_ANON, -1, 0);
+#endif
+  if (base == MAP_FAILED) {
+    fprintf(stderr, "Unable to allocate memory for sound data\n");
+    compress_destroy(comp);
+    samp->error = TRUE;
+    return FALSE;
+  }
+
+  samp->mapbase = base;
+  samp->maplen = maplen;
+  samp->data = (value_t *)base;
+  samp->compressed = comp;
+  sample_set_params(samp, framerate, numframes, loopstart, loopend,
+    numchanout);
+
+  /* If the stream can't be set up, decode the whole sample now. It
+     plays, but saves no memory. */
+  if (!stream_attach(samp)) {
+    for (bx=0; bx*STREAM_BLOCK < numframes; bx++) {
+      count = numframes - bx*STREAM_BLOCK;
+      if (count > STREAM_BLOCK)
+	count = STREAM_BLOCK;
+      compress_decode_block(comp, bx, 
+	samp->data + bx*STREAM_BLOCK*numchanout, count);
+    }
+  }
+
+  samp->loaded = TRUE;
+
+  return TRUE;
+}
+
+/* Convert sound data -- 8 or 16 bits, signed or unsigned, either
+   byte order, any number of channels -- into the form the mixer uses:
+   native 16-bit values, in one channel or two. (Channels past the
+   first two are dropped.) The snd array must have room for numframes
+   frames of one channel (if numchannels is 1) or two. Returns FALSE
+   if the data came out the wrong length. */
+int sample_convert(value_t *snd, void *data, long numframes,
+  int numchannels, int samplebits, int issigned, int isbigend)
+{
+  int numchanout;
+  value_t *sptr;
+  int val;
+  long fx;
+  int bval, bval2;
+
+  if (numchannels == 1)
+    numchanout = 1;
+  else
+    numchanout = 2;
+
   sptr = snd;
 
   if (samplebits == 8) {
@@ -170,13 +364,105 @@ int sample_load(sample_t *samp, int framerate,
 
   if (snd+(numchanout*numframes) != sptr) {
     fprintf(stderr, "Wrong number of samples in data\n");
-    samp->error = TRUE;
     return FALSE;
   }
 
-  samp->data = snd;
+  return TRUE;
+}
+
+/* Load a sample by mapping its data straight out of a file. The data
+   must already be in the form the mixer uses: native-endian 16-bit
+   values, one or two channels, starting at the given byte offset. The
+   file might be a decoded-sample cache file, or a WAV file which
+   happens to be in that form already.
+
+   If streamed is TRUE, the sample is streamed from the file as it
+   plays, rather than being left to the kernel to page in; see
+   stream.c. This is for samples too long to keep in memory.
+
+   Returns FALSE if the file can't be mapped. Unlike sample_load(),
+   this does not mark the sample as unplayable; the caller can go on
+   to load it the usual way. */
+int sample_load_mapped(sample_t *samp, char *pathname,
+  long offset, int framerate, long numframes,
+  long loopstart, long loopend, int numchannels, int streamed)
+{
+  int fd;
+  struct stat st;
+  size_t datalen, maplen;
+  void *base;
+
+  if (samp->error)
+    return FALSE;
+  if (samp->loaded)
+    return TRUE;
+
+  if (numchannels < 1 || numchannels > 2 || numframes <= 0
+    || offset < 0 || (offset % sizeof(value_t)) != 0)
+    return FALSE;
+  datalen = sizeof(value_t) * numchannels * numframes;
+
+  fd = open(pathname, O_RDONLY);
+  if (fd < 0)
+    return FALSE;
+  if (fstat(fd, &st) < 0 || (size_t)st.st_size < offset + datalen) {
+    close(fd);
+    return FALSE;
+  }
+
+  maplen = offset + datalen;
+  base = mmap(NULL, maplen, PROT_READ, MAP_SHARED, fd, 0);
+  /* The mapping outlives the descriptor. */
+  close(fd);
+  if (base == MAP_FAILED)
+    return FALSE;
+
+  samp->mapbase = base;
+  samp->maplen = maplen;
+  samp->data = (value_t *)((char *)base + offset);
+  sample_set_params(samp, framerate, numframes, loopstart, loopend,
+    numchannels);
+
+  /* If the stream can't be set up, the sample plays unstreamed. */
+  if (streamed)
+    stream_attach(samp);
+
+  samp->loaded = TRUE;
+
+  return TRUE;
+}
+
+/* Write a loaded sample's data to a file, after the given header, in
+   the form sample_load_mapped() accepts. Returns FALSE if the file
+   could not be written. */
+int sample_save(sample_t *samp, char *pathname,
+  void *header, long headerlen)
+{
+  FILE *fl;
+  size_t count;
+  int ok;
+
+  if (samp->error || !samp->loaded || samp->compressed)
+    return FALSE;
+
+  fl = fopen(pathname, "wb");
+  if (!fl)
+    return FALSE;
+
+  count = (size_t)samp->numchannels * samp->numframes;
+  ok = (fwrite(header, 1, headerlen, fl) == (size_t)headerlen
+    && fwrite(samp->data, sizeof(value_t), count, fl) == count);
+  if (fclose(fl) != 0)
+    ok = FALSE;
+
+  return ok;
+}
+
+static void sample_set_params(sample_t *samp, int framerate,
+  long numframes, long loopstart, long loopend, int numchannels)
+{
   samp->numframes = numframes;
-  samp->numchannels = numchanout;
+  samp->numchannels = numchannels;
   samp->framerate = (double)framerate / (double)audev_get_soundrate();
 
   if (loopstart >= loopend || loopstart < 0 || loopend < 0) {
@@ -190,9 +476,5 @@ int sample_load(sample_t *samp, int framerate,
     samp->loopend = loopend;
   }
   samp->looplen = samp->loopend - samp->loopstart;
-
-  samp->loaded = TRUE;
-
-  return TRUE;
 }
 
@@ -18,6 +18,19 @@ struct sample_struct {
 
   value_t *data; /* numchannels*numframes values, [-0x7FFF..0x7FFF] */
   double framerate; /* 1.0 means SOUNDRATE fps */
+
+  /* If the data is in a memory-mapped file, rather than malloc'd
+     memory, this is the mapping. (Otherwise mapbase is NULL.) */
+  void *mapbase;
+  size_t maplen;
+
+  /* If the sample is streamed from its file, rather than held in
+     memory, the state of the streaming. (See stream.c.) */
+  stream_t *stream;
+
+  /* If the sample is kept compressed, and decoded as it plays, the
+     compressed data. (See compress.c.) */
+  compress_t *compressed;
 };
 
 extern sample_t *sample_create(void);
@@ -27,5 +40,17 @@ extern int sample_load(sample_t *samp, int framerate,
   long numframes, void *data, long loopstart, long loopend,
   int numchannels, int samplebits,
   int issigned, int isbigend);
+extern int sample_load_compressed(sample_t *samp, int framerate,
+  long numframes, void *data, long loopstart, long loopend,
+  int numchannels, int samplebits,
+  int issigned, int isbigend, int mode);
+extern int sample_load_mapped(sample_t *samp, char *pathname,
+  long offset, int framerate, long numframes,
+  long loopstart, long loopend, int numchannels, int streamed);
+extern int sample_save(sample_t *samp, char *pathname,
+  void *header, long headerlen);
 extern void sample_unload(sample_t *samp);
+extern size_t sample_data_size(sample_t *samp);
+extern int sample_convert(value_t *snd, void *data, long numframes,
+  int numchannels, int samplebits, int issigned, int isbigend);
 
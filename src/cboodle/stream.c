@@ -0,0 +1,640 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <time.h>
+#include <unistd.h>
+#include <pthread.h>
+#include <sys/mman.h>
+
+#include "common.h"
+#include "audev.h"
+#include "sample.h"
+#include "stream.h"
+#include "compress.h"
+
+/* Streaming very long samples from disk.
+
+   A streamed sample is one whose data is mapped from a file (see
+   sample_load_mapped()) but which is too big to keep in memory. The
+   mixer reads it through the mapping, as it would any other sample.
+   What differs is which parts of the mapping are in memory.
+
+   The sample is divided into blocks of STREAM_BLOCK frames. Each
+   buffer, the mixer tells us (stream_prepare()) where every note of
+   a streamed sample is, and we work out which blocks it will need
+   over the next few seconds (the "streamahead" extra option). Any
+   that are not in memory are queued for the read-ahead thread, which
+   faults them in. Blocks which no note has wanted for a while are
+   queued to be dropped again (stream_sweep()). So the memory used is
+   a few seconds' worth per playing note, however long the file.
+
+   If the blocks a note needs for the current buffer are still not in
+   memory, the mixer waits for them, up to a limit (the "streamwait"
+   extra option, in milliseconds). After that the note is silent for
+   the buffer -- it keeps its place, as if it had played -- and a
+   warning is printed. The mixer must never block on the disk for
+   longer than the device can wait. But an offline render has no
+   deadline, and should not leave gaps in its output; so a streamwait
+   of "none" (which the boodler script sets when rendering) waits as
+   long as it takes.
+
+   Compressed samples (see compress.c) use the same machinery. Their
+   mapping is anonymous memory rather than a file, and a block is
+   "read in" by decoding it into the mapping. Dropping a block gives
+   its memory back, just as for a file.
+
+   A block's state is written by the read-ahead thread and by the
+   sweep, under stream_mutex, and read by the mixing threads without
+   it. The mixer must never read a block which has been dropped. For
+   a file, that would only be slow -- the page is read back from the
+   disk -- but a dropped block of a compressed sample reads as zeros,
+   since its memory was anonymous. It cannot happen, because:
+
+   - The mixer reads a note's data only after stream_prepare() has
+     found every block it needs for the buffer READY, and has marked
+     them wanted in this buffer. (The span covers the fractional
+     position, the interpolation's next frame, and the wrap back to
+     the loop start.)
+   - The sweep runs only between buffers (see noteq_generate()), and
+     drops only blocks which no note has wanted for STREAM_KEEP
+     buffers.
+   - A dropped block is ABSENT from the moment the sweep queues it.
+     If a note wants it again, the reload is queued behind the drop,
+     and the block is READY again only once the reload is done. */
+
+#define STREAM_QUEUE_SIZE (1024)
+#define STREAM_SWEEP_INTERVAL (16) /* buffers */
+#define STREAM_KEEP (64) /* buffers */
+
+#define DEFAULT_STREAM_AHEAD (2.0) /* seconds */
+#define DEFAULT_STREAM_WAIT (50) /* milliseconds */
+#define STREAM_WAIT_FOREVER (-1)
+#define STREAM_POLL (10) /* milliseconds */
+
+#define BLOCK_ABSENT (0)
+#define BLOCK_REQUESTED (1)
+#define BLOCK_READY (2)
+
+#define STREAM_LOAD(ptr) __atomic_load_n((ptr), __ATOMIC_ACQUIRE)
+#define STREAM_STORE(ptr, val) __atomic_store_n((ptr), (val), __ATOMIC_RELEASE)
+
+struct stream_struct {
+  sample_t *samp;
+  long numblocks;
+  long blockbytes;
+  unsigned char *state; /* BLOCK_ABSENT, BLOCK_REQUESTED, BLOCK_READY */
+  long *wanted; /* the buffer stamp at which a note last needed each block */
+  long numresident; /* blocks which are BLOCK_READY */
+  long residentbytes; /* ...and their size */
+  int warned; /* a starvation warning has been printed */
+  stream_t *next;
+};
+
+typedef struct request_struct {
+  stream_t *stream;
+  long block;
+  int drop; /* drop the block, rather than reading it */
+} request_t;
+
+static pthread_mutex_t stream_mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t work_cond = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t done_cond = PTHREAD_COND_INITIALIZER;
+
+static request_t queue[STREAM_QUEUE_SIZE];
+static long queuehead = 0;
+static long queuecount = 0;
+static stream_t *busy = NULL; /* the stream the thread is working on */
+
+static pthread_t thread;
+static int thread_running = FALSE;
+static int thread_quit = FALSE;
+
+static stream_t *streams = NULL;
+static long starved = 0;
+
+static double stream_ahead = DEFAULT_STREAM_AHEAD;
+static long stream_wait = DEFAULT_STREAM_WAIT;
+static long pagesize = 4096;
+
+static int walk_range(stream_t *stream, long start, long len,
+  int repsleft, long stamp, int request);
+static void request_block(stream_t *stream, long bx);
+static int queue_push(stream_t *stream, long bx, int drop);
+static void *stream_thread(void *rock);
+static void block_span(stream_t *stream, long bx, char **startptr,
+  char **endptr);
+static long block_bytes(stream_t *stream, long bx);
+static void load_block(stream_t *stream, long bx);
+static void drop_block(stream_t *stream, long bx);
+static void add_millis(struct timespec *ts, long millis);
+static int timespec_before(struct timespec *ts1, struct timespec *ts2);
+
+int stream_init(extraopt_t *extra)
+{
+  extraopt_t *opt;
+
+  stream_ahead = DEFAULT_STREAM_AHEAD;
+  stream_wait = DEFAULT_STREAM_WAIT;
+  for (opt=extra; opt->key; opt++) {
+    if (!strcmp(opt->key, "streamahead") && opt->val) {
+      stream_ahead = atof(opt->val);
+      if (stream_ahead < 0.0)
+	stream_ahead = 0.0;
+    }
+    else if (!strcmp(opt->key, "streamwait") && opt->val) {
+      if (!strcmp(opt->val, "none"))
+	stream_wait = STREAM_WAIT_FOREVER;
+      else
+	stream_wait = atol(opt->val);
+      if (stream_wait < 0)
+	stream_wait = STREAM_WAIT_FOREVER;
+    }
+  }
+
+#ifdef _SC_PAGESIZE
+  pagesize = sysconf(_SC_PAGESIZE);
+  if (pagesize <= 0)
+    pagesize = 4096;
+#endif
+
+  return TRUE;
+}
+
+/* Stop the read-ahead thread. (It is started again if needed.) */
+void stream_final()
+{
+  pthread_mutex_lock(&stream_mutex);
+  if (!thread_running) {
+    pthread_mutex_unlock(&stream_mutex);
+    return;
+  }
+  thread_quit = TRUE;
+  pthread_cond_broadcast(&work_cond);
+  pthread_mutex_unlock(&stream_mutex);
+
+  pthread_join(thread, NULL);
+
+  pthread_mutex_lock(&stream_mutex);
+  thread_running = FALSE;
+  thread_quit = FALSE;
+  /* Whatever was still queued is forgotten. */
+  while (queuecount) {
+    request_t *req = &queue[queuehead];
+    if (!req->drop)
+      STREAM_STORE(&req->stream->state[req->block], BLOCK_ABSENT);
+    queuehead = (queuehead+1) % STREAM_QUEUE_SIZE;
+    queuecount--;
+  }
+  pthread_mutex_unlock(&stream_mutex);
+}
+
+/* Start streaming a sample, which must have been mapped from a file.
+   None of it is read in until a note wants it. Returns FALSE if
+   memory could not be allocated; the sample is then simply played
+   from the mapping, unstreamed. */
+int stream_attach(sample_t *samp)
+{
+  stream_t *stream;
+
+  if (samp->stream)
+    return TRUE;
+  if (!samp->mapbase)
+    return FALSE;
+
+  stream = (stream_t *)malloc(sizeof(stream_t));
+  if (!stream)
+    return FALSE;
+
+  stream->samp = samp;
+  stream->numblocks = (samp->numframes + STREAM_BLOCK - 1) / STREAM_BLOCK;
+  stream->blockbytes = STREAM_BLOCK * samp->numchannels * sizeof(value_t);
+  stream->numresident = 0;
+  stream->residentbytes = 0;
+  stream->warned = FALSE;
+  stream->state = (unsigned char *)malloc(stream->numblocks);
+  stream->wanted = (long *)malloc(sizeof(long) * stream->numblocks);
+  if (!stream->state || !stream->wanted) {
+    free(stream->state);
+    free(stream->wanted);
+    free(stream);
+    return FALSE;
+  }
+  memset(stream->state, BLOCK_ABSENT, stream->numblocks);
+  memset(stream->wanted, 0, sizeof(long) * stream->numblocks);
+
+  /* The kernel's own read-ahead would only fight ours. */
+  if (!samp->compressed)
+    madvise(samp->mapbase, samp->maplen, MADV_RANDOM);
+
+  pthread_mutex_lock(&stream_mutex);
+  stream->next = streams;
+  streams = stream;
+  pthread_mutex_unlock(&stream_mutex);
+
+  samp->stream = stream;
+  return TRUE;
+}
+
+/* Stop streaming a sample, before its data is unmapped. No note may
+   be playing it. */
+void stream_detach(sample_t *samp)
+{
+  stream_t *stream = samp->stream;
+  stream_t **pp;
+  long ix, count;
+
+  if (!stream)
+    return;
+
+  pthread_mutex_lock(&stream_mutex);
+
+  /* Take its requests off the queue, and wait out any that the thread
+     is working on. */
+  count = queuecount;
+  queuecount = 0;
+  for (ix=0; ix<count; ix++) {
+    request_t req = queue[(queuehead+ix) % STREAM_QUEUE_SIZE];
+    if (req.stream != stream) {
+      queue[(queuehead+queuecount) % STREAM_QUEUE_SIZE] = req;
+      queuecount++;
+    }
+  }
+  while (busy == stream)
+    pthread_cond_wait(&done_cond, &stream_mutex);
+
+  for (pp = &streams; *pp; pp = &((*pp)->next)) {
+    if (*pp == stream) {
+      *pp = stream->next;
+      break;
+    }
+  }
+
+  pthread_mutex_unlock(&stream_mutex);
+
+  samp->stream = NULL;
+  free(stream->state);
+  free(stream->wanted);
+  free(stream);
+}
+
+/* Called by the mixer, for a note of a streamed sample, before mixing
+   count frames of it. The note is at framepos, with repsleft loop
+   repetitions to go, and moves pitch sample frames per output frame.
+   This asks for the blocks the note will need soon, and returns TRUE
+   if the ones it needs now are in memory (waiting a little for them
+   if necessary). If this returns FALSE, the note must not be mixed
+   this buffer.
+
+   This may be called from several mixing threads at once. */
+int stream_prepare(sample_t *samp, long framepos, int repsleft,
+  double pitch, long count, long stamp)
+{
+  stream_t *stream = samp->stream;
+  long span, ahead;
+  int ready;
+
+  /* Mixing count frames reads at most this many, from framepos on. */
+  span = (long)(pitch * (double)count) + 3;
+  ahead = (long)(pitch * stream_ahead * (double)audev_get_soundrate());
+
+  ready = walk_range(stream, framepos, span, repsleft, stamp, TRUE);
+  if (ahead > span)
+    walk_range(stream, framepos, ahead, repsleft, stamp, TRUE);
+  if (ready)
+    return TRUE;
+
+  if (stream_wait != 0) {
+    struct timespec deadline, wake;
+    int running;
+
+    clock_gettime(CLOCK_REALTIME, &deadline);
+    add_millis(&deadline, stream_wait);
+
+    while (1) {
+      clock_gettime(CLOCK_REALTIME, &wake);
+      add_millis(&wake, STREAM_POLL);
+      if (stream_wait > 0 && timespec_before(&deadline, &wake))
+	wake = deadline;
+
+      pthread_mutex_lock(&stream_mutex);
+      ready = walk_range(stream, framepos, span, repsleft, stamp, FALSE);
+      if (!ready) {
+	pthread_cond_timedwait(&done_cond, &stream_mutex, &wake);
+	ready = walk_range(stream, framepos, span, repsleft, stamp, FALSE);
+      }
+      running = thread_running;
+      pthread_mutex_unlock(&stream_mutex);
+      if (ready)
+	return TRUE;
+
+      /* Give up at the deadline -- or at once, if there is no thread
+	 to read the blocks. */
+      if (!running)
+	break;
+      if (stream_wait > 0) {
+	clock_gettime(CLOCK_REALTIME, &wake);
+	if (!timespec_before(&wake, &deadline))
+	  break;
+      }
+
+      /* Ask again for any blocks the queue was too full to take. */
+      walk_range(stream, framepos, span, repsleft, stamp, TRUE);
+    }
+  }
+
+  __atomic_add_fetch(&starved, 1, __ATOMIC_RELAXED);
+  if (!stream->warned) {
+    stream->warned = TRUE;
+    if (samp->compressed)
+      fprintf(stderr, "Compressed sample could not be decoded in time; playing silence.\n");
+    else
+      fprintf(stderr, "Streamed sample could not be read from disk in time; playing silence.\n");
+  }
+  return FALSE;
+}
+
+static void add_millis(struct timespec *ts, long millis)
+{
+  if (millis <= 0)
+    return;
+  ts->tv_sec += millis / 1000;
+  ts->tv_nsec += (millis % 1000) * 1000000;
+  if (ts->tv_nsec >= 1000000000) {
+    ts->tv_sec++;
+    ts->tv_nsec -= 1000000000;
+  }
+}
+
+static int timespec_before(struct timespec *ts1, struct timespec *ts2)
+{
+  if (ts1->tv_sec != ts2->tv_sec)
+    return (ts1->tv_sec < ts2->tv_sec);
+  return (ts1->tv_nsec < ts2->tv_nsec);
+}
+
+/* Work out which blocks len frames of a note, starting at start, will
+   touch -- following the note around its loop, if it has repetitions
+   left. Returns TRUE if they are all in memory. If request is TRUE,
+   also mark them as wanted, and queue any which are absent. */
+static int walk_range(stream_t *stream, long start, long len,
+  int repsleft, long stamp, int request)
+{
+  sample_t *samp = stream->samp;
+  int ready = TRUE;
+  int pass;
+
+  for (pass=0; pass<3 && len > 0; pass++) {
+    long limit = ((repsleft > 0) ? samp->loopend : samp->numframes);
+    long end = start + len;
+    long bx, lastbx;
+
+    if (end > limit)
+      end = limit;
+    if (start < end) {
+      lastbx = (end - 1) / STREAM_BLOCK;
+      for (bx = start / STREAM_BLOCK; bx <= lastbx; bx++) {
+	if (request)
+	  __atomic_store_n(&stream->wanted[bx], stamp, __ATOMIC_RELAXED);
+	if (STREAM_LOAD(&stream->state[bx]) != BLOCK_READY) {
+	  ready = FALSE;
+	  if (request)
+	    request_block(stream, bx);
+	}
+      }
+      len -= (end - start);
+    }
+
+    if (repsleft <= 0)
+      break;
+    /* The note wraps around to the start of the loop. */
+    repsleft--;
+    start = samp->loopstart;
+  }
+
+  return ready;
+}
+
+/* Queue a block to be read in, if it isn't already. */
+static void request_block(stream_t *stream, long bx)
+{
+  if (STREAM_LOAD(&stream->state[bx]) != BLOCK_ABSENT)
+    return;
+
+  pthread_mutex_lock(&stream_mutex);
+  if (stream->state[bx] == BLOCK_ABSENT) {
+    if (queue_push(stream, bx, FALSE))
+      STREAM_STORE(&stream->state[bx], BLOCK_REQUESTED);
+  }
+  pthread_mutex_unlock(&stream_mutex);
+}
+
+/* Add a request to the queue, starting the read-ahead thread if it
+   isn't running. Must be called with stream_mutex held. Returns FALSE
+   if the queue is full (or the thread can't start); the caller can
+   try again next buffer. */
+static int queue_push(stream_t *stream, long bx, int drop)
+{
+  request_t *req;
+
+  if (queuecount >= STREAM_QUEUE_SIZE)
+    return FALSE;
+
+  if (!thread_running) {
+    thread_quit = FALSE;
+    if (pthread_create(&thread, NULL, stream_thread, NULL))
+      return FALSE;
+    thread_running = TRUE;
+  }
+
+  req = &queue[(queuehead+queuecount) % STREAM_QUEUE_SIZE];
+  req->stream = stream;
+  req->block = bx;
+  req->drop = drop;
+  queuecount++;
+  pthread_cond_signal(&work_cond);
+  return TRUE;
+}
+
+/* Called by the mixer after each buffer, with the same stamp it passed
+   to stream_prepare(). Every so often, this queues the blocks which no
+   note has wanted recently to be dropped. */
+void stream_sweep(long stamp)
+{
+  stream_t *stream;
+  long bx;
+
+  if (!streams || (stamp % STREAM_SWEEP_INTERVAL) != 0)
+    return;
+
+  pthread_mutex_lock(&stream_mutex);
+  for (stream = streams; stream; stream = stream->next) {
+    if (!stream->numresident)
+      continue;
+    for (bx=0; bx<stream->numblocks; bx++) {
+      if (stream->state[bx] == BLOCK_READY
+	&& stamp - __atomic_load_n(&stream->wanted[bx], __ATOMIC_RELAXED)
+	> STREAM_KEEP) {
+	if (!queue_push(stream, bx, TRUE))
+	  break;
+	STREAM_STORE(&stream->state[bx], BLOCK_ABSENT);
+	stream->numresident--;
+	stream->residentbytes -= block_bytes(stream, bx);
+      }
+    }
+  }
+  pthread_mutex_unlock(&stream_mutex);
+}
+
+/* The body of the read-ahead thread. This never touches Python. */
+static void *stream_thread(void *rock)
+{
+  pthread_mutex_lock(&stream_mutex);
+
+  while (1) {
+    request_t req;
+
+    while (!queuecount && !thread_quit)
+      pthread_cond_wait(&work_cond, &stream_mutex);
+    if (thread_quit)
+      break;
+
+    req = queue[queuehead];
+    queuehead = (queuehead+1) % STREAM_QUEUE_SIZE;
+    queuecount--;
+    busy = req.stream;
+    pthread_mutex_unlock(&stream_mutex);
+
+    if (req.drop)
+      drop_block(req.stream, req.block);
+    else
+      load_block(req.stream, req.block);
+
+    pthread_mutex_lock(&stream_mutex);
+    busy = NULL;
+    if (!req.drop) {
+      STREAM_STORE(&req.stream->state[req.block], BLOCK_READY);
+      req.stream->numresident++;
+      req.stream->residentbytes += block_bytes(req.stream, req.block);
+    }
+    pthread_cond_broadcast(&done_cond);
+  }
+
+  pthread_mutex_unlock(&stream_mutex);
+  return NULL;
+}
+
+/* Find the bytes of a block, within the sample's mapping. */
+static void block_span(stream_t *stream, long bx, char **startptr,
+  char **endptr)
+{
+  sample_t *samp = stream->samp;
+  char *data = (char *)samp->data;
+  long datalen = samp->numframes * samp->numchannels * sizeof(value_t);
+  long startpos = bx * stream->blockbytes;
+  long endpos = startpos + stream->blockbytes;
+
+  if (endpos > datalen)
+    endpos = datalen;
+  *startptr = data + startpos;
+  *endptr = data + endpos;
+}
+
+/* The number of bytes in a block. (Only the last block may be short.) */
+static long block_bytes(stream_t *stream, long bx)
+{
+  char *start, *end;
+
+  block_span(stream, bx, &start, &end);
+  if (end < start)
+    return 0;
+  return end - start;
+}
+
+/* Read a block into memory, by touching every page of it -- or, for
+   a compressed sample, by decoding it. */
+static void load_block(stream_t *stream, long bx)
+{
+  char *start, *end, *pos;
+  sample_t *samp = stream->samp;
+  char *mapstart = (char *)samp->mapbase;
+  volatile char sum = 0;
+
+  block_span(stream, bx, &start, &end);
+  if (start >= end)
+    return;
+
+  if (samp->compressed) {
+    compress_decode_block(samp->compressed, bx, (value_t *)start,
+      (end - start) / (samp->numchannels * sizeof(value_t)));
+    return;
+  }
+
+  /* madvise() wants a page-aligned address. */
+  pos = mapstart + (((start - mapstart) / pagesize) * pagesize);
+  madvise(pos, end - pos, MADV_WILLNEED);
+
+  for (pos = start; pos < end; pos += pagesize)
+    sum += *pos;
+  sum += end[-1];
+}
+
+/* Let a block's memory go. Only the pages wholly inside the block are
+   dropped; the ones it shares with its neighbors are left alone. */
+static void drop_block(stream_t *stream, long bx)
+{
+  char *start, *end;
+  char *mapstart = (char *)stream->samp->mapbase;
+  long startoff, endoff;
+
+  block_span(stream, bx, &start, &end);
+  startoff = (((start - mapstart) + pagesize - 1) / pagesize) * pagesize;
+  endoff = ((end - mapstart) / pagesize) * pagesize;
+  if (endoff > startoff)
+    madvise(mapstart + startoff, endoff - startoff, MADV_DONTNEED);
+}
+
+void stream_get_stats(streamstats_t *stats)
+{
+  stream_t *stream;
+
+  memset(stats, 0, sizeof(streamstats_t));
+
+  pthread_mutex_lock(&stream_mutex);
+  for (stream = streams; stream; stream = stream->next) {
+    /* Compressed samples are reported separately. Their decoded
+       blocks are real memory, not pages of a file, so they are
+       counted against the memory budget. */
+    if (stream->samp->compressed) {
+      stats->decodedbytes += stream->residentbytes;
+      continue;
+    }
+    stats->numstreams++;
+    stats->numresident += stream->numresident;
+    stats->residentbytes += stream->residentbytes;
+  }
+  pthread_mutex_unlock(&stream_mutex);
+
+  stats->starved = __atomic_load_n(&starved, __ATOMIC_RELAXED);
+}
+
+/* The number of bytes of a sample's stream which are in memory. */
+long stream_resident_bytes(sample_t *samp)
+{
+  long res = 0;
+
+  pthread_mutex_lock(&stream_mutex);
+  if (samp->stream)
+    res = samp->stream->residentbytes;
+  pthread_mutex_unlock(&stream_mutex);
+
+  return res;
+}
@@ -0,0 +1,31 @@
+/* Boodler: a programmable soundscape tool
+   Copyright 2001-2011 by Andrew Plotkin <erkyrath@eblong.com>
+   Boodler web site: <http://boodler.org/>
+   The cboodle extensions are distributed under the LGPL and the
+   GPL; you may use cboodle under the terms of either license.
+   See the LGPL or GPL documents, or the above URL, for details.
+*/
+
+/* Streamed samples are divided into blocks of this many frames. (So
+   are compressed samples; see compress.c.) */
+#define STREAM_BLOCK (32768)
+
+typedef struct streamstats_struct {
+  long numstreams; /* streamed samples loaded (not counting compressed
+		      samples) */
+  long numresident; /* blocks of them in memory */
+  long residentbytes; /* ...and their size */
+  long decodedbytes; /* bytes of compressed samples decoded in memory */
+  long starved; /* notes silenced for a buffer, because their data
+		   could not be read in time */
+} streamstats_t;
+
+extern int stream_init(extraopt_t *extra);
+extern void stream_final(void);
+extern int stream_attach(sample_t *samp);
+extern void stream_detach(sample_t *samp);
+extern int stream_prepare(sample_t *samp, long framepos, int repsleft,
+  double pitch, long count, long stamp);
+extern void stream_sweep(long stamp);
+extern void stream_get_stats(streamstats_t *stats);
+extern long stream_resident_bytes(sample_t *samp);